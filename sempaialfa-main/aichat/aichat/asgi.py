@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aichat.settings')
 
 application = get_asgi_application()
+
+# Под ASGI-сервером цикл событий один на процесс: запросы к OpenRouter из async-представлений
+# идут через общий httpx.AsyncClient с пулом соединений
+from main import http_client  # noqa: E402
+
+http_client.enable_async_clients()
@@ -204,5 +204,70 @@ LM_STUDIO_URL = OPENROUTER_URL  # Устаревшая переменная, о
 # Настройки для загрузки больших файлов
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50 MB - максимальный размер данных в памяти
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000  # Максимальное количество полей
-FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50 MB - максимальный размер файла в памяти
-
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(2.5 * 1024 * 1024)  # 2.5 MB - файлы крупнее при multipart загрузке пишутся во временный файл на диске
+
+
+# Пул фоновой обработки запросов к AI
+# Размер пула ограничивает число одновременных запросов к OpenRouter,
+# очередь - число запросов, ожидающих свободного воркера (при переполнении API отвечает 503)
+CHAT_WORKER_POOL_SIZE = int(os.environ.get('CHAT_WORKER_POOL_SIZE', '8'))
+CHAT_QUEUE_MAX_SIZE = int(os.environ.get('CHAT_QUEUE_MAX_SIZE', '100'))
+
+# Режим обработки запросов к AI:
+# 'thread' - пул потоков внутри веб-процесса (по умолчанию),
+# 'worker' - запросы остаются в БД и их забирают отдельные процессы manage.py run_chat_workers
+CHAT_PROCESSING_MODE = os.environ.get('CHAT_PROCESSING_MODE', 'thread').strip()
+CHAT_QUEUE_LEASE_SECONDS = int(os.environ.get('CHAT_QUEUE_LEASE_SECONDS', '120'))  # Аренда запроса воркером, продлевается heartbeat'ами
+CHAT_QUEUE_MAX_ATTEMPTS = int(os.environ.get('CHAT_QUEUE_MAX_ATTEMPTS', '3'))  # Максимум попыток обработки одного запроса
+CHAT_STREAM_TIMEOUT = int(os.environ.get('CHAT_STREAM_TIMEOUT', '120'))  # Максимальная длительность потока /api/chat-stream/, сек
+CHAT_LONG_POLL_MAX_WAIT = int(os.environ.get('CHAT_LONG_POLL_MAX_WAIT', '25'))  # Максимальное ожидание long-poll /api/chat-status/?wait=, сек
+CHAT_LONG_POLL_DB_INTERVAL = 2  # Интервал проверки статуса в БД, если уведомления из воркеров недоступны, сек
+
+# Хранилище прикрепленных файлов (адресация по SHA-256, очистка - manage.py gc_blobs)
+CHAT_BLOB_ROOT = os.environ.get('CHAT_BLOB_ROOT', '').strip() or str(MEDIA_ROOT / 'blobs')
+
+# Кэш извлеченного из файлов текста (ключ - SHA-256 содержимого и версия извлекателей)
+CHAT_EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('CHAT_EXTRACTION_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))  # Размер LRU в памяти
+CHAT_EXTRACTION_CACHE_DIR = os.environ.get('CHAT_EXTRACTION_CACHE_DIR', '').strip() or None  # Дисковый уровень (отключен, если не задан)
+
+# Пул процессов для извлечения текста из PDF/DOCX/XLSX (0 - извлекать в потоке обработки запроса)
+CHAT_EXTRACTION_WORKERS = int(os.environ.get('CHAT_EXTRACTION_WORKERS', '2'))
+CHAT_EXTRACTION_TIMEOUT = int(os.environ.get('CHAT_EXTRACTION_TIMEOUT', '30'))  # Максимальное время обработки одного файла, сек
+CHAT_EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('CHAT_EXTRACTION_MEMORY_LIMIT_MB', '1024'))  # Лимит памяти процесса пула (Linux/macOS), МБ
+
+# Кэш ответов LLM для одинаковых запросов (ключ - хэш сообщений, данных пользователя и модели)
+CHAT_RESPONSE_CACHE_ENABLED = os.environ.get('CHAT_RESPONSE_CACHE_ENABLED', 'False').lower() == 'true'
+CHAT_RESPONSE_CACHE_TTL = int(os.environ.get('CHAT_RESPONSE_CACHE_TTL', '300'))  # Время жизни ответа в кэше, сек
+CHAT_RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('CHAT_RESPONSE_CACHE_MAX_ENTRIES', '1000'))  # Максимум ответов в кэше
+
+# Семантический кэш ответов для перефразированных вопросов (TF-IDF или модель sentence-transformers на CPU)
+CHAT_SEMANTIC_CACHE_ENABLED = os.environ.get('CHAT_SEMANTIC_CACHE_ENABLED', 'False').lower() == 'true'
+CHAT_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('CHAT_SEMANTIC_CACHE_THRESHOLD', '0.85'))  # Минимальная похожесть вопросов (0..1)
+CHAT_SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('CHAT_SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+CHAT_SEMANTIC_CACHE_MODEL = os.environ.get('CHAT_SEMANTIC_CACHE_MODEL', '').strip()  # Пусто - TF-IDF без зависимостей
+
+# Хранилище разделов userData по хэшу: клиент передает только изменившиеся разделы
+CHAT_USER_DATA_CACHE_MAX_BYTES = int(os.environ.get('CHAT_USER_DATA_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CHAT_USER_DATA_CACHE_TTL = int(os.environ.get('CHAT_USER_DATA_CACHE_TTL', '3600'))  # Время жизни раздела, сек
+
+# Ограничение размера контекста пользователя в системном промпте, токенов (0 - без ограничения)
+CHAT_CONTEXT_MAX_TOKENS = int(os.environ.get('CHAT_CONTEXT_MAX_TOKENS', '8000'))
+
+# Пометка неизменной части системного промпта для кэша промптов провайдера (cache_control через OpenRouter)
+CHAT_PROMPT_CACHE_CONTROL = os.environ.get('CHAT_PROMPT_CACHE_CONTROL', 'True').lower() == 'true'
+
+# Ответы на вопросы об итогах (баланс, фонд оплаты труда, задолженности) по шаблону без вызова LLM
+CHAT_FAST_ANSWERS_ENABLED = os.environ.get('CHAT_FAST_ANSWERS_ENABLED', 'True').lower() == 'true'
+
+# Действия AI через вызов инструментов (tools); для моделей без поддержки - разбор команд из текста
+CHAT_TOOL_CALLING_ENABLED = os.environ.get('CHAT_TOOL_CALLING_ENABLED', 'True').lower() == 'true'
+
+# Пулы HTTP соединений к внешним сервисам (keep-alive, переиспользование TLS соединений)
+# pool_size - максимум соединений, connect_timeout/read_timeout - таймауты по умолчанию, сек
+HTTP_UPSTREAMS = {
+    'openrouter': {
+        'pool_size': int(os.environ.get('OPENROUTER_POOL_SIZE', str(CHAT_WORKER_POOL_SIZE))),
+        'connect_timeout': int(os.environ.get('OPENROUTER_CONNECT_TIMEOUT', '5')),
+        'read_timeout': int(os.environ.get('OPENROUTER_READ_TIMEOUT', '90')),
+    },
+}
@@ -0,0 +1,173 @@
+"""
+Разбор команд действий в ответе AI за один проход
+Ответ модели может содержать команды в трех видах:
+- текстовая команда: CREATE_EVENT: название|дата|описание (аргумент - текст после двоеточия);
+- JSON команда: {"action": "UPDATE_EVENT", "event": "...", ...} в любом месте ответа;
+- команда графика: [CHART_RECEIPTS:pie] (отрисовывается на клиенте, остается в тексте).
+
+Все виды распознаются за один проход по тексту: сканер останавливается только на символах,
+с которых может начинаться команда, JSON объекты разбираются с позиции открывающей скобки,
+и сканирование продолжается после объекта.
+Стоимость разбора зависит только от длины ответа, а не от числа поддерживаемых команд:
+новая команда добавляется в COMMANDS, а ее обработка - в views по имени команды.
+
+Команды из вызовов инструментов (ai_tools) передаются в parse вместе с текстом: если они
+есть, текстовые и JSON команды из текста не используются (остаются только графики)
+"""
+import json
+import re
+
+# Команды действий (текстовые и JSON)
+COMMANDS = (
+    'CREATE_EVENT', 'UPDATE_EVENT', 'DELETE_EVENT',
+    'DELETE_DOCUMENT', 'RENAME_DOCUMENT', 'SEND_SUPPORT_MESSAGE',
+    'CREATE_FOLDER', 'DELETE_FOLDER', 'UPDATE_FOLDER',
+    'CREATE_INVENTORY_ITEM', 'DELETE_INVENTORY_ITEM', 'UPDATE_INVENTORY_ITEM',
+    'CREATE_EMPLOYEE_FOLDER', 'DELETE_EMPLOYEE_FOLDER', 'UPDATE_EMPLOYEE_FOLDER',
+    'CREATE_EMPLOYEE', 'DELETE_EMPLOYEE', 'UPDATE_EMPLOYEE',
+)
+_COMMAND_NAMES = frozenset(COMMANDS)
+
+KIND_TEXT = 'text'
+KIND_JSON = 'json'
+KIND_CHART = 'chart'
+
+# Сканируются только символы, с которых может начинаться команда: двоеточие после имени
+# текстовой команды, открывающая скобка JSON и графика. Поиск одного символа из набора
+# выполняется регулярным выражением без перебора имен команд в каждой позиции текста
+_TOKEN_START_PATTERN = re.compile(r'[:{\[]')
+_COMMAND_NAME_PATTERN = re.compile(r'(?<!\w)([A-Za-z_]+)[ \t]*$')
+_CHART_PATTERN = re.compile(r'\[(CHART_[A-Z_]+)(?::(\w+))?\]', re.IGNORECASE)
+_MAX_COMMAND_NAME_LENGTH = max(len(name) for name in COMMANDS) + 8
+
+_json_decoder = json.JSONDecoder()
+
+
+class Command:
+    """Команда, найденная в ответе AI"""
+    __slots__ = ('kind', 'name', 'start', 'end', 'raw', 'argument', 'data', 'chart_type', '_source')
+
+    def __init__(self, kind, name, start, end, source, argument=None, data=None, chart_type=None):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = end
+        self.raw = source[start:end]
+        self.argument = argument
+        self.data = data
+        self.chart_type = chart_type
+        self._source = source
+
+    @property
+    def line(self):
+        """Первая строка аргумента текстовой команды"""
+        return self.argument.strip().split('\n')[0].strip()
+
+    @property
+    def prefix(self):
+        """Текст ответа до команды"""
+        return self._source[:self.start].strip()
+
+    def __repr__(self):
+        return f"Command({self.kind}, {self.name}, {self.start}:{self.end})"
+
+
+class ParsedResponse:
+    """Результат разбора ответа: команды в порядке появления в тексте"""
+
+    def __init__(self, text, commands, tool_commands=()):
+        self.text = text
+        # Вызовы инструментов заменяют команды, написанные текстом
+        if tool_commands:
+            commands = list(tool_commands) + [command for command in commands if command.kind == KIND_CHART]
+        self.commands = commands
+        self.from_tools = bool(tool_commands)
+        self._first_text = {}
+        for command in commands:
+            if command.kind == KIND_TEXT:
+                self._first_text.setdefault(command.name, command)
+
+    def text_command(self, name):
+        """Первая текстовая команда с этим именем или None"""
+        return self._first_text.get(name)
+
+    def json_commands(self, names=None):
+        return [
+            command for command in self.commands
+            if command.kind == KIND_JSON and (names is None or command.name in names)
+        ]
+
+    def json_command(self, name):
+        """Первая JSON команда с этим именем или None"""
+        commands = self.json_commands((name,))
+        return commands[0] if commands else None
+
+    @property
+    def charts(self):
+        return [command for command in self.commands if command.kind == KIND_CHART]
+
+    @property
+    def actions(self):
+        """Команды действий (без графиков)"""
+        return [command for command in self.commands if command.kind != KIND_CHART]
+
+
+def parse(text, tool_commands=()):
+    """
+    Находит все команды в ответе AI за один проход
+
+    Аргумент текстовой команды - текст после двоеточия до следующей команды с тем же
+    именем (или до конца ответа), как при разделении ответа по имени команды.
+
+    Args:
+        text: текст ответа
+        tool_commands: команды из вызовов инструментов (ai_tools.to_commands)
+
+    Returns:
+        ParsedResponse
+    """
+    text = text or ''
+    commands = []
+    text_markers = []  # (индекс в commands, конец маркера)
+    position = 0
+    while True:
+        match = _TOKEN_START_PATTERN.search(text, position)
+        if match is None:
+            break
+        start = match.start()
+        position = start + 1
+        char = text[start]
+        if char == ':':
+            name_match = _COMMAND_NAME_PATTERN.search(text, max(0, start - _MAX_COMMAND_NAME_LENGTH), start)
+            name = name_match.group(1).upper() if name_match else None
+            if name in _COMMAND_NAMES:
+                text_markers.append((len(commands), position))
+                commands.append(Command(KIND_TEXT, name, name_match.start(1), position, text))
+        elif char == '{':
+            try:
+                data, end = _json_decoder.raw_decode(text, start)
+            except ValueError:
+                continue
+            # Содержимое JSON (включая строки с текстом команд) повторно не сканируется
+            position = end
+            action = data.get('action') if isinstance(data, dict) else None
+            if isinstance(action, str) and action.upper() in _COMMAND_NAMES:
+                commands.append(Command(KIND_JSON, action.upper(), start, end, text, data=data))
+        else:
+            chart_match = _CHART_PATTERN.match(text, start)
+            if chart_match:
+                position = chart_match.end()
+                commands.append(Command(
+                    KIND_CHART, chart_match.group(1).upper(), start, position, text,
+                    chart_type=(chart_match.group(2) or '').lower() or None
+                ))
+
+    # Аргумент продолжается до следующей команды с тем же именем
+    next_start = {}
+    for index, marker_end in reversed(text_markers):
+        command = commands[index]
+        end = next_start.get(command.name, len(text))
+        command.argument = text[marker_end:end]
+        command.end = end
+        next_start[command.name] = command.start
+    return ParsedResponse(text, commands, tool_commands)
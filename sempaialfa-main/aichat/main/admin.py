@@ -59,6 +59,7 @@ class ChatRequestAdmin(admin.ModelAdmin):
     ]
     date_hierarchy = 'created_at'
     list_per_page = 25
+    list_select_related = ('metrics',)
     inlines = [ChatRequestMetricsInline]
     
     fieldsets = (
@@ -81,6 +82,17 @@ class ChatRequestAdmin(admin.ModelAdmin):
         }),
     )
     
+    # Тяжелые JSON-поля, которые не нужны в списке запросов
+    CHANGELIST_DEFERRED_FIELDS = ('files_data', 'user_data', 'chat_history')
+    
+    def get_queryset(self, request):
+        """В списке запросов не загружаем файлы, данные пользователя и историю чата"""
+        queryset = super().get_queryset(request)
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match and resolver_match.url_name == 'main_chatrequest_changelist':
+            queryset = queryset.defer(*self.CHANGELIST_DEFERRED_FIELDS)
+        return queryset
+    
     def id_short(self, obj):
         """Короткий ID для отображения в списке"""
         return str(obj.id)[:8] + '...'
@@ -528,8 +540,8 @@ class ChatRequestMetricsAdmin(admin.ModelAdmin):
     
     def chat_request_link(self, obj):
         """Ссылка на запрос"""
-        url = reverse('admin:main_chatrequest_change', args=[obj.chat_request.pk])
-        return format_html('<a href="{}">{}</a>', url, str(obj.chat_request.id)[:20])
+        url = reverse('admin:main_chatrequest_change', args=[obj.chat_request_id])
+        return format_html('<a href="{}">{}</a>', url, str(obj.chat_request_id)[:20])
     chat_request_link.short_description = 'Запрос'
     
     def processing_time_display(self, obj):
@@ -752,9 +764,9 @@ class UserActivityAdmin(admin.ModelAdmin):
     
     def chat_request_link(self, obj):
         """Ссылка на запрос"""
-        if obj.chat_request:
-            url = reverse('admin:main_chatrequest_change', args=[obj.chat_request.pk])
-            return format_html('<a href="{}">{}</a>', url, str(obj.chat_request.id)[:20])
+        if obj.chat_request_id:
+            url = reverse('admin:main_chatrequest_change', args=[obj.chat_request_id])
+            return format_html('<a href="{}">{}</a>', url, str(obj.chat_request_id)[:20])
         return '-'
     chat_request_link.short_description = 'Запрос'
     
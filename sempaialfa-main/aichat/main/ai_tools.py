@@ -0,0 +1,236 @@
+"""
+Вызов инструментов (tool calling) для действий AI (включается CHAT_TOOL_CALLING_ENABLED)
+В запрос к OpenRouter передаются описания инструментов в формате OpenAI (tools), по одному
+на команду action_parser.COMMANDS. Модель возвращает действие в tool_calls с аргументами
+в JSON по схеме, и оно обрабатывается так же, как JSON команда из текста ответа
+({"action": "UPDATE_EVENT", ...}). Разбор команд из текста остается запасным вариантом
+для моделей без поддержки инструментов и ответов, в которых модель написала команду текстом.
+
+За один ответ выполняется одно действие (parallel_tool_calls выключен): результат
+действия в ответе клиенту один, поэтому лишние вызовы инструментов отбрасываются
+
+Если провайдер отвечает, что модель не поддерживает инструменты, запрос повторяется
+без tools, а модель запоминается до перезапуска процесса
+"""
+import json
+import logging
+import threading
+
+from django.conf import settings
+
+from .action_parser import KIND_JSON, Command
+
+logger = logging.getLogger(__name__)
+
+_DATE_DESCRIPTION = 'Дата и время в формате YYYY-MM-DDTHH:mm'
+
+# Поля с числовыми значениями, остальные аргументы передаются обработчикам строками
+NUMERIC_FIELDS = frozenset(('quantity', 'price', 'salary'))
+
+# Поля запроса, которые убираются при повторе без инструментов
+REQUEST_FIELDS = ('tools', 'tool_choice', 'parallel_tool_calls')
+
+
+def _string(description):
+    return {'type': 'string', 'description': description}
+
+
+def _number(description):
+    return {'type': 'number', 'description': description}
+
+
+def _tool(command, description, properties, required=()):
+    return {
+        'type': 'function',
+        'function': {
+            'name': command.lower(),
+            'description': description,
+            'parameters': {
+                'type': 'object',
+                'properties': properties,
+                'required': list(required),
+            },
+        },
+    }
+
+
+TOOLS = [
+    _tool('CREATE_EVENT', 'Создать событие в календаре', {
+        'title': _string('Название события'),
+        'date': _string(_DATE_DESCRIPTION),
+        'description': _string('Описание события'),
+    }, required=('title', 'date')),
+    _tool('UPDATE_EVENT', 'Изменить событие календаря (передавай только изменяемые поля)', {
+        'event': _string('ID, название или дата события ("завтра", "совещание в пятницу")'),
+        'title': _string('Новое название'),
+        'date': _string(_DATE_DESCRIPTION),
+        'description': _string('Новое описание'),
+    }, required=('event',)),
+    _tool('DELETE_EVENT', 'Удалить событие календаря', {
+        'event': _string('ID, название или дата события ("завтра", "совещание в пятницу")'),
+    }, required=('event',)),
+    _tool('DELETE_DOCUMENT', 'Удалить документ', {
+        'document': _string('ID или название документа'),
+    }, required=('document',)),
+    _tool('RENAME_DOCUMENT', 'Переименовать документ', {
+        'document': _string('ID или текущее название документа'),
+        'name': _string('Новое название'),
+    }, required=('document', 'name')),
+    _tool('SEND_SUPPORT_MESSAGE', 'Отправить сообщение в поддержку', {
+        'subject': _string('Тема'),
+        'message': _string('Текст сообщения'),
+    }, required=('subject', 'message')),
+    _tool('CREATE_FOLDER', 'Создать папку инвентаризации', {
+        'name': _string('Название папки'),
+    }, required=('name',)),
+    _tool('DELETE_FOLDER', 'Удалить папку инвентаризации', {
+        'folder': _string('ID или название папки'),
+    }, required=('folder',)),
+    _tool('UPDATE_FOLDER', 'Переименовать папку инвентаризации', {
+        'folder': _string('ID или текущее название папки'),
+        'name': _string('Новое название'),
+    }, required=('folder', 'name')),
+    _tool('CREATE_INVENTORY_ITEM', 'Добавить товар в инвентаризацию', {
+        'name': _string('Название товара'),
+        'quantity': _number('Количество'),
+        'price': _number('Цена за единицу, ₽'),
+        'folder': _string('Название папки (необязательно)'),
+    }, required=('name',)),
+    _tool('DELETE_INVENTORY_ITEM', 'Удалить товар из инвентаризации', {
+        'item': _string('ID или название товара'),
+    }, required=('item',)),
+    _tool('UPDATE_INVENTORY_ITEM', 'Изменить товар (передавай только изменяемые поля, пустая папка - убрать из папки)', {
+        'item': _string('ID или название товара'),
+        'name': _string('Новое название'),
+        'quantity': _number('Новое количество'),
+        'price': _number('Новая цена за единицу, ₽'),
+        'folder': _string('Название папки'),
+    }, required=('item',)),
+    _tool('CREATE_EMPLOYEE_FOLDER', 'Создать должность (папку сотрудников)', {
+        'name': _string('Название должности'),
+    }, required=('name',)),
+    _tool('DELETE_EMPLOYEE_FOLDER', 'Удалить должность (папку сотрудников)', {
+        'folder': _string('ID или название должности'),
+    }, required=('folder',)),
+    _tool('UPDATE_EMPLOYEE_FOLDER', 'Переименовать должность (папку сотрудников)', {
+        'folder': _string('ID или текущее название должности'),
+        'name': _string('Новое название'),
+    }, required=('folder', 'name')),
+    _tool('CREATE_EMPLOYEE', 'Добавить сотрудника', {
+        'fio': _string('ФИО'),
+        'phone': _string('Телефон'),
+        'email': _string('Почта'),
+        'salary': _number('Зарплата, ₽'),
+        'folder': _string('Должность (необязательно)'),
+    }, required=('fio', 'phone', 'email')),
+    _tool('DELETE_EMPLOYEE', 'Удалить сотрудника', {
+        'employee': _string('ФИО, телефон или почта сотрудника'),
+    }, required=('employee',)),
+    _tool('UPDATE_EMPLOYEE', 'Изменить данные сотрудника (передавай только изменяемые поля, пустая должность - убрать)', {
+        'employee': _string('ФИО, телефон или почта сотрудника'),
+        'fio': _string('Новое ФИО'),
+        'phone': _string('Новый телефон'),
+        'email': _string('Новая почта'),
+        'salary': _number('Новая зарплата, ₽'),
+        'folder': _string('Должность'),
+    }, required=('employee',)),
+]
+
+# Текст ответа, если модель вызвала инструмент без пояснения
+ACTION_LABELS = {
+    'CREATE_EVENT': 'создание события',
+    'UPDATE_EVENT': 'изменение события',
+    'DELETE_EVENT': 'удаление события',
+    'DELETE_DOCUMENT': 'удаление документа',
+    'RENAME_DOCUMENT': 'переименование документа',
+    'SEND_SUPPORT_MESSAGE': 'отправка сообщения в поддержку',
+    'CREATE_FOLDER': 'создание папки',
+    'DELETE_FOLDER': 'удаление папки',
+    'UPDATE_FOLDER': 'переименование папки',
+    'CREATE_INVENTORY_ITEM': 'добавление товара',
+    'DELETE_INVENTORY_ITEM': 'удаление товара',
+    'UPDATE_INVENTORY_ITEM': 'изменение товара',
+    'CREATE_EMPLOYEE_FOLDER': 'создание должности',
+    'DELETE_EMPLOYEE_FOLDER': 'удаление должности',
+    'UPDATE_EMPLOYEE_FOLDER': 'переименование должности',
+    'CREATE_EMPLOYEE': 'добавление сотрудника',
+    'DELETE_EMPLOYEE': 'удаление сотрудника',
+    'UPDATE_EMPLOYEE': 'изменение данных сотрудника',
+}
+
+_unsupported_models = set()
+_unsupported_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_TOOL_CALLING_ENABLED', True)
+
+
+def request_options(model):
+    """Поля запроса к OpenRouter с описанием инструментов (пусто, если инструменты не используются)"""
+    if not is_enabled():
+        return {}
+    with _unsupported_lock:
+        if model in _unsupported_models:
+            return {}
+    return {'tools': TOOLS, 'tool_choice': 'auto', 'parallel_tool_calls': False}
+
+
+def is_unsupported_error(response):
+    """Ответ OpenRouter с ошибкой о том, что модель не поддерживает инструменты"""
+    # Тело успешного ответа не читается: это поток, который еще нужно передать клиенту
+    return response.status_code in (400, 404) and 'tool' in (response.text or '').lower()
+
+
+def mark_unsupported(model):
+    with _unsupported_lock:
+        _unsupported_models.add(model)
+    logger.warning(f"🛠️ Модель {model} не поддерживает вызов инструментов, действия будут разбираться из текста")
+
+
+def _arguments(raw_arguments):
+    if isinstance(raw_arguments, dict):
+        return raw_arguments
+    try:
+        arguments = json.loads(raw_arguments or '{}')
+    except (TypeError, ValueError):
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+
+def to_commands(result):
+    """
+    Команды из tool_calls ответа OpenRouter
+
+    Аргументы приводятся к виду JSON команды из текста: пустые значения отбрасываются,
+    нечисловые поля передаются строками. Если модель все же вернула несколько вызовов,
+    выполняется только первый: остальные не попали бы в результат действия
+
+    Returns:
+        list: action_parser.Command (kind=json), не больше одной
+    """
+    message = (result.get('choices') or [{}])[0].get('message') or {}
+    commands = []
+    for tool_call in message.get('tool_calls') or []:
+        function = tool_call.get('function') or {}
+        name = (function.get('name') or '').upper()
+        arguments = _arguments(function.get('arguments'))
+        if name not in ACTION_LABELS or arguments is None:
+            logger.warning(f"⚠️ Не удалось разобрать вызов инструмента: {function.get('name')} {str(function.get('arguments'))[:200]}")
+            continue
+        data = {'action': name}
+        for key, value in arguments.items():
+            if value is None:
+                continue
+            data[key] = value if key in NUMERIC_FIELDS else str(value)
+        commands.append(Command(KIND_JSON, name, 0, 0, '', data=data))
+    if len(commands) > 1:
+        skipped = ', '.join(command.name for command in commands[1:])
+        logger.warning(f"⚠️ Модель вернула несколько вызовов инструментов, выполняется {commands[0].name}, пропущены: {skipped}")
+    return commands[:1]
+
+
+def describe(commands):
+    """Текст ответа для вызова инструментов без пояснения модели"""
+    labels = [ACTION_LABELS[command.name] for command in commands]
+    return f"Выполняю: {', '.join(labels)}."
@@ -5,3 +5,10 @@ class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
 
+    def ready(self):
+        from django.db.models.signals import post_save
+        from .chat_events import on_chat_request_saved
+        from .models import ChatRequest
+
+        # Будим long-poll запросы /api/chat-status/ при каждом сохранении запроса к AI
+        post_save.connect(on_chat_request_saved, sender=ChatRequest, dispatch_uid='chat_request_status_events')
@@ -0,0 +1,251 @@
+"""
+Хранилище прикрепленных файлов с адресацией по содержимому
+Файл сохраняется на диск один раз под ключом SHA-256 (MEDIA_ROOT/blobs/ab/cd/<sha256>),
+а ChatRequest.files_data хранит только ссылку: {'name', 'type', 'size', 'blob'}.
+Повторно прикрепленный файл не дублируется. Файлы, на которые больше не ссылается
+ни один запрос, удаляет manage.py gc_blobs
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BLOB_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def get_blob_root():
+    """Корневой каталог хранилища"""
+    return Path(getattr(settings, 'CHAT_BLOB_ROOT', None) or Path(settings.MEDIA_ROOT) / 'blobs')
+
+
+def blob_path(key):
+    """Путь к файлу по ключу"""
+    if not BLOB_KEY_PATTERN.match(key or ''):
+        raise ValueError(f'Некорректный ключ файла: {key!r}')
+    return get_blob_root() / key[:2] / key[2:4] / key
+
+
+def exists(key):
+    try:
+        return blob_path(key).exists()
+    except ValueError:
+        return False
+
+
+def put_bytes(data):
+    """
+    Сохраняет содержимое, если его еще нет в хранилище
+
+    Returns:
+        str: ключ SHA-256
+    """
+    key = hashlib.sha256(data).hexdigest()
+    path = blob_path(key)
+    if path.exists():
+        # Обновляем время изменения, чтобы сборщик мусора не удалил файл до сохранения ссылки
+        os.utime(path)
+        return key
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Пишем во временный файл и атомарно переименовываем: читатели не увидят частично записанный файл
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return key
+
+
+def put_stream(chunks):
+    """
+    Сохраняет содержимое, поступающее частями, не держа его в памяти целиком
+
+    Returns:
+        tuple: (ключ SHA-256, размер в байтах)
+    """
+    root = get_blob_root()
+    root.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            for chunk in chunks:
+                digest.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+        key = digest.hexdigest()
+        path = blob_path(key)
+        if path.exists():
+            os.unlink(tmp_path)
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return key, size
+
+
+def store_upload(uploaded_file):
+    """
+    Сохраняет загруженный файл (django UploadedFile) в хранилище
+
+    Returns:
+        dict: ссылка на файл для ChatRequest.files_data
+    """
+    key, size = put_stream(uploaded_file.chunks())
+    return {
+        'name': uploaded_file.name or '',
+        'type': uploaded_file.content_type or '',
+        'size': size,
+        'blob': key,
+    }
+
+
+def read_bytes(key):
+    with open(blob_path(key), 'rb') as blob_file:
+        return blob_file.read()
+
+
+def delete(key):
+    try:
+        blob_path(key).unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _decode_base64(file_data):
+    """Декодирует base64 (с префиксом data:...;base64, или без него)"""
+    if ',' in file_data[:200] and file_data.startswith('data:'):
+        file_data = file_data.split(',', 1)[1]
+    file_data = ''.join(file_data.split())
+    return base64.b64decode(file_data + '=' * (-len(file_data) % 4), validate=True)
+
+
+def externalize_file(file):
+    """
+    Переносит base64-содержимое файла в хранилище
+
+    Returns:
+        dict: ссылка на файл без поля data; исходный словарь, если данные не base64
+    """
+    if not isinstance(file, dict) or not file.get('data') or file.get('blob'):
+        return file
+    try:
+        content = _decode_base64(file['data'])
+    except (binascii.Error, ValueError) as e:
+        logger.warning(f"⚠️ Файл '{file.get('name', '')}' не удалось декодировать из base64, оставлен в запросе: {str(e)}")
+        return file
+
+    try:
+        key = put_bytes(content)
+    except OSError as e:
+        logger.error(f"❌ Не удалось сохранить файл '{file.get('name', '')}' в хранилище, оставлен в запросе: {str(e)}")
+        return file
+
+    reference = {name: value for name, value in file.items() if name != 'data'}
+    reference['blob'] = key
+    reference['size'] = len(content)
+    return reference
+
+
+def externalize_files(files):
+    """Переносит содержимое всех файлов запроса в хранилище"""
+    if not files:
+        return files
+    return [externalize_file(file) for file in files]
+
+
+def resolve_file_path(file):
+    """Путь к содержимому файла в хранилище или None (файл передан в base64 или отсутствует)"""
+    if not file.get('blob'):
+        return None
+    try:
+        path = blob_path(file['blob'])
+    except ValueError:
+        return None
+    return str(path) if path.exists() else None
+
+
+def resolve_file_data(file):
+    """
+    Возвращает содержимое файла в base64 (в формате, который ожидает process_file)
+
+    Поддерживает как ссылки на хранилище, так и старые записи с полем data
+    """
+    if file.get('blob'):
+        try:
+            return base64.b64encode(read_bytes(file['blob'])).decode('ascii')
+        except (FileNotFoundError, ValueError):
+            logger.error(f"❌ Файл '{file.get('name', '')}' не найден в хранилище: {file['blob']}")
+            return ''
+    return file.get('data', '')
+
+
+def iter_blob_keys():
+    """Перебирает ключи всех файлов в хранилище"""
+    root = get_blob_root()
+    if not root.exists():
+        return
+    for path in root.glob('*/*/*'):
+        if path.is_file() and BLOB_KEY_PATTERN.match(path.name):
+            yield path.name
+
+
+def referenced_keys(files_data_iterable):
+    """Собирает ключи файлов, на которые ссылаются записи files_data"""
+    keys = set()
+    for files in files_data_iterable:
+        for file in files or []:
+            if isinstance(file, dict) and file.get('blob'):
+                keys.add(file['blob'])
+    return keys
+
+
+def collect_garbage(referenced, grace_seconds=3600, dry_run=False):
+    """
+    Удаляет файлы, на которые никто не ссылается
+
+    Args:
+        referenced: множество используемых ключей
+        grace_seconds: не трогать файлы моложе этого возраста (запрос с ними еще может сохраняться)
+        dry_run: только посчитать
+
+    Returns:
+        tuple: (удалено файлов, освобождено байт)
+    """
+    now = time.time()
+    removed = 0
+    freed = 0
+    for key in list(iter_blob_keys()):
+        if key in referenced:
+            continue
+        path = blob_path(key)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime < grace_seconds:
+            continue
+        if not dry_run:
+            path.unlink(missing_ok=True)
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
@@ -0,0 +1,145 @@
+"""
+Диспетчер фоновой обработки запросов к AI
+Ограничивает число одновременных обращений к LLM пулом потоков фиксированного размера
+и очередью ограниченной длины, собирает статистику загрузки пула
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь обработки запросов переполнена"""
+
+
+class ChatDispatcher:
+    """Пул потоков фиксированного размера с ограниченной очередью ожидания"""
+
+    def __init__(self, max_workers, max_queue_size):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue_size = max(0, int(max_queue_size))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='ChatWorker'
+        )
+        self._lock = threading.Lock()
+        self._in_flight = set()  # ID запросов, которые ждут в очереди или обрабатываются
+        self._queued = 0
+        self._active = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+
+    def submit(self, func, request_id):
+        """
+        Ставит обработку запроса в очередь
+
+        Returns:
+            bool: True - задача поставлена, False - запрос уже в очереди или обрабатывается
+
+        Raises:
+            QueueFullError: если очередь ожидания заполнена
+        """
+        with self._lock:
+            if request_id in self._in_flight:
+                return False
+            if self._queued >= self.max_queue_size:
+                self._rejected += 1
+                raise QueueFullError(
+                    f'Очередь обработки заполнена ({self._queued}/{self.max_queue_size})'
+                )
+            self._in_flight.add(request_id)
+            self._queued += 1
+            self._submitted += 1
+
+        try:
+            self._executor.submit(self._run, func, request_id)
+        except RuntimeError:
+            # Пул уже остановлен (завершение процесса)
+            with self._lock:
+                self._in_flight.discard(request_id)
+                self._queued -= 1
+            raise
+        return True
+
+    def _run(self, func, request_id):
+        """Выполняет задачу в потоке пула и обновляет счетчики"""
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        started = time.monotonic()
+        failed = False
+        try:
+            func(request_id)
+        except Exception as e:
+            failed = True
+            logger.error(f"❌ Необработанная ошибка в потоке пула для запроса {request_id}: {str(e)}", exc_info=True)
+        finally:
+            # Потоки пула живут долго - освобождаем соединения с БД после каждой задачи
+            close_old_connections()
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._active -= 1
+                self._busy_seconds += elapsed
+                self._in_flight.discard(request_id)
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+    def is_in_flight(self, request_id):
+        """Ждет ли запрос в очереди или уже обрабатывается"""
+        with self._lock:
+            return request_id in self._in_flight
+
+    def stats(self):
+        """Текущее состояние пула: глубина очереди, занятость воркеров, счетчики"""
+        with self._lock:
+            uptime = max(time.monotonic() - self._started_at, 1e-9)
+            return {
+                'max_workers': self.max_workers,
+                'max_queue_size': self.max_queue_size,
+                'queue_depth': self._queued,
+                'active_workers': self._active,
+                'utilization': self._active / self.max_workers * 100,
+                'average_utilization': min(self._busy_seconds / (uptime * self.max_workers) * 100, 100.0),
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'failed': self._failed,
+                'uptime_seconds': uptime,
+            }
+
+    def shutdown(self, wait=True):
+        """Останавливает пул"""
+        self._executor.shutdown(wait=wait)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Возвращает общий для процесса диспетчер, создавая его по настройкам при первом обращении"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = ChatDispatcher(
+                    max_workers=getattr(settings, 'CHAT_WORKER_POOL_SIZE', 8),
+                    max_queue_size=getattr(settings, 'CHAT_QUEUE_MAX_SIZE', 100),
+                )
+                logger.info(
+                    f"🧵 Создан пул обработки запросов: воркеров={_dispatcher.max_workers}, "
+                    f"очередь={_dispatcher.max_queue_size}"
+                )
+    return _dispatcher
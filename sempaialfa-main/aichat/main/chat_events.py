@@ -0,0 +1,170 @@
+"""
+Уведомления об изменении статуса запросов к AI для long-poll /api/chat-status/
+Сохранение ChatRequest (сигнал post_save) увеличивает версию запроса в памяти процесса
+и в кэше Django, а ожидающие запросы статуса просыпаются, не опрашивая БД.
+Если кэш не общий для процессов (DummyCache/LocMemCache) и запросы обрабатываются
+отдельными воркерами, ожидание проверяет статус в БД легким запросом раз в
+CHAT_LONG_POLL_DB_INTERVAL секунд
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'chat_status_version:'
+CACHE_TTL = 600
+# Сколько запросов отслеживать в памяти процесса (старые вытесняются, их ожидание завершится по таймауту)
+MAX_TRACKED_REQUESTS = 10000
+
+_versions = OrderedDict()
+_condition = threading.Condition()
+# Ожидающие async-представления: request_id -> {(event loop, asyncio.Event)}
+_async_waiters = {}
+
+
+def _cache_key(request_id):
+    return f'{CACHE_KEY_PREFIX}{request_id}'
+
+
+def _is_shared_cache():
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    return not backend.endswith(('DummyCache', 'LocMemCache'))
+
+
+def current_version(request_id):
+    """Текущая версия запроса (в памяти процесса и в кэше)"""
+    request_id = str(request_id)
+    with _condition:
+        local = _versions.get(request_id, 0)
+    return local, cache.get(_cache_key(request_id), 0)
+
+
+def notify(request_id):
+    """Сообщает ожидающим, что запрос изменился"""
+    request_id = str(request_id)
+    with _condition:
+        _versions[request_id] = _versions.get(request_id, 0) + 1
+        _versions.move_to_end(request_id)
+        while len(_versions) > MAX_TRACKED_REQUESTS:
+            _versions.popitem(last=False)
+        _condition.notify_all()
+        for loop, event in _async_waiters.get(request_id, ()):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Цикл событий уже закрыт - ожидающий завершился
+                pass
+    try:
+        try:
+            cache.incr(_cache_key(request_id))
+        except ValueError:
+            cache.set(_cache_key(request_id), 1, CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось обновить версию запроса {request_id} в кэше: {str(e)}")
+
+
+def on_chat_request_saved(sender, instance, **kwargs):
+    """Обработчик post_save для ChatRequest"""
+    notify(instance.pk)
+
+
+def wait_for_change(request_id, since_version, timeout, status_changed=None):
+    """
+    Ждет изменения запроса не дольше timeout секунд
+
+    Args:
+        since_version: версия, полученная из current_version() до проверки статуса
+        status_changed: функция без аргументов, проверяющая статус в БД; вызывается,
+            только когда уведомления из других процессов недоступны
+
+    Returns:
+        bool: True - запрос изменился, False - истек таймаут
+    """
+    request_id = str(request_id)
+    local_since, cache_since = since_version
+    check_cache = _is_shared_cache()
+    db_interval = getattr(settings, 'CHAT_LONG_POLL_DB_INTERVAL', 2)
+    poll_db = status_changed is not None and not check_cache and getattr(
+        settings, 'CHAT_PROCESSING_MODE', 'thread'
+    ) == 'worker'
+
+    deadline = time.monotonic() + timeout
+    next_db_check = time.monotonic() + db_interval
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _condition:
+            if _versions.get(request_id, 0) != local_since:
+                return True
+            _condition.wait(min(remaining, 1.0))
+            if _versions.get(request_id, 0) != local_since:
+                return True
+        if check_cache and cache.get(_cache_key(request_id), 0) != cache_since:
+            return True
+        if poll_db and time.monotonic() >= next_db_check:
+            if status_changed():
+                return True
+            next_db_check = time.monotonic() + db_interval
+
+
+async def async_wait_for_change(request_id, since_version, timeout, status_changed=None):
+    """
+    Асинхронный вариант wait_for_change для async-представлений
+
+    Ожидание не занимает поток: notify() будит ожидающего через его цикл событий
+
+    Args:
+        status_changed: корутинная функция без аргументов, проверяющая статус в БД
+
+    Returns:
+        bool: True - запрос изменился, False - истек таймаут
+    """
+    request_id = str(request_id)
+    local_since, cache_since = since_version
+    check_cache = _is_shared_cache()
+    db_interval = getattr(settings, 'CHAT_LONG_POLL_DB_INTERVAL', 2)
+    poll_db = status_changed is not None and not check_cache and getattr(
+        settings, 'CHAT_PROCESSING_MODE', 'thread'
+    ) == 'worker'
+
+    event = asyncio.Event()
+    waiter = (asyncio.get_running_loop(), event)
+    with _condition:
+        _async_waiters.setdefault(request_id, set()).add(waiter)
+    try:
+        deadline = time.monotonic() + timeout
+        next_db_check = time.monotonic() + db_interval
+        while True:
+            with _condition:
+                if _versions.get(request_id, 0) != local_since:
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, 1.0))
+                event.clear()
+                continue
+            except asyncio.TimeoutError:
+                pass
+            if check_cache and await sync_to_async(cache.get)(_cache_key(request_id), 0) != cache_since:
+                return True
+            if poll_db and time.monotonic() >= next_db_check:
+                if await status_changed():
+                    return True
+                next_db_check = time.monotonic() + db_interval
+    finally:
+        with _condition:
+            waiters = _async_waiters.get(request_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del _async_waiters[request_id]
@@ -0,0 +1,245 @@
+"""
+Очередь обработки запросов к AI в базе данных
+Воркеры (manage.py run_chat_workers) атомарно забирают ожидающие запросы ChatRequest,
+владеют ими в течение аренды (lease), продлевают ее heartbeat'ами и повторяют
+обработку после временных ошибок. Запросы упавших воркеров возвращаются в очередь
+после истечения аренды
+"""
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ChatRequest
+
+logger = logging.getLogger(__name__)
+
+# Сколько кандидатов перебирать при захвате без SKIP LOCKED (SQLite)
+CLAIM_BATCH_SIZE = 10
+
+# Ошибки, после которых запрос имеет смысл повторить: сеть, таймауты, 429 и 5xx от OpenRouter
+RETRYABLE_ERROR_PATTERN = re.compile(
+    r'Ошибка подключения|Не удалось подключиться|Превышено время ожидания|timed? ?out|\((?:429|5\d\d)\)',
+    re.IGNORECASE
+)
+
+
+def get_processing_mode():
+    """Режим обработки: 'thread' - пул потоков веб-процесса, 'worker' - отдельные воркеры"""
+    return getattr(settings, 'CHAT_PROCESSING_MODE', 'thread')
+
+
+def make_worker_id():
+    """Уникальный идентификатор воркера: хост, PID и случайный суффикс"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _claim_values(worker_id, lease_seconds, now):
+    return {
+        'status': ChatRequest.STATUS_PROCESSING,
+        'locked_by': worker_id,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+        'heartbeat_at': now,
+        'attempts': F('attempts') + 1,
+        'updated_at': now,
+    }
+
+
+def claim_next(worker_id, lease_seconds):
+    """
+    Атомарно забирает самый старый ожидающий запрос
+
+    На Postgres используется SELECT ... FOR UPDATE SKIP LOCKED, на базах без SKIP LOCKED
+    (SQLite) - условный UPDATE по статусу: запрос достается только тому воркеру,
+    чей UPDATE изменил строку
+
+    Returns:
+        UUID забранного запроса или None, если очередь пуста
+    """
+    now = timezone.now()
+    pending = ChatRequest.objects.filter(status=ChatRequest.STATUS_PENDING).order_by('created_at')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            request_id = pending.select_for_update(skip_locked=True).values_list('id', flat=True).first()
+            if request_id is None:
+                return None
+            ChatRequest.objects.filter(id=request_id).update(**_claim_values(worker_id, lease_seconds, now))
+            return request_id
+
+    for request_id in pending.values_list('id', flat=True)[:CLAIM_BATCH_SIZE]:
+        claimed = ChatRequest.objects.filter(
+            id=request_id,
+            status=ChatRequest.STATUS_PENDING
+        ).update(**_claim_values(worker_id, lease_seconds, now))
+        if claimed:
+            return request_id
+    return None
+
+
+def heartbeat(request_id, worker_id, lease_seconds):
+    """
+    Продлевает аренду запроса
+
+    Returns:
+        bool: False, если воркер больше не владеет запросом (аренду забрал другой воркер)
+    """
+    now = timezone.now()
+    return bool(ChatRequest.objects.filter(
+        id=request_id,
+        locked_by=worker_id,
+        status=ChatRequest.STATUS_PROCESSING
+    ).update(
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        heartbeat_at=now
+    ))
+
+
+def release(request_id, worker_id):
+    """Снимает аренду с запроса после завершения обработки"""
+    ChatRequest.objects.filter(id=request_id, locked_by=worker_id).update(
+        locked_by='',
+        lease_expires_at=None
+    )
+
+
+def is_retryable_error(error):
+    """Можно ли повторить запрос, завершившийся этой ошибкой"""
+    return bool(error) and bool(RETRYABLE_ERROR_PATTERN.search(error))
+
+
+def requeue_if_retryable(request_id, worker_id, max_attempts):
+    """
+    Возвращает упавший запрос в очередь, если ошибка временная и попытки не исчерпаны
+
+    Returns:
+        bool: True - запрос снова ожидает обработки
+    """
+    chat_request = ChatRequest.objects.filter(id=request_id).only('status', 'error', 'attempts').first()
+    if chat_request is None or chat_request.status != ChatRequest.STATUS_FAILED:
+        return False
+    if chat_request.attempts >= max_attempts or not is_retryable_error(chat_request.error):
+        return False
+    return bool(ChatRequest.objects.filter(
+        id=request_id,
+        locked_by=worker_id,
+        status=ChatRequest.STATUS_FAILED
+    ).update(
+        status=ChatRequest.STATUS_PENDING,
+        error=None,
+        completed_at=None,
+        locked_by='',
+        lease_expires_at=None,
+        updated_at=timezone.now()
+    ))
+
+
+def recover_expired_leases(max_attempts):
+    """
+    Возвращает в очередь запросы, аренда которых истекла (воркер упал или завис)
+    Запросы с исчерпанными попытками помечаются как неудавшиеся
+
+    Returns:
+        tuple: (возвращено в очередь, помечено как неудавшиеся)
+    """
+    now = timezone.now()
+    expired = ChatRequest.objects.filter(
+        status=ChatRequest.STATUS_PROCESSING,
+        lease_expires_at__lt=now
+    )
+    failed = expired.filter(attempts__gte=max_attempts).update(
+        status=ChatRequest.STATUS_FAILED,
+        error='Обработка запроса прервана: воркер не ответил, попытки исчерпаны',
+        completed_at=now,
+        locked_by='',
+        lease_expires_at=None,
+        updated_at=now
+    )
+    requeued = expired.filter(attempts__lt=max_attempts).update(
+        status=ChatRequest.STATUS_PENDING,
+        locked_by='',
+        lease_expires_at=None,
+        updated_at=now
+    )
+    if requeued or failed:
+        logger.warning(f"♻️ Истекшие аренды: возвращено в очередь {requeued}, помечено как неудавшиеся {failed}")
+    return requeued, failed
+
+
+class LeaseKeeper:
+    """Фоновый поток, продлевающий аренду запроса, пока он обрабатывается"""
+
+    def __init__(self, request_id, worker_id, lease_seconds):
+        self.request_id = request_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'Lease-{request_id}')
+
+    def _run(self):
+        interval = max(self.lease_seconds / 3, 1)
+        try:
+            while not self._stop.wait(interval):
+                if not heartbeat(self.request_id, self.worker_id, self.lease_seconds):
+                    if self._stop.is_set():
+                        return  # Обработка завершилась между ожиданием и heartbeat
+                    self.lost = True
+                    logger.warning(f"⚠️ Воркер {self.worker_id} потерял аренду запроса {self.request_id}")
+                    return
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def process_claimed(request_id, worker_id, process_func, lease_seconds, max_attempts):
+    """
+    Обрабатывает забранный запрос под защитой аренды, затем снимает аренду
+    или возвращает запрос в очередь при временной ошибке
+    """
+    with LeaseKeeper(request_id, worker_id, lease_seconds):
+        try:
+            process_func(request_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки запроса {request_id} воркером {worker_id}: {str(e)}", exc_info=True)
+            ChatRequest.objects.filter(id=request_id, locked_by=worker_id).update(
+                status=ChatRequest.STATUS_FAILED,
+                error=str(e),
+                completed_at=timezone.now()
+            )
+
+    if requeue_if_retryable(request_id, worker_id, max_attempts):
+        logger.info(f"🔁 Запрос {request_id} возвращен в очередь для повторной попытки")
+        return
+    release(request_id, worker_id)
+
+
+def queue_stats():
+    """Состояние очереди в БД: ожидающие и обрабатываемые запросы, просроченные аренды"""
+    now = timezone.now()
+    processing = ChatRequest.objects.filter(status=ChatRequest.STATUS_PROCESSING)
+    oldest_pending = ChatRequest.objects.filter(
+        status=ChatRequest.STATUS_PENDING
+    ).order_by('created_at').values_list('created_at', flat=True).first()
+    return {
+        'queue_depth': ChatRequest.objects.filter(status=ChatRequest.STATUS_PENDING).count(),
+        'active_workers': processing.filter(lease_expires_at__gte=now).count(),
+        'expired_leases': processing.filter(lease_expires_at__lt=now).count(),
+        'oldest_pending_seconds': (now - oldest_pending).total_seconds() if oldest_pending else 0,
+    }
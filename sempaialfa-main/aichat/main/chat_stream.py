@@ -0,0 +1,221 @@
+"""
+Потоковая передача ответов AI (Server-Sent Events)
+Фоновая обработка запроса читает ответ OpenRouter в режиме stream и публикует
+фрагменты текста в брокер, из которого их забирает endpoint /api/chat-stream/<id>/.
+Брокер хранится в памяти процесса: в режиме отдельных воркеров (CHAT_PROCESSING_MODE=worker)
+фрагменты в веб-процесс не попадают, и поток отдает только итоговый ответ
+
+Endpoint - async-представление: под ASGI ожидание фрагментов (async_wait) не занимает поток,
+а публикация из потока обработки будит его через цикл событий
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд хранить завершенный поток для опоздавших подписчиков
+FINISHED_STREAM_TTL = 60
+
+
+class _Stream:
+    """Накопленные фрагменты ответа одного запроса"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.finished_at = None
+
+
+class StreamBroker:
+    """Буфер фрагментов ответов: публикация из воркера, чтение из SSE endpoint"""
+
+    def __init__(self):
+        self._streams = {}
+        self._condition = threading.Condition()
+        # Ожидающие async-подписчики: request_id -> {(event loop, asyncio.Event)}
+        self._async_waiters = {}
+
+    def _get(self, request_id):
+        stream = self._streams.get(request_id)
+        if stream is None:
+            stream = _Stream()
+            self._streams[request_id] = stream
+        return stream
+
+    def publish(self, request_id, text):
+        """Добавляет фрагмент ответа и будит ожидающих подписчиков"""
+        if not text:
+            return
+        with self._condition:
+            self._get(str(request_id)).chunks.append(text)
+            self._condition.notify_all()
+            self._wake(str(request_id))
+
+    def finish(self, request_id):
+        """Отмечает, что генерация ответа завершена"""
+        with self._condition:
+            stream = self._get(str(request_id))
+            stream.finished = True
+            stream.finished_at = time.monotonic()
+            self._condition.notify_all()
+            self._wake(str(request_id))
+            self._cleanup()
+
+    def _wake(self, request_id):
+        """Будит async-подписчиков запроса (вызывается под блокировкой)"""
+        for loop, event in self._async_waiters.get(request_id, ()):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Цикл событий уже закрыт - подписчик завершился
+                pass
+
+    def _new_chunks(self, request_id, offset):
+        """Фрагменты после offset или None, если ждать еще нужно (вызывается под блокировкой)"""
+        stream = self._streams.get(request_id)
+        if stream is not None and (len(stream.chunks) > offset or stream.finished):
+            return stream.chunks[offset:], stream.finished
+        return None
+
+    def wait(self, request_id, offset, timeout):
+        """
+        Ждет новые фрагменты после позиции offset
+
+        Returns:
+            tuple: (список новых фрагментов, завершена ли генерация)
+        """
+        request_id = str(request_id)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                new_chunks = self._new_chunks(request_id, offset)
+                if new_chunks is not None:
+                    return new_chunks
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], False
+                self._condition.wait(remaining)
+
+    async def async_wait(self, request_id, offset, timeout):
+        """Асинхронный вариант wait: ожидание не занимает поток"""
+        request_id = str(request_id)
+        deadline = time.monotonic() + timeout
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._condition:
+            self._async_waiters.setdefault(request_id, set()).add(waiter)
+        try:
+            while True:
+                with self._condition:
+                    new_chunks = self._new_chunks(request_id, offset)
+                if new_chunks is not None:
+                    return new_chunks
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], False
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            with self._condition:
+                waiters = self._async_waiters.get(request_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._async_waiters[request_id]
+
+    def discard(self, request_id):
+        with self._condition:
+            self._streams.pop(str(request_id), None)
+
+    def _cleanup(self):
+        """Удаляет давно завершенные потоки (вызывается под блокировкой)"""
+        now = time.monotonic()
+        expired = [
+            request_id for request_id, stream in self._streams.items()
+            if stream.finished and now - stream.finished_at > FINISHED_STREAM_TTL
+        ]
+        for request_id in expired:
+            del self._streams[request_id]
+
+
+broker = StreamBroker()
+
+
+def read_completion(response, request_id):
+    """
+    Читает ответ OpenRouter, публикуя фрагменты текста по мере поступления
+
+    Поддерживает как поток SSE (payload "stream": True), так и обычный JSON,
+    если провайдер проигнорировал потоковый режим
+    Вызовы инструментов (delta.tool_calls) собираются из фрагментов в message.tool_calls
+
+    Returns:
+        dict: ответ в формате обычного (не потокового) chat completion
+    """
+    content_type = response.headers.get('Content-Type', '')
+    if 'text/event-stream' not in content_type:
+        result = response.json()
+        content = result.get('choices', [{}])[0].get('message', {}).get('content')
+        if content:
+            broker.publish(request_id, content)
+        return result
+
+    parts = []
+    tool_calls = {}  # индекс вызова -> вызов инструмента, аргументы приходят фрагментами
+    usage = None
+    finish_reason = None
+    # SSE всегда в UTF-8, а без charset в Content-Type requests декодирует поток как ISO-8859-1
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(decode_unicode=True):
+        # Пустые строки разделяют события, строки с ':' - комментарии (OpenRouter шлет keep-alive)
+        if not line or line.startswith(':') or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            logger.warning(f"⚠️ Не удалось разобрать фрагмент потока OpenRouter: {data[:100]}")
+            continue
+        if chunk.get('error'):
+            error = chunk['error']
+            message = error.get('message', '') if isinstance(error, dict) else str(error)
+            raise ValueError(f'Ошибка OpenRouter в потоке ответа: {message}')
+        if chunk.get('usage'):
+            usage = chunk['usage']
+        choice = (chunk.get('choices') or [{}])[0]
+        finish_reason = choice.get('finish_reason') or finish_reason
+        delta = choice.get('delta') or {}
+        if delta.get('content'):
+            parts.append(delta['content'])
+            broker.publish(request_id, delta['content'])
+        for tool_delta in delta.get('tool_calls') or []:
+            tool_call = tool_calls.setdefault(tool_delta.get('index', len(tool_calls)), {
+                'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''}
+            })
+            tool_call['id'] = tool_delta.get('id') or tool_call['id']
+            function = tool_delta.get('function') or {}
+            tool_call['function']['name'] += function.get('name') or ''
+            tool_call['function']['arguments'] += function.get('arguments') or ''
+
+    message = {'role': 'assistant'}
+    if parts:
+        message['content'] = ''.join(parts)
+    if tool_calls:
+        message['tool_calls'] = [tool_calls[index] for index in sorted(tool_calls)]
+    result = {'choices': [{'message': message, 'finish_reason': finish_reason}]}
+    if usage:
+        result['usage'] = usage
+    return result
+
+
+def format_sse(event, data):
+    """Форматирует событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
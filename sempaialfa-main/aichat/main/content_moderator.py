@@ -1,12 +1,27 @@
 """
 Модуль цензуры и модерации контента для LLM
 Фильтрует входящие сообщения пользователя и ответы AI
+
+Запрещенные слова и паттерны при загрузке модуля собираются в одно регулярное выражение
+(compile_rules), и чистый текст проверяется за один проход вместо цикла по каждому правилу.
+Если выражение нашло совпадение, сработавшие правила определяются заранее скомпилированными
+выражениями (find_rules возвращает все, а не только первое).
+Результат check_message кэшируется по тексту сообщения: chat_api и обработчик запроса
+проверяют одно и то же сообщение, и повторная проверка берется из кэша
 """
 import re
 import logging
+import threading
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+RULE_WORD = 'word'
+RULE_PATTERN = 'pattern'
+
+_REPEATED_CHARS_PATTERN = re.compile(r'(.)\1{10,}')
+_CONTROL_CHARS_PATTERN = re.compile(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]')
+
 
 class ContentModerator:
     """Класс для модерации контента"""
@@ -35,6 +50,51 @@ class ContentModerator:
     # Максимальная длина сообщения
     MAX_MESSAGE_LENGTH = 10000
     
+    # Число результатов check_message в кэше (по тексту сообщения)
+    CHECK_CACHE_MAX_ENTRIES = 1024
+    
+    _rules = ()  # (правило, вид, скомпилированное выражение)
+    _combined_pattern = None
+    _check_cache = OrderedDict()
+    _check_cache_lock = threading.Lock()
+    
+    @classmethod
+    def compile_rules(cls):
+        """
+        Компилирует запрещенные слова и паттерны в одно выражение
+        Вызывается при загрузке модуля; после изменения FORBIDDEN_WORDS или FORBIDDEN_PATTERNS
+        нужно вызвать снова (кэш проверок сбрасывается)
+        """
+        sources = [(word, RULE_WORD, re.escape(word.lower())) for word in cls.FORBIDDEN_WORDS]
+        sources += [(pattern, RULE_PATTERN, pattern) for pattern in cls.FORBIDDEN_PATTERNS]
+        # Текст проверяется в нижнем регистре, поэтому правила без заглавных букв компилируются
+        # без IGNORECASE: с ним поиск по кириллице в несколько раз медленнее
+        alternatives = [
+            f'(?:{source})' if source == source.lower() else f'(?i:{source})'
+            for _, _, source in sources
+        ]
+        cls._rules = tuple(
+            (rule, kind, re.compile(alternative)) for (rule, kind, _), alternative in zip(sources, alternatives)
+        )
+        cls._combined_pattern = re.compile('|'.join(alternatives)) if alternatives else None
+        with cls._check_cache_lock:
+            cls._check_cache.clear()
+    
+    @classmethod
+    def find_rules(cls, text):
+        """
+        Находит все сработавшие правила
+        
+        Args:
+            text: текст в нижнем регистре
+            
+        Returns:
+            list: (правило, вид) в порядке FORBIDDEN_WORDS, затем FORBIDDEN_PATTERNS
+        """
+        if cls._combined_pattern is None or not cls._combined_pattern.search(text):
+            return []
+        return [(rule, kind) for rule, kind, compiled in cls._rules if compiled.search(text)]
+    
     @classmethod
     def check_message(cls, message):
         """
@@ -50,6 +110,23 @@ class ContentModerator:
                 'filtered_message': str - отфильтрованное сообщение
             }
         """
+        if not message or not isinstance(message, str):
+            return cls._check_message(message)
+        with cls._check_cache_lock:
+            cached = cls._check_cache.get(message)
+            if cached is not None:
+                cls._check_cache.move_to_end(message)
+                return dict(cached)
+        result = cls._check_message(message)
+        with cls._check_cache_lock:
+            cls._check_cache[message] = dict(result)
+            while len(cls._check_cache) > cls.CHECK_CACHE_MAX_ENTRIES:
+                cls._check_cache.popitem(last=False)
+        return result
+    
+    @classmethod
+    def _check_message(cls, message):
+        """Проверка сообщения без кэша (см. check_message)"""
         if not message or not isinstance(message, str):
             return {
                 'allowed': False,
@@ -74,25 +151,27 @@ class ContentModerator:
                 'filtered_message': message[:cls.MAX_MESSAGE_LENGTH]
             }
         
-        # Проверка на запрещенные слова
-        for word in cls.FORBIDDEN_WORDS:
-            if word.lower() in message_lower:
-                logger.warning(f"Обнаружено запрещенное слово в сообщении: {word}")
-                return {
-                    'allowed': False,
-                    'reason': 'Сообщение содержит недопустимый контент',
-                    'filtered_message': cls._filter_message(message, word)
-                }
-        
-        # Проверка на запрещенные паттерны
-        for pattern in cls.FORBIDDEN_PATTERNS:
-            if re.search(pattern, message_lower, re.IGNORECASE):
-                logger.warning(f"Обнаружен запрещенный паттерн в сообщении: {pattern}")
-                return {
-                    'allowed': False,
-                    'reason': 'Сообщение содержит недопустимый контент',
-                    'filtered_message': message  # Не фильтруем, просто блокируем
-                }
+        # Проверка на запрещенные слова и паттерны за один проход
+        matched_rules = cls.find_rules(message_lower)
+        words = [rule for rule, kind in matched_rules if kind == RULE_WORD]
+        if words:
+            logger.warning(f"Обнаружены запрещенные слова в сообщении: {words}")
+            filtered_message = message
+            for word in words:
+                filtered_message = cls._filter_message(filtered_message, word)
+            return {
+                'allowed': False,
+                'reason': 'Сообщение содержит недопустимый контент',
+                'filtered_message': filtered_message
+            }
+        
+        if matched_rules:
+            logger.warning(f"Обнаружены запрещенные паттерны в сообщении: {[rule for rule, _ in matched_rules]}")
+            return {
+                'allowed': False,
+                'reason': 'Сообщение содержит недопустимый контент',
+                'filtered_message': message  # Не фильтруем, просто блокируем
+            }
         
         # Проверка на спам (множественные повторения)
         if cls._is_spam(message):
@@ -132,25 +211,27 @@ class ContentModerator:
         
         response_lower = response.lower()
         
-        # Проверка на запрещенные слова в ответе AI
-        for word in cls.FORBIDDEN_WORDS:
-            if word.lower() in response_lower:
-                logger.warning(f"Обнаружено запрещенное слово в ответе AI: {word}")
-                return {
-                    'allowed': False,
-                    'reason': 'Ответ содержит недопустимый контент',
-                    'filtered_response': cls._filter_message(response, word)
-                }
-        
-        # Проверка на запрещенные паттерны
-        for pattern in cls.FORBIDDEN_PATTERNS:
-            if re.search(pattern, response_lower, re.IGNORECASE):
-                logger.warning(f"Обнаружен запрещенный паттерн в ответе AI: {pattern}")
-                return {
-                    'allowed': False,
-                    'reason': 'Ответ содержит недопустимый контент',
-                    'filtered_response': 'Извините, я не могу ответить на этот запрос.'
-                }
+        # Проверка на запрещенные слова и паттерны в ответе AI за один проход
+        matched_rules = cls.find_rules(response_lower)
+        words = [rule for rule, kind in matched_rules if kind == RULE_WORD]
+        if words:
+            logger.warning(f"Обнаружены запрещенные слова в ответе AI: {words}")
+            filtered_response = response
+            for word in words:
+                filtered_response = cls._filter_message(filtered_response, word)
+            return {
+                'allowed': False,
+                'reason': 'Ответ содержит недопустимый контент',
+                'filtered_response': filtered_response
+            }
+        
+        if matched_rules:
+            logger.warning(f"Обнаружены запрещенные паттерны в ответе AI: {[rule for rule, _ in matched_rules]}")
+            return {
+                'allowed': False,
+                'reason': 'Ответ содержит недопустимый контент',
+                'filtered_response': 'Извините, я не могу ответить на этот запрос.'
+            }
         
         return {
             'allowed': True,
@@ -169,7 +250,7 @@ class ContentModerator:
     def _is_spam(cls, message):
         """Проверяет, является ли сообщение спамом"""
         # Проверка на множественные повторения символов (например, "аааааа")
-        if re.search(r'(.)\1{10,}', message):
+        if _REPEATED_CHARS_PATTERN.search(message):
             return True
         
         # Проверка на множественные повторения слов
@@ -199,7 +280,7 @@ class ContentModerator:
             return ''
         
         # Удаляем управляющие символы (кроме переносов строк и табуляции)
-        message = re.sub(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]', '', message)
+        message = _CONTROL_CHARS_PATTERN.sub('', message)
         
         # Ограничиваем длину
         if len(message) > cls.MAX_MESSAGE_LENGTH:
@@ -207,3 +288,5 @@ class ContentModerator:
         
         return message.strip()
 
+
+ContentModerator.compile_rules()
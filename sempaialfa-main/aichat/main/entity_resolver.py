@@ -0,0 +1,315 @@
+"""
+Поиск записи данных пользователя по идентификатору из команды AI
+(событие календаря, товар, папка инвентаризации, должность, сотрудник)
+
+Для списка записей один раз строится индекс: ID -> запись, название (casefold) -> записи,
+основы слов названия и описания -> записи (как в retrieval), триграммы названия -> записи,
+нормализованные телефон и почта. Поиск берет кандидатов из индексов и оценивает только их,
+поэтому не проходит по всему списку несколько раз.
+
+Кандидаты ранжируются по оценке (0..1): точный ID, точное название, контакт, часть названия
+(чем больше доля совпадения, тем выше), нечеткое совпадение по триграммам (опечатки), описание
+и доля найденных слов. Запись выбирается (resolve), только если ее оценка не ниже MIN_SCORE
+(часть названия или лучше) и заметно выше следующей: команды удаления и изменения не должны
+попадать в другую запись. При неоднозначном совпадении возвращается None.
+
+Для событий индекс также хранит даты, отсортированные по времени: если в идентификаторе есть
+дата ("завтрашняя встреча", "совещание в пятницу", "15 декабря" - relative_dates), события
+интервала находятся бинарным поиском за O(log n), а оставшиеся слова выбирают среди них.
+
+Индекс кэшируется по объекту списка: разделы userData не изменяются после получения запроса,
+а неизменившиеся разделы из user_data_store - один и тот же объект в разных запросах
+"""
+import bisect
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from . import relative_dates
+from .retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Минимальная оценка, с которой запись считается найденной (совпадение части названия)
+MIN_SCORE = 0.6
+# Минимальный отрыв лучшей записи от следующей (для неточных совпадений)
+MIN_MARGIN = 0.05
+# Минимальная оценка кандидата в результатах search (для ранжирования)
+MIN_CANDIDATE_SCORE = 0.25
+# Нечеткое совпадение учитывается с этой похожести триграмм (коэффициент Дайса): опечатка
+# в одном-двух символах, но не другое слово ("Шкаф офисный" и "Стол офисный" - 0.54)
+MIN_TRIGRAM_SIMILARITY = 0.75
+# Частичный телефон учитывается с этого числа цифр
+MIN_PHONE_DIGITS = 5
+# С этой оценки совпадение по тексту считается точным и дата идентификатора не проверяется
+EXACT_SCORE = 0.95
+# Оценка события, найденного только по дате
+DATE_SCORE = 0.85
+INDEX_CACHE_MAX_ENTRIES = 64
+
+# Поля записей по видам сущностей
+KINDS = {
+    'event': {'label': 'Событие', 'name': 'title', 'text': ('description',), 'date': 'date'},
+    'folder': {'label': 'Папка', 'name': 'name'},
+    'inventory_item': {'label': 'Товар', 'name': 'name'},
+    'employee_folder': {'label': 'Папка должности', 'name': 'name'},
+    'employee': {'label': 'Сотрудник', 'name': 'fio', 'phone': 'phone', 'email': 'email'},
+}
+
+_NON_DIGITS = re.compile(r'\D')
+_NUMBERS = re.compile(r'\d+')
+
+
+def _casefold(value):
+    return str(value or '').casefold().strip()
+
+
+def _digits(value):
+    return _NON_DIGITS.sub('', str(value or ''))
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Match:
+    """Найденная запись с оценкой и причиной совпадения"""
+    __slots__ = ('id', 'record', 'score', 'reason', 'position')
+
+    def __init__(self, record_id, record, score, reason, position):
+        self.id = record_id
+        self.record = record
+        self.score = score
+        self.reason = reason
+        self.position = position
+
+    def __repr__(self):
+        return f"Match({self.id}, {self.score:.2f}, {self.reason})"
+
+
+class EntityIndex:
+    """Индекс списка записей одного вида"""
+
+    def __init__(self, records, name, text=(), phone=None, email=None, date=None):
+        self.records = [record for record in records if isinstance(record, dict)]
+        self._ids = {}
+        self._names = {}
+        self._tokens = {}
+        self._trigrams = {}
+        self._phones = {}
+        self._emails = {}
+        self._entries = []  # (название, тексты, основы слов, триграммы названия, телефон, почта)
+        dated = []  # (дата, позиция)
+        for position, record in enumerate(self.records):
+            self._ids.setdefault(str(record.get('id', '')), position)
+            record_name = _casefold(record.get(name))
+            texts = [_casefold(record.get(field)) for field in text]
+            stems = set(tokenize(' '.join([record_name] + texts)))
+            trigrams = _trigrams(record_name) if record_name else set()
+            record_phone = _digits(record.get(phone)) if phone else ''
+            record_email = _casefold(record.get(email)) if email else ''
+            self._entries.append((record_name, texts, stems, trigrams, record_phone, record_email))
+            if record_name:
+                self._names.setdefault(record_name, []).append(position)
+            for stem in stems:
+                self._tokens.setdefault(stem, set()).add(position)
+            for trigram in trigrams:
+                self._trigrams.setdefault(trigram, set()).add(position)
+            if record_phone:
+                self._phones.setdefault(record_phone, []).append(position)
+            if record_email:
+                self._emails.setdefault(record_email, []).append(position)
+            record_date = relative_dates.parse_event_date(record.get(date)) if date else None
+            if record_date:
+                dated.append((record_date, position))
+        dated.sort()
+        self._dates = [record_date for record_date, _ in dated]
+        self._date_positions = [position for _, position in dated]
+
+    def between(self, start, end):
+        """Позиции записей с датой в интервале [start, end) в порядке даты"""
+        low = bisect.bisect_left(self._dates, start)
+        high = bisect.bisect_left(self._dates, end, low)
+        return self._date_positions[low:high]
+
+    def search(self, identifier, limit=5, within=None):
+        """
+        Args:
+            within: позиции записей, среди которых выбирать (по умолчанию - все)
+
+        Returns:
+            list: Match по убыванию оценки (не ниже MIN_CANDIDATE_SCORE)
+        """
+        identifier = str(identifier or '').strip()
+        if not identifier or not self.records:
+            return []
+        query = identifier.casefold()
+        query_digits = _digits(identifier)
+        scores = {}  # позиция -> (оценка, причина)
+
+        def add(position, score, reason):
+            if within is not None and position not in within:
+                return
+            if score > scores.get(position, (0, None))[0]:
+                scores[position] = (score, reason)
+
+        if identifier in self._ids:
+            add(self._ids[identifier], 1.0, 'id')
+        for position in self._names.get(query, ()):
+            add(position, 0.95, 'name')
+        for position in self._emails.get(query, ()):
+            add(position, 0.9, 'email')
+        if len(query_digits) >= MIN_PHONE_DIGITS and len(query_digits) * 2 >= len(identifier.replace(' ', '')):
+            for position in self._phones.get(query_digits, ()):
+                add(position, 0.9, 'phone')
+
+        # Кандидаты для частичных совпадений: общие основы слов и триграммы
+        query_stems = set(tokenize(query))
+        query_trigrams = _trigrams(query)
+        query_numbers = set(_NUMBERS.findall(query))
+        candidates = set()
+        for stem in query_stems:
+            candidates.update(self._tokens.get(stem, ()))
+        for trigram in query_trigrams:
+            candidates.update(self._trigrams.get(trigram, ()))
+        if len(query_digits) >= MIN_PHONE_DIGITS or '@' in query:
+            # Контакты не разбиваются на слова, частичный телефон или почта ищутся по всем записям
+            candidates.update(range(len(self.records)))
+
+        for position in candidates:
+            record_name, texts, stems, trigrams, phone, email = self._entries[position]
+            if record_name and (query in record_name or record_name in query):
+                shorter, longer = sorted((len(query), len(record_name)))
+                add(position, 0.6 + 0.3 * shorter / longer, 'partial_name')
+            if len(query_digits) >= MIN_PHONE_DIGITS and phone and query_digits in phone:
+                add(position, 0.6, 'phone')
+            if email and '@' in query and query in email:
+                add(position, 0.6, 'email')
+            if any(query in text for text in texts if text):
+                add(position, MIN_SCORE, 'text')
+            if query_stems and stems:
+                found = len(query_stems & stems) / len(query_stems)
+                if found >= 0.5:
+                    add(position, 0.5 * found, 'words')
+            if trigrams:
+                similarity = 2 * len(query_trigrams & trigrams) / (len(query_trigrams) + len(trigrams))
+                # Числа в названии должны совпадать: "Бумага А5" - другой товар, а не опечатка
+                if similarity >= MIN_TRIGRAM_SIMILARITY and query_numbers == set(_NUMBERS.findall(record_name)):
+                    add(position, MIN_SCORE + 0.3 * (similarity - MIN_TRIGRAM_SIMILARITY) / (1 - MIN_TRIGRAM_SIMILARITY),
+                        'fuzzy')
+
+        matches = [
+            Match(str(self.records[position].get('id', '')), self.records[position], score, reason, position)
+            for position, (score, reason) in scores.items() if score >= MIN_CANDIDATE_SCORE
+        ]
+        matches.sort(key=lambda match: (-match.score, match.position))
+        return matches[:limit]
+
+
+_index_cache = OrderedDict()  # (вид, id списка) -> (список, длина, индекс)
+_index_lock = threading.Lock()
+
+
+def get_index(kind, records):
+    """Индекс списка записей (строится один раз для объекта списка)"""
+    key = (kind, id(records))
+    with _index_lock:
+        cached = _index_cache.get(key)
+        # Ссылка на список в кэше не дает переиспользовать его id для другого списка
+        if cached is not None and cached[0] is records and cached[1] == len(records):
+            _index_cache.move_to_end(key)
+            return cached[2]
+    fields = KINDS[kind]
+    index = EntityIndex(
+        records, fields['name'], fields.get('text', ()), fields.get('phone'), fields.get('email'), fields.get('date')
+    )
+    with _index_lock:
+        _index_cache[key] = (records, len(records), index)
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_MAX_ENTRIES:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def search(kind, records, identifier, limit=5):
+    """Записи, подходящие под идентификатор, по убыванию оценки"""
+    if not records or not identifier:
+        return []
+    return get_index(kind, records).search(identifier, limit)
+
+
+def search_by_date(kind, records, identifier, now=None):
+    """
+    События из интервала даты, указанной в идентификаторе
+
+    Оставшиеся после даты слова выбирают среди событий интервала; если они не подходят
+    ни к одному из них, возвращается пустой список (поиск по тексту). Без слов возвращаются
+    события интервала: несколько событий дают равные оценки, и resolve не выбирает ни одно
+
+    Returns:
+        list: Match (не больше двух) или пустой список, если даты в идентификаторе нет
+    """
+    if not records or not KINDS[kind].get('date'):
+        return []
+    date_range = relative_dates.parse(identifier, now)
+    if date_range is None:
+        return []
+    index = get_index(kind, records)
+    positions = index.between(date_range.start, date_range.end)
+    if not positions:
+        logger.info(f"📅 Нет записей в интервале {date_range.start:%Y-%m-%d %H:%M} - {date_range.end:%Y-%m-%d %H:%M}")
+        return []
+    if date_range.rest:
+        return [
+            match for match in index.search(date_range.rest, limit=2, within=set(positions))
+            if match.score >= MIN_SCORE
+        ]
+    return [
+        Match(str(index.records[position].get('id', '')), index.records[position], DATE_SCORE, 'date', position)
+        for position in positions[:2]
+    ]
+
+
+def _is_clear_winner(best, runner_up):
+    """Лучшая запись заметно лучше следующей (точное совпадение - просто лучше)"""
+    if runner_up.score < MIN_SCORE:
+        return True
+    if best.score >= EXACT_SCORE:
+        return runner_up.score < best.score
+    return round(best.score - runner_up.score, 6) >= MIN_MARGIN
+
+
+def resolve(kind, records, identifier, now=None):
+    """
+    ID лучшей подходящей записи или None
+
+    None возвращается и при неоднозначном совпадении: несколько записей с близкой оценкой.
+    Для событий дата в идентификаторе ("завтра", "в пятницу") проверяется, если по тексту
+    нет точного совпадения
+    """
+    label = KINDS[kind]['label']
+    matches = search(kind, records, identifier, limit=2)
+    if not matches or matches[0].score < EXACT_SCORE:
+        # Дата заменяет совпадения по тексту, только если по ней найдено подходящее событие
+        matches = search_by_date(kind, records, identifier, now) or matches
+    if not matches:
+        if records and identifier:
+            logger.warning(f"{label} не найден(а) по идентификатору: '{identifier}'")
+        return None
+    best = matches[0]
+    if best.score < MIN_SCORE:
+        logger.warning(
+            f"{label} не найден(а) по идентификатору: '{identifier}' "
+            f"(ближайшая запись {best.id}, оценка {best.score:.2f} ниже {MIN_SCORE})"
+        )
+        return None
+    if len(matches) > 1 and not _is_clear_winner(best, matches[1]):
+        logger.warning(
+            f"⚠️ Неоднозначное совпадение для '{identifier}': {[match.id for match in matches]} "
+            f"(оценки {best.score:.2f} и {matches[1].score:.2f}), запись не выбрана"
+        )
+        return None
+    logger.info(f"{label} найден(а): {best.id} ({best.reason}, оценка {best.score:.2f})")
+    return best.id
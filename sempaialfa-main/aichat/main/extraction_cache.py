@@ -0,0 +1,209 @@
+"""
+Кэш результатов извлечения текста из файлов (file_processor.process_file)
+Ключ - SHA-256 содержимого файла, тип файла и версия извлекателей (EXTRACTOR_VERSION),
+поэтому повторно прикрепленный документ не разбирается заново, а после изменения
+извлекателей старые записи перестают использоваться.
+
+Уровни кэша:
+- в памяти процесса: LRU, ограниченный суммарным размером текста (CHAT_EXTRACTION_CACHE_MAX_BYTES)
+- на диске (необязательно): JSON-файлы в CHAT_EXTRACTION_CACHE_DIR, общие для процессов и перезапусков
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+from .file_processor import EXTRACTOR_VERSION, process_file
+
+logger = logging.getLogger(__name__)
+
+# Результаты, которые не кэшируются: ошибки и отсутствующие библиотеки могут исчезнуть
+UNCACHEABLE_PREFIXES = ('[Ошибка', '[Библиотека', '[Файл пуст')
+
+
+class ExtractionCache:
+    """LRU-кэш извлеченного текста с необязательным дисковым уровнем"""
+
+    def __init__(self, max_bytes, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry_size(entry):
+        return len(entry['text'].encode('utf-8')) + 64
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._store_memory(key, entry)
+            with self._lock:
+                self.disk_hits += 1
+            return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, entry):
+        self._store_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def _store_memory(self, key, entry):
+        size = self._entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= self._entry_size(previous)
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._entry_size(evicted)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.disk_dir / digest[:2] / f'{digest}.json'
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as cache_file:
+                entry = json.load(cache_file)
+            return entry if entry.get('key') == key else None
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Не удалось прочитать кэш извлечения {key}: {str(e)}")
+            return None
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+                json.dump({**entry, 'key': key}, tmp_file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить кэш извлечения {key}: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': ((self.hits + self.disk_hits) / lookups * 100) if lookups else 0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Общий для процесса кэш, создается по настройкам при первом обращении"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(
+                    max_bytes=getattr(settings, 'CHAT_EXTRACTION_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+                    disk_dir=getattr(settings, 'CHAT_EXTRACTION_CACHE_DIR', None),
+                )
+    return _cache
+
+
+def content_hash(file_data=None, file_path=None):
+    """SHA-256 содержимого файла (base64 декодируется, файл на диске читается частями)"""
+    digest = hashlib.sha256()
+    if file_path:
+        with open(file_path, 'rb') as source:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        if ',' in file_data:
+            file_data = file_data.split(',')[1]
+        digest.update(base64.b64decode(file_data))
+    return digest.hexdigest()
+
+
+def make_key(content_sha256, file_name, file_type, max_chars=None):
+    """Ключ кэша: версия извлекателей, содержимое, признаки выбора извлекателя и бюджет символов"""
+    extension = os.path.splitext((file_name or '').lower())[1]
+    return f'{EXTRACTOR_VERSION}:{content_sha256}:{file_type or ""}:{extension}:{max_chars or "all"}'
+
+
+def cached_process_file(file_name, file_type, file_data=None, file_path=None, content_sha256=None, extractor=None,
+                        max_chars=None):
+    """
+    process_file с кэшированием результата
+
+    Args:
+        content_sha256: известный хэш содержимого (например, ключ хранилища файлов), чтобы не считать его заново
+        extractor: функция извлечения с сигнатурой process_file (например, из пула процессов)
+        max_chars: бюджет символов извлечения (см. process_file)
+
+    Returns:
+        Tuple[str, Optional[str]]: как process_file
+    """
+    extractor = extractor or process_file
+    if not file_data and not file_path:
+        return extractor(file_name, file_type, file_data, file_path=file_path, max_chars=max_chars)
+
+    try:
+        key = make_key(content_sha256 or content_hash(file_data, file_path), file_name, file_type, max_chars)
+    except Exception as e:
+        # Некорректный base64 и т.п. - пусть process_file сообщит об ошибке как обычно
+        logger.warning(f"⚠️ Не удалось вычислить ключ кэша для '{file_name}': {str(e)}")
+        return extractor(file_name, file_type, file_data, file_path=file_path, max_chars=max_chars)
+
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        if not entry['is_image']:
+            return entry['text'], None
+        # Для изображений кэшируются только метаданные, сами данные нужны vision модели
+        if file_path:
+            with open(file_path, 'rb') as image_file:
+                return entry['text'], base64.b64encode(image_file.read()).decode('ascii')
+        return entry['text'], file_data.split(',')[1] if ',' in file_data else file_data
+
+    text, image_base64 = extractor(file_name, file_type, file_data, file_path=file_path, max_chars=max_chars)
+    if text and not text.startswith(UNCACHEABLE_PREFIXES):
+        cache.set(key, {'text': text, 'is_image': image_base64 is not None})
+    return text, image_base64
@@ -0,0 +1,223 @@
+"""
+Пул процессов для извлечения текста из файлов
+Разбор PDF/DOCX/XLSX - нагрузка на CPU под GIL: в потоке веб-процесса он тормозит
+все остальные запросы. Здесь извлечение выполняется в отдельных процессах
+с ограничением времени на файл (CHAT_EXTRACTION_TIMEOUT) и памяти на процесс
+(CHAT_EXTRACTION_MEMORY_LIMIT_MB), а файлы одного запроса обрабатываются параллельно.
+CHAT_EXTRACTION_WORKERS=0 отключает пул (извлечение в текущем потоке)
+
+Время на файл отсчитывается с момента, когда процесс пула начал задачу (процесс сообщает
+об этом через очередь), а не с постановки в очередь: под нагрузкой файлы, ожидающие
+свободный процесс, не превышают таймаут. По таймауту останавливается только процесс
+зависшей задачи; multiprocessing.Pool запускает вместо него новый, а задачи других
+запросов продолжают выполняться
+
+Ожидание начала задачи тоже ограничено: задачи впереди в очереди занимают не больше
+таймаута каждая, поэтому задача, не начавшаяся за это время (процесс пула завершился,
+не успев сообщить о ней), считается потерянной. Если она все же начнется позже,
+ее процесс останавливается сразу
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .file_processor import process_file
+
+logger = logging.getLogger(__name__)
+
+# Очередь уведомлений о начале задач (в процессе пула)
+_started_queue = None
+
+
+def _init_worker(memory_limit_mb, started_queue=None):
+    """Инициализация процесса пула: очередь уведомлений и ограничение адресного пространства"""
+    global _started_queue
+    _started_queue = started_queue
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+        limit = int(memory_limit_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        # resource недоступен (Windows) или лимит нельзя установить - работаем без него
+        pass
+
+
+def _run_task(task_id, func, args):
+    """Выполняется в процессе пула: сообщает о начале задачи и выполняет ее"""
+    if _started_queue is not None:
+        _started_queue.put((task_id, os.getpid()))
+    return func(*args)
+
+
+class ExtractionPool:
+    """Пул процессов извлечения; по таймауту останавливается только процесс зависшей задачи"""
+
+    def __init__(self, max_workers, timeout, memory_limit_mb, mp_context='spawn'):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.mp_context = mp_context
+        self._pool = None
+        self._started_queue = None
+        self._lock = threading.Lock()
+        self._started = threading.Condition()
+        self._tasks = {}  # id задачи -> (pid, время начала) или None, пока задача ждет в очереди
+        self._abandoned = set()  # задачи, начала которых перестали ждать
+        self._task_ids = itertools.count()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(self.mp_context)
+                self._started_queue = context.SimpleQueue()
+                self._pool = context.Pool(
+                    processes=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.memory_limit_mb, self._started_queue),
+                )
+                threading.Thread(
+                    target=self._listen, args=(self._started_queue,), name='ExtractionStarted', daemon=True
+                ).start()
+            return self._pool
+
+    def _listen(self, started_queue):
+        """Принимает уведомления о начале задач от процессов пула"""
+        while True:
+            message = started_queue.get()
+            if message is None:
+                return
+            task_id, pid = message
+            with self._started:
+                if task_id in self._abandoned:
+                    self._abandoned.discard(task_id)
+                    self._kill(pid)
+                elif task_id in self._tasks:
+                    self._tasks[task_id] = (pid, time.monotonic())
+                    self._started.notify_all()
+
+    def _kill(self, pid):
+        try:
+            os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        except OSError:
+            pass
+
+    def run(self, func, *args):
+        """
+        Выполняет func(*args) в процессе пула
+
+        Raises:
+            TimeoutError: задача выполнялась дольше timeout (ее процесс остановлен)
+                или не началась, пока выполнялись задачи впереди в очереди
+            Исключение, которое выбросила func
+        """
+        pool = self._get_pool()
+        task_id = next(self._task_ids)
+        with self._started:
+            # Каждая задача впереди занимает процесс не дольше таймаута, плюс запас на перезапуск процесса
+            start_wait = self.timeout * (len(self._tasks) // self.max_workers + 2)
+            start_deadline = time.monotonic() + start_wait
+            self._tasks[task_id] = None
+        try:
+            result = pool.apply_async(_run_task, (task_id, func, args))
+            # Ожидание свободного процесса в таймаут не входит
+            with self._started:
+                while self._tasks[task_id] is None and not result.ready():
+                    remaining = start_deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._abandoned.add(task_id)
+                        raise TimeoutError(f'задача не началась за {start_wait} сек')
+                    self._started.wait(min(0.1, remaining))
+                started = self._tasks[task_id]
+            if started is None:
+                return result.get()
+            pid, started_at = started
+            try:
+                return result.get(timeout=max(0, self.timeout - (time.monotonic() - started_at)))
+            except multiprocessing.TimeoutError:
+                if result.ready():
+                    return result.get()
+                self._kill(pid)
+                raise TimeoutError(f'задача выполнялась дольше {self.timeout} сек')
+        finally:
+            with self._started:
+                self._tasks.pop(task_id, None)
+
+    def process_file(self, file_name, file_type, file_data=None, file_path=None, max_chars=None):
+        """process_file в отдельном процессе; при таймауте или нехватке памяти возвращает описание ошибки"""
+        try:
+            return self.run(process_file, file_name, file_type, file_data, file_path, max_chars)
+        except TimeoutError:
+            logger.error(f"⏱️ Извлечение текста из '{file_name}' превысило {self.timeout} сек, процесс остановлен")
+            return f"[Ошибка: превышено время обработки файла ({self.timeout} сек)]", None
+        except MemoryError:
+            logger.error(f"❌ Извлечение текста из '{file_name}' превысило лимит памяти процесса")
+            return "[Ошибка: не удалось обработать файл - превышен лимит памяти или процесс завершился аварийно]", None
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            started_queue, self._started_queue = self._started_queue, None
+        if pool is not None:
+            # Задача остановленного процесса не завершится, поэтому close/join не дождались бы пула
+            pool.terminate()
+            pool.join()
+        if started_queue is not None:
+            started_queue.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Общий для процесса пул извлечения или None, если он отключен"""
+    global _pool
+    from django.conf import settings
+
+    workers = getattr(settings, 'CHAT_EXTRACTION_WORKERS', 0)
+    if workers <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ExtractionPool(
+                    max_workers=workers,
+                    timeout=getattr(settings, 'CHAT_EXTRACTION_TIMEOUT', 30),
+                    memory_limit_mb=getattr(settings, 'CHAT_EXTRACTION_MEMORY_LIMIT_MB', 1024),
+                )
+                logger.info(f"🧮 Создан пул извлечения текста: процессов={workers}")
+    return _pool
+
+
+def get_extractor():
+    """Функция извлечения с сигнатурой process_file: в пуле процессов или в текущем потоке"""
+    pool = get_pool()
+    return pool.process_file if pool is not None else process_file
+
+
+def process_files_parallel(func, items, max_parallel=None):
+    """
+    Применяет func к каждому элементу параллельно, сохраняя порядок результатов
+
+    Исключение при обработке элемента возвращается вместо результата
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [_call(func, item) for item in items]
+    max_parallel = max_parallel or min(len(items), os.cpu_count() or 2)
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='FileExtract') as executor:
+        return list(executor.map(lambda item: _call(func, item), items))
+
+
+def _call(func, item):
+    try:
+        return func(item)
+    except Exception as e:
+        return e
@@ -0,0 +1,217 @@
+"""
+Быстрые ответы на вопросы об итогах без вызова LLM (включается CHAT_FAST_ANSWERS_ENABLED)
+Баланс счетов, фонд оплаты труда, задолженность по налогам и коммунальным услугам,
+стоимость инвентаризации и сумма операций точно считаются по данным пользователя.
+Если короткое сообщение однозначно спрашивает одно из этих значений, ответ собирается
+по шаблону (с командой [CHART_*], если просят график) за миллисекунды.
+
+Маршрутизатор консервативен: при уточнениях (период, сравнение, конкретный сотрудник),
+командах-действиях, нескольких подходящих намерениях или отсутствии данных
+возвращается None, и запрос обрабатывает LLM
+"""
+import logging
+import re
+
+from django.conf import settings
+
+from .semantic_cache import normalize_message
+from .user_context import TAX_NAMES, UTILITY_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Длинные сообщения почти всегда содержат уточнения, которые шаблон не учтет
+MAX_MESSAGE_WORDS = 12
+
+FOLLOW_UP_QUESTION = "Нужно ли что-то добавить или изменить?"
+
+# Сообщение просит график
+_CHART_PATTERN = re.compile(r'\b(график|диаграмм|визуализ|chart)\w*')
+
+# Уточнения и действия, с которыми шаблонный ответ был бы неполным или неверным
+_LOW_CONFIDENCE_PATTERN = re.compile(
+    r'\b('
+    r'почему|зачем|если|сравн\w*|прогноз\w*|динамик\w*|измен\w*|рост\w*|сниж\w*|тренд\w*|'
+    r'кроме|без|только|кажд\w*|отдельно|подробн\w*|детальн\w*|'
+    r'январ\w*|феврал\w*|март\w*|апрел\w*|ма[йя]|июн\w*|июл\w*|август\w*|сентябр\w*|октябр\w*|ноябр\w*|декабр\w*|'
+    r'вчера|сегодня|недел\w*|месяц\w*|квартал\w*|год\w*|период\w*|'
+    r'создай|добав\w*|удали\w*|измени\w*|переименуй|отправь|запланируй|перенеси|'
+    r'\d+'
+    r')\b'
+)
+
+
+def _money(value, decimals=0):
+    """Сумма в рублях с пробелами между разрядами"""
+    return f"{value:,.{decimals}f}".replace(',', ' ') + ' ₽'
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def _answer(lines, chart=None):
+    return {'text': '\n'.join(lines), 'chart': chart}
+
+
+def _balance(user_data):
+    balance1 = _number(user_data.get('accountBalance', 0))
+    balance2 = _number(user_data.get('accountBalance2', 0))
+    if 'accountBalance' not in user_data and 'accountBalance2' not in user_data:
+        return None
+    return _answer([
+        f"Общий баланс счетов: **{_money(balance1 + balance2, 2)}**",
+        "",
+        "| Счет | Баланс |",
+        "|:---|---:|",
+        f"| Счет 1 | {_money(balance1, 2)} |",
+        f"| Счет 2 | {_money(balance2, 2)} |",
+        f"| **Итого** | **{_money(balance1 + balance2, 2)}** |",
+    ], chart='[CHART_BALANCE:bar]')
+
+
+def _payroll(user_data):
+    employees = user_data.get('employees') or []
+    if not employees:
+        return None
+    total_salary = sum(_number(e.get('salary', 0)) for e in employees)
+    return _answer([
+        f"Фонд оплаты труда: **{_money(total_salary)}** в месяц.",
+        "",
+        "| Показатель | Значение |",
+        "|:---|---:|",
+        f"| Сотрудников | {len(employees)} |",
+        f"| Фонд оплаты труда | {_money(total_salary)} |",
+        f"| Средняя зарплата | {_money(total_salary / len(employees))} |",
+    ], chart='[CHART_EMPLOYEES:bar]')
+
+
+def _debts(data, names, title, total_title, chart):
+    if not data:
+        return None
+    debts = [
+        (names.get(item_id, item_id), item.get('debt', 0))
+        for item_id, item in data.items()
+        if isinstance(item, dict) and isinstance(item.get('debt', 0), (int, float)) and item.get('debt', 0) > 0
+    ]
+    if not debts:
+        return _answer([f"{title}: задолженности нет."])
+    total = sum(debt for _, debt in debts)
+    lines = [f"{total_title}: **{_money(total)}**", "", "| Вид | Задолженность |", "|:---|---:|"]
+    lines.extend(f"| {name} | {_money(debt)} |" for name, debt in debts)
+    lines.append(f"| **Итого** | **{_money(total)}** |")
+    return _answer(lines, chart=chart)
+
+
+def _tax_debt(user_data):
+    return _debts(user_data.get('taxesData'), TAX_NAMES, 'Налоги', 'Общая задолженность по налогам',
+                  '[CHART_TAXES:doughnut]')
+
+
+def _utilities_debt(user_data):
+    return _debts(user_data.get('utilitiesData'), UTILITY_NAMES, 'Коммунальные услуги',
+                  'Общая задолженность по коммунальным услугам', '[CHART_UTILITIES:pie]')
+
+
+def _inventory_value(user_data):
+    inventory = user_data.get('inventory') or []
+    if not inventory:
+        return None
+    total_value = sum(_number(item.get('quantity', 0)) * _number(item.get('price', 0)) for item in inventory)
+    total_quantity = sum(_number(item.get('quantity', 0)) for item in inventory)
+    return _answer([
+        f"Общая стоимость инвентаризации: **{_money(total_value, 2)}**",
+        "",
+        "| Показатель | Значение |",
+        "|:---|---:|",
+        f"| Позиций | {len(inventory)} |",
+        f"| Единиц товара | {total_quantity:,.0f} |".replace(',', ' '),
+        f"| Общая стоимость | {_money(total_value, 2)} |",
+    ], chart='[CHART_INVENTORY:pie]')
+
+
+def _receipts_total(user_data):
+    receipts = user_data.get('receipts') or []
+    if not receipts:
+        return None
+    by_type = {}
+    for receipt in receipts:
+        op_type = receipt.get('operationType', 'Операция')
+        by_type[op_type] = by_type.get(op_type, 0) + _number(receipt.get('amount', 0))
+    total = sum(by_type.values())
+    lines = [f"Сумма операций по чекам: **{_money(total)}** ({len(receipts)} операций)", "",
+             "| Тип операции | Сумма |", "|:---|---:|"]
+    lines.extend(f"| {op_type} | {_money(amount)} |" for op_type, amount in by_type.items())
+    lines.append(f"| **Итого** | **{_money(total)}** |")
+    return _answer(lines, chart='[CHART_RECEIPTS:pie]')
+
+
+# Намерения: (имя, шаблон нормализованного сообщения, функция ответа)
+INTENTS = (
+    ('balance', re.compile(r'\b(баланс\w*|остат\w* (на|по) счет\w*|сколько денег)\b'), _balance),
+    ('payroll', re.compile(
+        r'\b(фонд\w* оплаты труда|фот|зарплатн\w* фонд\w*|фонд\w* зарплат\w*|'
+        r'(общ\w*|сумм\w*|итог\w*) (сумм\w* )?зарплат\w*|расход\w* на зарплат\w*)\b'
+    ), _payroll),
+    ('tax_debt', re.compile(
+        r'\b(задолжен\w* по налог\w*|налогов\w* (задолжен\w*|долг\w*)|долг\w* по налог\w*|'
+        r'сколько \w* ?(долж\w*|задолжал\w*) (по )?налог\w*)\b'
+    ), _tax_debt),
+    ('utilities_debt', re.compile(
+        r'\b((задолжен\w*|долг\w*) (по|за) коммунал\w*|коммунальн\w* (задолжен\w*|долг\w*))\b'
+    ), _utilities_debt),
+    ('inventory_value', re.compile(
+        r'\b(стоимост\w* (всей |всего )?(инвентаризац\w*|склад\w*|товар\w*|запас\w*|имуществ\w* на склад\w*)|'
+        r'на как\w* сумм\w* (товар\w*|запас\w*|склад\w*))\b'
+    ), _inventory_value),
+    ('receipts_total', re.compile(
+        r'\b((общ\w* )?сумм\w* (всех )?(операц\w*|чек\w*|расход\w*)|(сколько|всего) потрачен\w*)\b'
+    ), _receipts_total),
+)
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_FAST_ANSWERS_ENABLED', True)
+
+
+def route(message):
+    """
+    Определяет намерение сообщения
+
+    Returns:
+        tuple: (имя намерения и функция ответа или None, просит ли сообщение график)
+    """
+    normalized = normalize_message(message)
+    if not normalized or len(normalized.split()) > MAX_MESSAGE_WORDS:
+        return None, False
+    wants_chart = bool(_CHART_PATTERN.search(normalized))
+    if _LOW_CONFIDENCE_PATTERN.search(normalized):
+        return None, wants_chart
+    matched = [(name, handler) for name, pattern, handler in INTENTS if pattern.search(normalized)]
+    # Несколько намерений в одном вопросе - сводный ответ лучше даст LLM
+    if len(matched) != 1:
+        return None, wants_chart
+    return matched[0], wants_chart
+
+
+def answer(message, user_data):
+    """
+    Ответ по шаблону в формате chat completion или None (обработать через LLM)
+    """
+    if not is_enabled():
+        return None
+    intent, wants_chart = route(message)
+    if intent is None:
+        return None
+    name, handler = intent
+    result = handler(user_data or {})
+    if result is None:
+        return None
+    lines = [result['text']]
+    if wants_chart and result['chart']:
+        lines.extend(['', result['chart']])
+    lines.extend(['', FOLLOW_UP_QUESTION])
+    logger.info(f"⚡ Быстрый ответ без LLM: намерение '{name}'")
+    return {
+        'choices': [{'message': {'role': 'assistant', 'content': '\n'.join(lines)}, 'finish_reason': 'stop'}],
+        'fast_path': name,
+    }
@@ -4,158 +4,261 @@
 import base64
 import io
 import os
-from typing import Dict, Optional, Tuple
+import zipfile
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+from xml.etree import ElementTree
 
+# Версия извлекателей текста: увеличивайте при изменении логики извлечения,
+# чтобы кэш (extraction_cache) не отдавал результаты старой версии
+EXTRACTOR_VERSION = 2
 
-def extract_text_from_pdf(file_data: str) -> str:
-    """Извлекает текст из PDF файла"""
+
+def _open_source(file_data: Optional[str] = None, file_path: Optional[str] = None) -> BinaryIO:
+    """
+    Открывает содержимое файла для чтения
+    
+    Файл на диске (file_path) читается напрямую, без загрузки в память целиком;
+    для base64 (file_data) данные декодируются в память
+    """
+    if file_path:
+        return open(file_path, 'rb')
+    # Убираем префикс data:type;base64, если есть
+    if ',' in file_data:
+        file_data = file_data.split(',')[1]
+    # Декодируем base64
+    return io.BytesIO(base64.b64decode(file_data))
+
+
+class _TextBudget:
+    """
+    Накопитель текста с ограничением по числу символов
+    
+    Извлекатели прекращают чтение файла, как только набрано больше max_chars символов,
+    поэтому стоимость разбора большого документа определяется его первыми страницами
+    """
+    
+    def __init__(self, max_chars: Optional[int] = None):
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+    
+    def add(self, text: str) -> bool:
+        """Добавляет фрагмент; возвращает False, когда бюджет исчерпан и чтение можно прекратить"""
+        self.parts.append(text)
+        self.length += len(text) + 1  # + разделитель строк
+        return not self.exhausted
+    
+    @property
+    def exhausted(self) -> bool:
+        return self.max_chars is not None and self.length > self.max_chars
+    
+    def text(self) -> str:
+        return "\n".join(self.parts)
+
+
+def _iter_page_texts(pages) -> Iterator[Tuple[int, str]]:
+    """Перебирает страницы PDF по одной, извлекая текст только по мере обхода"""
+    for page_num, page in enumerate(pages):
+        try:
+            text = page.extract_text()
+            if text:
+                yield page_num, f"--- Страница {page_num + 1} ---\n{text}\n"
+        except Exception as e:
+            yield page_num, f"--- Страница {page_num + 1} ---\n[Ошибка чтения страницы: {str(e)}]\n"
+
+
+def extract_text_from_pdf(file_data: Optional[str] = None, file_path: Optional[str] = None,
+                          max_chars: Optional[int] = None) -> str:
+    """Извлекает текст из PDF файла (base64 в file_data или путь file_path), не более max_chars символов"""
     try:
         import PyPDF2
-        # Убираем префикс data:type;base64, если есть
-        if ',' in file_data:
-            file_data = file_data.split(',')[1]
-        
-        # Декодируем base64
-        pdf_bytes = base64.b64decode(file_data)
-        pdf_file = io.BytesIO(pdf_bytes)
+        budget = _TextBudget(max_chars)
         
-        # Читаем PDF
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text_parts = []
+        # Читаем PDF (страницы читаются из файла по мере обхода)
+        with _open_source(file_data, file_path) as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            for _, page_text in _iter_page_texts(pdf_reader.pages):
+                if not budget.add(page_text):
+                    break
         
-        for page_num, page in enumerate(pdf_reader.pages):
-            try:
-                text = page.extract_text()
-                if text:
-                    text_parts.append(f"--- Страница {page_num + 1} ---\n{text}\n")
-            except Exception as e:
-                text_parts.append(f"--- Страница {page_num + 1} ---\n[Ошибка чтения страницы: {str(e)}]\n")
-        
-        return "\n".join(text_parts) if text_parts else "[Не удалось извлечь текст из PDF]"
+        return budget.text() if budget.parts else "[Не удалось извлечь текст из PDF]"
     except ImportError:
         try:
             import pdfplumber
-            # Убираем префикс data:type;base64, если есть
-            if ',' in file_data:
-                file_data = file_data.split(',')[1]
-            
-            # Декодируем base64
-            pdf_bytes = base64.b64decode(file_data)
-            pdf_file = io.BytesIO(pdf_bytes)
+            budget = _TextBudget(max_chars)
+            with pdfplumber.open(file_path or _open_source(file_data)) as pdf:
+                for _, page_text in _iter_page_texts(pdf.pages):
+                    if not budget.add(page_text):
+                        break
             
-            text_parts = []
-            with pdfplumber.open(pdf_file) as pdf:
-                for page_num, page in enumerate(pdf.pages):
-                    try:
-                        text = page.extract_text()
-                        if text:
-                            text_parts.append(f"--- Страница {page_num + 1} ---\n{text}\n")
-                    except Exception as e:
-                        text_parts.append(f"--- Страница {page_num + 1} ---\n[Ошибка чтения страницы: {str(e)}]\n")
-            
-            return "\n".join(text_parts) if text_parts else "[Не удалось извлечь текст из PDF]"
+            return budget.text() if budget.parts else "[Не удалось извлечь текст из PDF]"
         except ImportError:
             return "[Библиотека для чтения PDF не установлена. Установите PyPDF2 или pdfplumber]"
     except Exception as e:
         return f"[Ошибка при чтении PDF: {str(e)}]"
 
 
-def extract_text_from_docx(file_data: str) -> str:
-    """Извлекает текст из DOCX файла"""
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def _iter_docx_blocks(source: BinaryIO) -> Iterator[str]:
+    """
+    Потоково перебирает абзацы и строки таблиц DOCX в порядке документа
+    
+    word/document.xml разбирается через iterparse, без построения дерева всего документа.
+    Строка таблицы - ячейки через " | ", как в python-docx
+    """
+    with zipfile.ZipFile(source) as package:
+        with package.open('word/document.xml') as document_xml:
+            table_depth = 0
+            paragraph_parts = []
+            cell_paragraphs = []
+            row_cells = []
+            for event, element in ElementTree.iterparse(document_xml, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == f'{_WORD_NS}tbl':
+                        table_depth += 1
+                    continue
+                
+                if tag == f'{_WORD_NS}t':
+                    paragraph_parts.append(element.text or '')
+                elif tag == f'{_WORD_NS}tab':
+                    paragraph_parts.append('\t')
+                elif tag in (f'{_WORD_NS}br', f'{_WORD_NS}cr'):
+                    paragraph_parts.append('\n')
+                elif tag == f'{_WORD_NS}p':
+                    paragraph = ''.join(paragraph_parts)
+                    paragraph_parts = []
+                    if table_depth == 0:
+                        if paragraph.strip():
+                            yield paragraph
+                        element.clear()
+                    else:
+                        cell_paragraphs.append(paragraph)
+                elif tag == f'{_WORD_NS}tc' and table_depth == 1:
+                    row_cells.append('\n'.join(cell_paragraphs).strip())
+                    cell_paragraphs = []
+                elif tag == f'{_WORD_NS}tr' and table_depth == 1:
+                    row_text = " | ".join(row_cells)
+                    row_cells = []
+                    if row_text.strip():
+                        yield row_text
+                    element.clear()
+                elif tag == f'{_WORD_NS}tbl':
+                    table_depth -= 1
+
+
+def extract_text_from_docx(file_data: Optional[str] = None, file_path: Optional[str] = None,
+                           max_chars: Optional[int] = None) -> str:
+    """Извлекает текст из DOCX файла (base64 в file_data или путь file_path), не более max_chars символов"""
+    budget = _TextBudget(max_chars)
+    try:
+        # Потоковое чтение абзацев: разбор прекращается, как только набран бюджет
+        with _open_source(file_data, file_path) as docx_file:
+            for block in _iter_docx_blocks(docx_file):
+                if not budget.add(block):
+                    break
+        return budget.text() if budget.parts else "[Документ пуст или не удалось извлечь текст]"
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+        # Нестандартная структура пакета - читаем документ целиком через python-docx
+        pass
+    except Exception as e:
+        return f"[Ошибка при чтении DOCX: {str(e)}]"
+    
     try:
         from docx import Document
         
-        # Убираем префикс data:type;base64, если есть
-        if ',' in file_data:
-            file_data = file_data.split(',')[1]
-        
-        # Декодируем base64
-        docx_bytes = base64.b64decode(file_data)
-        docx_file = io.BytesIO(docx_bytes)
-        
         # Читаем DOCX
-        doc = Document(docx_file)
-        text_parts = []
+        with _open_source(file_data, file_path) as docx_file:
+            doc = Document(docx_file)
+        budget = _TextBudget(max_chars)
         
         for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_parts.append(paragraph.text)
+            if paragraph.text.strip() and not budget.add(paragraph.text):
+                break
         
         # Также извлекаем текст из таблиц
         for table in doc.tables:
+            if budget.exhausted:
+                break
             for row in table.rows:
                 row_text = " | ".join([cell.text.strip() for cell in row.cells])
-                if row_text.strip():
-                    text_parts.append(row_text)
+                if row_text.strip() and not budget.add(row_text):
+                    break
         
-        return "\n".join(text_parts) if text_parts else "[Документ пуст или не удалось извлечь текст]"
+        return budget.text() if budget.parts else "[Документ пуст или не удалось извлечь текст]"
     except ImportError:
         return "[Библиотека python-docx не установлена]"
     except Exception as e:
         return f"[Ошибка при чтении DOCX: {str(e)}]"
 
 
-def extract_text_from_xlsx(file_data: str) -> str:
-    """Извлекает текст из XLSX файла"""
+def extract_text_from_xlsx(file_data: Optional[str] = None, file_path: Optional[str] = None,
+                           max_chars: Optional[int] = None) -> str:
+    """Извлекает текст из XLSX файла (base64 в file_data или путь file_path), не более max_chars символов"""
     try:
         from openpyxl import load_workbook
         
-        # Убираем префикс data:type;base64, если есть
-        if ',' in file_data:
-            file_data = file_data.split(',')[1]
-        
-        # Декодируем base64
-        xlsx_bytes = base64.b64decode(file_data)
-        xlsx_file = io.BytesIO(xlsx_bytes)
-        
-        # Читаем XLSX
-        workbook = load_workbook(xlsx_file, data_only=True)
-        text_parts = []
+        # Читаем XLSX в режиме read_only: строки читаются из файла по мере обхода
+        workbook = load_workbook(file_path or _open_source(file_data), read_only=True, data_only=True)
+        budget = _TextBudget(max_chars)
         
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            text_parts.append(f"--- Лист: {sheet_name} ---")
-            
-            for row in sheet.iter_rows(values_only=True):
-                row_data = [str(cell) if cell is not None else "" for cell in row]
-                row_text = " | ".join(row_data)
-                if row_text.strip() and not all(not cell.strip() for cell in row_data):
-                    text_parts.append(row_text)
-            
-            text_parts.append("")  # Пустая строка между листами
+        try:
+            for sheet_name in workbook.sheetnames:
+                if budget.exhausted:
+                    break
+                sheet = workbook[sheet_name]
+                budget.add(f"--- Лист: {sheet_name} ---")
+                
+                for row in sheet.iter_rows(values_only=True):
+                    row_data = [str(cell) if cell is not None else "" for cell in row]
+                    row_text = " | ".join(row_data)
+                    if row_text.strip() and not all(not cell.strip() for cell in row_data):
+                        if not budget.add(row_text):
+                            break
+                
+                budget.add("")  # Пустая строка между листами
+        finally:
+            # В режиме read_only книга держит файл открытым
+            workbook.close()
         
-        return "\n".join(text_parts) if text_parts else "[Таблица пуста или не удалось извлечь данные]"
+        return budget.text() if budget.parts else "[Таблица пуста или не удалось извлечь данные]"
     except ImportError:
         return "[Библиотека openpyxl не установлена]"
     except Exception as e:
         return f"[Ошибка при чтении XLSX: {str(e)}]"
 
 
-def extract_text_from_text_file(file_data: str) -> str:
-    """Извлекает текст из текстового файла"""
+def extract_text_from_text_file(file_data: Optional[str] = None, file_path: Optional[str] = None,
+                                max_chars: Optional[int] = None) -> str:
+    """Извлекает текст из текстового файла (base64 в file_data или путь file_path), не более max_chars символов"""
     try:
-        # Убираем префикс data:type;base64, если есть
-        if ',' in file_data:
-            file_data = file_data.split(',')[1]
-        
-        # Декодируем base64
-        decoded = base64.b64decode(file_data).decode('utf-8', errors='ignore')
+        with _open_source(file_data, file_path) as text_file:
+            # В UTF-8 символ занимает до 4 байт; читаем с запасом, чтобы результат был длиннее бюджета
+            raw = text_file.read() if max_chars is None else text_file.read((max_chars + 1) * 4)
+        decoded = raw.decode('utf-8', errors='ignore')
         return decoded
     except Exception as e:
         return f"[Ошибка при чтении текстового файла: {str(e)}]"
 
 
-def process_file(file_name: str, file_type: str, file_data: str) -> Tuple[str, Optional[str]]:
+def process_file(file_name: str, file_type: str, file_data: Optional[str] = None,
+                 file_path: Optional[str] = None, max_chars: Optional[int] = None) -> Tuple[str, Optional[str]]:
     """
     Обрабатывает файл и извлекает из него текст или возвращает данные для изображения
     
+    Содержимое передается либо в base64 (file_data), либо путем к файлу на диске (file_path).
+    max_chars - бюджет символов: извлечение прекращается, как только он превышен
+    (результат может быть немного длиннее бюджета; None - весь файл)
+    
     Returns:
         Tuple[str, Optional[str]]: (extracted_text, image_base64)
         - extracted_text: извлеченный текст или описание файла
         - image_base64: base64 данные изображения (если это изображение) или None
     """
     # Проверка входных данных
-    if not file_data:
+    if not file_data and not file_path:
         return "[Файл пуст или данные не получены]", None
     
     if not file_name:
@@ -168,8 +271,11 @@ def process_file(file_name: str, file_type: str, file_data: str) -> Tuple[str, O
     
     # Обработка изображений
     if file_type.startswith('image/'):
-        # Для изображений возвращаем base64 данные
-        if ',' in file_data:
+        # Для изображений возвращаем base64 данные (их нужно передать в vision модель)
+        if file_path:
+            with open(file_path, 'rb') as image_file:
+                image_base64 = base64.b64encode(image_file.read()).decode('ascii')
+        elif ',' in file_data:
             # Убираем префикс data:image/...;base64,
             image_base64 = file_data.split(',')[1]
         else:
@@ -197,13 +303,13 @@ def process_file(file_name: str, file_type: str, file_data: str) -> Tuple[str, O
     
     # Обработка PDF
     if file_name_lower.endswith('.pdf') or file_type == 'application/pdf':
-        text = extract_text_from_pdf(file_data)
+        text = extract_text_from_pdf(file_data, file_path, max_chars)
         return text, None
     
     # Обработка DOCX
     if (file_name_lower.endswith('.docx') or 
         file_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'):
-        text = extract_text_from_docx(file_data)
+        text = extract_text_from_docx(file_data, file_path, max_chars)
         return text, None
     
     # Обработка DOC (старый формат Word)
@@ -213,7 +319,7 @@ def process_file(file_name: str, file_type: str, file_data: str) -> Tuple[str, O
     # Обработка XLSX
     if (file_name_lower.endswith('.xlsx') or 
         file_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'):
-        text = extract_text_from_xlsx(file_data)
+        text = extract_text_from_xlsx(file_data, file_path, max_chars)
         return text, None
     
     # Обработка XLS (старый формат Excel)
@@ -223,12 +329,12 @@ def process_file(file_name: str, file_type: str, file_data: str) -> Tuple[str, O
     # Обработка текстовых файлов
     if (file_type.startswith('text/') or 
         any(file_name_lower.endswith(ext) for ext in ['.txt', '.csv', '.json', '.xml', '.html', '.md', '.py', '.js', '.css', '.log', '.yaml', '.yml'])):
-        text = extract_text_from_text_file(file_data)
+        text = extract_text_from_text_file(file_data, file_path, max_chars)
         return text, None
     
     # Для неизвестных форматов пытаемся прочитать как текст
     try:
-        text = extract_text_from_text_file(file_data)
+        text = extract_text_from_text_file(file_data, file_path, max_chars)
         if text and len(text) > 50:  # Если получили достаточно текста
             return text, None
     except:
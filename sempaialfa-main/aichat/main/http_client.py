@@ -0,0 +1,150 @@
+"""
+Общий HTTP-клиент для обращений к внешним API (OpenRouter)
+Для каждого внешнего сервиса создается одна requests.Session с пулом соединений:
+TCP/TLS соединения переиспользуются между запросами (keep-alive), а не открываются
+заново на каждый вызов. Сессии общие для всех потоков процесса (пул urllib3 потокобезопасен).
+
+Размер пула и таймауты задаются в settings.HTTP_UPSTREAMS по имени сервиса.
+
+Для async-представлений есть async_post: под ASGI-сервером - через httpx.AsyncClient (если httpx
+установлен), иначе - через синхронную сессию в пуле потоков. Клиент httpx привязан к циклу событий:
+под ASGI цикл один на процесс, а под WSGI (runserver) async-представление выполняется через
+async_to_sync в новом цикле на каждый вызов, и клиент на цикл не переиспользовал бы соединения.
+Поэтому клиенты httpx включаются в asgi.py (enable_async_clients)
+"""
+import asyncio
+import logging
+import threading
+import weakref
+
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    import httpx
+except ImportError:  # httpx необязателен: без него async_post выполняет запрос в потоке
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM_CONFIG = {
+    'pool_size': 10,         # Максимум одновременно открытых соединений к сервису
+    'connect_timeout': 5,    # Таймаут установки соединения, сек
+    'read_timeout': 90,      # Таймаут ожидания данных ответа, сек
+}
+
+_sessions = {}
+_lock = threading.Lock()
+# Асинхронные клиенты привязаны к циклу событий: {цикл: {сервис: httpx.AsyncClient}}
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_enabled = False
+
+
+def enable_async_clients(enabled=True):
+    """Включает httpx-клиенты для async_post (процесс работает под ASGI-сервером с одним циклом событий)"""
+    global _async_clients_enabled
+    _async_clients_enabled = enabled
+
+
+def get_upstream_config(upstream):
+    """Настройки сервиса: значения по умолчанию, переопределенные settings.HTTP_UPSTREAMS"""
+    overrides = getattr(settings, 'HTTP_UPSTREAMS', {}).get(upstream, {})
+    return {**DEFAULT_UPSTREAM_CONFIG, **overrides}
+
+
+def get_session(upstream):
+    """Сессия с пулом соединений для сервиса (создается при первом обращении)"""
+    session = _sessions.get(upstream)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            config = get_upstream_config(upstream)
+            # pool_block=False: при исчерпании пула открывается временное соединение, а не ожидание
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['pool_size'], max_retries=0)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[upstream] = session
+            logger.info(f"🔌 Создан пул HTTP соединений '{upstream}': размер={config['pool_size']}")
+        return session
+
+
+def get_timeout(upstream, read_timeout=None):
+    """Таймаут (соединение, чтение) для вызова; read_timeout переопределяет настройку сервиса"""
+    config = get_upstream_config(upstream)
+    return config['connect_timeout'], read_timeout if read_timeout is not None else config['read_timeout']
+
+
+def post(upstream, url, read_timeout=None, **kwargs):
+    """
+    POST через пул соединений сервиса
+
+    Args:
+        upstream: имя сервиса в settings.HTTP_UPSTREAMS (например, 'openrouter')
+        read_timeout: таймаут чтения для этого вызова вместо настройки сервиса
+        **kwargs: параметры requests (headers, json, stream, ...)
+    """
+    kwargs.setdefault('timeout', get_timeout(upstream, read_timeout))
+    return get_session(upstream).post(url, **kwargs)
+
+
+def get_async_client(upstream):
+    """httpx.AsyncClient с пулом соединений для сервиса в текущем цикле событий"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        # Клиенты завершившихся циклов больше не используются
+        for closed_loop in [other for other in list(_async_clients) if other.is_closed()]:
+            _async_clients.pop(closed_loop, None)
+        clients = _async_clients[loop] = {}
+    client = clients.get(upstream)
+    if client is None:
+        config = get_upstream_config(upstream)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=config['pool_size'], max_keepalive_connections=config['pool_size']),
+            timeout=httpx.Timeout(config['read_timeout'], connect=config['connect_timeout']),
+        )
+        clients[upstream] = client
+        logger.info(f"🔌 Создан асинхронный пул HTTP соединений '{upstream}': размер={config['pool_size']}")
+    return client
+
+
+async def async_post(upstream, url, read_timeout=None, **kwargs):
+    """
+    POST для async-кода; ошибки соединения и таймаута - исключения requests,
+    как у синхронного post, чтобы обработка ошибок не зависела от клиента
+
+    Ответ поддерживает status_code, json() и text
+    """
+    if httpx is None or not _async_clients_enabled:
+        return await sync_to_async(post, thread_sensitive=False)(upstream, url, read_timeout=read_timeout, **kwargs)
+
+    connect_timeout, read_timeout = get_timeout(upstream, read_timeout)
+    try:
+        return await get_async_client(upstream).post(
+            url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **kwargs
+        )
+    except httpx.TimeoutException as e:
+        raise requests.exceptions.Timeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+
+async def close_async_clients():
+    """Закрывает httpx-клиенты текущего цикла событий (перед его завершением)"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), None) or {}
+    for client in clients.values():
+        await client.aclose()
+
+
+def close_all():
+    """Закрывает все сессии (соединения будут открыты заново при следующем вызове)"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,109 @@
+"""
+Микробенчмарк разбора команд действий в ответе AI
+
+Сравнивает action_parser.parse (один проход по ответу) с каскадом проверок, который
+выполнялся раньше: для каждой команды поиск 'ИМЯ:' в ответе и split по имени,
+затем поиск JSON команд двумя регулярными выражениями в каждом блоке обработки.
+Ответы генерируются разной длины (абзацы текста) и с разным числом команд.
+
+Запуск:
+    python manage.py bench_action_parser --iterations 2000 --paragraphs 1 10 50
+"""
+import json
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from main import action_parser
+
+_PARAGRAPH = (
+    'По данным за текущий месяц общий баланс счетов составляет 1 250 000 ₽, '
+    'задолженность по НДС погашена, ближайший платеж по аренде - 25 числа. '
+    'Рекомендую запланировать встречу с бухгалтером и проверить остатки на складе.\n'
+)
+
+_COMMAND_LINES = (
+    'CREATE_EVENT: Встреча с бухгалтером|2025-01-20T10:00|Сверка платежей',
+    '{"action": "UPDATE_INVENTORY_ITEM", "item": "Бумага А4", "quantity": 40}',
+    '[CHART_RECEIPTS:pie]',
+    'UPDATE_EMPLOYEE_FOLDER: Бухгалтерия|Финансовый отдел',
+    '{"action": "DELETE_EVENT", "event": "Старая встреча"}',
+)
+
+# Блоки прежнего обработчика: текстовые команды и поиск JSON перед каждой группой
+_LEGACY_JSON_PATTERNS = (
+    r'\{\s*"action"\s*:\s*"[^"]+"[^}]*\}',
+    r'\{[^{}]*"action"\s*:\s*"[^"]+"[^{}]*\}',
+)
+_LEGACY_STAGES = (
+    ('DELETE_EVENT', 'DELETE_DOCUMENT', 'RENAME_DOCUMENT', 'SEND_SUPPORT_MESSAGE', 'CREATE_EVENT'),
+    'json',
+    ('CREATE_FOLDER', 'DELETE_FOLDER', 'UPDATE_FOLDER',
+     'CREATE_INVENTORY_ITEM', 'DELETE_INVENTORY_ITEM', 'UPDATE_INVENTORY_ITEM'),
+    'json',
+    ('CREATE_EMPLOYEE_FOLDER', 'DELETE_EMPLOYEE_FOLDER', 'UPDATE_EMPLOYEE_FOLDER',
+     'CREATE_EMPLOYEE', 'DELETE_EMPLOYEE', 'UPDATE_EMPLOYEE'),
+    ('UPDATE_EVENT',),
+    'json',
+    ('UPDATE_EVENT',),
+)
+
+
+def _legacy_scan(text):
+    """Каскад проверок прежнего обработчика (без поиска сущностей в данных пользователя)"""
+    found = []
+    for stage in _LEGACY_STAGES:
+        if stage == 'json':
+            for pattern in _LEGACY_JSON_PATTERNS:
+                for match in re.finditer(pattern, text, re.DOTALL | re.IGNORECASE):
+                    try:
+                        found.append(json.loads(match.group(0)).get('action'))
+                    except ValueError:
+                        continue
+            continue
+        for name in stage:
+            if f'{name}:' in text:
+                parts = text.split(f'{name}:')
+                found.append((name, parts[1].strip().split('\n')[0]))
+    # Гибкий поиск CREATE_EVENT / DELETE_EVENT в любом регистре
+    re.search(r'CREATE_EVENT\s*:\s*([^\n]+)', text, re.IGNORECASE)
+    re.search(r'DELETE_EVENT\s*:\s*["\']?([^"\'\n]+)["\']?', text, re.IGNORECASE)
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает однопроходный разбор команд в ответе AI с прежним каскадом проверок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='Повторов разбора на вариант')
+        parser.add_argument('--paragraphs', type=int, nargs='+', default=[1, 10, 50],
+                            help='Длины ответа в абзацах текста')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        self.stdout.write(f'Повторов: {iterations}')
+        self.stdout.write('')
+        for paragraphs in options['paragraphs']:
+            for commands in (0, 1, len(_COMMAND_LINES)):
+                text = _PARAGRAPH * paragraphs + '\n'.join(_COMMAND_LINES[:commands])
+                title = f'{len(text):7} симв., команд {commands}'
+                self._report(title, 'один проход', self._measure(action_parser.parse, text, iterations))
+                self._report(title, 'каскад', self._measure(_legacy_scan, text, iterations))
+
+    def _measure(self, function, text, iterations):
+        durations = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function(text)
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    def _report(self, title, variant, durations):
+        durations = sorted(durations)
+        p95 = durations[int(len(durations) * 0.95) - 1]
+        self.stdout.write(
+            f'{title} | {variant:12} медиана {statistics.median(durations) * 1e6:9.1f} мкс, '
+            f'p95 {p95 * 1e6:9.1f} мкс'
+        )
@@ -0,0 +1,173 @@
+"""
+Сравнение потоковой и асинхронной модели обработки ожидающих запросов
+
+Два сценария, каждый в двух вариантах (потоки / asyncio):
+- long-poll: N клиентов ждут изменения статуса (chat_events.wait_for_change
+  против chat_events.async_wait_for_change), затем все запросы завершаются;
+- upstream: N одновременных POST к локальному серверу с задержкой --latency, имитирующему
+  OpenRouter (http_client.post в пуле из CHAT_WORKER_POOL_SIZE потоков против http_client.async_post)
+
+Запуск:
+    python manage.py bench_async --concurrency 500 --latency 0.5
+"""
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import chat_events, http_client
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    """Отвечает JSON после задержки server.latency секунд"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.latency)
+        body = b'{"choices": [{"message": {"content": "ok"}}]}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает потоковую и asyncio-обработку long-poll ожиданий и запросов к LLM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='Число одновременных запросов')
+        parser.add_argument('--latency', type=float, default=0.5, help='Задержка ответа имитации OpenRouter, сек')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Потоков в потоковом варианте (по умолчанию CHAT_WORKER_POOL_SIZE)')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        latency = options['latency']
+        workers = options['workers'] or getattr(settings, 'CHAT_WORKER_POOL_SIZE', 8)
+
+        self.stdout.write(f'Одновременных запросов: {concurrency}, задержка upstream: {latency} сек, потоков: {workers}')
+        # Один цикл событий на замер, как под ASGI-сервером
+        http_client.enable_async_clients()
+        if http_client.httpx is None:
+            self.stdout.write(self.style.WARNING('httpx не установлен: async_post выполняет запросы в пуле потоков'))
+        self.stdout.write('')
+
+        self._report('long-poll, поток на ожидание', *self._long_poll_threads(concurrency, latency))
+        self._report('long-poll, asyncio', *asyncio.run(self._long_poll_async(concurrency, latency)))
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+        server.latency = latency
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+        try:
+            with self._pool_settings(workers, concurrency):
+                self._report('upstream, пул потоков', *self._upstream_threads(url, concurrency, workers))
+                self._report('upstream, asyncio', *asyncio.run(self._upstream_async(url, concurrency)))
+        finally:
+            server.shutdown()
+            http_client.close_all()
+
+    def _pool_settings(self, workers, concurrency):
+        """Пулы соединений: потоковому варианту - по числу потоков, asyncio - по числу запросов"""
+        from django.test.utils import override_settings
+        return override_settings(HTTP_UPSTREAMS={
+            'bench-threads': {'pool_size': workers},
+            'bench-async': {'pool_size': concurrency},
+        })
+
+    def _long_poll_threads(self, concurrency, latency):
+        request_ids = [str(uuid.uuid4()) for _ in range(concurrency)]
+        woken_at = [None] * concurrency
+
+        def waiter(index):
+            request_id = request_ids[index]
+            since = chat_events.current_version(request_id)
+            chat_events.wait_for_change(request_id, since, timeout=latency + 30)
+            woken_at[index] = time.monotonic()
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=waiter, args=(i,), daemon=True) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        time.sleep(latency)
+        peak_threads = threading.active_count()
+        notified_at = time.monotonic()
+        for request_id in request_ids:
+            chat_events.notify(request_id)
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started, [t - notified_at for t in woken_at], peak_threads
+
+    async def _long_poll_async(self, concurrency, latency):
+        request_ids = [str(uuid.uuid4()) for _ in range(concurrency)]
+        woken_at = [None] * concurrency
+
+        async def waiter(index):
+            request_id = request_ids[index]
+            since = chat_events.current_version(request_id)
+            await chat_events.async_wait_for_change(request_id, since, timeout=latency + 30)
+            woken_at[index] = time.monotonic()
+
+        started = time.monotonic()
+        tasks = [asyncio.create_task(waiter(i)) for i in range(concurrency)]
+        await asyncio.sleep(latency)
+        peak_threads = threading.active_count()
+        notified_at = time.monotonic()
+        # Уведомления приходят из потока обработки, как при сохранении ChatRequest
+        await asyncio.to_thread(lambda: [chat_events.notify(request_id) for request_id in request_ids])
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started, [t - notified_at for t in woken_at], peak_threads
+
+    def _upstream_threads(self, url, concurrency, workers):
+        durations = []
+
+        def call(_):
+            call_started = time.monotonic()
+            http_client.post('bench-threads', url, json={'messages': []}).json()
+            durations.append(time.monotonic() - call_started)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(call, range(concurrency)))
+            peak_threads = threading.active_count()
+        return time.monotonic() - started, durations, peak_threads
+
+    async def _upstream_async(self, url, concurrency):
+        durations = []
+        peak_threads = 0
+
+        async def call():
+            nonlocal peak_threads
+            call_started = time.monotonic()
+            response = await http_client.async_post('bench-async', url, json={'messages': []})
+            response.json()
+            peak_threads = max(peak_threads, threading.active_count())
+            durations.append(time.monotonic() - call_started)
+
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(call() for _ in range(concurrency)))
+        finally:
+            await http_client.close_async_clients()
+        return time.monotonic() - started, durations, peak_threads
+
+    def _report(self, title, elapsed, latencies, peak_threads):
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f'{title:32} всего {elapsed:7.2f} сек | '
+            f'задержка p50 {statistics.median(latencies) * 1000:8.1f} мс, p95 {p95 * 1000:8.1f} мс | '
+            f'потоков {peak_threads}'
+        )
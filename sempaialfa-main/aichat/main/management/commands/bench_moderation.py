@@ -0,0 +1,72 @@
+"""
+Микробенчмарк модерации контента
+
+Сравнивает проверку текста одним выражением (ContentModerator.find_rules) с циклом,
+который выполнялся раньше: поиск каждого запрещенного слова через `in` и re.search
+для каждого паттерна. Стоимость выводится на КБ текста для текстов разного размера,
+а также время повторной проверки сообщения из кэша check_message.
+
+Запуск:
+    python manage.py bench_moderation --iterations 500 --sizes 1 4 16 64
+"""
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.content_moderator import ContentModerator
+
+_PARAGRAPH = (
+    'По данным за текущий месяц общий баланс счетов составляет 1 250 000 ₽, '
+    'задолженность по НДС погашена, ближайший платеж по аренде - 25 числа. '
+    'Как сократить расходы на коммунальные услуги и обучить сотрудников учету?\n'
+)
+
+
+def _legacy_find_rules(text):
+    """Цикл по правилам прежней проверки (все правила, без остановки на первом)"""
+    found = [word for word in ContentModerator.FORBIDDEN_WORDS if word.lower() in text]
+    found += [pattern for pattern in ContentModerator.FORBIDDEN_PATTERNS if re.search(pattern, text, re.IGNORECASE)]
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает проверку модератора одним выражением с циклом по правилам (стоимость на КБ текста)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500, help='Повторов проверки на вариант')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 16, 64], help='Размеры текста в КБ')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        self.stdout.write(f'Повторов: {iterations}, правил: {len(ContentModerator.FORBIDDEN_WORDS) + len(ContentModerator.FORBIDDEN_PATTERNS)}')
+        self.stdout.write('')
+        for size in options['sizes']:
+            text = (_PARAGRAPH * (size * 1024 // len(_PARAGRAPH.encode()) + 1)).lower()
+            kilobytes = len(text.encode()) / 1024
+            title = f'{kilobytes:6.1f} КБ'
+            self._report(title, 'одно выражение', kilobytes,
+                         self._measure(ContentModerator.find_rules, text, iterations))
+            self._report(title, 'цикл по правилам', kilobytes, self._measure(_legacy_find_rules, text, iterations))
+            if len(text) <= ContentModerator.MAX_MESSAGE_LENGTH:
+                ContentModerator.check_message(text)
+                self._report(title, 'повтор из кэша', kilobytes,
+                             self._measure(ContentModerator.check_message, text, iterations))
+
+    def _measure(self, function, text, iterations):
+        durations = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function(text)
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    def _report(self, title, variant, kilobytes, durations):
+        durations = sorted(durations)
+        median = statistics.median(durations)
+        p95 = durations[int(len(durations) * 0.95) - 1]
+        self.stdout.write(
+            f'{title} | {variant:16} медиана {median * 1e6:9.1f} мкс, p95 {p95 * 1e6:9.1f} мкс, '
+            f'{median * 1e6 / kilobytes:8.1f} мкс/КБ'
+        )
@@ -0,0 +1,39 @@
+"""
+Удаление файлов хранилища, на которые не ссылается ни один запрос к AI
+
+Запуск:
+    python manage.py gc_blobs --grace-hours 24
+    python manage.py gc_blobs --dry-run
+"""
+from django.core.management.base import BaseCommand
+
+from main import blob_store
+from main.models import ChatRequest
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища файлы, на которые не ссылается ни один ChatRequest'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=1.0,
+            help='Не удалять файлы моложе указанного возраста (часы)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько файлов будет удалено'
+        )
+
+    def handle(self, *args, **options):
+        referenced = blob_store.referenced_keys(
+            ChatRequest.objects.exclude(files_data=[]).values_list('files_data', flat=True).iterator()
+        )
+        removed, freed = blob_store.collect_garbage(
+            referenced,
+            grace_seconds=options['grace_hours'] * 3600,
+            dry_run=options['dry_run']
+        )
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {removed} ({freed / 1024 / 1024:.2f} MB), используется: {len(referenced)}'
+        ))
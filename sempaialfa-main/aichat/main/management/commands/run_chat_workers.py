@@ -0,0 +1,104 @@
+"""
+Воркеры обработки запросов к AI из очереди в БД
+
+Запуск (веб-процесс должен работать с CHAT_PROCESSING_MODE=worker):
+    python manage.py run_chat_workers --workers 8
+Процессов-воркеров может быть несколько, в том числе на разных узлах с общей БД
+"""
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main import chat_queue
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры, обрабатывающие запросы к AI из очереди в БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=getattr(settings, 'CHAT_WORKER_POOL_SIZE', 8),
+            help='Число одновременно обрабатываемых запросов в этом процессе'
+        )
+        parser.add_argument(
+            '--lease', type=int,
+            default=getattr(settings, 'CHAT_QUEUE_LEASE_SECONDS', 120),
+            help='Длительность аренды запроса в секундах'
+        )
+        parser.add_argument(
+            '--max-attempts', type=int,
+            default=getattr(settings, 'CHAT_QUEUE_MAX_ATTEMPTS', 3),
+            help='Максимум попыток обработки одного запроса'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза между опросами пустой очереди в секундах'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать все ожидающие запросы и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        from main.views import process_chat_request_async
+
+        workers = max(1, options['workers'])
+        lease_seconds = max(5, options['lease'])
+        max_attempts = max(1, options['max_attempts'])
+        poll_interval = options['poll_interval']
+        worker_id = chat_queue.make_worker_id()
+
+        stop = threading.Event()
+        slots = threading.Semaphore(workers)
+
+        def request_stop(signum, frame):
+            self.stdout.write('Получен сигнал остановки, завершаем обрабатываемые запросы...')
+            stop.set()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, request_stop)
+            signal.signal(signal.SIGTERM, request_stop)
+
+        def run(request_id):
+            try:
+                chat_queue.process_claimed(
+                    request_id, worker_id, process_chat_request_async,
+                    lease_seconds, max_attempts
+                )
+            finally:
+                close_old_connections()
+                slots.release()
+
+        self.stdout.write(
+            f'Воркер {worker_id}: потоков={workers}, аренда={lease_seconds}с, попыток={max_attempts}'
+        )
+
+        processed = 0
+        next_recovery = 0.0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ChatQueueWorker') as executor:
+            while not stop.is_set():
+                if time.monotonic() >= next_recovery:
+                    chat_queue.recover_expired_leases(max_attempts)
+                    next_recovery = time.monotonic() + lease_seconds / 2
+
+                if not slots.acquire(timeout=poll_interval):
+                    continue
+
+                request_id = chat_queue.claim_next(worker_id, lease_seconds)
+                if request_id is None:
+                    slots.release()
+                    if options['once']:
+                        break
+                    stop.wait(poll_interval)
+                    continue
+
+                processed += 1
+                executor.submit(run, request_id)
+
+        self.stdout.write(self.style.SUCCESS(f'Воркер {worker_id} остановлен, обработано запросов: {processed}'))
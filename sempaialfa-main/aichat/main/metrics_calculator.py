@@ -9,6 +9,7 @@ from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from .models import ChatRequest, ChatRequestMetrics, Metric, ChatHistory
 from .content_moderator import ContentModerator
+from .semantic_cache import normalize_message
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +29,7 @@ class MetricsCalculator:
         'response_time_p50': 5.0,
         'response_time_p95': 10.0,
         'llm_processing_time_p50': 3.0,
+        'prompt_cache_hit_rate': 50.0,
         'throughput': 10.0,
         'request_success_rate': 95.0,
         'error_rate': 5.0,
@@ -88,6 +90,8 @@ class MetricsCalculator:
         # Метрики популярных запросов
         'unique_request_rate': 70.0,  # процент
         'repeated_request_rate': 30.0,  # процент
+        'response_cache_hit_rate': 20.0,  # процент
+        'fast_path_hit_rate': 15.0,  # процент
         # Метрики мультимодальности
         'image_processing_rate': 5.0,  # процент
         'image_processing_success_rate': 90.0,  # процент
@@ -413,6 +417,31 @@ class MetricsCalculator:
                 }
             })
         
+        # Prompt Cache Hit Rate - доля входных токенов, прочитанных из кэша промптов провайдера
+        token_usage = requests_with_metrics.filter(
+            metrics__prompt_tokens__gt=0
+        ).aggregate(
+            prompt_tokens=Sum('metrics__prompt_tokens'),
+            cached_tokens=Sum('metrics__cached_tokens'),
+            sample_size=Count('id')
+        )
+        if token_usage['prompt_tokens']:
+            cached_tokens = token_usage['cached_tokens'] or 0
+            metrics.append({
+                'name': 'prompt_cache_hit_rate',
+                'category': 'performance',
+                'value': cached_tokens / token_usage['prompt_tokens'] * 100,
+                'target_value': cls.TARGET_VALUES.get('prompt_cache_hit_rate'),
+                'unit': 'percent',
+                'period_start': period_start,
+                'period_end': period_end,
+                'sample_size': token_usage['sample_size'],
+                'metadata': {
+                    'prompt_tokens': token_usage['prompt_tokens'],
+                    'cached_tokens': cached_tokens
+                }
+            })
+        
         return metrics
     
     @classmethod
@@ -928,7 +957,7 @@ class MetricsCalculator:
         """Расчет метрик длины запросов и ответов"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('message', 'response')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1020,7 +1049,7 @@ class MetricsCalculator:
         """Расчет метрик использования истории чата"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('chat_history')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1090,7 +1119,7 @@ class MetricsCalculator:
         """Расчет метрик паттернов использования"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('created_at')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1167,7 +1196,7 @@ class MetricsCalculator:
         """Расчет метрик ошибок и повторных запросов"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('status', 'error', 'user_data', 'created_at', 'message')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1325,8 +1354,8 @@ class MetricsCalculator:
         
         # Среднее количество действий на запрос
         total_actions = sum(
-            len(req.action or {}) if isinstance(req.action, dict) else (1 if req.action else 0)
-            for req in requests_with_actions
+            len(action or {}) if isinstance(action, dict) else (1 if action else 0)
+            for action in requests_with_actions.values_list('action', flat=True)
         )
         avg_actions_per_request = total_actions / action_count if action_count > 0 else 0
         
@@ -1398,7 +1427,7 @@ class MetricsCalculator:
         """Расчет метрик использования функций"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('files_data', 'action')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1494,7 +1523,7 @@ class MetricsCalculator:
         """Расчет метрик качества контекста"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('user_data')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1607,7 +1636,7 @@ class MetricsCalculator:
         avg_session_duration = sum(session_durations) / len(session_durations) if session_durations else 0
         
         # Среднее время между запросами (анализ по ChatRequest)
-        all_requests = ChatRequest.objects.filter(requests_filter).order_by('created_at')
+        all_requests = ChatRequest.objects.filter(requests_filter).only('user_data', 'created_at').order_by('created_at')
         
         # Группируем запросы по пользователям и считаем среднее время между запросами
         user_request_times = {}
@@ -1717,16 +1746,16 @@ class MetricsCalculator:
         """Расчет метрик анализа контента"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('message')
         total_requests = all_requests.count()
         
         if total_requests == 0:
             return metrics
         
-        # Анализ уникальности запросов
+        # Анализ уникальности запросов (нормализация та же, что у семантического кэша ответов)
         request_texts = {}
         for req in all_requests:
-            text = (req.message or '').strip().lower()[:200]  # Первые 200 символов для сравнения
+            text = normalize_message(req.message)[:200]  # Первые 200 символов для сравнения
             if text:
                 request_texts[text] = request_texts.get(text, 0) + 1
         
@@ -1766,6 +1795,53 @@ class MetricsCalculator:
             }
         })
         
+        # Попадания в кэши ответов (точный и семантический): повторные вопросы без вызова LLM
+        cache_statuses = list(ChatRequestMetrics.objects.filter(
+            chat_request__in=ChatRequest.objects.filter(requests_filter),
+            metadata__has_key='response_cache'
+        ).values_list('metadata__response_cache', flat=True))
+        if cache_statuses:
+            exact_hits = cache_statuses.count('exact')
+            semantic_hits = cache_statuses.count('semantic')
+            metrics.append({
+                'name': 'response_cache_hit_rate',
+                'category': 'content_analysis',
+                'value': (exact_hits + semantic_hits) / len(cache_statuses) * 100,
+                'target_value': cls.TARGET_VALUES.get('response_cache_hit_rate'),
+                'unit': 'percent',
+                'period_start': period_start,
+                'period_end': period_end,
+                'sample_size': len(cache_statuses),
+                'metadata': {
+                    'exact_hits': exact_hits,
+                    'semantic_hits': semantic_hits,
+                    'misses': cache_statuses.count('miss'),
+                    'repeated_texts': repeated_texts
+                }
+            })
+        
+        # Быстрые ответы по шаблону без вызова LLM
+        fast_path_flags = list(ChatRequestMetrics.objects.filter(
+            chat_request__in=ChatRequest.objects.filter(requests_filter),
+            metadata__has_key='fast_path'
+        ).values_list('metadata__fast_path', flat=True))
+        if fast_path_flags:
+            fast_hits = sum(1 for flag in fast_path_flags if flag)
+            metrics.append({
+                'name': 'fast_path_hit_rate',
+                'category': 'content_analysis',
+                'value': fast_hits / len(fast_path_flags) * 100,
+                'target_value': cls.TARGET_VALUES.get('fast_path_hit_rate'),
+                'unit': 'percent',
+                'period_start': period_start,
+                'period_end': period_end,
+                'sample_size': len(fast_path_flags),
+                'metadata': {
+                    'fast_hits': fast_hits,
+                    'llm_requests': len(fast_path_flags) - fast_hits
+                }
+            })
+        
         return metrics
     
     @classmethod
@@ -1773,7 +1849,7 @@ class MetricsCalculator:
         """Расчет метрик мультимодальности"""
         metrics = []
         
-        all_requests = ChatRequest.objects.filter(requests_filter)
+        all_requests = ChatRequest.objects.filter(requests_filter).only('message', 'files_data', 'status', 'error')
         total_requests = all_requests.count()
         
         if total_requests == 0:
@@ -1870,7 +1946,7 @@ class MetricsCalculator:
         
         # Запросы с действиями
         action_requests = requests_with_metrics.filter(metrics__has_action=True)
-        action_times = [req.metrics.processing_time for req in action_requests if req.metrics.processing_time]
+        action_times = [t for t in action_requests.values_list('metrics__processing_time', flat=True) if t]
         if action_times:
             avg_action_time = sum(action_times) / len(action_times)
         else:
@@ -1878,7 +1954,7 @@ class MetricsCalculator:
         
         # Запросы с файлами
         file_requests = requests_with_metrics.filter(metrics__has_files=True)
-        file_times = [req.metrics.processing_time for req in file_requests if req.metrics.processing_time]
+        file_times = [t for t in file_requests.values_list('metrics__processing_time', flat=True) if t]
         if file_times:
             avg_file_time = sum(file_times) / len(file_times)
         else:
@@ -1889,7 +1965,7 @@ class MetricsCalculator:
             metrics__has_action=False,
             metrics__has_files=False
         )
-        simple_times = [req.metrics.processing_time for req in simple_requests if req.metrics.processing_time]
+        simple_times = [t for t in simple_requests.values_list('metrics__processing_time', flat=True) if t]
         if simple_times:
             avg_simple_time = sum(simple_times) / len(simple_times)
         else:
@@ -1946,7 +2022,8 @@ class MetricsCalculator:
     def create_request_metrics(cls, chat_request, processing_time=None, llm_time=None, 
                                 has_action=False, action_success=None, files_data=None,
                                 message_blocked=False, response_blocked=False,
-                                context_used=False, response_text=None):
+                                context_used=False, response_text=None, cache_status=None, usage=None,
+                                fast_path=None):
         """
         Создает метрики для конкретного запроса
         
@@ -1961,6 +2038,9 @@ class MetricsCalculator:
             response_blocked: Заблокирован ли ответ
             context_used: Использован ли контекст
             response_text: Текст ответа
+            cache_status: Результат поиска в кэшах ответов (exact / semantic / miss, None - кэши выключены)
+            usage: Блок usage ответа OpenRouter (prompt_tokens, completion_tokens, prompt_tokens_details)
+            fast_path: Ответ собран по шаблону без LLM (None - быстрые ответы выключены)
         """
         metrics, created = ChatRequestMetrics.objects.get_or_create(
             chat_request=chat_request,
@@ -1996,6 +2076,20 @@ class MetricsCalculator:
                 metrics.response_length = len(response_text)
             metrics.save()
         
+        if cache_status is not None:
+            metrics.metadata = {**(metrics.metadata or {}), 'response_cache': cache_status}
+            metrics.save(update_fields=['metadata', 'updated_at'])
+        
+        if fast_path is not None:
+            metrics.metadata = {**(metrics.metadata or {}), 'fast_path': fast_path}
+            metrics.save(update_fields=['metadata', 'updated_at'])
+        
+        if usage:
+            metrics.prompt_tokens = usage.get('prompt_tokens')
+            metrics.completion_tokens = usage.get('completion_tokens')
+            metrics.cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+            metrics.save(update_fields=['prompt_tokens', 'completion_tokens', 'cached_tokens', 'updated_at'])
+        
         # Подсчитываем файлы
         if files_data:
             metrics.files_processed = len([f for f in files_data if f.get('processed', False)])
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.26 on 2026-10-17 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_useractivity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatrequest',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatrequest',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatrequest',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatrequest',
+            name='locked_by',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='chatrequest',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='main_chatre_status_19336f_idx'),
+        ),
+    ]
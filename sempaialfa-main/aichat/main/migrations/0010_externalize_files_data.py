@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def externalize_files_data(apps, schema_editor):
+    """Переносит base64-содержимое файлов существующих запросов в хранилище"""
+    from main.blob_store import externalize_files
+
+    ChatRequest = apps.get_model('main', 'ChatRequest')
+    for chat_request in ChatRequest.objects.exclude(files_data=[]).only('files_data').iterator():
+        files = chat_request.files_data or []
+        if not any(isinstance(file, dict) and file.get('data') for file in files):
+            continue
+        chat_request.files_data = externalize_files(files)
+        chat_request.save(update_fields=['files_data'])
+
+
+def inline_files_data(apps, schema_editor):
+    """Возвращает содержимое файлов из хранилища обратно в files_data"""
+    from main.blob_store import resolve_file_data
+
+    ChatRequest = apps.get_model('main', 'ChatRequest')
+    for chat_request in ChatRequest.objects.exclude(files_data=[]).only('files_data').iterator():
+        files = chat_request.files_data or []
+        if not any(isinstance(file, dict) and file.get('blob') for file in files):
+            continue
+        inlined = []
+        for file in files:
+            if isinstance(file, dict) and file.get('blob'):
+                data = resolve_file_data(file)
+                file = {key: value for key, value in file.items() if key != 'blob'}
+                file['data'] = f"data:{file.get('type') or 'application/octet-stream'};base64,{data}"
+            inlined.append(file)
+        chat_request.files_data = inlined
+        chat_request.save(update_fields=['files_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_chatrequest_queue_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(externalize_files_data, inline_files_data),
+    ]
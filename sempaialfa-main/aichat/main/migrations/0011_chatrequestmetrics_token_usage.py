@@ -0,0 +1,28 @@
+# Generated by Django 4.2.26 on 2026-10-17 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_externalize_files_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatrequestmetrics',
+            name='cached_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatrequestmetrics',
+            name='completion_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatrequestmetrics',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
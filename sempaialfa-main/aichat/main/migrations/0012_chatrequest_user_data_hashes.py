@@ -0,0 +1,18 @@
+# Generated by Django 4.2.26 on 2026-10-17 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_chatrequestmetrics_token_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatrequest',
+            name='user_data_hashes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -23,6 +23,7 @@ class ChatRequest(models.Model):
     message = models.TextField(blank=True)
     chat_history = models.JSONField(default=list, blank=True)
     user_data = models.JSONField(default=dict, blank=True)
+    user_data_hashes = models.JSONField(default=dict, blank=True)  # Хэши разделов user_data (user_data_store)
     files_data = models.JSONField(default=list, blank=True)
     
     # Результаты
@@ -35,10 +36,17 @@ class ChatRequest(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
+    # Очередь воркеров (manage.py run_chat_workers)
+    attempts = models.IntegerField(default=0)  # Сколько раз запрос забирался воркером
+    locked_by = models.CharField(max_length=255, blank=True, default='')  # Идентификатор воркера-владельца
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # До какого момента воркер владеет запросом
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Последний heartbeat воркера
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
         ]
     
     def __str__(self):
@@ -168,6 +176,11 @@ class ChatRequestMetrics(models.Model):
     context_used = models.BooleanField(default=False)  # Использован ли контекст пользователя
     response_length = models.IntegerField(default=0)  # Длина ответа в символах
     
+    # Метрики использования токенов (блок usage ответа OpenRouter)
+    prompt_tokens = models.IntegerField(null=True, blank=True)  # Токенов во входных сообщениях
+    completion_tokens = models.IntegerField(null=True, blank=True)  # Токенов в ответе
+    cached_tokens = models.IntegerField(null=True, blank=True)  # Входных токенов, прочитанных из кэша промптов провайдера
+    
     # Дополнительные метрики
     metadata = models.JSONField(default=dict, blank=True)  # Дополнительная информация
     
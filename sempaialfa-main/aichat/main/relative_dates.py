@@ -0,0 +1,203 @@
+"""
+Разбор дат в идентификаторах событий ("завтрашняя встреча", "совещание в пятницу", "15 декабря")
+Модель передает в команды событий то, как о событии сказал пользователь. Если в идентификаторе
+есть дата, она переводится в интервал [начало, конец) относительно текущего времени, и событие
+ищется по дате в индексе календаря (entity_resolver), а оставшиеся слова уточняют выбор.
+
+Поддерживаются:
+- сегодня, завтра, послезавтра, вчера, позавчера (и прилагательные: "завтрашняя");
+- дни недели ("в пятницу" - ближайшая пятница, начиная с сегодняшнего дня);
+- "на этой неделе", "на следующей неделе", "через 3 дня", "через неделю";
+- "15 декабря", "15 декабря 2025", "15.12", "15.12.2025", "2025-12-15";
+- время: "в 10:30" (минута), "на 10 утра", "в 5 вечера", "в 15 часов" (час).
+
+Разбор выполняется регулярными выражениями без обращения к LLM; если даты нет, возвращается None
+"""
+import re
+from datetime import date, datetime, timedelta
+
+from django.utils import timezone
+
+MONTHS = {
+    'январ': 1, 'феврал': 2, 'март': 3, 'апрел': 4, 'ма': 5, 'июн': 6,
+    'июл': 7, 'август': 8, 'сентябр': 9, 'октябр': 10, 'ноябр': 11, 'декабр': 12,
+}
+WEEKDAYS = {
+    'понедельник': 0, 'вторник': 1, 'сред': 2, 'четверг': 3, 'пятниц': 4, 'суббот': 5, 'воскресень': 6,
+}
+RELATIVE_DAYS = {'позавчера': -2, 'вчера': -1, 'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+
+_MONTH = r'(январ[ья]|феврал[ья]|марта?|апрел[ья]|ма[йя]|июн[ья]|июл[ья]|августа?|сентябр[ья]|октябр[ья]|ноябр[ья]|декабр[ья])'
+
+# Порядок важен: сначала более длинные выражения ("послезавтра" раньше "завтра")
+_DAY_PATTERNS = (
+    ('relative', re.compile(r'(?<!\w)(послезавтра|позавчера|завтра|вчера|сегодня)(?:шн\w*)?(?!\w)')),
+    ('in_days', re.compile(r'(?<!\w)через\s+(\d+|одну|один|два|две|три|пару)?\s*(дн\w*|день|недел\w*)(?!\w)')),
+    ('week', re.compile(r'(?<!\w)(?:на\s+)?(эт\w+|текущ\w+|следующ\w+)\s+недел\w*(?!\w)')),
+    ('iso', re.compile(r'(?<!\d)(\d{4})-(\d{2})-(\d{2})(?:[t ](\d{2}):(\d{2})\S*)?(?!\d)')),
+    ('numeric', re.compile(r'(?<![\d.])(\d{1,2})\.(\d{1,2})(?:\.(\d{4}|\d{2}))?(?![\d.])')),
+    ('day_month', re.compile(rf'(?<!\w)(\d{{1,2}})\s+{_MONTH}(?:\s+(\d{{4}}))?(?:\s*(?:г\.|года?))?(?!\w)')),
+    ('weekday', re.compile(
+        r'(?<!\w)(?:(?:в|во|на)\s+)?(?:(следующ\w+|эт\w+)\s+)?'
+        r'(понедельник\w*|вторник\w*|сред[аеуы]|четверг\w*|пятниц[аеуы]|суббот[аеуы]|воскресень[еяю])(?!\w)'
+    )),
+)
+_TIME_PATTERNS = (
+    ('minute', re.compile(r'(?<!\w)(?:(?:в|на|к)\s+)?(\d{1,2}):(\d{2})(?!\d)')),
+    ('hour', re.compile(
+        r'(?<!\w)(?:(?:в|на|к)\s+)?(\d{1,2})\s*(?:(утра|дня|вечера|ночи)|час\w*)(?:\s+(утра|дня|вечера|ночи))?(?!\w)'
+    )),
+)
+_NUMBER_WORDS = {'один': 1, 'одну': 1, 'два': 2, 'две': 2, 'пару': 2, 'три': 3}
+# Предлоги, остающиеся на краях текста после удаления даты
+_EDGE_WORDS = re.compile(r'^(?:(?:в|во|на|к|ко|с|со|за|от|до|по|и)\s+)+|(?:\s+(?:в|во|на|к|ко|с|со|за|от|до|по|и))+$')
+
+
+class DateRange:
+    """Интервал дат [start, end) и текст идентификатора без даты"""
+    __slots__ = ('start', 'end', 'rest')
+
+    def __init__(self, start, end, rest):
+        self.start = start
+        self.end = end
+        self.rest = rest
+
+    def __repr__(self):
+        return f"DateRange({self.start:%Y-%m-%d %H:%M}, {self.end:%Y-%m-%d %H:%M}, {self.rest!r})"
+
+
+def current_time():
+    """Текущее время без часового пояса (как время в промпте и даты событий)"""
+    return timezone.localtime(timezone.now()).replace(tzinfo=None)
+
+
+def parse_event_date(value):
+    """
+    Дата события из userData (ISO, с часовым поясом или без) как naive datetime или None
+    Часовой пояс отбрасывается так же, как при выводе календаря в контекст пользователя
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _month(word):
+    for prefix, month in MONTHS.items():
+        if word.startswith(prefix):
+            return month
+    return None
+
+
+def _weekday(word):
+    for prefix, weekday in WEEKDAYS.items():
+        if word.startswith(prefix):
+            return weekday
+    return None
+
+
+def _year(value, today):
+    if not value:
+        return today.year
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _day_range(kind, match, today):
+    """(первый день, число дней) для найденного выражения"""
+    if kind == 'relative':
+        return today + timedelta(days=RELATIVE_DAYS[match.group(1)]), 1
+    if kind == 'in_days':
+        count = match.group(1)
+        count = int(count) if count and count.isdigit() else _NUMBER_WORDS.get(count, 1)
+        days = count * 7 if match.group(2).startswith('недел') else count
+        return today + timedelta(days=days), 1
+    if kind == 'week':
+        monday = today - timedelta(days=today.weekday())
+        if match.group(1).startswith('следующ'):
+            return monday + timedelta(days=7), 7
+        return today, 7 - today.weekday()
+    if kind == 'iso':
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3))), 1
+    if kind == 'numeric':
+        return date(_year(match.group(3), today), int(match.group(2)), int(match.group(1))), 1
+    if kind == 'day_month':
+        return date(_year(match.group(3), today), _month(match.group(2)), int(match.group(1))), 1
+    # День недели: ближайший, начиная с сегодняшнего; "следующий" - на следующей неделе
+    weekday = _weekday(match.group(2))
+    if match.group(1) and match.group(1).startswith('следующ'):
+        monday = today - timedelta(days=today.weekday())
+        return monday + timedelta(days=7 + weekday), 1
+    return today + timedelta(days=(weekday - today.weekday()) % 7), 1
+
+
+def _time(kind, match):
+    """(час, минута или None) для найденного времени или None"""
+    hour = int(match.group(1))
+    if kind == 'minute':
+        minute = int(match.group(2))
+        return (hour, minute) if hour < 24 and minute < 60 else None
+    part = match.group(2) or match.group(3)
+    if part in ('дня', 'вечера') and hour < 12:
+        hour += 12
+    elif part == 'ночи' and hour == 12:
+        hour = 0
+    return (hour, None) if hour < 24 else None
+
+
+def parse(text, now=None):
+    """
+    Находит дату (и время) в тексте идентификатора события
+
+    Args:
+        text: идентификатор из команды ("завтрашняя встреча", "совещание 15 декабря в 10:00")
+        now: текущее время (naive datetime), по умолчанию current_time()
+
+    Returns:
+        DateRange или None, если даты в тексте нет
+    """
+    lowered = str(text or '').casefold().replace('ё', 'е')
+    if not lowered.strip():
+        return None
+    today = (now or current_time()).date()
+
+    found = None
+    for kind, pattern in _DAY_PATTERNS:
+        match = pattern.search(lowered)
+        if match:
+            try:
+                day_range = _day_range(kind, match, today)
+            except (ValueError, TypeError):
+                continue
+            found = (kind, match, day_range)
+            break
+    if found is None:
+        return None
+    kind, match, (first_day, days) = found
+    spans = [match.span()]
+    start = datetime.combine(first_day, datetime.min.time())
+    end = start + timedelta(days=days)
+
+    # Время уточняет интервал только для одного дня
+    if kind == 'iso' and match.group(4) and int(match.group(4)) < 24 and int(match.group(5)) < 60:
+        start = start.replace(hour=int(match.group(4)), minute=int(match.group(5)))
+        end = start + timedelta(minutes=1)
+    elif days == 1:
+        remaining = lowered[:match.start()] + ' ' * (match.end() - match.start()) + lowered[match.end():]
+        for time_kind, pattern in _TIME_PATTERNS:
+            time_match = pattern.search(remaining)
+            time = _time(time_kind, time_match) if time_match else None
+            if time:
+                hour, minute = time
+                start = start.replace(hour=hour, minute=minute or 0)
+                end = start + (timedelta(hours=1) if minute is None else timedelta(minutes=1))
+                spans.append(time_match.span())
+                break
+
+    rest = lowered
+    for span_start, span_end in sorted(spans, reverse=True):
+        rest = rest[:span_start] + ' ' + rest[span_end:]
+    rest = _EDGE_WORDS.sub('', ' '.join(rest.split()))
+    return DateRange(start, end, rest)
@@ -0,0 +1,129 @@
+"""
+Кэш ответов LLM для одинаковых запросов (включается CHAT_RESPONSE_CACHE_ENABLED)
+Ключ - SHA-256 канонического JSON итогового payload (модель, сообщения и параметры генерации),
+поэтому повторный вопрос при неизменных данных пользователя обслуживается без вызова OpenRouter.
+Текущее время в системном промпте (строка "СЕЙЧАС: ...") меняется каждую минуту, поэтому
+в ключ входит только дата из нее: относительные даты в ответе ("завтра") остаются верными.
+Записи живут CHAT_RESPONSE_CACHE_TTL секунд, при превышении CHAT_RESPONSE_CACHE_MAX_ENTRIES
+вытесняются давно не использованные. Ответы, приведшие к действиям, не кэшируются
+"""
+import copy
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .prompts import CURRENT_DATETIME_MARKER
+
+logger = logging.getLogger(__name__)
+
+# Параметры payload, не влияющие на содержание ответа
+IGNORED_PAYLOAD_KEYS = ('stream',)
+
+# Время в строке текущей даты системного промпта (в ключе остается только дата)
+_CURRENT_TIME_PATTERN = re.compile(rf'({re.escape(CURRENT_DATETIME_MARKER)}\d{{4}}-\d{{2}}-\d{{2}}) \d{{2}}:\d{{2}}')
+
+
+class ResponseCache:
+    """LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups * 100) if lookups else 0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_RESPONSE_CACHE_ENABLED', False)
+
+
+def get_cache():
+    """Общий для процесса кэш ответов"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    max_entries=getattr(settings, 'CHAT_RESPONSE_CACHE_MAX_ENTRIES', 1000),
+                    ttl=getattr(settings, 'CHAT_RESPONSE_CACHE_TTL', 300),
+                )
+    return _cache
+
+
+def make_key(payload):
+    """Канонический хэш payload запроса к LLM (порядок ключей, пробелы и время в промпте не влияют)"""
+    canonical = {key: value for key, value in payload.items() if key not in IGNORED_PAYLOAD_KEYS}
+    serialized = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    serialized = _CURRENT_TIME_PATTERN.sub(r'\1', serialized)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def lookup(payload):
+    """
+    Ищет сохраненный ответ для payload
+
+    Returns:
+        tuple: (ключ или None, если кэш выключен; ответ в формате chat completion или None)
+    """
+    if not is_enabled():
+        return None, None
+    key = make_key(payload)
+    return key, get_cache().get(key)
+
+
+def store(key, result):
+    """Сохраняет ответ в формате chat completion"""
+    if key is None:
+        return
+    content = (result.get('choices') or [{}])[0].get('message', {}).get('content')
+    if not content:
+        return
+    get_cache().set(key, result)
@@ -0,0 +1,57 @@
+"""
+Поиск записей данных пользователя, относящихся к сообщению (BM25)
+Индекс строится по значимым полям записей (название товара и папка, ФИО и должность, ...),
+а не по отформатированным строкам контекста: подписи полей ("ТОВАР", "Цена") есть в каждой
+строке и не должны совпадать с сообщением. Слова сравниваются по основам (как в semantic_cache).
+
+Индекс строится один раз для версии раздела: разделы контекста кэшируются по хэшам данных
+(user_context), поэтому при новом сообщении перестраиваются только изменившиеся разделы
+"""
+import math
+from collections import Counter
+
+from .semantic_cache import STEM_LENGTH, STOP_WORDS, normalize_message
+
+# Параметры BM25: насыщение частоты слова и нормализация по длине записи
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Основы значимых слов текста"""
+    return [word[:STEM_LENGTH] for word in normalize_message(text).split() if word not in STOP_WORDS]
+
+
+class BM25Index:
+    """Инвертированный индекс записей с ранжированием BM25"""
+
+    def __init__(self, documents):
+        self._postings = {}  # основа -> [(номер записи, частота)]
+        self._lengths = []
+        for doc_index, document in enumerate(documents):
+            terms = Counter(tokenize(document))
+            self._lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, []).append((doc_index, frequency))
+        self.size = len(self._lengths)
+        self._average_length = (sum(self._lengths) / self.size) if self.size else 0
+
+    def _idf(self, term):
+        document_frequency = len(self._postings[term])
+        return math.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, query, limit=None):
+        """
+        Returns:
+            list: [(номер записи, оценка)] по убыванию оценки, только записи с совпадениями
+        """
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for doc_index, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[doc_index] / (self._average_length or 1)
+                scores[doc_index] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        return scores.most_common(limit)
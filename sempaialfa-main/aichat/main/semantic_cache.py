@@ -0,0 +1,289 @@
+"""
+Семантический кэш ответов LLM для перефразированных вопросов (включается CHAT_SEMANTIC_CACHE_ENABLED)
+Точный кэш (response_cache) не срабатывает на "покажи график расходов" и "график моих расходов".
+Здесь нормализованное сообщение пользователя превращается в вектор, и ответ берется из кэша,
+если похожесть с сохраненным вопросом не ниже CHAT_SEMANTIC_CACHE_THRESHOLD.
+
+Сравниваются только вопросы с одинаковым контекстом (модель, данные пользователя, история чата):
+ответ на тот же вопрос при других данных отличается.
+
+Векторы:
+- TF-IDF по основам слов и символьным n-граммам (по умолчанию, без зависимостей);
+- модель sentence-transformers на CPU, если задана CHAT_SEMANTIC_CACHE_MODEL и библиотека установлена.
+Поиск кандидатов для TF-IDF - по инвертированному индексу признаков (приближенный, без полного перебора)
+"""
+import copy
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+# Вес символьных n-грамм относительно слов: n-граммы ловят опечатки и окончания,
+# но не должны сближать разные слова с общим корнем ("доходов" / "расходов")
+NGRAM_WEIGHT = 0.25
+# Длина основы слова (грубый стемминг: "расходов" и "расходы" совпадают)
+STEM_LENGTH = 5
+# Сколько кандидатов с наибольшим числом общих признаков сравнивать точно
+MAX_CANDIDATES = 50
+
+# Слова, не меняющие смысл запроса к ассистенту
+STOP_WORDS = frozenset((
+    'а', 'и', 'ну', 'же', 'ли', 'бы', 'у', 'я', 'мне', 'меня', 'мой', 'моя', 'мое', 'мои', 'моих', 'моим',
+    'моего', 'моей', 'нас', 'наш', 'наши', 'наших', 'есть', 'пожалуйста', 'покажи', 'покажите', 'показать',
+    'выведи', 'выведите', 'скажи', 'скажите', 'подскажи', 'подскажите', 'дай', 'дайте',
+))
+
+_NON_WORD_PATTERN = re.compile(r'[^\w\s]+', re.UNICODE)
+_SPACES_PATTERN = re.compile(r'\s+')
+
+
+def normalize_message(text):
+    """Нормализация текста запроса: регистр, ё, пунктуация и пробелы не влияют на сравнение"""
+    text = (text or '').lower().replace('ё', 'е')
+    text = _NON_WORD_PATTERN.sub(' ', text)
+    return _SPACES_PATTERN.sub(' ', text).strip()
+
+
+def context_fingerprint(model, user_data, chat_history=None):
+    """Отпечаток контекста, при котором ответ на один и тот же вопрос одинаков"""
+    serialized = json.dumps(
+        {'model': model, 'user_data': user_data or {}, 'history': chat_history or []},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def text_features(normalized):
+    """Признаки TF-IDF: основы значимых слов и (с меньшим весом) символьные n-граммы"""
+    features = Counter()
+    words = [word for word in normalized.split() if word not in STOP_WORDS] or normalized.split()
+    for word in words:
+        features[f'w:{word[:STEM_LENGTH]}'] += 1
+        padded = f' {word} '
+        for i in range(max(len(padded) - NGRAM_SIZE + 1, 1)):
+            features[f'g:{padded[i:i + NGRAM_SIZE]}'] += NGRAM_WEIGHT
+    return features
+
+
+class _DenseEmbedder:
+    """Векторы sentence-transformers (нормализованные), считаются на CPU"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    def embed(self, normalized):
+        return [float(x) for x in self.model.encode(normalized, normalize_embeddings=True)]
+
+
+class _Entry:
+    __slots__ = ('entry_id', 'context', 'vector', 'result', 'expires_at')
+
+    def __init__(self, entry_id, context, vector, result, expires_at):
+        self.entry_id = entry_id
+        self.context = context
+        self.vector = vector
+        self.result = result
+        self.expires_at = expires_at
+
+
+class SemanticCache:
+    """Кэш ответов с поиском похожих вопросов, TTL и вытеснением LRU"""
+
+    def __init__(self, threshold, max_entries, ttl, embedder=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedder = embedder
+        self._entries = OrderedDict()           # entry_id -> _Entry (порядок LRU)
+        self._by_context = {}                   # context -> {entry_id}
+        self._postings = {}                     # (context, признак) -> {entry_id} (только TF-IDF)
+        self._document_frequency = Counter()    # признак -> число записей с ним
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _vectorize(self, normalized):
+        if self.embedder is not None:
+            return self.embedder.embed(normalized)
+        return text_features(normalized)
+
+    def _idf(self, feature):
+        return math.log((1 + len(self._entries)) / (1 + self._document_frequency[feature])) + 1
+
+    def _tfidf_similarity(self, query, document):
+        dot = sum(weight * document[feature] * self._idf(feature) ** 2
+                  for feature, weight in query.items() if feature in document)
+        if not dot:
+            return 0.0
+        query_norm = math.sqrt(sum((weight * self._idf(feature)) ** 2 for feature, weight in query.items()))
+        document_norm = math.sqrt(sum((weight * self._idf(feature)) ** 2 for feature, weight in document.items()))
+        return dot / (query_norm * document_norm)
+
+    def _candidates(self, context, vector):
+        """Кандидаты для точного сравнения"""
+        if self.embedder is not None:
+            # Плотные векторы: перебор записей того же контекста (их немного)
+            return list(self._by_context.get(context, ()))
+        shared = Counter()
+        for feature in vector:
+            for entry_id in self._postings.get((context, feature), ()):
+                shared[entry_id] += 1
+        return [entry_id for entry_id, _ in shared.most_common(MAX_CANDIDATES)]
+
+    def _similarity(self, query, document):
+        if self.embedder is not None:
+            return sum(a * b for a, b in zip(query, document))
+        return self._tfidf_similarity(query, document)
+
+    def get(self, message, context):
+        """
+        Returns:
+            tuple: (ответ или None, похожесть лучшего кандидата)
+        """
+        normalized = normalize_message(message)
+        if not normalized:
+            return None, 0.0
+        vector = self._vectorize(normalized)
+        now = time.monotonic()
+        with self._lock:
+            best_entry, best_score = None, 0.0
+            for entry_id in self._candidates(context, vector):
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                if entry.expires_at <= now:
+                    self._remove(entry_id)
+                    continue
+                score = self._similarity(vector, entry.vector)
+                if score > best_score:
+                    best_entry, best_score = entry, score
+            if best_entry is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_entry.entry_id)
+                self.hits += 1
+                return copy.deepcopy(best_entry.result), best_score
+            self.misses += 1
+            return None, best_score
+
+    def set(self, message, context, result):
+        normalized = normalize_message(message)
+        if not normalized:
+            return
+        vector = self._vectorize(normalized)
+        with self._lock:
+            self._next_id += 1
+            entry = _Entry(self._next_id, context, vector, copy.deepcopy(result), time.monotonic() + self.ttl)
+            self._entries[entry.entry_id] = entry
+            self._by_context.setdefault(context, set()).add(entry.entry_id)
+            if self.embedder is None:
+                for feature in vector:
+                    self._postings.setdefault((context, feature), set()).add(entry.entry_id)
+                    self._document_frequency[feature] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id):
+        """Удаляет запись из всех индексов (вызывается под блокировкой)"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        context_entries = self._by_context.get(entry.context)
+        if context_entries is not None:
+            context_entries.discard(entry_id)
+            if not context_entries:
+                del self._by_context[entry.context]
+        if self.embedder is None:
+            for feature in entry.vector:
+                key = (entry.context, feature)
+                postings = self._postings.get(key)
+                if postings is not None:
+                    postings.discard(entry_id)
+                    if not postings:
+                        del self._postings[key]
+                self._document_frequency[feature] -= 1
+                if self._document_frequency[feature] <= 0:
+                    del self._document_frequency[feature]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self._postings.clear()
+            self._document_frequency.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'embedder': 'tfidf' if self.embedder is None else 'sentence-transformers',
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups * 100) if lookups else 0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_SEMANTIC_CACHE_ENABLED', False)
+
+
+def _create_embedder():
+    model_name = getattr(settings, 'CHAT_SEMANTIC_CACHE_MODEL', '')
+    if not model_name:
+        return None
+    try:
+        return _DenseEmbedder(model_name)
+    except ImportError:
+        logger.warning("⚠️ sentence-transformers не установлен, семантический кэш использует TF-IDF")
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить модель {model_name}, семантический кэш использует TF-IDF: {str(e)}")
+    return None
+
+
+def get_cache():
+    """Общий для процесса семантический кэш"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache(
+                    threshold=getattr(settings, 'CHAT_SEMANTIC_CACHE_THRESHOLD', 0.85),
+                    max_entries=getattr(settings, 'CHAT_SEMANTIC_CACHE_MAX_ENTRIES', 1000),
+                    ttl=getattr(settings, 'CHAT_RESPONSE_CACHE_TTL', 300),
+                    embedder=_create_embedder(),
+                )
+    return _cache
+
+
+def lookup(message, context):
+    """Ответ на похожий вопрос в том же контексте или None"""
+    if not is_enabled():
+        return None
+    result, score = get_cache().get(message, context)
+    if result is not None:
+        logger.info(f"🧠 Семантический кэш: найден похожий вопрос (похожесть {score:.2f})")
+    return result
+
+
+def store(message, context, result):
+    if not is_enabled():
+        return
+    content = (result.get('choices') or [{}])[0].get('message', {}).get('content')
+    if content:
+        get_cache().set(message, context, result)
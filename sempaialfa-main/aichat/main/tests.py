@@ -2,7 +2,7 @@
 Полный набор тестов для приложения Alfa Finansi
 Покрывает модели, API endpoints, обработку файлов, модерацию контента и утилиты
 """
-from django.test import TestCase, Client
+from django.test import TestCase, Client, AsyncClient
 from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
@@ -11,10 +11,12 @@ import json
 import uuid
 import base64
 import time
+import threading
 from unittest.mock import patch, Mock, MagicMock
 from io import BytesIO
+from datetime import datetime
 
-from .models import ChatRequest, ChatHistory
+from .models import ChatRequest, ChatHistory, ChatRequestMetrics
 from .content_moderator import ContentModerator
 from .file_processor import (
     process_file, 
@@ -24,6 +26,14 @@ from .file_processor import (
     extract_text_from_text_file
 )
 from .views import format_user_context, find_event_smart
+from .chat_dispatcher import ChatDispatcher, QueueFullError
+from . import chat_queue
+from . import chat_stream
+from . import chat_events
+from . import blob_store
+from . import extraction_cache
+from .extraction_cache import ExtractionCache
+from .metrics_calculator import MetricsCalculator
 
 
 # ============================================================================
@@ -330,6 +340,32 @@ class ContentModeratorTest(TestCase):
         self.assertFalse(result['allowed'])
         result = ContentModerator.check_message(123)
         self.assertFalse(result['allowed'])
+    
+    def test_find_rules_returns_all_matches(self):
+        """Тест: одно выражение находит все сработавшие правила, слова фильтруются все"""
+        self.assertEqual(ContentModerator.find_rules('как учесть расходы'), [])
+        rules = ContentModerator.find_rules('как взломать сейф и где взять наркотики')
+        self.assertEqual([rule for rule, _ in rules], [r'как.*взломать', r'наркотик'])
+        try:
+            with patch.object(ContentModerator, 'FORBIDDEN_WORDS', ['Спам', 'реклама']):
+                ContentModerator.compile_rules()
+                result = ContentModerator.check_ai_response('Спам и РЕКЛАМА в ответе')
+                self.assertFalse(result['allowed'])
+                self.assertEqual(result['filtered_response'], '*** и *** в ответе')
+        finally:
+            ContentModerator.compile_rules()
+        self.assertTrue(ContentModerator.check_ai_response('Спам и реклама в ответе')['allowed'])
+    
+    def test_check_message_cached(self):
+        """Тест: повторная проверка того же сообщения берется из кэша"""
+        message = f"Сообщение для проверки кэша {uuid.uuid4()}"
+        with patch.object(ContentModerator, 'find_rules', wraps=ContentModerator.find_rules) as mock_find:
+            first = ContentModerator.check_message(message)
+            first['allowed'] = False
+            second = ContentModerator.check_message(message)
+        self.assertEqual(mock_find.call_count, 1)
+        self.assertTrue(second['allowed'])
+        self.assertEqual(second['filtered_message'], message)
 
 
 # ============================================================================
@@ -435,11 +471,15 @@ class FileProcessorTest(TestCase):
             def __init__(self, sheet):
                 self.sheetnames = ["Sheet1"]
                 self._sheet = sheet
+                self.closed = False
             
             def __getitem__(self, key):
                 if key == "Sheet1":
                     return self._sheet
                 return Mock()
+            
+            def close(self):
+                self.closed = True
         
         mock_workbook = MockWorkbook(mock_sheet)
         mock_load_workbook.return_value = mock_workbook
@@ -448,6 +488,7 @@ class FileProcessorTest(TestCase):
         result = extract_text_from_xlsx(file_data)
         self.assertIn("Sheet1", result)
         self.assertIn("A1", result)
+        self.assertTrue(mock_workbook.closed)
 
 
 # ============================================================================
@@ -506,6 +547,53 @@ class UtilityFunctionsTest(TestCase):
         self.assertIn("2 позиций", result)
         self.assertIn("Товар 1", result)
     
+    def test_format_user_context_budget(self):
+        """Тест: при ограничении бюджета агрегаты сохраняются, строки отбираются по релевантности сообщению"""
+        from main.user_context import build_user_context
+        user_data = {
+            'inventory': [{'name': f'Товар {i}', 'quantity': 1, 'price': 100} for i in range(500)]
+                         + [{'name': 'Кофемашина', 'quantity': 1, 'price': 1}],
+            'employees': [{'fio': f'Сотрудник {i}', 'salary': 1000} for i in range(200)],
+        }
+        full, full_report = build_user_context(user_data, 'все товары и сотрудники', max_tokens=0)
+        self.assertEqual(full_report['dropped'], {})
+        
+        result, report = build_user_context(user_data, 'сколько стоит кофемашина', max_tokens=1500)
+        self.assertLessEqual(report['estimated_tokens'], 1500)
+        self.assertLess(len(result), len(full))
+        self.assertIn("ИНВЕНТАРИЗАЦИЯ: 501 позиций", result)
+        self.assertIn("СОТРУДНИКИ: 200 человек", result)
+        self.assertIn("ТОВАР: 'Кофемашина'", result)
+        self.assertIn("не показаны", result)
+        self.assertGreater(report['dropped']['inventory'], 0)
+        self.assertEqual(report['dropped']['inventory'] + result.count("  - ТОВАР:"), 501)
+    
+    def test_format_user_context_retrieval(self):
+        """Тест: из большого раздела передаются найденные по сообщению записи, итоги - по всем"""
+        from main.user_context import build_user_context, MIN_ROWS_PER_SECTION
+        user_data = {
+            'employees': [{'fio': f'Иванов {i}', 'salary': 1000, 'position': 'Менеджер'} for i in range(300)]
+                         + [{'fio': 'Петрова Анна', 'salary': 2000, 'position': 'Бухгалтер'}],
+        }
+        result, report = build_user_context(user_data, 'Какой оклад у Петровой?', max_tokens=0)
+        self.assertIn("СОТРУДНИК: 'Петрова Анна'", result)
+        self.assertIn("СОТРУДНИКИ: 301 человек, фонд 302,000 ₽", result)
+        self.assertEqual(result.count("  - СОТРУДНИК:"), 301)  # Вопрос о сотрудниках - раздел целиком
+        
+        result, report = build_user_context(user_data, 'Где работает Петрова?', max_tokens=0)
+        self.assertIn("СОТРУДНИК: 'Петрова Анна'", result)
+        self.assertEqual(result.count("  - СОТРУДНИК:"), MIN_ROWS_PER_SECTION + 1)
+        self.assertEqual(report['dropped']['employees'], 301 - MIN_ROWS_PER_SECTION - 1)
+    
+    def test_bm25_ranks_rare_terms_higher(self):
+        """Тест: BM25 находит записи по основам слов, редкие слова весят больше"""
+        from main.retrieval import BM25Index
+        index = BM25Index(['Кофемашина Склад', 'Стол Склад', 'Стул Склад', 'Кофемашины Кухня'])
+        results = index.search('кофемашину со склада')
+        self.assertEqual({doc for doc, _ in results}, {0, 1, 2, 3})
+        self.assertEqual(results[0][0], 0)
+        self.assertEqual(index.search('принтер'), [])
+    
     def test_find_event_smart_by_id(self):
         """Тест поиска события по ID"""
         events = [
@@ -923,7 +1011,7 @@ class CheckLMStudioAPITest(TestCase):
         self.client = Client()
     
     @patch('main.views.requests.get')
-    @patch('main.views.requests.post')
+    @patch('main.views.http_client.post')
     def test_check_lm_studio_success(self, mock_post, mock_get):
         """Тест успешной проверки подключения (мок)"""
         # Настраиваем моки
@@ -1161,3 +1249,1468 @@ class PerformanceTest(TestCase):
         self.assertEqual(len(histories), 50)
         # Запрос должен быть быстрым (< 1 секунды)
         self.assertLess(end_time - start_time, 1.0)
+
+
+# ============================================================================
+# ТЕСТЫ ПУЛА ОБРАБОТКИ ЗАПРОСОВ
+# ============================================================================
+
+class ChatDispatcherTest(TestCase):
+    """Тесты для пула фоновой обработки запросов"""
+    
+    def test_submit_runs_task(self):
+        """Тест выполнения задачи в пуле"""
+        dispatcher = ChatDispatcher(max_workers=2, max_queue_size=5)
+        done = threading.Event()
+        processed = []
+        
+        def task(request_id):
+            processed.append(request_id)
+            done.set()
+        
+        self.assertTrue(dispatcher.submit(task, 'req-1'))
+        self.assertTrue(done.wait(5))
+        dispatcher.shutdown()
+        self.assertEqual(processed, ['req-1'])
+        self.assertEqual(dispatcher.stats()['completed'], 1)
+    
+    def test_queue_full(self):
+        """Тест отказа при переполнении очереди"""
+        dispatcher = ChatDispatcher(max_workers=1, max_queue_size=1)
+        release = threading.Event()
+        started = threading.Event()
+        
+        def blocking_task(request_id):
+            started.set()
+            release.wait(5)
+        
+        dispatcher.submit(blocking_task, 'req-1')
+        self.assertTrue(started.wait(5))
+        dispatcher.submit(blocking_task, 'req-2')  # Ждет в очереди
+        with self.assertRaises(QueueFullError):
+            dispatcher.submit(blocking_task, 'req-3')
+        
+        stats = dispatcher.stats()
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertEqual(stats['active_workers'], 1)
+        self.assertEqual(stats['utilization'], 100)
+        self.assertEqual(stats['rejected'], 1)
+        
+        release.set()
+        dispatcher.shutdown()
+    
+    def test_duplicate_submit_ignored(self):
+        """Тест: запрос, который уже в очереди, повторно не ставится"""
+        dispatcher = ChatDispatcher(max_workers=1, max_queue_size=5)
+        release = threading.Event()
+        dispatcher.submit(lambda request_id: release.wait(5), 'req-1')
+        self.assertFalse(dispatcher.submit(lambda request_id: None, 'req-1'))
+        self.assertTrue(dispatcher.is_in_flight('req-1'))
+        release.set()
+        dispatcher.shutdown()
+        self.assertFalse(dispatcher.is_in_flight('req-1'))
+    
+    @patch('main.views.get_dispatcher')
+    def test_chat_api_queue_full(self, mock_get_dispatcher):
+        """Тест ответа 503 при переполненной очереди"""
+        mock_get_dispatcher.return_value.submit.side_effect = QueueFullError('full')
+        mock_get_dispatcher.return_value.stats.return_value = {'queue_depth': 100}
+        response = Client().post(
+            '/api/chat/',
+            data=json.dumps({'message': 'Привет', 'history': [], 'userData': {}, 'files': []}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        result = json.loads(response.content)
+        self.assertEqual(result['error_code'], 'QUEUE_FULL')
+        self.assertEqual(ChatRequest.objects.get().status, ChatRequest.STATUS_FAILED)
+    
+    def test_chat_queue_status_endpoint(self):
+        """Тест endpoint мониторинга очереди"""
+        response = Client().get('/api/chat-queue/')
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertTrue(result['success'])
+        self.assertIn('queue_depth', result['queue'])
+        self.assertIn('utilization', result['queue'])
+
+
+class ChatQueueTest(TestCase):
+    """Тесты для очереди запросов в БД (режим воркеров)"""
+    
+    def _create_request(self, message='Тест'):
+        return ChatRequest.objects.create(message=message, status=ChatRequest.STATUS_PENDING)
+    
+    def test_claim_oldest_once(self):
+        """Тест: запрос забирается только одним воркером, начиная с самого старого"""
+        first = self._create_request('Первый')
+        second = self._create_request('Второй')
+        
+        self.assertEqual(chat_queue.claim_next('worker-a', 60), first.id)
+        self.assertEqual(chat_queue.claim_next('worker-b', 60), second.id)
+        self.assertIsNone(chat_queue.claim_next('worker-c', 60))
+        
+        first.refresh_from_db()
+        self.assertEqual(first.status, ChatRequest.STATUS_PROCESSING)
+        self.assertEqual(first.locked_by, 'worker-a')
+        self.assertEqual(first.attempts, 1)
+        self.assertIsNotNone(first.lease_expires_at)
+    
+    def test_heartbeat_only_for_owner(self):
+        """Тест: продлить аренду может только воркер-владелец"""
+        chat_request = self._create_request()
+        chat_queue.claim_next('worker-a', 60)
+        self.assertTrue(chat_queue.heartbeat(chat_request.id, 'worker-a', 60))
+        self.assertFalse(chat_queue.heartbeat(chat_request.id, 'worker-b', 60))
+    
+    def test_recover_expired_leases(self):
+        """Тест возврата в очередь запросов упавших воркеров"""
+        retry = self._create_request()
+        exhausted = self._create_request()
+        chat_queue.claim_next('worker-a', 60)
+        chat_queue.claim_next('worker-a', 60)
+        expired_at = timezone.now() - timezone.timedelta(seconds=1)
+        ChatRequest.objects.filter(id=retry.id).update(lease_expires_at=expired_at)
+        ChatRequest.objects.filter(id=exhausted.id).update(lease_expires_at=expired_at, attempts=3)
+        
+        self.assertEqual(chat_queue.recover_expired_leases(max_attempts=3), (1, 1))
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(retry.status, ChatRequest.STATUS_PENDING)
+        self.assertEqual(retry.locked_by, '')
+        self.assertEqual(exhausted.status, ChatRequest.STATUS_FAILED)
+    
+    def test_retryable_failure_requeued(self):
+        """Тест повтора запроса после временной ошибки и отказа от повтора после постоянной"""
+        self.assertTrue(chat_queue.is_retryable_error('Ошибка OpenRouter (502): Bad Gateway'))
+        self.assertTrue(chat_queue.is_retryable_error('Превышено время ожидания ответа от OpenRouter'))
+        self.assertFalse(chat_queue.is_retryable_error('Ошибка OpenRouter (401): Unauthorized'))
+        
+        chat_request = self._create_request()
+        chat_queue.claim_next('worker-a', 60)
+        
+        def failing_process(request_id):
+            ChatRequest.objects.filter(id=request_id).update(
+                status=ChatRequest.STATUS_FAILED,
+                error='Ошибка OpenRouter (503): Service Unavailable'
+            )
+        
+        chat_queue.process_claimed(chat_request.id, 'worker-a', failing_process, 60, max_attempts=2)
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.status, ChatRequest.STATUS_PENDING)
+        
+        chat_queue.claim_next('worker-a', 60)
+        chat_queue.process_claimed(chat_request.id, 'worker-a', failing_process, 60, max_attempts=2)
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.status, ChatRequest.STATUS_FAILED)
+        self.assertEqual(chat_request.attempts, 2)
+        self.assertEqual(chat_request.locked_by, '')
+    
+    @patch('main.views.get_dispatcher')
+    def test_worker_mode_leaves_request_pending(self, mock_get_dispatcher):
+        """Тест: в режиме воркеров chat_api не запускает обработку в веб-процессе"""
+        with self.settings(CHAT_PROCESSING_MODE='worker'):
+            response = Client().post(
+                '/api/chat/',
+                data=json.dumps({'message': 'Привет', 'history': [], 'userData': {}, 'files': []}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        mock_get_dispatcher.return_value.submit.assert_not_called()
+        self.assertEqual(ChatRequest.objects.get().status, ChatRequest.STATUS_PENDING)
+
+
+# ============================================================================
+# ТЕСТЫ ПОТОКОВОЙ ВЫДАЧИ ОТВЕТОВ
+# ============================================================================
+
+class ChatStreamTest(TestCase):
+    """Тесты для потоковой выдачи ответов AI (SSE)"""
+    
+    def test_read_completion_from_event_stream(self):
+        """Тест сборки ответа из потока OpenRouter и публикации фрагментов"""
+        request_id = str(uuid.uuid4())
+        response = Mock()
+        response.headers = {'Content-Type': 'text/event-stream'}
+        response.iter_lines.return_value = [
+            ': OPENROUTER PROCESSING',
+            'data: {"choices": [{"delta": {"content": "Добрый "}}]}',
+            '',
+            'data: {"choices": [{"delta": {"content": "день"}, "finish_reason": "stop"}]}',
+            'data: [DONE]',
+        ]
+        
+        result = chat_stream.read_completion(response, request_id)
+        
+        self.assertEqual(result['choices'][0]['message']['content'], 'Добрый день')
+        chunks, finished = chat_stream.broker.wait(request_id, 0, timeout=0)
+        self.assertEqual(chunks, ['Добрый ', 'день'])
+        self.assertFalse(finished)
+        chat_stream.broker.discard(request_id)
+    
+    def test_read_completion_decodes_utf8_without_charset(self):
+        """Тест: поток без charset в Content-Type декодируется как UTF-8, а не ISO-8859-1"""
+        import requests
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/event-stream'
+        response.raw = BytesIO(
+            'data: {"choices": [{"delta": {"content": "Привет, баланс 100 ₽"}}]}\n\ndata: [DONE]\n\n'.encode('utf-8')
+        )
+    
+        request_id = str(uuid.uuid4())
+        result = chat_stream.read_completion(response, request_id)
+    
+        self.assertEqual(result['choices'][0]['message']['content'], 'Привет, баланс 100 ₽')
+        chat_stream.broker.discard(request_id)
+    
+    def test_read_completion_stream_error(self):
+        """Тест ошибки, переданной OpenRouter внутри потока"""
+        response = Mock()
+        response.headers = {'Content-Type': 'text/event-stream'}
+        response.iter_lines.return_value = ['data: {"error": {"message": "Provider error"}}']
+        with self.assertRaises(ValueError):
+            chat_stream.read_completion(response, str(uuid.uuid4()))
+    
+    async def test_stream_endpoint_sends_deltas_and_done(self):
+        """Тест SSE endpoint: фрагменты и итоговый ответ"""
+        chat_request = await ChatRequest.objects.acreate(
+            message='Тест',
+            status=ChatRequest.STATUS_COMPLETED,
+            response='Итоговый ответ'
+        )
+        chat_stream.broker.publish(chat_request.id, 'Итоговый ')
+        chat_stream.broker.finish(chat_request.id)
+        
+        response = await AsyncClient().get(f'/api/chat-stream/{chat_request.id}/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        
+        self.assertIn('event: delta', body)
+        self.assertIn('event: done', body)
+        self.assertIn('Итоговый ответ', body)
+        chat_stream.broker.discard(chat_request.id)
+    
+    async def test_stream_endpoint_streams_delta_before_done_under_asgi(self):
+        """Тест: под ASGI фрагмент из потока обработки уходит клиенту до завершения ответа"""
+        import asyncio
+        chat_request = await ChatRequest.objects.acreate(message='Тест', status=ChatRequest.STATUS_PROCESSING)
+        
+        response = await AsyncClient().get(f'/api/chat-stream/{chat_request.id}/')
+        self.assertTrue(response.is_async)
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+        
+        # Фрагмент публикуется из другого потока, как в обработке запроса
+        threading.Timer(0.1, chat_stream.broker.publish, args=(chat_request.id, 'Первый ')).start()
+        delta = (await asyncio.wait_for(anext(events), 5)).decode('utf-8')
+        self.assertTrue(delta.startswith('event: delta'))
+        self.assertIn('Первый ', delta)
+        
+        await ChatRequest.objects.filter(id=chat_request.id).aupdate(
+            status=ChatRequest.STATUS_COMPLETED, response='Первый ответ'
+        )
+        chat_stream.broker.finish(chat_request.id)
+        rest = b''.join([chunk async for chunk in events]).decode('utf-8')
+        self.assertIn('event: done', rest)
+        self.assertIn('Первый ответ', rest)
+        chat_stream.broker.discard(chat_request.id)
+    
+    def test_stream_endpoint_not_found(self):
+        """Тест SSE endpoint для несуществующего запроса"""
+        response = Client().get(f'/api/chat-stream/{uuid.uuid4()}/')
+        self.assertEqual(response.status_code, 404)
+    
+    @patch('main.views.extraction_cache.cached_process_file', return_value=('', 'aGVsbG8='))
+    @patch('main.views.http_client.post')
+    def test_image_fallback_reads_stream(self, mock_post, mock_extract):
+        """Тест: повтор запроса без изображений идет потоком и без tools, ответ читается из SSE"""
+        from main.views import process_chat_request_async
+        rejected = Mock()
+        rejected.status_code = 400
+        rejected.text = 'Invalid image'
+        rejected.json.return_value = {'error': {'message': 'Invalid image'}}
+        streamed = Mock()
+        streamed.status_code = 200
+        streamed.headers = {'Content-Type': 'text/event-stream'}
+        streamed.iter_lines.return_value = [
+            'data: {"choices": [{"delta": {"content": "Ответ без картинки"}, "finish_reason": "stop"}]}',
+            'data: [DONE]',
+        ]
+        mock_post.side_effect = [rejected, streamed]
+        chat_request = ChatRequest.objects.create(
+            message='Что на картинке?', user_data={},
+            files_data=[{'name': 'photo.png', 'type': 'image/png', 'data': 'aGVsbG8='}]
+        )
+        with self.settings(OPENROUTER_API_KEY='sk-test-key'):
+            process_chat_request_async(chat_request.id)
+        
+        retry = mock_post.call_args_list[1]
+        self.assertTrue(retry.kwargs['stream'])
+        self.assertNotIn('tools', retry.kwargs['json'])
+        self.assertTrue(retry.kwargs['json']['stream'])
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.status, ChatRequest.STATUS_COMPLETED)
+        self.assertTrue(chat_request.response.startswith('Ответ без картинки'))
+        chat_stream.broker.discard(chat_request.id)
+
+
+class ChatStatusLongPollTest(TestCase):
+    """Тесты для long-poll проверки статуса запроса"""
+    
+    def test_save_wakes_waiter(self):
+        """Тест: сохранение запроса будит ожидающих"""
+        chat_request = ChatRequest.objects.create(message='Тест', status=ChatRequest.STATUS_PROCESSING)
+        since_version = chat_events.current_version(chat_request.id)
+        
+        def complete():
+            chat_events.notify(chat_request.id)
+        
+        timer = threading.Timer(0.1, complete)
+        timer.start()
+        started = time.monotonic()
+        self.assertTrue(chat_events.wait_for_change(chat_request.id, since_version, timeout=5))
+        self.assertLess(time.monotonic() - started, 4)
+        timer.join()
+    
+    def test_post_save_signal_notifies(self):
+        """Тест: сигнал post_save увеличивает версию запроса"""
+        chat_request = ChatRequest.objects.create(message='Тест', status=ChatRequest.STATUS_PROCESSING)
+        since_version = chat_events.current_version(chat_request.id)
+        chat_request.status = ChatRequest.STATUS_COMPLETED
+        chat_request.save()
+        self.assertTrue(chat_events.wait_for_change(chat_request.id, since_version, timeout=0.1))
+    
+    def test_long_poll_returns_immediately_on_changed_status(self):
+        """Тест: если статус уже отличается от известного клиенту, ответ не задерживается"""
+        chat_request = ChatRequest.objects.create(
+            message='Тест',
+            status=ChatRequest.STATUS_COMPLETED,
+            response='Готово'
+        )
+        started = time.monotonic()
+        response = Client().get(f'/api/chat-status/{chat_request.id}/?wait=10&status=processing')
+        self.assertLess(time.monotonic() - started, 5)
+        result = json.loads(response.content)
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(result['response'], 'Готово')
+    
+    def test_long_poll_timeout(self):
+        """Тест: без изменений ответ возвращается по истечении времени ожидания"""
+        chat_request = ChatRequest.objects.create(message='Тест', status=ChatRequest.STATUS_PROCESSING)
+        response = Client().get(f'/api/chat-status/{chat_request.id}/?wait=0.2&status=processing')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['status'], 'processing')
+    
+    def test_long_poll_not_found(self):
+        """Тест long-poll для несуществующего запроса"""
+        response = Client().get(f'/api/chat-status/{uuid.uuid4()}/?wait=1')
+        self.assertEqual(response.status_code, 404)
+
+
+class DeferredLoadingTest(TestCase):
+    """Тесты: проверка статуса и списки не загружают тяжелые JSON-поля"""
+    
+    def setUp(self):
+        self.chat_request = ChatRequest.objects.create(
+            message='Тест',
+            status=ChatRequest.STATUS_COMPLETED,
+            response='Ответ',
+            files_data=[{'name': 'big.pdf', 'type': 'application/pdf', 'data': 'A' * 10000}]
+        )
+    
+    def _selected_sql(self, func):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as context:
+            response = func()
+        selects = [q['sql'] for q in context.captured_queries if 'main_chatrequest' in q['sql'] and q['sql'].startswith('SELECT')]
+        return response, selects
+    
+    def test_chat_status_skips_files_data(self):
+        """Тест: /api/chat-status/ не читает files_data"""
+        response, selects = self._selected_sql(
+            lambda: Client().get(f'/api/chat-status/{self.chat_request.id}/')
+        )
+        self.assertEqual(json.loads(response.content)['response'], 'Ответ')
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertNotIn('files_data', sql)
+    
+    def test_admin_changelist_skips_heavy_fields(self):
+        """Тест: список запросов в админке не читает файлы и историю"""
+        from django.contrib.auth.models import User
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client = Client()
+        client.force_login(admin_user)
+        response, selects = self._selected_sql(
+            lambda: client.get('/admin/main/chatrequest/')
+        )
+        self.assertEqual(response.status_code, 200)
+        listing = [sql for sql in selects if '"main_chatrequest"."message"' in sql]
+        self.assertTrue(listing)
+        for sql in listing:
+            self.assertNotIn('files_data', sql)
+            self.assertNotIn('chat_history', sql)
+
+
+# ============================================================================
+# ТЕСТЫ ХРАНИЛИЩА ФАЙЛОВ
+# ============================================================================
+
+class BlobStoreTest(TestCase):
+    """Тесты для хранилища прикрепленных файлов"""
+    
+    def setUp(self):
+        import tempfile
+        self.blob_dir = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(CHAT_BLOB_ROOT=self.blob_dir.name)
+        self.settings_override.enable()
+        self.content = base64.b64encode('Содержимое файла'.encode('utf-8')).decode('ascii')
+    
+    def tearDown(self):
+        self.settings_override.disable()
+        self.blob_dir.cleanup()
+    
+    def test_externalize_deduplicates(self):
+        """Тест: одинаковые файлы сохраняются один раз, в запросе остается ссылка"""
+        files = blob_store.externalize_files([
+            {'name': 'a.txt', 'type': 'text/plain', 'data': f'data:text/plain;base64,{self.content}'},
+            {'name': 'b.txt', 'type': 'text/plain', 'data': self.content},
+        ])
+        self.assertNotIn('data', files[0])
+        self.assertEqual(files[0]['blob'], files[1]['blob'])
+        self.assertEqual(len(list(blob_store.iter_blob_keys())), 1)
+        self.assertEqual(blob_store.resolve_file_data(files[0]), self.content)
+    
+    def test_legacy_inline_data_resolved(self):
+        """Тест: старые записи с полем data продолжают обрабатываться"""
+        self.assertEqual(blob_store.resolve_file_data({'name': 'a.txt', 'data': self.content}), self.content)
+    
+    @patch('main.views.get_dispatcher')
+    def test_chat_api_stores_reference(self, mock_get_dispatcher):
+        """Тест: chat_api сохраняет в запросе ссылку вместо base64"""
+        response = Client().post(
+            '/api/chat/',
+            data=json.dumps({
+                'message': 'Проанализируй файл',
+                'files': [{'name': 'a.txt', 'type': 'text/plain', 'size': 10, 'data': self.content}]
+            }),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        files_data = ChatRequest.objects.get().files_data
+        self.assertNotIn('data', files_data[0])
+        self.assertTrue(blob_store.exists(files_data[0]['blob']))
+    
+    def test_garbage_collection(self):
+        """Тест: удаляются только неиспользуемые файлы старше периода ожидания"""
+        used = blob_store.put_bytes(b'used')
+        unused = blob_store.put_bytes(b'unused')
+        
+        removed, _ = blob_store.collect_garbage({used}, grace_seconds=3600)
+        self.assertEqual(removed, 0)  # Новые файлы не трогаем
+        
+        removed, freed = blob_store.collect_garbage({used}, grace_seconds=0)
+        self.assertEqual((removed, freed), (1, len(b'unused')))
+        self.assertTrue(blob_store.exists(used))
+        self.assertFalse(blob_store.exists(unused))
+    
+    @patch('main.views.get_dispatcher')
+    def test_chat_api_multipart_upload(self, mock_get_dispatcher):
+        """Тест: файлы из multipart сохраняются в хранилище без base64"""
+        response = Client().post('/api/chat/', data={
+            'message': 'Проанализируй файл',
+            'history': json.dumps([{'text': 'Привет', 'isUser': True}]),
+            'userData': json.dumps({'email': 'test@example.com'}),
+            'files': SimpleUploadedFile('report.txt', 'Отчет за месяц'.encode('utf-8'), content_type='text/plain'),
+        })
+        self.assertEqual(response.status_code, 200)
+        chat_request = ChatRequest.objects.get()
+        self.assertEqual(chat_request.chat_history[0]['text'], 'Привет')
+        self.assertEqual(chat_request.user_data['email'], 'test@example.com')
+        file_ref = chat_request.files_data[0]
+        self.assertEqual(file_ref['name'], 'report.txt')
+        self.assertNotIn('data', file_ref)
+        
+        text, image = process_file(file_ref['name'], file_ref['type'], file_path=blob_store.resolve_file_path(file_ref))
+        self.assertEqual(text, 'Отчет за месяц')
+        self.assertIsNone(image)
+
+
+class ExtractionCacheTest(TestCase):
+    """Тесты для кэша извлеченного из файлов текста"""
+    
+    def setUp(self):
+        extraction_cache.get_cache().clear()
+        self.file_data = base64.b64encode('Квартальный отчет'.encode('utf-8')).decode('ascii')
+    
+    def test_repeated_file_extracted_once(self):
+        """Тест: повторно прикрепленный файл не разбирается заново"""
+        with patch('main.extraction_cache.process_file', wraps=process_file) as mock_process:
+            first = extraction_cache.cached_process_file('a.txt', 'text/plain', self.file_data)
+            second = extraction_cache.cached_process_file('copy.txt', 'text/plain', f'data:text/plain;base64,{self.file_data}')
+        self.assertEqual(first, ('Квартальный отчет', None))
+        self.assertEqual(second, first)
+        self.assertEqual(mock_process.call_count, 1)
+    
+    def test_errors_not_cached(self):
+        """Тест: ошибки извлечения не кэшируются"""
+        with patch('main.extraction_cache.process_file', return_value=('[Ошибка при чтении PDF: test]', None)) as mock_process:
+            extraction_cache.cached_process_file('a.pdf', 'application/pdf', self.file_data)
+            extraction_cache.cached_process_file('a.pdf', 'application/pdf', self.file_data)
+        self.assertEqual(mock_process.call_count, 2)
+    
+    def test_key_depends_on_extractor_version(self):
+        """Тест: смена версии извлекателей меняет ключ"""
+        key = extraction_cache.make_key('abc', 'a.pdf', 'application/pdf')
+        with patch('main.extraction_cache.EXTRACTOR_VERSION', 999):
+            self.assertNotEqual(extraction_cache.make_key('abc', 'a.pdf', 'application/pdf'), key)
+    
+    def test_lru_eviction_by_size(self):
+        """Тест: при превышении размера вытесняются давно не использованные записи"""
+        cache = ExtractionCache(max_bytes=400)
+        cache.set('a', {'text': 'a' * 100, 'is_image': False})
+        cache.set('b', {'text': 'b' * 100, 'is_image': False})
+        cache.get('a')
+        cache.set('c', {'text': 'c' * 100, 'is_image': False})
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+    
+    def test_disk_tier_shared_between_instances(self):
+        """Тест: дисковый уровень переживает перезапуск процесса"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as cache_dir:
+            ExtractionCache(max_bytes=1000, disk_dir=cache_dir).set('key', {'text': 'текст', 'is_image': False})
+            restarted = ExtractionCache(max_bytes=1000, disk_dir=cache_dir)
+            self.assertEqual(restarted.get('key')['text'], 'текст')
+            self.assertEqual(restarted.stats()['disk_hits'], 1)
+
+
+class ExtractionPoolTest(TestCase):
+    """Тесты пула процессов извлечения текста"""
+    
+    def test_process_file_in_separate_process(self):
+        """Тест: текстовый файл обрабатывается в процессе пула"""
+        import base64
+        from main.extraction_pool import ExtractionPool
+        pool = ExtractionPool(max_workers=1, timeout=60, memory_limit_mb=0)
+        try:
+            file_data = base64.b64encode('Привет из файла'.encode('utf-8')).decode('ascii')
+            text, image_base64 = pool.process_file('a.txt', 'text/plain', file_data)
+        finally:
+            pool.shutdown()
+        self.assertEqual(text, 'Привет из файла')
+        self.assertIsNone(image_base64)
+    
+    def test_timeout_stops_only_hung_task(self):
+        """Тест: по таймауту останавливается только процесс зависшей задачи, остальные завершаются"""
+        from main.extraction_pool import ExtractionPool
+        pool = ExtractionPool(max_workers=2, timeout=1, memory_limit_mb=0)
+        try:
+            pool.run(time.sleep, 0)  # запуск процессов пула
+            results = {}
+            
+            def run(name, seconds):
+                try:
+                    results[name] = pool.run(time.sleep, seconds)
+                except TimeoutError as e:
+                    results[name] = e
+            
+            threads = [threading.Thread(target=run, args=('hung', 30)), threading.Thread(target=run, args=('ok', 0.5))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            self.assertIsInstance(results['hung'], TimeoutError)
+            self.assertIsNone(results['ok'])
+            # Пул продолжает работать с новым процессом вместо остановленного
+            self.assertIsNone(pool.run(time.sleep, 0))
+            with patch.object(pool, 'run', side_effect=TimeoutError()):
+                text, image_base64 = pool.process_file('a.pdf', 'application/pdf', 'data')
+            self.assertTrue(text.startswith('[Ошибка: превышено время'))
+            self.assertIsNone(image_base64)
+        finally:
+            pool.shutdown()
+    
+    def test_queue_wait_not_counted_in_timeout(self):
+        """Тест: время ожидания свободного процесса не входит в таймаут задачи"""
+        from main.extraction_pool import ExtractionPool
+        pool = ExtractionPool(max_workers=1, timeout=1, memory_limit_mb=0)
+        try:
+            pool.run(time.sleep, 0)
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(pool.run(time.sleep, 0.7))) for _ in range(2)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            self.assertEqual(results, [None, None])
+        finally:
+            pool.shutdown()
+    
+    def test_lost_task_start_wait_is_bounded(self):
+        """Тест: если процесс пула не сообщил о начале задачи, ожидание ограничено, а поздний старт останавливается"""
+        import queue
+        from main.extraction_pool import ExtractionPool
+        pool = ExtractionPool(max_workers=1, timeout=0.2, memory_limit_mb=0)
+        lost_pool = Mock()
+        lost_pool.apply_async.return_value.ready.return_value = False
+        with patch.object(pool, '_get_pool', return_value=lost_pool):
+            started = time.monotonic()
+            with self.assertRaises(TimeoutError):
+                pool.run(time.sleep, 0)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(pool._tasks, {})
+    
+        started_queue = queue.SimpleQueue()
+        started_queue.put((0, 12345))
+        started_queue.put(None)
+        with patch.object(pool, '_kill') as mock_kill:
+            pool._listen(started_queue)
+        mock_kill.assert_called_once_with(12345)
+        self.assertEqual(pool._abandoned, set())
+    
+    def test_parallel_preserves_order_and_errors(self):
+        """Тест: параллельная обработка сохраняет порядок и возвращает исключения"""
+        from main.extraction_pool import process_files_parallel
+        
+        def work(item):
+            if item == 2:
+                raise ValueError('плохой файл')
+            time.sleep(0.05 * (3 - item))
+            return item * 10
+        
+        results = process_files_parallel(work, [0, 1, 2, 3])
+        self.assertEqual(results[0], 0)
+        self.assertEqual(results[1], 10)
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(results[3], 30)
+    
+    def test_pool_disabled_by_settings(self):
+        """Тест: CHAT_EXTRACTION_WORKERS=0 - извлечение в текущем потоке"""
+        from main import extraction_pool
+        from main.file_processor import process_file
+        with self.settings(CHAT_EXTRACTION_WORKERS=0):
+            self.assertIs(extraction_pool.get_extractor(), process_file)
+
+
+class LimitedExtractionTest(TestCase):
+    """Тесты извлечения текста с бюджетом символов"""
+    
+    def _to_base64(self, writer):
+        buffer = BytesIO()
+        writer(buffer)
+        return base64.b64encode(buffer.getvalue()).decode('ascii')
+    
+    def test_pdf_stops_after_budget(self):
+        """Тест: страницы PDF после исчерпания бюджета не разбираются"""
+        pages = [Mock() for _ in range(500)]
+        for page in pages:
+            page.extract_text.return_value = 'x' * 400
+        reader = Mock()
+        reader.pages = pages
+        with patch('PyPDF2.PdfReader', return_value=reader):
+            result = extract_text_from_pdf(base64.b64encode(b'pdf').decode('ascii'), max_chars=1000)
+        self.assertGreater(len(result), 1000)
+        self.assertEqual(sum(page.extract_text.call_count for page in pages), 3)
+    
+    def test_docx_streaming_matches_document_order(self):
+        """Тест: потоковое чтение DOCX - абзацы и строки таблиц в порядке документа"""
+        from docx import Document
+        document = Document()
+        document.add_paragraph('Первый абзац')
+        table = document.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = 'Ячейка 1'
+        table.cell(0, 1).text = 'Ячейка 2'
+        document.add_paragraph('Последний абзац')
+        result = extract_text_from_docx(self._to_base64(document.save))
+        self.assertEqual(result, 'Первый абзац\nЯчейка 1 | Ячейка 2\nПоследний абзац')
+    
+    def test_docx_stops_after_budget(self):
+        """Тест: из длинного DOCX читаются только первые абзацы"""
+        from docx import Document
+        document = Document()
+        for i in range(2000):
+            document.add_paragraph(f'Абзац {i} ' + 'текст ' * 10)
+        result = extract_text_from_docx(self._to_base64(document.save), max_chars=500)
+        self.assertIn('Абзац 0 ', result)
+        self.assertNotIn('Абзац 100 ', result)
+        self.assertLess(len(result), 1000)
+    
+    def test_xlsx_stops_after_budget(self):
+        """Тест: из большой таблицы читаются только первые строки"""
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        for i in range(5000):
+            sheet.append([f'строка {i}', i])
+        result = extract_text_from_xlsx(self._to_base64(workbook.save), max_chars=300)
+        self.assertIn('строка 0 | 0', result)
+        self.assertNotIn('строка 100 ', result)
+    
+    def test_budget_is_part_of_cache_key(self):
+        """Тест: результаты с разным бюджетом кэшируются отдельно"""
+        self.assertNotEqual(
+            extraction_cache.make_key('abc', 'a.pdf', 'application/pdf', 1500),
+            extraction_cache.make_key('abc', 'a.pdf', 'application/pdf')
+        )
+
+
+class HttpClientTest(TestCase):
+    """Тесты общего HTTP-клиента"""
+    
+    def setUp(self):
+        from main import http_client
+        self.http_client = http_client
+        http_client.close_all()
+    
+    def tearDown(self):
+        self.http_client.close_all()
+    
+    def test_session_reused_between_calls(self):
+        """Тест: вызовы к одному сервису используют одну сессию"""
+        self.assertIs(self.http_client.get_session('openrouter'), self.http_client.get_session('openrouter'))
+        self.assertIsNot(self.http_client.get_session('openrouter'), self.http_client.get_session('other'))
+    
+    def test_pool_size_from_settings(self):
+        """Тест: размер пула берется из HTTP_UPSTREAMS"""
+        with self.settings(HTTP_UPSTREAMS={'openrouter': {'pool_size': 3}}):
+            adapter = self.http_client.get_session('openrouter').get_adapter('https://openrouter.ai/')
+        self.assertEqual(adapter._pool_maxsize, 3)
+    
+    def test_post_uses_configured_timeouts(self):
+        """Тест: таймауты вызова - из настроек сервиса, read_timeout переопределяет чтение"""
+        with self.settings(HTTP_UPSTREAMS={'openrouter': {'connect_timeout': 2, 'read_timeout': 30}}):
+            session = self.http_client.get_session('openrouter')
+            with patch.object(session, 'post') as mock_post:
+                self.http_client.post('openrouter', 'https://example.com', json={})
+                self.http_client.post('openrouter', 'https://example.com', read_timeout=7)
+        self.assertEqual(mock_post.call_args_list[0].kwargs['timeout'], (2, 30))
+        self.assertEqual(mock_post.call_args_list[1].kwargs['timeout'], (2, 7))
+
+
+class AsyncViewsTest(TestCase):
+    """Тесты async-представлений и асинхронного ожидания статуса"""
+    
+    def test_views_are_coroutines(self):
+        """Тест: chat_api и chat_status - async-представления без CSRF"""
+        import asyncio
+        from main import views
+        for view in (views.chat_api, views.chat_status, views.chat_stream_view, views.check_lm_studio_connection):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+            self.assertTrue(view.csrf_exempt)
+    
+    def test_wrong_method_not_allowed(self):
+        """Тест: метод, не разрешенный для async-представления, - 405"""
+        response = Client().post(f'/api/chat-status/{uuid.uuid4()}/')
+        self.assertEqual(response.status_code, 405)
+    
+    def test_async_wait_woken_by_notify_from_thread(self):
+        """Тест: notify() из потока обработки будит асинхронное ожидание"""
+        import asyncio
+        request_id = str(uuid.uuid4())
+        since_version = chat_events.current_version(request_id)
+        
+        async def wait():
+            timer = threading.Timer(0.1, chat_events.notify, args=(request_id,))
+            timer.start()
+            started = time.monotonic()
+            changed = await chat_events.async_wait_for_change(request_id, since_version, timeout=5)
+            return changed, time.monotonic() - started
+        
+        changed, elapsed = asyncio.run(wait())
+        self.assertTrue(changed)
+        self.assertLess(elapsed, 4)
+        self.assertNotIn(request_id, chat_events._async_waiters)
+    
+    def test_async_wait_timeout(self):
+        """Тест: без изменений асинхронное ожидание завершается по таймауту"""
+        import asyncio
+        request_id = str(uuid.uuid4())
+        since_version = chat_events.current_version(request_id)
+        self.assertFalse(asyncio.run(chat_events.async_wait_for_change(request_id, since_version, timeout=0.2)))
+    
+    @patch('main.views.get_dispatcher')
+    def test_chat_api_async_creates_request(self, mock_get_dispatcher):
+        """Тест: async chat_api сохраняет запрос и ставит его в очередь"""
+        response = Client().post(
+            '/api/chat/',
+            data=json.dumps({'message': 'Привет', 'history': [], 'userData': {}}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertTrue(ChatRequest.objects.filter(id=result['request_id']).exists())
+        mock_get_dispatcher.return_value.submit.assert_called_once()
+    
+    def test_async_post_without_httpx_uses_session(self):
+        """Тест: без httpx async_post выполняет синхронный запрос в потоке"""
+        import asyncio
+        from main import http_client
+        with patch.object(http_client, 'httpx', None), patch.object(http_client, 'post') as mock_post:
+            asyncio.run(http_client.async_post('openrouter', 'https://example.com', json={}))
+        mock_post.assert_called_once_with('openrouter', 'https://example.com', read_timeout=None, json={})
+    
+    def test_async_clients_only_under_asgi(self):
+        """Тест: без ASGI-сервера async_post идет через сессию, под ASGI клиент httpx общий для цикла и закрывается"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from main import http_client
+        fake_httpx = MagicMock()
+        fake_httpx.AsyncClient.return_value.post = AsyncMock(return_value='ответ')
+        fake_httpx.AsyncClient.return_value.aclose = AsyncMock()
+        with patch.object(http_client, 'httpx', fake_httpx), patch.object(http_client, 'post') as mock_post:
+            asyncio.run(http_client.async_post('openrouter', 'https://example.com', json={}))
+            mock_post.assert_called_once()
+            fake_httpx.AsyncClient.assert_not_called()
+            
+            async def calls():
+                await http_client.async_post('openrouter', 'https://example.com', json={})
+                await http_client.async_post('openrouter', 'https://example.com', json={})
+                await http_client.close_async_clients()
+                return asyncio.get_running_loop()
+            
+            http_client.enable_async_clients()
+            try:
+                loop = asyncio.run(calls())
+            finally:
+                http_client.enable_async_clients(False)
+        self.assertEqual(fake_httpx.AsyncClient.call_count, 1)
+        self.assertEqual(fake_httpx.AsyncClient.return_value.post.await_count, 2)
+        fake_httpx.AsyncClient.return_value.aclose.assert_awaited_once()
+        self.assertNotIn(loop, http_client._async_clients)
+
+
+class ResponseCacheTest(TestCase):
+    """Тесты кэша ответов LLM"""
+    
+    def setUp(self):
+        from main import response_cache
+        self.response_cache = response_cache
+        response_cache.get_cache().clear()
+    
+    def _completion(self, content):
+        return {'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+    
+    def test_key_is_canonical(self):
+        """Тест: порядок ключей и режим stream не влияют на ключ, модель и сообщения - влияют"""
+        payload = {'model': 'm', 'messages': [{'role': 'user', 'content': 'Баланс'}], 'temperature': 0.5}
+        same = {'temperature': 0.5, 'stream': True, 'messages': [{'content': 'Баланс', 'role': 'user'}], 'model': 'm'}
+        self.assertEqual(self.response_cache.make_key(payload), self.response_cache.make_key(same))
+        self.assertNotEqual(self.response_cache.make_key(payload), self.response_cache.make_key({**payload, 'model': 'other'}))
+    
+    def test_key_ignores_time_of_day_in_prompt(self):
+        """Тест: время в системном промпте не меняет ключ в течение дня, дата - меняет"""
+        from main.prompts import build_system_message
+        
+        def key(now):
+            return self.response_cache.make_key({'model': 'm', 'messages': [
+                build_system_message('Баланс: 100', now), {'role': 'user', 'content': 'Какой баланс?'}
+            ]})
+        
+        morning = key(datetime(2025, 1, 15, 9, 30))
+        self.assertEqual(key(datetime(2025, 1, 15, 9, 31)), morning)
+        self.assertEqual(key(datetime(2025, 1, 15, 18, 5)), morning)
+        self.assertNotEqual(key(datetime(2025, 1, 16, 9, 30)), morning)
+    
+    def test_ttl_and_lru(self):
+        """Тест: записи истекают по TTL и вытесняются по LRU"""
+        from main.response_cache import ResponseCache
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        
+        expiring = ResponseCache(max_entries=2, ttl=0)
+        expiring.set('a', 1)
+        self.assertIsNone(expiring.get('a'))
+    
+    def test_disabled_by_default(self):
+        """Тест: без CHAT_RESPONSE_CACHE_ENABLED кэш не используется"""
+        with self.settings(CHAT_RESPONSE_CACHE_ENABLED=False):
+            self.assertEqual(self.response_cache.lookup({'model': 'm', 'messages': []}), (None, None))
+    
+    @patch('main.views.http_client.post')
+    def test_identical_request_served_from_cache(self, mock_post):
+        """Тест: повторный одинаковый запрос не вызывает OpenRouter"""
+        from datetime import datetime, timezone as dt_timezone
+        from main.views import process_chat_request_async
+        
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.headers = {'Content-Type': 'application/json'}
+        mock_post.return_value.json.return_value = self._completion('Баланс: 1000 ₽')
+        
+        fixed_now = datetime(2025, 1, 15, 12, 0, tzinfo=dt_timezone.utc)
+        with self.settings(CHAT_RESPONSE_CACHE_ENABLED=True, OPENROUTER_API_KEY='sk-test-key'), \
+                patch('main.views.timezone.now', return_value=fixed_now):
+            requests_ = [
+                ChatRequest.objects.create(message='покажи баланс', user_data={'balance': 1000})
+                for _ in range(2)
+            ]
+            for chat_request in requests_:
+                process_chat_request_async(chat_request.id)
+        
+        self.assertEqual(mock_post.call_count, 1)
+        for chat_request in requests_:
+            chat_request.refresh_from_db()
+            self.assertEqual(chat_request.status, ChatRequest.STATUS_COMPLETED)
+            self.assertIn('Баланс: 1000', chat_request.response)
+    
+    def test_store_skips_empty_response(self):
+        """Тест: пустой ответ модели не кэшируется"""
+        with self.settings(CHAT_RESPONSE_CACHE_ENABLED=True):
+            key, _ = self.response_cache.lookup({'model': 'm', 'messages': []})
+            self.response_cache.store(key, {'choices': [{'message': {'role': 'assistant'}}]})
+            self.assertIsNone(self.response_cache.lookup({'model': 'm', 'messages': []})[1])
+
+
+class SemanticCacheTest(TestCase):
+    """Тесты семантического кэша ответов"""
+    
+    def setUp(self):
+        from main.semantic_cache import SemanticCache
+        self.cache = SemanticCache(threshold=0.85, max_entries=10, ttl=60)
+        self.context = 'контекст'
+        self.cache.set('покажи график расходов', self.context, {'answer': 'график'})
+        self.cache.set('сколько сотрудников', self.context, {'answer': 'сотрудники'})
+    
+    def test_rephrased_question_hits(self):
+        """Тест: перефразированный вопрос находит сохраненный ответ"""
+        result, score = self.cache.get('График моих расходов!', self.context)
+        self.assertEqual(result, {'answer': 'график'})
+        self.assertGreaterEqual(score, 0.85)
+        self.assertEqual(self.cache.get('сколько у меня сотрудников', self.context)[0], {'answer': 'сотрудники'})
+    
+    def test_different_question_misses(self):
+        """Тест: вопрос с другим смыслом не берется из кэша"""
+        self.assertIsNone(self.cache.get('покажи график доходов', self.context)[0])
+        self.assertIsNone(self.cache.get('какие налоги я должен', self.context)[0])
+        self.assertEqual(self.cache.stats()['misses'], 2)
+    
+    def test_other_context_misses(self):
+        """Тест: тот же вопрос при других данных пользователя не берется из кэша"""
+        from main.semantic_cache import context_fingerprint
+        self.assertNotEqual(context_fingerprint('m', {'balance': 1}), context_fingerprint('m', {'balance': 2}))
+        self.assertIsNone(self.cache.get('покажи график расходов', 'другой контекст')[0])
+    
+    def test_lru_eviction_cleans_index(self):
+        """Тест: вытесненные записи удаляются из инвертированного индекса"""
+        from main.semantic_cache import SemanticCache
+        cache = SemanticCache(threshold=0.85, max_entries=1, ttl=60)
+        cache.set('покажи баланс', 'c', {'answer': 1})
+        cache.set('список задач', 'c', {'answer': 2})
+        self.assertIsNone(cache.get('покажи баланс', 'c')[0])
+        self.assertFalse(any(key[1] == 'w:балан' for key in cache._postings))
+    
+    def test_cache_status_saved_to_metrics(self):
+        """Тест: результат поиска в кэше попадает в метрики и в response_cache_hit_rate"""
+        statuses = ['semantic', 'exact', 'miss', 'miss']
+        for status in statuses:
+            chat_request = ChatRequest.objects.create(message='покажи баланс', status=ChatRequest.STATUS_COMPLETED)
+            MetricsCalculator.create_request_metrics(chat_request, response_text='ok', cache_status=status)
+        from django.db.models import Q
+        metrics = MetricsCalculator._calculate_content_analysis_metrics(Q(), None, None)
+        hit_rate = next(metric for metric in metrics if metric['name'] == 'response_cache_hit_rate')
+        self.assertEqual(hit_rate['value'], 50.0)
+        self.assertEqual(hit_rate['metadata']['semantic_hits'], 1)
+
+
+class SystemPromptTest(TestCase):
+    """Тесты сборки системного промпта"""
+    
+    def test_prefix_is_stable_between_requests(self):
+        """Тест: инструкции и данные пользователя идут до даты, префикс не меняется между запросами"""
+        from datetime import datetime
+        from main.prompts import SYSTEM_PROMPT_PREFIX, build_system_prompt
+        first = build_system_prompt('Баланс: 100', datetime(2025, 1, 1, 9, 0))
+        second = build_system_prompt('Баланс: 100', datetime(2025, 1, 2, 18, 30))
+        self.assertTrue(first.startswith(SYSTEM_PROMPT_PREFIX + 'Баланс: 100'))
+        self.assertTrue(second.startswith(SYSTEM_PROMPT_PREFIX + 'Баланс: 100'))
+        self.assertTrue(first.endswith('СЕЙЧАС: 2025-01-01 09:00 (01 January 2025 года)'))
+    
+    def test_no_unfilled_placeholders(self):
+        """Тест: в промпте не остается неподставленных полей шаблона"""
+        from datetime import datetime
+        from main.prompts import build_system_prompt
+        prompt = build_system_prompt('', datetime(2025, 1, 1))
+        self.assertNotIn('{current', prompt)
+        self.assertNotIn('{user_context}', prompt)
+        self.assertIn('{"action":"UPDATE_EVENT"', prompt)
+    
+    def test_system_message_marks_static_part_for_caching(self):
+        """Тест: инструкции помечены cache_control, данные пользователя и дата - отдельной частью"""
+        from datetime import datetime
+        from main.prompts import SYSTEM_PROMPT_INSTRUCTIONS, build_system_message, build_system_prompt
+        now = datetime(2025, 1, 1, 9, 0)
+        message = build_system_message('Баланс: 100', now)
+        static_part, request_part = message['content']
+        self.assertEqual(static_part['text'], SYSTEM_PROMPT_INSTRUCTIONS)
+        self.assertEqual(static_part['cache_control'], {'type': 'ephemeral'})
+        self.assertNotIn('cache_control', request_part)
+        self.assertEqual(static_part['text'] + request_part['text'], build_system_prompt('Баланс: 100', now))
+        self.assertEqual(build_system_message('Баланс: 100', now, cache_control=False)['content'],
+                         build_system_prompt('Баланс: 100', now))
+    
+    def test_cached_tokens_saved_to_metrics(self):
+        """Тест: токены из блока usage сохраняются в метрики запроса и в prompt_cache_hit_rate"""
+        from django.db.models import Q
+        for cached in (3000, 0):
+            chat_request = ChatRequest.objects.create(message='баланс', status=ChatRequest.STATUS_COMPLETED)
+            MetricsCalculator.create_request_metrics(
+                chat_request, processing_time=1.0, response_text='ok',
+                usage={'prompt_tokens': 4000, 'completion_tokens': 50,
+                       'prompt_tokens_details': {'cached_tokens': cached}}
+            )
+        metrics = ChatRequestMetrics.objects.get(chat_request=chat_request)
+        self.assertEqual((metrics.prompt_tokens, metrics.completion_tokens, metrics.cached_tokens), (4000, 50, 0))
+        performance = MetricsCalculator._calculate_performance_metrics(Q(), timezone.now(), timezone.now())
+        hit_rate = next(metric for metric in performance if metric['name'] == 'prompt_cache_hit_rate')
+        self.assertEqual(hit_rate['value'], 37.5)
+
+
+class UserDataSyncTest(TestCase):
+    """Тесты передачи неизменившихся разделов userData хэшами"""
+    
+    def setUp(self):
+        from main import user_data_store
+        user_data_store.get_store().clear()
+    
+    def _post(self, user_data, hashes=None):
+        return Client().post(
+            '/api/chat/',
+            data=json.dumps({'message': 'Привет', 'history': [], 'userData': user_data,
+                             'userDataHashes': hashes or {}}),
+            content_type='application/json'
+        )
+    
+    @patch('main.views.get_dispatcher')
+    def test_unchanged_sections_sent_as_hashes(self, mock_get_dispatcher):
+        """Тест: разделы из предыдущего запроса восстанавливаются по хэшу"""
+        inventory = [{'name': 'Товар 1', 'quantity': 1, 'price': 100}]
+        first = json.loads(self._post({'inventory': inventory, 'accountBalance': 100}).content)
+        hashes = first['user_data_hashes']
+        self.assertEqual(set(hashes), {'inventory', 'accountBalance'})
+        
+        response = self._post({'accountBalance': 200}, {'inventory': hashes['inventory']})
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        chat_request = ChatRequest.objects.get(id=result['request_id'])
+        self.assertEqual(chat_request.user_data, {'inventory': inventory, 'accountBalance': 200})
+        self.assertEqual(chat_request.user_data_hashes['inventory'], hashes['inventory'])
+        self.assertNotEqual(result['user_data_hashes']['accountBalance'], hashes['accountBalance'])
+    
+    @patch('main.views.get_dispatcher')
+    def test_unknown_hash_requires_resync(self, mock_get_dispatcher):
+        """Тест: неизвестный хэш раздела - 409, запрос не создается"""
+        response = self._post({}, {'inventory': '0' * 64, 'receipts': 'не хэш'})
+        self.assertEqual(response.status_code, 409)
+        result = json.loads(response.content)
+        self.assertEqual(result['error_code'], 'USER_DATA_RESYNC')
+        self.assertEqual(result['missing_sections'], ['inventory', 'receipts'])
+        self.assertFalse(ChatRequest.objects.exists())
+        mock_get_dispatcher.return_value.submit.assert_not_called()
+    
+    def test_context_sections_reused_by_hash(self):
+        """Тест: раздел контекста с теми же хэшами данных не пересобирается"""
+        from main import user_context, user_data_store
+        user_data = {'employees': [{'fio': 'Иванов', 'salary': 1000}], 'taxesData': {'vat': {'debt': 10}}}
+        user_data, hashes = user_data_store.resolve(user_data)
+        with patch.object(user_context, 'SECTION_BUILDERS', tuple(
+            (Mock(wraps=builder, __name__=builder.__name__), keys) for builder, keys in user_context.SECTION_BUILDERS
+        )):
+            builders = {keys: builder for builder, keys in user_context.SECTION_BUILDERS}
+            first = user_context.build_user_context(user_data, section_hashes=hashes)[0]
+            second = user_context.build_user_context(user_data, 'зарплата', section_hashes=hashes)[0]
+            self.assertEqual(builders[('employees',)].call_count, 1)
+            
+            changed, changed_hashes = user_data_store.resolve({'taxesData': {'vat': {'debt': 20}}},
+                                                              {'employees': hashes['employees']})
+            third = user_context.build_user_context(changed, section_hashes=changed_hashes)[0]
+            self.assertEqual(builders[('employees',)].call_count, 1)
+            self.assertEqual(builders[('taxesData',)].call_count, 2)
+        self.assertEqual(first, second)
+        self.assertIn('20 ₽', third)
+        self.assertEqual(first, user_context.format_user_context(user_data))
+
+
+class FastAnswersTest(TestCase):
+    """Тесты быстрых ответов по шаблону без вызова LLM"""
+    
+    user_data = {
+        'accountBalance': 1000.5,
+        'accountBalance2': 500,
+        'employees': [{'fio': 'Иванов', 'salary': 50000}, {'fio': 'Петров', 'salary': 70000}],
+        'taxesData': {'vat': {'debt': 12000}, 'incomeTax': {'debt': 0}},
+    }
+    
+    def _content(self, result):
+        return result['choices'][0]['message']['content']
+    
+    def test_aggregate_intents(self):
+        """Тест: баланс, фонд оплаты труда и налоговая задолженность считаются по данным"""
+        from main import fast_answers
+        balance = fast_answers.answer('Какой у меня баланс?', self.user_data)
+        self.assertEqual(balance['fast_path'], 'balance')
+        self.assertIn('1 500.50 ₽', self._content(balance))
+        self.assertNotIn('[CHART_', self._content(balance))
+        
+        payroll = fast_answers.answer('Покажи фонд оплаты труда на графике', self.user_data)
+        self.assertEqual(payroll['fast_path'], 'payroll')
+        self.assertIn('120 000 ₽', self._content(payroll))
+        self.assertIn('[CHART_EMPLOYEES:bar]', self._content(payroll))
+        
+        taxes = fast_answers.answer('какая задолженность по налогам', self.user_data)
+        self.assertIn('12 000 ₽', self._content(taxes))
+    
+    def test_low_confidence_falls_back_to_llm(self):
+        """Тест: уточнения, действия, несколько намерений и отсутствие данных - ответ через LLM"""
+        from main import fast_answers
+        for message in ['Сравни баланс за январь', 'Почему такой баланс?', 'Создай событие по налогам',
+                        'Баланс и фонд оплаты труда', 'Напиши письмо партнеру']:
+            self.assertIsNone(fast_answers.answer(message, self.user_data), message)
+        self.assertIsNone(fast_answers.answer('Какой фонд оплаты труда?', {'accountBalance': 1}))
+        with self.settings(CHAT_FAST_ANSWERS_ENABLED=False):
+            self.assertIsNone(fast_answers.answer('Какой у меня баланс?', self.user_data))
+    
+    @patch('main.views.http_client.post')
+    def test_fast_answer_skips_openrouter(self, mock_post):
+        """Тест: быстрый ответ сохраняется без запроса к OpenRouter и учитывается в метриках"""
+        from main.views import process_chat_request_async
+        chat_request = ChatRequest.objects.create(message='Какой у меня баланс?', user_data=self.user_data)
+        process_chat_request_async(chat_request.id)
+        
+        mock_post.assert_not_called()
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.status, ChatRequest.STATUS_COMPLETED)
+        self.assertIn('1 500.50 ₽', chat_request.response)
+        self.assertTrue(ChatRequestMetrics.objects.get(chat_request=chat_request).metadata['fast_path'])
+
+
+class ActionParserTest(TestCase):
+    """Тесты разбора команд действий в ответе AI"""
+    
+    def test_all_command_kinds_in_one_pass(self):
+        """Тест: текстовые, JSON команды и графики находятся в порядке появления"""
+        from main import action_parser
+        text = (
+            'Готово.\n[CHART_RECEIPTS:pie]\n'
+            '{"action": "DELETE_EMPLOYEE", "employee": "Иванов"}\n'
+            'create_employee_folder : Бухгалтерия\n'
+            'CREATE_EMPLOYEE: Петров|+79990000000|p@example.com|50000'
+        )
+        parsed = action_parser.parse(text)
+        self.assertEqual(
+            [(command.kind, command.name) for command in parsed.commands],
+            [('chart', 'CHART_RECEIPTS'), ('json', 'DELETE_EMPLOYEE'),
+             ('text', 'CREATE_EMPLOYEE_FOLDER'), ('text', 'CREATE_EMPLOYEE')]
+        )
+        self.assertEqual(parsed.charts[0].chart_type, 'pie')
+        self.assertEqual(parsed.json_command('DELETE_EMPLOYEE').data['employee'], 'Иванов')
+        folder = parsed.text_command('CREATE_EMPLOYEE_FOLDER')
+        self.assertEqual(folder.line, 'Бухгалтерия')
+        self.assertTrue(folder.prefix.endswith('"Иванов"}'))
+        self.assertEqual(parsed.text_command('CREATE_EMPLOYEE').line, 'Петров|+79990000000|p@example.com|50000')
+    
+    def test_json_contents_not_rescanned(self):
+        """Тест: вложенные объекты и текст команд внутри JSON строк не дают лишних команд"""
+        from main import action_parser
+        text = ('Обновляю {не JSON} событие: {"action": "UPDATE_EVENT", "event": "Встреча", '
+                '"description": "DELETE_EVENT: не команда", "meta": {"a": 1}} {"action": "UNKNOWN"}')
+        parsed = action_parser.parse(text)
+        self.assertEqual([command.name for command in parsed.commands], ['UPDATE_EVENT'])
+        self.assertIsNone(parsed.text_command('DELETE_EVENT'))
+        self.assertTrue(parsed.json_command('UPDATE_EVENT').raw.endswith('{"a": 1}}'))
+    
+    @patch('main.views.http_client.post')
+    def test_worker_extracts_actions(self, mock_post):
+        """Тест: обработчик запроса получает действие из текстовой и JSON команды и убирает команду из ответа"""
+        from main.views import process_chat_request_async
+        
+        user_data = {'calendarEvents': [{'id': 7, 'title': 'Встреча с банком', 'date': '2025-01-20T10:00'}]}
+        cases = [
+            ('Добавляю событие.\nCREATE_EVENT: Встреча|2025-01-21|Обсуждение', 'Добавляю событие.',
+             {'action': 'create_event', 'title': 'Встреча', 'date': '2025-01-21T12:00', 'description': 'Обсуждение'}),
+            ('Переношу встречу.\n{"action": "UPDATE_EVENT", "event": "банком", "date": "2025-01-22T11:00"}',
+             'Переношу встречу.',
+             {'action': 'update_event', 'id': '7', 'title': None, 'date': '2025-01-22T11:00', 'description': None}),
+        ]
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.headers = {'Content-Type': 'application/json'}
+        for content, response_text, action in cases:
+            mock_post.return_value.json.return_value = {'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+            chat_request = ChatRequest.objects.create(message='Создай событие в календаре', user_data=user_data)
+            with self.settings(OPENROUTER_API_KEY='sk-test-key'):
+                process_chat_request_async(chat_request.id)
+            chat_request.refresh_from_db()
+            self.assertEqual(chat_request.response, response_text)
+            self.assertEqual(chat_request.action, action)
+    
+    @patch('main.views.http_client.post')
+    def test_ambiguous_update_event_not_applied(self, mock_post):
+        """Тест: неоднозначное событие в UPDATE_EVENT не подменяется последним, действие не выполняется"""
+        from main.views import process_chat_request_async
+    
+        user_data = {'calendarEvents': [
+            {'id': 1, 'title': 'Встреча с клиентом', 'date': '2025-01-20T10:00'},
+            {'id': 2, 'title': 'Встреча с поставщиком', 'date': '2025-01-21T10:00'},
+            {'id': 3, 'title': 'Отчет за квартал', 'date': '2025-01-22T10:00'},
+        ]}
+        contents = [
+            'Переношу встречу.\n{"action": "UPDATE_EVENT", "event": "Встреча", "date": "2025-01-23T11:00"}',
+            'Переношу встречу.\nUPDATE_EVENT: Встреча||2025-01-23T11:00|',
+        ]
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.headers = {'Content-Type': 'application/json'}
+        for content in contents:
+            mock_post.return_value.json.return_value = {'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+            chat_request = ChatRequest.objects.create(message='Перенеси встречу', user_data=user_data)
+            with self.settings(OPENROUTER_API_KEY='sk-test-key'):
+                process_chat_request_async(chat_request.id)
+            chat_request.refresh_from_db()
+            self.assertEqual(chat_request.action, {})
+    
+
+class ToolCallingTest(TestCase):
+    """Тесты действий AI через вызов инструментов"""
+    
+    model = 'test/tools-model'
+    
+    def setUp(self):
+        from main import ai_tools
+        self.ai_tools = ai_tools
+        ai_tools._unsupported_models.clear()
+    
+    def _response(self, status_code, body):
+        response = Mock()
+        response.status_code = status_code
+        response.headers = {'Content-Type': 'application/json'}
+        response.json.return_value = body
+        response.text = json.dumps(body)
+        return response
+    
+    def test_stream_tool_calls_and_commands(self):
+        """Тест: фрагменты tool_calls из потока собираются и становятся командами, заменяющими текстовые"""
+        from main import action_parser
+        response = Mock()
+        response.headers = {'Content-Type': 'text/event-stream'}
+        response.iter_lines.return_value = [
+            'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, "id": "call_1", '
+            '"function": {"name": "delete_employee", "arguments": "{\\"employee\\": "}}]}}]}',
+            'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, '
+            '"function": {"arguments": "\\"Иванов\\", \\"fio\\": null}"}}]}, "finish_reason": "tool_calls"}]}',
+            'data: [DONE]',
+        ]
+        result = chat_stream.read_completion(response, str(uuid.uuid4()))
+        commands = self.ai_tools.to_commands(result)
+        self.assertEqual([(command.name, command.data) for command in commands],
+                         [('DELETE_EMPLOYEE', {'action': 'DELETE_EMPLOYEE', 'employee': 'Иванов'})])
+        
+        parsed = action_parser.parse('DELETE_EVENT: Встреча\n[CHART_EMPLOYEES:bar]', commands)
+        self.assertIsNone(parsed.text_command('DELETE_EVENT'))
+        self.assertEqual([command.name for command in parsed.commands], ['DELETE_EMPLOYEE', 'CHART_EMPLOYEES'])
+    
+    @patch('main.views.http_client.post')
+    def test_worker_executes_tool_call(self, mock_post):
+        """Тест: инструменты передаются в запросе, вызов инструмента без текста выполняется как действие"""
+        from main.views import process_chat_request_async
+        mock_post.return_value = self._response(200, {'choices': [{'message': {
+            'role': 'assistant', 'content': None,
+            'tool_calls': [{'id': 'call_1', 'type': 'function', 'function': {
+                'name': 'create_event', 'arguments': '{"title": "Встреча", "date": "2025-01-21"}'
+            }}]
+        }}]})
+        chat_request = ChatRequest.objects.create(message='Запланируй встречу на 21 января', user_data={})
+        with self.settings(OPENROUTER_API_KEY='sk-test-key', OPENROUTER_MODEL=self.model):
+            process_chat_request_async(chat_request.id)
+        
+        payload = mock_post.call_args.kwargs['json']
+        self.assertEqual(len(payload['tools']), len(self.ai_tools.ACTION_LABELS))
+        self.assertIs(payload['parallel_tool_calls'], False)
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.response, 'Выполняю: создание события.')
+        self.assertEqual(chat_request.action, {'action': 'create_event', 'title': 'Встреча',
+                                               'date': '2025-01-21T12:00', 'description': ''})
+    
+    @patch('main.views.http_client.post')
+    def test_several_tool_calls_execute_first(self, mock_post):
+        """Тест: из нескольких вызовов инструментов выполняется и попадает в ответ только первый"""
+        from main.views import process_chat_request_async
+        mock_post.return_value = self._response(200, {'choices': [{'message': {
+            'role': 'assistant', 'content': None,
+            'tool_calls': [
+                {'id': 'call_1', 'type': 'function', 'function': {
+                    'name': 'create_event', 'arguments': '{"title": "Встреча", "date": "2025-01-21T10:00"}'
+                }},
+                {'id': 'call_2', 'type': 'function', 'function': {
+                    'name': 'create_folder', 'arguments': '{"name": "Склад"}'
+                }},
+            ]
+        }}]})
+        chat_request = ChatRequest.objects.create(message='Запланируй встречу и создай папку', user_data={})
+        with self.settings(OPENROUTER_API_KEY='sk-test-key', OPENROUTER_MODEL=self.model):
+            process_chat_request_async(chat_request.id)
+    
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.response, 'Выполняю: создание события.')
+        self.assertEqual(chat_request.action['action'], 'create_event')
+    
+    @patch('main.views.http_client.post')
+    def test_model_without_tools_falls_back_to_text(self, mock_post):
+        """Тест: если модель не поддерживает инструменты, запрос повторяется без tools и команды берутся из текста"""
+        from main.views import process_chat_request_async
+        mock_post.side_effect = [
+            self._response(404, {'error': {'message': 'No endpoints found that support tool use'}}),
+            self._response(200, {'choices': [{'message': {
+                'role': 'assistant', 'content': 'Добавляю.\nCREATE_EVENT: Встреча|2025-01-21T10:00|'
+            }}]}),
+        ]
+        chat_request = ChatRequest.objects.create(message='Запланируй встречу', user_data={})
+        with self.settings(OPENROUTER_API_KEY='sk-test-key', OPENROUTER_MODEL=self.model):
+            process_chat_request_async(chat_request.id)
+        
+        self.assertIn('tools', mock_post.call_args_list[0].kwargs['json'])
+        self.assertFalse(set(self.ai_tools.REQUEST_FIELDS) & set(mock_post.call_args_list[1].kwargs['json']))
+        self.assertEqual(self.ai_tools.request_options(self.model), {})
+        chat_request.refresh_from_db()
+        self.assertEqual(chat_request.action['action'], 'create_event')
+        self.assertEqual(chat_request.response, 'Добавляю.')
+
+
+class EntityResolverTest(TestCase):
+    """Тесты поиска записей данных пользователя по идентификатору из команды AI"""
+    
+    events = [
+        {'id': 1, 'title': 'Звонок клиенту Петрову по договору поставки', 'description': ''},
+        {'id': 2, 'title': 'Клиент Иванов', 'description': 'Подписать акт сверки'},
+        {'id': 3, 'title': 'Встреча с клиентом', 'description': ''},
+    ]
+    
+    def test_ranked_matches(self):
+        """Тест: точное совпадение выше частичного, частичные ранжируются по доле совпадения"""
+        from main import entity_resolver
+        matches = entity_resolver.search('event', self.events, 'клиент')
+        self.assertEqual([match.id for match in matches], ['2', '3', '1'])
+        self.assertTrue(all(earlier.score >= later.score for earlier, later in zip(matches, matches[1:])))
+        self.assertEqual(entity_resolver.search('event', self.events, 'встреча с клиентом')[0].reason, 'name')
+        self.assertEqual(entity_resolver.resolve('event', self.events, 'акт сверки'), '2')
+        self.assertEqual(entity_resolver.resolve('event', self.events, '3'), '3')
+    
+    def test_fuzzy_and_contacts(self):
+        """Тест: опечатки находятся по триграммам, сотрудники - по телефону в любом формате и почте"""
+        from main import entity_resolver
+        self.assertEqual(find_event_smart(self.events, 'Встерча с клиентом'), '3')
+        employees = [
+            {'id': 'e1', 'fio': 'Иванов Иван Иванович', 'phone': '+7 (999) 123-45-67', 'email': 'ivanov@example.com'},
+            {'id': 'e2', 'fio': 'Петров Петр', 'phone': '', 'email': 'petrov@example.com'},
+        ]
+        self.assertEqual(entity_resolver.resolve('employee', employees, '999 123 45 67'), 'e1')
+        self.assertEqual(entity_resolver.resolve('employee', employees, 'PETROV@example.com'), 'e2')
+        self.assertEqual(entity_resolver.resolve('employee', employees, 'Петров'), 'e2')
+        self.assertIsNone(entity_resolver.resolve('employee', employees, 'Сидоров'))
+    
+    def test_index_built_once_per_list(self):
+        """Тест: индекс списка строится один раз и перестраивается при изменении длины списка"""
+        from main import entity_resolver
+        items = [{'id': 'i1', 'name': 'Бумага А4'}, {'id': 'i2', 'name': 'Бумага А3'}]
+        with patch('main.entity_resolver.EntityIndex', wraps=entity_resolver.EntityIndex) as mock_index:
+            entity_resolver.resolve('inventory_item', items, 'бумага а3')
+            entity_resolver.resolve('inventory_item', items, 'i1')
+            self.assertEqual(mock_index.call_count, 1)
+            items.append({'id': 'i3', 'name': 'Картридж'})
+            self.assertEqual(entity_resolver.resolve('inventory_item', items, 'картридж'), 'i3')
+            self.assertEqual(mock_index.call_count, 2)
+        
+        with self.assertLogs('main.entity_resolver', level='WARNING') as logs:
+            self.assertIsNone(entity_resolver.resolve('inventory_item', items, 'бумага'))
+        self.assertIn('Неоднозначное совпадение', logs.output[0])
+    
+    def test_missing_record_not_replaced_by_similar(self):
+        """Тест: несуществующая запись не подменяется похожей (команды удаления и изменения)"""
+        from main import entity_resolver
+        employees = [
+            {'id': 'e1', 'fio': 'Петров Иван', 'phone': '', 'email': ''},
+            {'id': 'e2', 'fio': 'Сидорова Анна', 'phone': '', 'email': ''},
+        ]
+        self.assertIsNone(entity_resolver.resolve('employee', employees, 'Петров Сергей'))
+        self.assertIsNone(entity_resolver.resolve('employee', employees, 'Петрова Мария'))
+        items = [
+            {'id': 'i1', 'name': 'Стол офисный'},
+            {'id': 'i2', 'name': 'Стул офисный'},
+            {'id': 'i3', 'name': 'Бумага А4'},
+        ]
+        self.assertIsNone(entity_resolver.resolve('inventory_item', items, 'Шкаф офисный'))
+        self.assertIsNone(entity_resolver.resolve('inventory_item', items, 'Бумага А5'))
+        self.assertIsNone(find_event_smart(EntityResolverTest.events, 'клиент'))
+        self.assertEqual(entity_resolver.resolve('inventory_item', items, 'Бумага а4'), 'i3')
+        self.assertEqual(entity_resolver.resolve('inventory_item', items, 'Стол офисный'), 'i1')
+
+
+class RelativeDatesTest(TestCase):
+    """Тесты поиска событий по дате в идентификаторе"""
+    
+    # Среда, 15 января 2025
+    now = datetime(2025, 1, 15, 9, 30)
+    events = [
+        {'id': 'e1', 'title': 'Совещание', 'date': '2025-01-17T10:00', 'description': ''},
+        {'id': 'e2', 'title': 'Встреча с клиентом', 'date': '2025-01-16T15:00', 'description': ''},
+        {'id': 'e3', 'title': 'Обед с партнером', 'date': '2025-01-16T13:00:00.000Z', 'description': ''},
+        {'id': 'e4', 'title': 'Планерка', 'date': '2025-12-15T10:00', 'description': ''},
+    ]
+    
+    def test_parse_relative_dates(self):
+        """Тест: относительные и календарные даты переводятся в интервалы, время сужает интервал"""
+        from main.relative_dates import parse
+        tomorrow = parse('завтрашняя встреча', self.now)
+        self.assertEqual((tomorrow.start, tomorrow.end), (datetime(2025, 1, 16), datetime(2025, 1, 17)))
+        self.assertEqual(tomorrow.rest, 'встреча')
+        self.assertEqual(parse('совещание в пятницу', self.now).start, datetime(2025, 1, 17))
+        self.assertEqual(parse('послезавтра на 10 утра', self.now).start, datetime(2025, 1, 17, 10, 0))
+        self.assertEqual(parse('в 5 вечера послезавтра', self.now).start, datetime(2025, 1, 17, 17, 0))
+        self.assertEqual(parse('15 декабря в 10:00', self.now).start, datetime(2025, 12, 15, 10, 0))
+        self.assertEqual(parse('через неделю', self.now).start, datetime(2025, 1, 22))
+        self.assertEqual(parse('2025-01-16T15:00', self.now).start, datetime(2025, 1, 16, 15, 0))
+        self.assertIsNone(parse('Встреча с клиентом', self.now))
+        self.assertIsNone(parse('завтрак с партнером', self.now))
+    
+    def test_resolve_event_by_date(self):
+        """Тест: событие находится по дате, слова после даты выбирают среди событий дня"""
+        from main import entity_resolver
+        self.assertEqual(entity_resolver.resolve('event', self.events, 'совещание в пятницу', self.now), 'e1')
+        self.assertEqual(entity_resolver.resolve('event', self.events, 'завтрашняя встреча', self.now), 'e2')
+        self.assertEqual(entity_resolver.resolve('event', self.events, 'завтра в 15:00', self.now), 'e2')
+        self.assertEqual(entity_resolver.resolve('event', self.events, '15 декабря', self.now), 'e4')
+        # Несколько событий без уточнения - событие не выбирается
+        with self.assertLogs('main.entity_resolver', level='WARNING') as logs:
+            self.assertIsNone(entity_resolver.resolve('event', self.events, 'завтра', self.now))
+        self.assertIn('Неоднозначное совпадение', logs.output[0])
+        # Точное название важнее даты, в пустом интервале - поиск по тексту
+        self.assertEqual(entity_resolver.resolve('event', self.events, 'Планерка', self.now), 'e4')
+        self.assertEqual(entity_resolver.resolve('event', self.events, 'вчерашняя планерка', self.now), 'e4')
+    
+    def test_date_with_unmatched_words_not_resolved(self):
+        """Тест: событие интервала не выбирается, если слова после даты к нему не подходят"""
+        from main import entity_resolver
+        events = [
+            {'id': 'm1', 'title': 'Встреча с клиентом', 'date': '2025-01-16T15:00', 'description': ''},
+            {'id': 'm2', 'title': 'Совещание', 'date': '2025-01-17T10:00', 'description': ''},
+        ]
+        for identifier in ('завтрашний обед с директором', 'обед с директором в пятницу', 'звонок 16.01'):
+            self.assertIsNone(entity_resolver.resolve('event', events, identifier, self.now), identifier)
+        self.assertEqual(entity_resolver.resolve('event', events, 'завтра', self.now), 'm1')
+        self.assertEqual(entity_resolver.resolve('event', events, 'совещание в пятницу', self.now), 'm2')
+    
+    def test_date_index_lookup(self):
+        """Тест: индекс хранит события по дате и возвращает интервал бинарным поиском"""
+        from main import entity_resolver
+        index = entity_resolver.get_index('event', self.events)
+        self.assertEqual(index.between(datetime(2025, 1, 16), datetime(2025, 1, 17)), [2, 1])
+        self.assertEqual(index.between(datetime(2025, 1, 18), datetime(2025, 12, 1)), [])
+        self.assertEqual(index.between(datetime(2025, 1, 1), datetime(2026, 1, 1)), [2, 1, 0, 3])
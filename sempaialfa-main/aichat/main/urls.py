@@ -7,6 +7,8 @@ urlpatterns = [
     path('chat/', views.chat, name='chat'),
     path('api/chat/', views.chat_api, name='chat_api'),
     path('api/chat-status/<uuid:request_id>/', views.chat_status, name='chat_status'),
+    path('api/chat-stream/<uuid:request_id>/', views.chat_stream_view, name='chat_stream'),
+    path('api/chat-queue/', views.chat_queue_status, name='chat_queue_status'),
     path('api/check-lm-studio/', views.check_lm_studio_connection, name='check_lm_studio'),
     path('api/register/', views.register_user, name='register_user'),
     path('api/login/', views.login_api, name='login_api'),
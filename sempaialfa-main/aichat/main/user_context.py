@@ -0,0 +1,452 @@
+"""
+Контекст пользователя для системного промпта с ограничением по токенам
+Каждый раздел (чеки, инвентаризация, сотрудники, календарь, налоги, коммунальные услуги, документы)
+состоит из агрегатов (итоги, распределения - передаются всегда) и строк-записей.
+Записи, относящиеся к сообщению, находятся поиском BM25 (retrieval) и идут первыми.
+В больших разделах (больше SMALL_SECTION_ROWS записей), о которых сообщение не спрашивает,
+кроме найденных передаются только MIN_ROWS_PER_SECTION первых записей - итоги раздела
+считаются по всем записям. Строки добавляются, пока оценка размера контекста не превысит
+CHAT_CONTEXT_MAX_TOKENS: сначала по MIN_ROWS_PER_SECTION строк в каждом разделе, затем
+остальные - начиная с разделов, ближе всего относящихся к сообщению пользователя.
+О пропущенных строках сообщается в самом контексте и в отчете build_user_context.
+
+Собранные разделы кэшируются по хэшам данных, из которых они построены (хэши разделов userData
+из user_data_store): при следующем сообщении пересчитываются только изменившиеся разделы
+"""
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+
+from .retrieval import BM25Index
+from .semantic_cache import normalize_message
+
+# Средняя длина токена для русского текста с числами, символов
+CHARS_PER_TOKEN = 3
+# Строк каждого раздела, добавляемых до распределения остатка бюджета по релевантности
+MIN_ROWS_PER_SECTION = 5
+# Разделы до стольких записей передаются целиком (в пределах бюджета) при любом сообщении
+SMALL_SECTION_ROWS = 50
+# Сколько собранных разделов хранить в кэше процесса
+SECTION_CACHE_MAX_ENTRIES = 512
+
+# Строка о записях, не включенных в контекст
+OMITTED_ROWS_NOTE = (
+    "  ... еще {count} записей не показаны: включены записи, относящиеся к запросу, итоги выше - по всем записям "
+    "(попроси пользователя уточнить запрос, если нужны другие)"
+)
+
+# Основы слов, по которым сообщение относится к разделу
+SECTION_KEYWORDS = {
+    'receipts': ('чек', 'операц', 'расход', 'доход', 'плат', 'покуп', 'продаж', 'трат', 'выписк', 'транзакц'),
+    'inventory': ('товар', 'инвент', 'склад', 'остат', 'папк', 'номенклат', 'категор', 'запас'),
+    'employees': ('сотруд', 'работник', 'персонал', 'зарплат', 'оклад', 'фио', 'штат', 'должност', 'кадр'),
+    'calendar': ('событ', 'календар', 'встреч', 'напомин', 'созвон', 'мероприят', 'дедлайн', 'расписан'),
+    'taxes': ('налог', 'ндс', 'взнос', 'фнс', 'задолжен'),
+    'utilities': ('коммунал', 'электр', 'вод', 'отоплен', 'тко', 'мусор', 'охран', 'интернет', 'задолжен'),
+    'documents': ('документ', 'файл', 'договор', 'отчет', 'скан'),
+}
+
+TAX_NAMES = {
+    'profit': 'Налог на прибыль',
+    'vat': 'НДС',
+    'property': 'Налог на имущество',
+    'insurance': 'Страховые взносы'
+}
+
+UTILITY_NAMES = {
+    'electricity': 'Электричество',
+    'water': 'Водоснабжение',
+    'heating': 'Отопление',
+    'waste': 'Вывоз ТКО',
+    'security': 'Охранные услуги',
+    'internet': 'Интернет'
+}
+
+
+def estimate_tokens(text):
+    """Оценка числа токенов текста (без токенизатора модели)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+class _Section:
+    """
+    Раздел контекста
+
+    Args:
+        key: ключ раздела из SECTION_KEYWORDS
+        header: строки агрегатов (всегда в контексте)
+        rows: строки записей в порядке вывода
+        priority: порядок отбора строк (индексы rows), первые - важнее
+        footer: строки после записей (инструкции для модели)
+        max_rows: максимум строк раздела независимо от бюджета
+        search_texts: значимые поля записей для поиска (по умолчанию - сами строки)
+    """
+
+    def __init__(self, key, header, rows=None, priority=None, footer=None, max_rows=None, search_texts=None):
+        self.key = key
+        self.header = header
+        self.rows = rows or []
+        self.priority = priority if priority is not None else list(range(len(self.rows)))
+        self.footer = footer or []
+        self.max_rows = len(self.rows) if max_rows is None else min(max_rows, len(self.rows))
+        self.index = BM25Index(search_texts if search_texts is not None else self.rows)
+        self.selected = set()
+        self.relevance = 0
+
+    def copy(self):
+        """Копия для отбора строк под конкретное сообщение (собранные строки общие)"""
+        section = _Section.__new__(_Section)
+        section.__dict__.update(self.__dict__)
+        section.selected = set()
+        section.relevance = 0
+        return section
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+def _rank(section, message, words):
+    """
+    Порядок отбора строк раздела: найденные по сообщению записи, затем остальные в обычном порядке
+    (для больших разделов, о которых сообщение не спрашивает, - только MIN_ROWS_PER_SECTION из них).
+    Релевантность раздела - по ключевым словам и найденным записям
+    """
+    keywords = SECTION_KEYWORDS.get(section.key, ())
+    keyword_hits = sum(1 for word in words for keyword in keywords if word.startswith(keyword))
+    found = [index for index, _ in section.index.search(message)] if section.rows else []
+    found_set = set(found)
+    rest = [index for index in section.priority if index not in found_set]
+    if not keyword_hits and len(section.rows) > SMALL_SECTION_ROWS:
+        rest = rest[:MIN_ROWS_PER_SECTION]
+    section.priority = found + rest
+    section.relevance = keyword_hits + (1 if found else 0)
+
+
+def _balances_section(user_data):
+    balance1 = user_data.get('accountBalance', 0)
+    balance2 = user_data.get('accountBalance2', 0)
+    if not (balance1 or balance2):
+        return None
+    return _Section('balances', [f"Балансы счетов: Счет 1 - {balance1:,.0f} ₽, Счет 2 - {balance2:,.0f} ₽"])
+
+
+def _receipts_section(user_data):
+    receipts = user_data.get('receipts', [])
+    if not receipts:
+        return None
+    total_amount = sum(r.get('amount', 0) for r in receipts if isinstance(r.get('amount'), (int, float)))
+    header = [f"\nЧЕКИ: {len(receipts)} операций, сумма {total_amount:,.0f} ₽"]
+
+    # Распределение по типам операций (для графиков)
+    operations_by_type = {}
+    for r in receipts:
+        op_type = r.get('operationType', 'Операция')
+        operations_by_type[op_type] = operations_by_type.get(op_type, 0) + r.get('amount', 0)
+    header.append("Распределение по типам операций:")
+    for op_type, total in operations_by_type.items():
+        header.append(f"  - {op_type}: {total:,.0f} ₽")
+
+    # Последние операции
+    header.append("Последние операции:")
+    rows = [
+        f"  - {r.get('operationType', 'Операция')}: {r.get('amount', 0):,.0f} ₽ ({r.get('date', 'Не указана')})"
+        for r in receipts
+    ]
+    search_texts = [f"{r.get('operationType', '')} {r.get('date', '')} {r.get('amount', '')}" for r in receipts]
+    return _Section('receipts', header, rows, priority=list(reversed(range(len(rows)))), max_rows=5,
+                    search_texts=search_texts)
+
+
+def _inventory_category(item, folder_map):
+    folder_id = str(item.get('folderId') or item.get('folder') or '')
+    if folder_id and folder_id in folder_map:
+        return folder_map[folder_id]
+    return item.get('folderName') or item.get('folder') or 'Без категории'
+
+
+def _inventory_section(user_data):
+    inventory = user_data.get('inventory', [])
+    if not inventory:
+        return None
+
+    # Соответствие между id папок и их названиями
+    folder_map = {}
+    for folder in user_data.get('inventoryFolders', []) or []:
+        folder_id = folder.get('id') or folder.get('folderId')
+        if folder_id:
+            folder_map[str(folder_id)] = folder.get('name', 'Без названия')
+
+    items = []
+    categories = {}
+    for item in inventory:
+        quantity = item.get('quantity', 0)
+        price = item.get('price', 0)
+        value = quantity * price if isinstance(quantity, (int, float)) and isinstance(price, (int, float)) else 0
+        category = _inventory_category(item, folder_map)
+        items.append({
+            'name': item.get('name', 'Без названия'),
+            'category': category,
+            'quantity': quantity,
+            'price': price,
+            'value': value
+        })
+        count, total = categories.get(category, (0, 0))
+        categories[category] = (count + _number(quantity), total + value)
+
+    header = [f"\nИНВЕНТАРИЗАЦИЯ: {len(inventory)} позиций", "СТРУКТУРА ИНВЕНТАРИЗАЦИИ (папки):"]
+    for category, (count, value) in categories.items():
+        header.append(f"ПАПКА: '{category}' - {count} шт., общая стоимость {value:,.2f} ₽")
+
+    all_items_value = sum(item['value'] for item in items)
+    if all_items_value > 0:
+        header.append(f"Общая стоимость инвентаризации: {all_items_value:,.2f} ₽")
+
+    by_value = sorted(range(len(items)), key=lambda index: items[index]['value'], reverse=True)
+    header.append("Топ-5 товаров по стоимости:")
+    for index in by_value[:5]:
+        item = items[index]
+        header.append(f"  - {item['name']} ({item['category']}): {item['value']:,.2f} ₽")
+
+    # Список товаров с названиями: AI должен использовать названия, а не ID
+    header.append("\nСПИСОК ТОВАРОВ (ВАЖНО: используй НАЗВАНИЯ, а не ID):")
+    rows = [
+        f"  - ТОВАР: '{item['name']}' | ПАПКА: '{item['category']}' | Количество: {item['quantity']} | "
+        f"Цена: {_number(item['price']):,.2f} ₽ | Стоимость: {item['value']:,.2f} ₽"
+        for item in items
+    ]
+    footer = [
+        "\nКРИТИЧЕСКИ ВАЖНО ДЛЯ ИНВЕНТАРИЗАЦИИ:",
+        "- Всегда используй НАЗВАНИЯ товаров из поля 'ТОВАР', НИКОГДА не используй числовые ID!",
+        "- Всегда используй НАЗВАНИЯ папок из поля 'ПАПКА', НИКОГДА не используй числовые ID папок!",
+        "- Когда пользователь просит показать инвентаризацию, перечисляй каждую ПАПКУ с товарами внутри!",
+        "- Когда пользователь просит отчет по определенным категориям (например: 'люкс, сьют, стандарт'):",
+        "  * ИЩИ категории по НАЗВАНИЯМ папок (ПАПКА), сравнивая с запрошенными названиями",
+        "  * Названия могут быть в разных форматах: 'Люкс', '№303 (Люкс)', 'люкс' - ищи по ключевым словам",
+        "  * Если категория найдена - ВКЛЮЧИ ВСЕ товары из этой категории в отчет",
+        "  * Если категория НЕ найдена - СПРОСИ пользователя или укажи, что такой категории нет в данных",
+        "  * ВСЕГДА включай ВСЕ запрошенные категории - если указано 3 категории, должно быть 3 раздела в отчете",
+        "- При составлении таблиц с итогами:",
+        "  * Добавляй итоговую строку для КАЖДОЙ категории (сумма количества и стоимости по категории)",
+        "  * Добавляй ОБЩУЮ итоговую строку в конце (сумма по всем категориям)",
+        "  * НЕ оставляй пустых ячеек - если данных нет, указывай 0 или 'Нет данных'",
+    ]
+    search_texts = [f"{item['name']} {item['category']}" for item in items]
+    return _Section('inventory', header, rows, priority=by_value, footer=footer, search_texts=search_texts)
+
+
+def _employees_section(user_data):
+    employees = user_data.get('employees', [])
+    if not employees:
+        return None
+    total_salary = sum(e.get('salary', 0) for e in employees if isinstance(e.get('salary'), (int, float)))
+    avg_salary = total_salary / len(employees)
+    header = [
+        f"\nСОТРУДНИКИ: {len(employees)} человек, фонд {total_salary:,.0f} ₽, средняя зарплата {avg_salary:,.0f} ₽",
+        "СПИСОК СОТРУДНИКОВ (включая прошлых):",
+    ]
+    rows = [
+        f"  - СОТРУДНИК: '{emp.get('fio', 'Не указано')}' | Должность: '{emp.get('position', 'Не указана')}' | "
+        f"Зарплата: {_number(emp.get('salary', 0)):,.0f} ₽ | Телефон: {emp.get('phone', 'Не указан')} | "
+        f"Email: {emp.get('email', 'Не указан')}"
+        for emp in employees
+    ]
+    footer = [
+        "\nКРИТИЧЕСКИ ВАЖНО ДЛЯ СОТРУДНИКОВ:",
+        "- Всегда используй ФИО сотрудников из поля 'СОТРУДНИК', НИКОГДА не используй числовые ID!",
+        "- Итоги раздела учитывают ВСЕХ сотрудников, включая тех, которые были добавлены ранее или уже не работают!",
+    ]
+    search_texts = [
+        f"{emp.get('fio', '')} {emp.get('position', '')} {emp.get('folderName', '')} "
+        f"{emp.get('email', '')} {emp.get('phone', '')}"
+        for emp in employees
+    ]
+    return _Section('employees', header, rows, footer=footer, search_texts=search_texts)
+
+
+def _event_iso_date(date):
+    if not date:
+        return ''
+    try:
+        return datetime.fromisoformat(date.replace('Z', '+00:00')).strftime('%Y-%m-%dT%H:%M')
+    except (TypeError, ValueError):
+        return date[:16] if 'T' in date else date
+
+
+def _calendar_section(user_data):
+    calendar_events = user_data.get('calendarEvents', [])
+    if not calendar_events:
+        return None
+    upcoming = sorted((e for e in calendar_events if e.get('date')), key=lambda e: e.get('date', ''))
+    rows = [
+        f"  - ID: {e.get('id', '')} | '{e.get('title', 'Событие')}' | {_event_iso_date(e.get('date', ''))}"
+        for e in upcoming
+    ]
+    search_texts = [f"{e.get('title', '')} {e.get('description', '')} {e.get('date', '')}" for e in upcoming]
+    return _Section('calendar', [f"\nКАЛЕНДАРЬ: {len(calendar_events)} событий"], rows, max_rows=3,
+                    search_texts=search_texts)
+
+
+def _debts_section(key, title, total_title, data, names):
+    if not data:
+        return None
+    header = [f"\n{title}:"]
+    total_debt = 0
+    for item_id, item_data in data.items():
+        debt = item_data.get('debt', 0)
+        if isinstance(debt, (int, float)) and debt > 0:
+            header.append(f"  - {names.get(item_id, item_id)}: {debt:,.0f} ₽")
+            total_debt += debt
+    if total_debt > 0:
+        header.append(f"{total_title}: {total_debt:,.0f} ₽")
+    return _Section(key, header)
+
+
+def _documents_section(user_data):
+    documents = user_data.get('documents', [])
+    if not documents:
+        return None
+    # Содержимое документов передается отдельно через файлы
+    rows = [
+        f"  - {doc.get('name', 'Без названия')} ({doc.get('type', 'неизвестный тип')}, {doc.get('size', 0)} байт)"
+        for doc in documents
+    ]
+    search_texts = [f"{doc.get('name', '')} {doc.get('type', '')}" for doc in documents]
+    return _Section('documents', [f"\nДОКУМЕНТЫ: {len(documents)} файлов"], rows, max_rows=3,
+                    search_texts=search_texts)
+
+
+def _taxes_section(user_data):
+    return _debts_section('taxes', 'НАЛОГИ', 'Общая задолженность по налогам',
+                          user_data.get('taxesData', {}), TAX_NAMES)
+
+
+def _utilities_section(user_data):
+    return _debts_section('utilities', 'КОММУНАЛЬНЫЕ УСЛУГИ', 'Общая задолженность по коммунальным услугам',
+                          user_data.get('utilitiesData', {}), UTILITY_NAMES)
+
+
+# Разделы контекста в порядке вывода: (сборщик, разделы userData, из которых он строится)
+SECTION_BUILDERS = (
+    (_balances_section, ('accountBalance', 'accountBalance2')),
+    (_receipts_section, ('receipts',)),
+    (_inventory_section, ('inventory', 'inventoryFolders')),
+    (_employees_section, ('employees',)),
+    (_calendar_section, ('calendarEvents',)),
+    (_taxes_section, ('taxesData',)),
+    (_utilities_section, ('utilitiesData',)),
+    (_documents_section, ('documents',)),
+)
+
+_section_cache = OrderedDict()  # (сборщик, хэши данных) -> _Section или None (нет данных)
+_section_cache_lock = threading.Lock()
+_MISSING = object()
+
+
+def _section_cache_key(builder, data_keys, user_data, section_hashes):
+    """Ключ кэша раздела или None, если хэши данных раздела неизвестны"""
+    if section_hashes is None or any(key in user_data and key not in section_hashes for key in data_keys):
+        return None
+    return builder.__name__, tuple(section_hashes.get(key, '') for key in data_keys)
+
+
+def _build_sections(user_data, section_hashes=None):
+    """
+    Собирает разделы контекста; при известных хэшах данных раздел берется из кэша
+
+    Args:
+        section_hashes: {раздел userData: хэш содержимого} (user_data_store.resolve)
+    """
+    sections = []
+    for builder, data_keys in SECTION_BUILDERS:
+        cache_key = _section_cache_key(builder, data_keys, user_data, section_hashes)
+        section = _MISSING
+        if cache_key is not None:
+            with _section_cache_lock:
+                section = _section_cache.get(cache_key, _MISSING)
+                if section is not _MISSING:
+                    _section_cache.move_to_end(cache_key)
+        if section is _MISSING:
+            section = builder(user_data)
+            if cache_key is not None:
+                with _section_cache_lock:
+                    _section_cache[cache_key] = section
+                    while len(_section_cache) > SECTION_CACHE_MAX_ENTRIES:
+                        _section_cache.popitem(last=False)
+        if section is not None:
+            sections.append(section.copy())
+    return sections
+
+
+def _select_rows(sections, budget):
+    """Отбирает строки разделов в пределах бюджета (в токенах, None - без ограничения)"""
+    if budget is None:
+        for section in sections:
+            section.selected = set(section.priority[:section.max_rows])
+        return
+
+    # Агрегаты и инструкции передаются всегда; для разделов с записями резервируется строка о пропусках
+    remaining = budget - sum(
+        estimate_tokens('\n'.join(section.header + section.footer))
+        + (estimate_tokens(OMITTED_ROWS_NOTE.format(count=section.max_rows)) + 1 if section.rows else 0)
+        for section in sections
+    )
+    by_relevance = sorted(sections, key=lambda section: -section.relevance)
+    for limit in (MIN_ROWS_PER_SECTION, None):
+        for section in by_relevance:
+            section_limit = section.max_rows if limit is None else min(limit, section.max_rows)
+            for index in section.priority[len(section.selected):section_limit]:
+                # +1: перевод строки
+                cost = estimate_tokens(section.rows[index]) + 1
+                if cost > remaining:
+                    break
+                section.selected.add(index)
+                remaining -= cost
+
+
+def build_user_context(user_data, message='', max_tokens=None, section_hashes=None):
+    """
+    Форматирует данные пользователя для передачи в AI с ограничением размера
+
+    Args:
+        user_data: данные пользователя от клиента
+        message: сообщение пользователя (для выбора релевантных разделов и строк)
+        max_tokens: бюджет контекста в токенах (по умолчанию CHAT_CONTEXT_MAX_TOKENS, 0 - без ограничения)
+        section_hashes: хэши разделов userData; если заданы, неизменившиеся разделы не пересобираются
+
+    Returns:
+        tuple: (текст контекста, отчет {'estimated_tokens', 'max_tokens', 'dropped': {раздел: строк}})
+    """
+    if max_tokens is None:
+        max_tokens = getattr(settings, 'CHAT_CONTEXT_MAX_TOKENS', 8000)
+    sections = _build_sections(user_data or {}, section_hashes)
+    words = set(normalize_message(message).split())
+    for section in sections:
+        _rank(section, message, words)
+    _select_rows(sections, max_tokens or None)
+
+    context_parts = []
+    dropped = {}
+    for section in sections:
+        context_parts.extend(section.header)
+        context_parts.extend(row for index, row in enumerate(section.rows) if index in section.selected)
+        omitted = section.max_rows - len(section.selected)
+        if omitted > 0:
+            dropped[section.key] = omitted
+            context_parts.append(OMITTED_ROWS_NOTE.format(count=omitted))
+        context_parts.extend(section.footer)
+
+    context = "\n".join(context_parts) if context_parts else "Данные отсутствуют"
+    return context, {
+        'estimated_tokens': estimate_tokens(context),
+        'max_tokens': max_tokens,
+        'dropped': dropped,
+    }
+
+
+def format_user_context(user_data, message=''):
+    """Форматирует данные пользователя для передачи в AI"""
+    return build_user_context(user_data, message)[0]
@@ -0,0 +1,148 @@
+"""
+Хранилище разделов данных пользователя (userData) по хэшу содержимого
+Клиент передает в chat_api только изменившиеся разделы userData (receipts, inventory, ...),
+а для остальных - хэши из ответа на предыдущий запрос (userDataHashes). Сервер достает
+неизменившиеся разделы отсюда, поэтому тело запроса, разбор JSON и хэширование
+больших разделов (инвентаризация, чеки) не повторяются на каждое сообщение.
+
+Ключ - SHA-256 канонического JSON раздела: хэш известен только тому, кто уже передавал
+это содержимое. Хранилище в памяти процесса, ограничено CHAT_USER_DATA_CACHE_MAX_BYTES,
+записи живут CHAT_USER_DATA_CACHE_TTL секунд. Если раздела нет (истек, вытеснен,
+другой процесс сервера), chat_api отвечает 409 и клиент повторяет запрос с полными данными.
+
+Разделы не копируются: после сохранения их содержимое не изменяется
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class MissingSectionsError(Exception):
+    """Клиент сослался на разделы, которых нет в хранилище"""
+
+    def __init__(self, sections):
+        self.sections = sections
+        super().__init__(f"Нет сохраненных разделов данных пользователя: {', '.join(sections)}")
+
+
+def section_hash(value):
+    """Хэш содержимого раздела (порядок ключей и пробелы не влияют)"""
+    serialized = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest(), len(serialized)
+
+
+class UserDataStore:
+    """LRU-хранилище разделов по хэшу с ограничением размера и времени жизни"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # хэш -> (истекает, размер, раздел)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                self._pop(digest)
+                return None
+            # Используемый раздел живет дольше
+            self._entries[digest] = (now + self.ttl, entry[1], entry[2])
+            self._entries.move_to_end(digest)
+            return entry[2]
+
+    def put(self, digest, size, value):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(digest)
+            self._entries[digest] = (time.monotonic() + self.ttl, size, value)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'max_bytes': self.max_bytes}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Общее для процесса хранилище разделов"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = UserDataStore(
+                    max_bytes=getattr(settings, 'CHAT_USER_DATA_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+                    ttl=getattr(settings, 'CHAT_USER_DATA_CACHE_TTL', 3600),
+                )
+    return _store
+
+
+def resolve(user_data, section_hashes=None):
+    """
+    Собирает полные данные пользователя из переданных разделов и ссылок на сохраненные
+
+    Args:
+        user_data: переданные клиентом разделы (новые или изменившиеся)
+        section_hashes: {раздел: хэш} для разделов, которые клиент не передал
+
+    Returns:
+        tuple: (полные данные пользователя, {раздел: хэш} для всех разделов)
+
+    Raises:
+        MissingSectionsError: часть разделов по хэшу не найдена
+    """
+    store = get_store()
+    merged = {}
+    hashes = {}
+    for section, value in (user_data or {}).items():
+        digest, size = section_hash(value)
+        store.put(digest, size, value)
+        merged[section] = value
+        hashes[section] = digest
+
+    missing = []
+    for section, digest in (section_hashes or {}).items():
+        if section in merged:
+            continue
+        value = store.get(digest) if isinstance(digest, str) and _HASH_PATTERN.match(digest) else None
+        if value is None:
+            missing.append(section)
+            continue
+        merged[section] = value
+        hashes[section] = digest
+
+    if missing:
+        raise MissingSectionsError(sorted(missing))
+    if section_hashes:
+        logger.debug(f"📦 Данные пользователя: передано разделов {len(user_data or {})}, из хранилища {len(merged) - len(user_data or {})}")
+    return merged, hashes
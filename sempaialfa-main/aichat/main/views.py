@@ -1,7 +1,8 @@
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import JsonResponse, HttpResponse, Http404, HttpResponseNotAllowed, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+import asyncio
 import time
 import json
 import re
@@ -10,6 +11,7 @@ import base64
 import logging
 import threading
 import csv
+from functools import wraps
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.utils import timezone
@@ -23,11 +25,49 @@ from .file_processor import process_file
 from .models import ChatRequest, ChatHistory, Metric, UserActivity
 from .content_moderator import ContentModerator
 from .metrics_calculator import MetricsCalculator
+from .chat_dispatcher import get_dispatcher, QueueFullError
+from . import chat_queue
+from . import chat_stream
+from . import chat_events
+from . import blob_store
+from . import extraction_cache
+from . import extraction_pool
+from . import http_client
+from . import response_cache
+from . import semantic_cache
+from . import prompts
+from . import fast_answers
+from . import action_parser
+from . import ai_tools
+from . import entity_resolver
+from .user_context import build_user_context, format_user_context
+from .user_data_store import MissingSectionsError
+from . import user_data_store
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login as django_login
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
+# Сколько символов текста каждого файла передается модели; извлечение останавливается чуть дальше
+FILE_TEXT_PREVIEW_CHARS = 1500
+
+
+def async_api_view(methods):
+    """
+    csrf_exempt + require_http_methods для async-представлений
+    (декораторы Django 4.2 оборачивают view в синхронную функцию, и он перестает быть корутиной)
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper_view(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view_func(request, *args, **kwargs)
+        wrapper_view.csrf_exempt = True
+        return wrapper_view
+    return decorator
+
 
 def index(request):
     """Главная страница"""
@@ -213,9 +253,8 @@ def scenarios(request):
     return render(request, 'main/scenarios.html', context)
 
 
-@csrf_exempt
-@require_http_methods(["GET", "POST"])
-def check_lm_studio_connection(request):
+@async_api_view(["GET", "POST"])
+async def check_lm_studio_connection(request):
     """API endpoint для проверки подключения к OpenRouter"""
     try:
         OPENROUTER_API_KEY = getattr(settings, 'OPENROUTER_API_KEY', '')
@@ -255,7 +294,8 @@ def check_lm_studio_connection(request):
                 "max_tokens": 1
             }
             
-            api_response = requests.post(OPENROUTER_URL, headers=headers, json=test_payload, timeout=10)
+            api_response = await http_client.async_post('openrouter', OPENROUTER_URL, headers=headers,
+                                                        json=test_payload, read_timeout=10)
             
             if api_response.status_code == 200:
                 api_available = True
@@ -569,297 +609,6 @@ def manage_calendar_event(request):
         }, status=500)
 
 
-def format_user_context(user_data):
-    """Форматирует данные пользователя для передачи в AI"""
-    context_parts = []
-    
-    # Балансы счетов
-    balance1 = user_data.get('accountBalance', 0)
-    balance2 = user_data.get('accountBalance2', 0)
-    if balance1 or balance2:
-        context_parts.append(f"Балансы счетов: Счет 1 - {balance1:,.0f} ₽, Счет 2 - {balance2:,.0f} ₽")
-    
-    # Чеки (для визуализации)
-    receipts = user_data.get('receipts', [])
-    if receipts:
-        total_receipts = len(receipts)
-        total_amount = sum(r.get('amount', 0) for r in receipts if isinstance(r.get('amount'), (int, float)))
-        context_parts.append(f"\nЧЕКИ: {total_receipts} операций, сумма {total_amount:,.0f} ₽")
-        
-        # Группируем операции по типам и датам для графиков
-        operations_by_type = {}
-        operations_by_date = {}
-        for r in receipts:
-            op_type = r.get('operationType', 'Операция')
-            amount = r.get('amount', 0)
-            date = r.get('date', '')
-            
-            # Группировка по типам
-            if op_type not in operations_by_type:
-                operations_by_type[op_type] = 0
-            operations_by_type[op_type] += amount
-            
-            # Группировка по датам, если указаны
-            if date:
-                date_key = date.split('T')[0] if 'T' in date else date.split(' ')[0]
-                if date_key not in operations_by_date:
-                    operations_by_date[date_key] = 0
-                operations_by_date[date_key] += amount
-        
-        # Добавляем данные для графиков
-        if operations_by_type:
-            context_parts.append("Распределение по типам операций:")
-            for op_type, total in operations_by_type.items():
-                context_parts.append(f"  - {op_type}: {total:,.0f} ₽")
-        
-        # Последние операции
-        if receipts:
-            recent = receipts[-5:]  # Берем последние 5
-            context_parts.append("Последние операции:")
-            for r in recent:
-                op_type = r.get('operationType', 'Операция')
-                amount = r.get('amount', 0)
-                date = r.get('date', 'Не указана')
-                context_parts.append(f"  - {op_type}: {amount:,.0f} ₽ ({date})")
-    
-    # Инвентаризация (для визуализации)
-    inventory = user_data.get('inventory', [])
-    inventory_folders = user_data.get('inventoryFolders', [])
-    
-    if inventory:
-        context_parts.append(f"\nИНВЕНТАРИЗАЦИЯ: {len(inventory)} позиций")
-        
-        # Создаем соответствие между id папок и их названиями
-        folder_map = {}
-        if inventory_folders:
-            for folder in inventory_folders:
-                folder_id = folder.get('id') or folder.get('folderId')
-                folder_name = folder.get('name', 'Без названия')
-                if folder_id:
-                    folder_map[str(folder_id)] = folder_name
-        
-        # Группируем товары по папкам (категориям)
-        categories = {}
-        categories_value = {}
-        categories_items = {}  # Храним товары по категориям
-        
-        for item in inventory:
-            # Получаем название папки для товара
-            folder_id = str(item.get('folderId') or item.get('folder') or '')
-            if folder_id and folder_id in folder_map:
-                cat = folder_map[folder_id]
-            elif item.get('folderName'):
-                cat = item.get('folderName')
-            elif item.get('folder'):
-                cat = item.get('folder')
-            else:
-                cat = 'Без категории'
-            
-            quantity = item.get('quantity', 0)
-            price = item.get('price', 0)
-            value = quantity * price if isinstance(quantity, (int, float)) and isinstance(price, (int, float)) else 0
-            item_name = item.get('name', 'Без названия')
-            
-            if cat not in categories:
-                categories[cat] = 0
-                categories_value[cat] = 0
-                categories_items[cat] = []
-            
-            categories[cat] += quantity
-            categories_value[cat] += value
-            categories_items[cat].append({
-                'name': item_name,
-                'quantity': quantity,
-                'price': price,
-                'value': value
-            })
-        
-        # Структурированный вывод: каждая папка с товарами внутри
-        if categories:
-            context_parts.append("СТРУКТУРА ИНВЕНТАРИЗАЦИИ (папки и товары):")
-            for cat, count in categories.items():
-                value = categories_value.get(cat, 0)
-                items_in_cat = categories_items.get(cat, [])
-                context_parts.append(f"ПАПКА: '{cat}' - {count} шт., общая стоимость {value:,.2f} ₽")
-                # Перечисляем все товары в папке
-                for item in items_in_cat:
-                    context_parts.append(f"  - ТОВАР: '{item['name']}' | Количество: {item['quantity']} | Цена: {item['price']:,.2f} ₽ | Стоимость: {item['value']:,.2f} ₽")
-        
-        # Добавляем общее распределение по категориям
-        if categories:
-            context_parts.append("\nРаспределение по категориям (кратко):")
-            for cat, count in categories.items():
-                value = categories_value.get(cat, 0)
-                context_parts.append(f"  - {cat}: {count} шт., стоимость {value:,.2f} ₽")
-        
-        # Общая стоимость инвентаризации
-        all_items_value = sum(
-            item.get('quantity', 0) * item.get('price', 0) 
-            for item in inventory 
-            if isinstance(item.get('quantity'), (int, float)) and isinstance(item.get('price'), (int, float))
-        )
-        if all_items_value > 0:
-            context_parts.append(f"Общая стоимость инвентаризации: {all_items_value:,.2f} ₽")
-        
-        # Топ товары по стоимости
-        items_with_value = [
-            {
-                'name': item.get('name', 'Без названия'),
-                'category': item.get('folder') or item.get('folderId') or 'Без категории',
-                'quantity': item.get('quantity', 0),
-                'price': item.get('price', 0),
-                'value': (item.get('quantity', 0) * item.get('price', 0)) if isinstance(item.get('quantity'), (int, float)) and isinstance(item.get('price'), (int, float)) else 0
-            }
-            for item in inventory
-        ]
-        items_with_value.sort(key=lambda x: x['value'], reverse=True)
-        if items_with_value:
-            context_parts.append("Топ-5 товаров по стоимости:")
-            for item in items_with_value[:5]:
-                context_parts.append(f"  - {item['name']} ({item['category']}): {item['value']:,.2f} ₽")
-        
-        # Полный список товаров с названиями для AI
-        # Важно: AI должен использовать названия, а не ID
-        # ВАЖНО: Включаем ВСЕ товары, включая прошлые/исторические данные
-        if inventory:
-            context_parts.append("\nПОЛНЫЙ СПИСОК ТОВАРОВ (ВАЖНО: используй НАЗВАНИЯ, а не ID):")
-            # Включаем ВСЕ товары, без ограничений, чтобы AI видел всю инвентаризацию, включая исторические данные
-            for item in inventory:  # Включаем все товары без ограничений
-                item_name = item.get('name', 'Без названия')
-                # Получаем название папки
-                folder_id = str(item.get('folderId') or item.get('folder') or '')
-                if folder_id and folder_id in folder_map:
-                    item_cat = folder_map[folder_id]
-                elif item.get('folderName'):
-                    item_cat = item.get('folderName')
-                elif item.get('folder'):
-                    item_cat = item.get('folder')
-                else:
-                    item_cat = 'Без категории'
-                
-                item_qty = item.get('quantity', 0)
-                item_price = item.get('price', 0)
-                item_value = item_qty * item_price if isinstance(item_qty, (int, float)) and isinstance(item_price, (int, float)) else 0
-                # Явно указываем названия, а не ID
-                context_parts.append(f"  - ТОВАР: '{item_name}' | ПАПКА: '{item_cat}' | Количество: {item_qty} | Цена: {item_price:,.2f} ₽ | Стоимость: {item_value:,.2f} ₽")
-            context_parts.append("\nКРИТИЧЕСКИ ВАЖНО ДЛЯ ИНВЕНТАРИЗАЦИИ:")
-            context_parts.append("- Всегда используй НАЗВАНИЯ товаров из поля 'ТОВАР', НИКОГДА не используй числовые ID!")
-            context_parts.append("- Всегда используй НАЗВАНИЯ папок из поля 'ПАПКА', НИКОГДА не используй числовые ID папок!")
-            context_parts.append("- Когда пользователь просит показать инвентаризацию, перечисляй каждую ПАПКУ с товарами внутри!")
-            context_parts.append("- Когда пользователь просит отчет по определенным категориям (например: 'люкс, сьют, стандарт'):")
-            context_parts.append("  * ИЩИ категории по НАЗВАНИЯМ папок (ПАПКА), сравнивая с запрошенными названиями")
-            context_parts.append("  * Названия могут быть в разных форматах: 'Люкс', '№303 (Люкс)', 'люкс' - ищи по ключевым словам")
-            context_parts.append("  * Если категория найдена - ВКЛЮЧИ ВСЕ товары из этой категории в отчет")
-            context_parts.append("  * Если категория НЕ найдена - СПРОСИ пользователя или укажи, что такой категории нет в данных")
-            context_parts.append("  * ВСЕГДА включай ВСЕ запрошенные категории - если указано 3 категории, должно быть 3 раздела в отчете")
-            context_parts.append("- При составлении таблиц с итогами:")
-            context_parts.append("  * Добавляй итоговую строку для КАЖДОЙ категории (сумма количества и стоимости по категории)")
-            context_parts.append("  * Добавляй ОБЩУЮ итоговую строку в конце (сумма по всем категориям)")
-            context_parts.append("  * НЕ оставляй пустых ячеек - если данных нет, указывай 0 или 'Нет данных'")
-    
-    # Сотрудники (для визуализации)
-    # ВАЖНО: Включаем ВСЕХ сотрудников, включая прошлых/исторических
-    employees = user_data.get('employees', [])
-    if employees:
-        total_salary = sum(e.get('salary', 0) for e in employees if isinstance(e.get('salary'), (int, float)))
-        avg_salary = total_salary / len(employees) if employees else 0
-        context_parts.append(f"\nСОТРУДНИКИ: {len(employees)} человек, фонд {total_salary:,.0f} ₽, средняя зарплата {avg_salary:,.0f} ₽")
-        
-        # Полный список сотрудников (ВСЕХ, включая исторические данные)
-        context_parts.append("ПОЛНЫЙ СПИСОК СОТРУДНИКОВ (включая прошлых):")
-        for emp in employees:  # Включаем всех сотрудников без ограничений
-            fio = emp.get('fio', 'Не указано')
-            salary = emp.get('salary', 0)
-            position = emp.get('position', 'Не указана')
-            phone = emp.get('phone', 'Не указан')
-            email = emp.get('email', 'Не указан')
-            # Включаем все поля сотрудника для полной информации
-            context_parts.append(f"  - СОТРУДНИК: '{fio}' | Должность: '{position}' | Зарплата: {salary:,.0f} ₽ | Телефон: {phone} | Email: {email}")
-        context_parts.append("\nКРИТИЧЕСКИ ВАЖНО ДЛЯ СОТРУДНИКОВ:")
-        context_parts.append("- Всегда используй ФИО сотрудников из поля 'СОТРУДНИК', НИКОГДА не используй числовые ID!")
-        context_parts.append("- AI должен видеть и анализировать ВСЕХ сотрудников, включая тех, которые были добавлены ранее или уже не работают!")
-    
-    # Календарь
-    calendar_events = user_data.get('calendarEvents', [])
-    if calendar_events:
-        context_parts.append(f"\nКАЛЕНДАРЬ: {len(calendar_events)} событий")
-        upcoming = [e for e in calendar_events if e.get('date')]
-        upcoming.sort(key=lambda x: x.get('date', ''))
-        upcoming = upcoming[:3]  # Берем только 3 ближайших
-        if upcoming:
-            for e in upcoming:
-                event_id = e.get('id', '')
-                title = e.get('title', 'Событие')
-                date = e.get('date', '')
-                # Извлекаем дату в формате ISO
-                iso_date = ''
-                if date:
-                    try:
-                        event_date = datetime.fromisoformat(date.replace('Z', '+00:00'))
-                        iso_date = event_date.strftime('%Y-%m-%dT%H:%M')
-                    except:
-                        if 'T' in date:
-                            iso_date = date[:16]
-                        else:
-                            iso_date = date
-                context_parts.append(f"  - ID: {event_id} | '{title}' | {iso_date}")
-    
-    # Налоги
-    taxes_data = user_data.get('taxesData', {})
-    if taxes_data:
-        context_parts.append(f"\nНАЛОГИ:")
-        tax_names = {
-            'profit': 'Налог на прибыль',
-            'vat': 'НДС',
-            'property': 'Налог на имущество',
-            'insurance': 'Страховые взносы'
-        }
-        total_tax_debt = 0
-        for tax_id, tax_data in taxes_data.items():
-            debt = tax_data.get('debt', 0)
-            if isinstance(debt, (int, float)) and debt > 0:
-                tax_name = tax_names.get(tax_id, tax_id)
-                context_parts.append(f"  - {tax_name}: {debt:,.0f} ₽")
-                total_tax_debt += debt
-        if total_tax_debt > 0:
-            context_parts.append(f"Общая задолженность по налогам: {total_tax_debt:,.0f} ₽")
-    
-    # Коммунальные услуги
-    utilities_data = user_data.get('utilitiesData', {})
-    if utilities_data:
-        context_parts.append(f"\nКОММУНАЛЬНЫЕ УСЛУГИ:")
-        util_names = {
-            'electricity': 'Электричество',
-            'water': 'Водоснабжение',
-            'heating': 'Отопление',
-            'waste': 'Вывоз ТКО',
-            'security': 'Охранные услуги',
-            'internet': 'Интернет'
-        }
-        total_utilities_debt = 0
-        for util_id, util_data in utilities_data.items():
-            debt = util_data.get('debt', 0)
-            if isinstance(debt, (int, float)) and debt > 0:
-                util_name = util_names.get(util_id, util_id)
-                context_parts.append(f"  - {util_name}: {debt:,.0f} ₽")
-                total_utilities_debt += debt
-        if total_utilities_debt > 0:
-            context_parts.append(f"Общая задолженность по коммунальным услугам: {total_utilities_debt:,.0f} ₽")
-    
-    # Документы
-    documents = user_data.get('documents', [])
-    if documents:
-        context_parts.append(f"\nДОКУМЕНТЫ: {len(documents)} файлов")
-        for doc in documents[:3]:  # Берем первые 3, чтобы не перегружать контекст
-            name = doc.get('name', 'Без названия')
-            size = doc.get('size', 0)
-            doc_type = doc.get('type', 'неизвестный тип')
-            context_parts.append(f"  - {name} ({doc_type}, {size} байт)")
-            # Содержимое документов передается отдельно через файлы
-    
-    return "\n".join(context_parts) if context_parts else "Данные отсутствуют"
-
-
 def find_event_smart(calendar_events, identifier):
     """
     Умный поиск события в календаре по различным критериям:
@@ -867,67 +616,10 @@ def find_event_smart(calendar_events, identifier):
     - Точное название
     - Часть названия
     - Описание события
-    - Дата события
+    - Ключевые слова и нечеткое совпадение (entity_resolver)
+    - Дата события ("завтра", "в пятницу", "15 декабря в 10:00" - relative_dates)
     """
-    if not calendar_events or not identifier:
-        return None
-    
-    identifier = identifier.strip()
-    identifier_lower = identifier.lower().strip()
-    
-    # Сначала ищем по точному ID
-    for event in calendar_events:
-        if str(event.get('id', '')) == identifier:
-            logger.info(f"Событие найдено по точному ID: {identifier}")
-            return str(event.get('id', ''))
-    
-    # Потом по точному названию (регистр не важен)
-    for event in calendar_events:
-        event_title = event.get('title', '').lower().strip()
-        if event_title == identifier_lower:
-            logger.info(f"Событие найдено по точному названию: '{event.get('title')}'")
-            return str(event.get('id', ''))
-    
-    # Поиск по части названия
-    for event in calendar_events:
-        event_title = event.get('title', '').lower().strip()
-        if identifier_lower in event_title or event_title in identifier_lower:
-            logger.info(f"Событие найдено по части названия: '{event.get('title')}'")
-            return str(event.get('id', ''))
-    
-    # Поиск по описанию
-    for event in calendar_events:
-        event_description = event.get('description', '').lower().strip()
-        if event_description and identifier_lower in event_description:
-            logger.info(f"Событие найдено по описанию: '{event.get('title')}'")
-            return str(event.get('id', ''))
-    
-    # Поиск по ключевым словам в названии
-    identifier_words = [w for w in identifier_lower.split() if len(w) > 2]  # Короткие слова игнорируем
-    if identifier_words:
-        best_match = None
-        best_score = 0
-        
-        for event in calendar_events:
-            event_title = event.get('title', '').lower()
-            event_desc = event.get('description', '').lower()
-            event_text = f"{event_title} {event_desc}"
-            
-            score = 0
-            for word in identifier_words:
-                if word in event_text:
-                    score += 1
-            
-            if score > best_score and score >= len(identifier_words) * 0.5:  # Нужно совпадение хотя бы половины слов
-                best_score = score
-                best_match = event
-        
-        if best_match:
-            logger.info(f"Событие найдено по ключевым словам: '{best_match.get('title')}' (score: {best_score})")
-            return str(best_match.get('id', ''))
-    
-    logger.warning(f"Событие не найдено по идентификатору: '{identifier}'")
-    return None
+    return entity_resolver.resolve('event', calendar_events, identifier)
 
 
 def find_folder_smart(folders, identifier):
@@ -937,34 +629,7 @@ def find_folder_smart(folders, identifier):
     - Точное название
     - Часть названия
     """
-    if not folders or not identifier:
-        return None
-    
-    identifier = identifier.strip()
-    identifier_lower = identifier.lower().strip()
-    
-    # Сначала ищем по точному ID
-    for folder in folders:
-        if str(folder.get('id', '')) == identifier:
-            logger.info(f"Папка найдена по точному ID: {identifier}")
-            return str(folder.get('id', ''))
-    
-    # Потом по точному названию (регистр не важен)
-    for folder in folders:
-        folder_name = folder.get('name', '').lower().strip()
-        if folder_name == identifier_lower:
-            logger.info(f"Папка найдена по точному названию: '{folder.get('name')}'")
-            return str(folder.get('id', ''))
-    
-    # Поиск по части названия
-    for folder in folders:
-        folder_name = folder.get('name', '').lower().strip()
-        if identifier_lower in folder_name or folder_name in identifier_lower:
-            logger.info(f"Папка найдена по части названия: '{folder.get('name')}'")
-            return str(folder.get('id', ''))
-    
-    logger.warning(f"Папка не найдена по идентификатору: '{identifier}'")
-    return None
+    return entity_resolver.resolve('folder', folders, identifier)
 
 
 def find_inventory_item_smart(inventory_items, identifier):
@@ -974,34 +639,7 @@ def find_inventory_item_smart(inventory_items, identifier):
     - Точное название
     - Часть названия
     """
-    if not inventory_items or not identifier:
-        return None
-    
-    identifier = identifier.strip()
-    identifier_lower = identifier.lower().strip()
-    
-    # Сначала ищем по точному ID
-    for item in inventory_items:
-        if str(item.get('id', '')) == identifier:
-            logger.info(f"Товар найден по точному ID: {identifier}")
-            return str(item.get('id', ''))
-    
-    # Потом по точному названию (регистр не важен)
-    for item in inventory_items:
-        item_name = item.get('name', '').lower().strip()
-        if item_name == identifier_lower:
-            logger.info(f"Товар найден по точному названию: '{item.get('name')}'")
-            return str(item.get('id', ''))
-    
-    # Поиск по части названия
-    for item in inventory_items:
-        item_name = item.get('name', '').lower().strip()
-        if identifier_lower in item_name or item_name in identifier_lower:
-            logger.info(f"Товар найден по части названия: '{item.get('name')}'")
-            return str(item.get('id', ''))
-    
-    logger.warning(f"Товар не найден по идентификатору: '{identifier}'")
-    return None
+    return entity_resolver.resolve('inventory_item', inventory_items, identifier)
 
 
 def find_employee_folder_smart(folders, identifier):
@@ -1011,34 +649,7 @@ def find_employee_folder_smart(folders, identifier):
     - Точное название
     - Часть названия
     """
-    if not folders or not identifier:
-        return None
-    
-    identifier = identifier.strip()
-    identifier_lower = identifier.lower().strip()
-    
-    # Сначала ищем по точному ID
-    for folder in folders:
-        if str(folder.get('id', '')) == identifier:
-            logger.info(f"Папка должности найдена по точному ID: {identifier}")
-            return str(folder.get('id', ''))
-    
-    # Потом по точному названию (регистр не важен)
-    for folder in folders:
-        folder_name = folder.get('name', '').lower().strip()
-        if folder_name == identifier_lower:
-            logger.info(f"Папка должности найдена по точному названию: '{folder.get('name')}'")
-            return str(folder.get('id', ''))
-    
-    # Поиск по части названия
-    for folder in folders:
-        folder_name = folder.get('name', '').lower().strip()
-        if identifier_lower in folder_name or folder_name in identifier_lower:
-            logger.info(f"Папка должности найдена по части названия: '{folder.get('name')}'")
-            return str(folder.get('id', ''))
-    
-    logger.warning(f"Папка должности не найдена по идентификатору: '{identifier}'")
-    return None
+    return entity_resolver.resolve('employee_folder', folders, identifier)
 
 
 def find_employee_smart(employees, identifier):
@@ -1049,49 +660,7 @@ def find_employee_smart(employees, identifier):
     - Телефон
     - Email
     """
-    if not employees or not identifier:
-        return None
-    
-    identifier = identifier.strip()
-    identifier_lower = identifier.lower().strip()
-    
-    # Сначала ищем по точному ID
-    for employee in employees:
-        if str(employee.get('id', '')) == identifier:
-            logger.info(f"Сотрудник найден по точному ID: {identifier}")
-            return str(employee.get('id', ''))
-    
-    # Потом по точному ФИО (регистр не важен)
-    for employee in employees:
-        employee_fio = employee.get('fio', '').lower().strip()
-        if employee_fio == identifier_lower:
-            logger.info(f"Сотрудник найден по точному ФИО: '{employee.get('fio')}'")
-            return str(employee.get('id', ''))
-    
-    # Поиск по части ФИО
-    for employee in employees:
-        employee_fio = employee.get('fio', '').lower().strip()
-        if identifier_lower in employee_fio or employee_fio in identifier_lower:
-            logger.info(f"Сотрудник найден по части ФИО: '{employee.get('fio')}'")
-            return str(employee.get('id', ''))
-    
-    # Поиск по телефону
-    for employee in employees:
-        employee_phone = employee.get('phone', '').lower().strip().replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-        identifier_clean = identifier_lower.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-        if employee_phone and identifier_clean in employee_phone or employee_phone in identifier_clean:
-            logger.info(f"Сотрудник найден по телефону: '{employee.get('phone')}'")
-            return str(employee.get('id', ''))
-    
-    # Поиск по email
-    for employee in employees:
-        employee_email = employee.get('email', '').lower().strip()
-        if employee_email == identifier_lower or identifier_lower in employee_email:
-            logger.info(f"Сотрудник найден по email: '{employee.get('email')}'")
-            return str(employee.get('id', ''))
-    
-    logger.warning(f"Сотрудник не найден по идентификатору: '{identifier}'")
-    return None
+    return entity_resolver.resolve('employee', employees, identifier)
 
 
 def process_chat_request_async(request_id):
@@ -1126,12 +695,17 @@ def process_chat_request_async(request_id):
         user_data = chat_request.user_data
         files = chat_request.files_data
         
-        # Проверяем сообщение на модерацию
+        # Проверяем сообщение на модерацию (результат проверки в chat_api берется из кэша модератора)
         message_blocked = False
         moderation_result = ContentModerator.check_message(message)
         if not moderation_result['allowed']:
             message_blocked = True
         
+        # Вопросы об итогах (баланс, фонд оплаты труда, задолженности) отвечаются по шаблону без LLM
+        fast_result = None
+        if not message_blocked and not files:
+            fast_result = fast_answers.answer(message, user_data)
+        
         # Настройки OpenRouter
         OPENROUTER_API_KEY = getattr(settings, 'OPENROUTER_API_KEY', '').strip() if getattr(settings, 'OPENROUTER_API_KEY', '') else ''
         OPENROUTER_URL = getattr(settings, 'OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
@@ -1149,7 +723,7 @@ def process_chat_request_async(request_id):
         
         logger.info(f"🔑 OpenRouter настройки: URL={OPENROUTER_URL}, MODEL={OPENROUTER_MODEL}, API_KEY={api_key_preview}")
         
-        if not OPENROUTER_API_KEY:
+        if not OPENROUTER_API_KEY and fast_result is None:
             logger.error(f"❌ API ключ OpenRouter не настроен!")
             close_old_connections()
             chat_request.status = ChatRequest.STATUS_FAILED
@@ -1167,263 +741,70 @@ def process_chat_request_async(request_id):
         # Формируем историю сообщений для модели
         messages = []
         
-        # Формируем контекст пользователя
-        user_context = format_user_context(user_data)
+        # Формируем контекст пользователя в пределах CHAT_CONTEXT_MAX_TOKENS (релевантные сообщению разделы - первыми)
+        user_context, context_report = build_user_context(
+            user_data, message, section_hashes=chat_request.user_data_hashes or None
+        )
+        if context_report['dropped']:
+            logger.info(
+                f"✂️ Контекст пользователя сокращен до ~{context_report['estimated_tokens']} токенов "
+                f"(лимит {context_report['max_tokens']}), пропущено строк: {context_report['dropped']}"
+            )
         
-        # Получаем текущую дату для вычисления относительных дат
+        # Системный промпт: неизменная часть собрана один раз (prompts.py), per-request - только данные и дата.
+        # Инструкции помечаются для кэша промптов провайдера (CHAT_PROMPT_CACHE_CONTROL)
         now = timezone.now()
-        current_date_str = now.strftime('%Y-%m-%d')
-        current_time_str = now.strftime('%H:%M')
-        current_datetime_str = now.strftime('%Y-%m-%d %H:%M')
-        current_date_readable = now.strftime('%d %B %Y года')
-        
-        # Добавляем системный промпт (сокращенная версия для скорости)
-        system_prompt = f"""Ты - профессиональный AI-ассистент. Работай СТРОГО в деловом стиле. Отвечай кратко и точно.
-
-ВАЖНО - ДОСТУП К ДАННЫМ:
-- Тебе предоставлены ВСЕ данные пользователя, включая ВСЮ инвентаризацию (все товары, включая прошлые)
-- Тебе предоставлены ВСЕ сотрудники (включая тех, кто был добавлен ранее или уже не работает)
-- Анализируй ВСЕ данные, включая исторические записи
-- Когда пользователь спрашивает про товары/сотрудников, показывай ВСЕ доступные данные из контекста
-
-КРИТИЧЕСКИ ВАЖНО - ТОЧНОСТЬ ВЫПОЛНЕНИЯ ЗАПРОСОВ:
-1. ВНИМАТЕЛЬНО АНАЛИЗИРУЙ ЗАПРОС ПОЛЬЗОВАТЕЛЯ:
-   - Прочитай запрос ПОЛНОСТЬЮ перед ответом
-   - Определи ВСЕ требования пользователя (категории, параметры, условия)
-   - Если пользователь просит несколько категорий (например: "люкс, сьют, стандарт") - ВКЛЮЧИ ВСЕ указанные категории
-   - Если пользователь просит итоги/суммы - ОБЯЗАТЕЛЬНО добавь итоговые строки для каждой категории и общий итог
-   - Если запрос неполный или неясный - ЗАДАЙ УТОЧНЯЮЩИЙ ВОПРОС перед выполнением
-
-2. ПРОВЕРКА ДОСТУПНОСТИ ДАННЫХ:
-   - Перед ответом проверь, есть ли в контексте ВСЕ необходимые данные
-   - Если данных нет или они неполные - СПРОСИ пользователя или укажи, что данные отсутствуют
-   - НИКОГДА не добавляй строки с пустыми данными в таблицы без предупреждения
-
-3. ПОЛНОТА ВЫПОЛНЕНИЯ ЗАПРОСА:
-   - Перед отправкой ответа ПРОВЕРЬ, что выполнены ВСЕ пункты запроса пользователя
-   - Если в запросе было несколько требований - выполни ВСЕ, не пропускай ни одного
-   - Если не можешь выполнить часть запроса - явно укажи это и объясни причину
-
-4. ОБЯЗАТЕЛЬНЫЙ ВОПРОС ПОСЛЕ ОТВЕТА:
-   - ПОСЛЕ каждого ответа ОБЯЗАТЕЛЬНО спрашивай: "Нужно ли что-то добавить или изменить в ответе?"
-   - Это позволяет пользователю уточнить или дополнить запрос
-   - Примеры формулировок:
-     * "Нужно ли что-то добавить или изменить?"
-     * "Что-то еще уточнить или дополнить?"
-     * "Есть ли что-то еще, что нужно включить в отчет?"
-
-5. ПРАВИЛЬНОЕ СОСТАВЛЕНИЕ ТАБЛИЦ:
-   - ВСЕГДА заполняй ВСЕ ячейки таблицы - не оставляй пустых значений без объяснения
-   - Если данные отсутствуют - укажи "Нет данных" или "Не указано", но НЕ оставляй пустую ячейку
-   - Если запрошены итоги - добавь:
-     * Итоговую строку для КАЖДОЙ категории (если запрос включает несколько категорий)
-     * ОБЩУЮ итоговую строку в конце таблицы
-   - Группируй данные по категориям (папкам) четко и последовательно
-   - Проверь, что все запрошенные категории присутствуют в таблице
-
-ТЕКУЩАЯ ДАТА И ВРЕМЯ:
-СЕЙЧАС: {current_datetime_str} ({current_date_readable})
-Используй ЭТУ дату как базовую для вычисления относительных дат ("завтра", "через неделю" и т.д.).
-
-ПОНИМАНИЕ ЕСТЕСТВЕННОГО ЯЗЫКА:
-Пользователь пишет ОБЫЧНЫМ языком (например: "добавь встречу", "удали совещание", "перенеси на завтра", "сделай отчет по инвентаризации").
-ТЫ ДОЛЖЕН сам переводить эти просьбы в технические команды или действия.
-НИКОГДА НЕ ПРОСИ пользователя писать команды вручную (типа CREATE_EVENT или UPDATE_EVENT).
-
-АНАЛИЗ ЗАПРОСОВ:
-1. ПАРСИНГ ЗАПРОСА:
-   - Разбери запрос на составные части (категории, параметры, условия)
-   - Определи все ключевые слова и требования
-   - Пример: "отчет по инвентаризации, люкс, сьют, стандарт, итоги" содержит:
-     * Тип запроса: отчет
-     * Область: инвентаризация
-     * Категории: люкс, сьют, стандарт (3 категории!)
-     * Требование: итоги (суммы)
-   
-2. УТОЧНЯЮЩИЕ ВОПРОСЫ:
-   - Если запрос неполный или неясный - СПРОСИ перед выполнением
-   - Примеры ситуаций для вопросов:
-     * Не указаны категории/параметры: "Какие именно категории включить в отчет?"
-     * Неясно, какие данные нужны: "Нужны ли все товары или только определенные?"
-     * Отсутствуют данные: "В данных нет категории 'стандарт'. Что делать?"
-   - Но если запрос ЯСНЫЙ и ПОЛНЫЙ - выполняй сразу без вопросов
-
-3. ПРИМЕРЫ ТОЧНОГО ВЫПОЛНЕНИЯ:
-   - "Отчет по инвентаризации: люкс, сьют, стандарт, итоги" → ВКЛЮЧИ все 3 категории + итоги по каждой + общий итог
-   - "Покажи сотрудников" → Покажи ВСЕХ сотрудников из контекста
-   - "Таблица товаров" → Если не указаны категории, покажи ВСЕ товары или СПРОСИ, какие нужны
-
-4. ПРОВЕРКА ПЕРЕД ОТВЕТОМ:
-   - Выполнил ли я ВСЕ требования из запроса?
-   - Включены ли ВСЕ указанные категории/элементы?
-   - Добавлены ли итоги, если они были запрошены?
-   - Нет ли пустых ячеек в таблице без объяснения?
-   - Задал ли я вопрос "Нужно ли что-то добавить?" после ответа?
-
-Просто выполняй действие и подтверждай его словами, но ТОЧНО и ПОЛНОСТЬЮ.
-
-ВОЗМОЖНОСТИ И КОМАНДЫ (ДЛЯ ТЕБЯ):
-- Анализ: чеки, инвентаризация, сотрудники, календарь, налоги, коммунальные услуги, документы, балансы
-- Действия (пиши их на отдельной строке):
-  * CREATE_EVENT: название|дата ISO|описание
-  * DELETE_EVENT: название
-  * UPDATE_EVENT: {{"action":"UPDATE_EVENT","event":"ID","title":"...","date":"YYYY-MM-DDTHH:mm","description":"..."}}
-  * DELETE_DOCUMENT: название
-  * RENAME_DOCUMENT: старое|новое
-  * SEND_SUPPORT_MESSAGE: тема|текст
-  * CREATE_FOLDER: название_папки
-  * DELETE_FOLDER: название_папки
-  * UPDATE_FOLDER: старое_название|новое_название
-  * CREATE_INVENTORY_ITEM: название|количество|цена|папка
-  * DELETE_INVENTORY_ITEM: название_товара
-  * UPDATE_INVENTORY_ITEM: {{"action":"UPDATE_INVENTORY_ITEM","item":"название","name":"...","quantity":10,"price":1000,"folder":"папка"}}
-  * CREATE_EMPLOYEE_FOLDER: название_должности
-  * DELETE_EMPLOYEE_FOLDER: название_должности
-  * UPDATE_EMPLOYEE_FOLDER: старое_название|новое_название
-  * CREATE_EMPLOYEE: ФИО|телефон|почта|зарплата|должность
-  * DELETE_EMPLOYEE: ФИО_или_телефон_или_почта
-  * UPDATE_EMPLOYEE: {{"action":"UPDATE_EMPLOYEE","employee":"ФИО","fio":"...","phone":"...","email":"...","salary":50000,"folder":"должность"}}
-
-ВАЖНО ДЛЯ КАЛЕНДАРЯ:
-1. Если пользователь пишет "запланируй", "добавь", "напомни" -> используй CREATE_EVENT.
-   - Пример: "Напомни позвонить маме завтра в 5 вечера" -> вычисли дату завтра от {current_date_str} и создай CREATE_EVENT: Звонок маме|YYYY-MM-DDTHH:mm|Позвонить маме
-2. Если пользователь пишет "удали", "отмени" -> используй DELETE_EVENT.
-   - Пример: "Удали встречу с клиентом" -> DELETE_EVENT: Встреча с клиентом
-3. Если пользователь пишет "перенеси", "измени" -> используй UPDATE_EVENT.
-   - Пример: "Перенеси совещание на послезавтра на 10 утра" -> вычисли дату послезавтра от {current_date_str} и создай {{"action":"UPDATE_EVENT", "event":"Совещание", "date":"YYYY-MM-DDTHH:mm"}}
-
-ОБЯЗАТЕЛЬНО вычисляй точную дату из относительных формулировок ОТНОСИТЕЛЬНО ТЕКУЩЕЙ ДАТЫ ({current_date_str}):
-- "через неделю" = {current_date_str} + 7 дней
-- "завтра" = {current_date_str} + 1 день
-- "послезавтра" = {current_date_str} + 2 дня
-- "через месяц" = {current_date_str} + 30 дней
-- "в 15:00" = 15:00
-- "в полдень" = 12:00
-- "в 5 вечера" = 17:00
-- "в 10 утра" = 10:00
-
-Формат даты СТРОГО: YYYY-MM-DDTHH:mm
-
-ВАЖНО:
-- Команду пиши на отдельной строке.
-- Пользователю отвечай вежливо: "Хорошо, я запланировал...", "Событие удалено.", "Встреча перенесена."
-- НЕ показывай пользователю технические детали команд, если это не требуется для отладки.
-
-ВИЗУАЛИЗАЦИЯ:
-- Таблицы Markdown: | Колонка1 | Колонка2 |\n|:---|:---:|\n| Данные1 | Данные2 |
-- Графики и диаграммы: используй простые команды [CHART_ТИП_ДАННЫХ:тип_графика]
-
-ВИЗУАЛИЗАЦИЯ ДАННЫХ:
-Когда пользователь просит показать график, диаграмму или визуализацию данных, используй ПРОСТЫЕ КОМАНДЫ:
-[CHART_ТИП_ДАННЫХ:тип_графика]
-
-Типы данных:
-- RECEIPTS или ЧЕКИ - для графиков по чекам/операциям
-- INVENTORY или ИНВЕНТАРИЗАЦИЯ - для графиков по инвентаризации
-- EMPLOYEES или СОТРУДНИКИ - для графиков по сотрудникам
-- TAXES или НАЛОГИ - для графиков по налогам
-- UTILITIES или КОММУНАЛЬНЫЕ - для графиков по коммунальным услугам
-- BALANCE или БАЛАНС - для графиков балансов счетов
-
-Типы графиков:
-- line: линейный график (для динамики по времени)
-- bar: столбчатая диаграмма (для сравнения)
-- pie: круговая диаграмма (для распределения)
-- doughnut: кольцевая диаграмма (для распределения)
-- horizontal: горизонтальная столбчатая (для топ-списков)
-
-ПРИМЕРЫ ИСПОЛЬЗОВАНИЯ:
-- "Покажи график расходов" → [CHART_RECEIPTS:pie]
-- "Создай круговую диаграмму инвентаризации" → [CHART_INVENTORY:pie]
-- "Сравни зарплаты сотрудников" → [CHART_EMPLOYEES:bar]
-- "Покажи распределение задолженностей по налогам" → [CHART_TAXES:doughnut]
-- "График коммунальных услуг" → [CHART_UTILITIES:pie]
-- "Сравни балансы счетов" → [CHART_BALANCE:bar]
-
-ВАЖНО: 
-- Используй ТОЛЬКО простые команды [CHART_ТИП:тип_графика]
-- НЕ создавай JSON вручную - система сама извлечет данные из контекста пользователя
-- Если данных недостаточно, сообщи об этом пользователю
-- Выбирай подходящий тип графика: pie/doughnut для распределения, bar для сравнения, line для динамики
-
-ПРИМЕР ПРАВИЛЬНОГО ВЫПОЛНЕНИЯ ЗАПРОСА:
-Запрос: "Сделай отчет по инвентаризации. первая люкс. вторая сьют. третья стандарт. итоги. не включай ничего другого."
-
-ПРАВИЛЬНЫЙ АЛГОРИТМ:
-1. Парсинг запроса:
-   - Тип: отчет
-   - Область: инвентаризация
-   - Категории: люкс (первая), сьют (вторая), стандарт (третья) - ВСЕГО 3 категории
-   - Требование: итоги
-   - Ограничение: только эти категории, ничего другого
-
-2. Поиск данных:
-   - Ищу в контексте папки с названиями, содержащими "люкс" (может быть "№303 (Люкс)", "Люкс", "люкс")
-   - Ищу папки с названиями, содержащими "сьют" (может быть "№202 (Сьют)", "Сьют")
-   - Ищу папки с названиями, содержащими "стандарт" (может быть "Стандарт", "№101 (Стандарт)")
-
-3. Составление таблицы:
-   - Раздел 1: ВСЕ товары из категории "люкс" (все папки, содержащие "люкс")
-   - Раздел 2: ВСЕ товары из категории "сьют" (все папки, содержащие "сьют")
-   - Раздел 3: ВСЕ товары из категории "стандарт" (все папки, содержащие "стандарт")
-   - Итоговая строка для категории "люкс" (сумма количества и стоимости)
-   - Итоговая строка для категории "сьют" (сумма количества и стоимости)
-   - Итоговая строка для категории "стандарт" (сумма количества и стоимости)
-   - ОБЩАЯ итоговая строка в конце (сумма по всем трем категориям)
-
-4. Проверка:
-   - ✓ Включены все 3 категории? Да
-   - ✓ Все товары из каждой категории показаны? Да
-   - ✓ Есть итоги по каждой категории? Да
-   - ✓ Есть общий итог? Да
-   - ✓ Включено только запрошенное, ничего лишнего? Да
-
-5. После ответа:
-   - Обязательно спросить: "Нужно ли что-то добавить или изменить в отчете?"
-
-НЕПРАВИЛЬНО:
-- Показать только 2 категории из 3 запрошенных
-- Показать товары из других категорий
-- Оставить пустые ячейки в таблице
-- Не добавить итоги
-- Не спросить после ответа
-
-СТИЛЬ: Деловой, формальный, без анекдотов и шуток. Для данных используй таблицы, для визуализации - графики.
-
-ОБЯЗАТЕЛЬНО: После КАЖДОГО ответа добавляй в конце: "Нужно ли что-то добавить или изменить?"
-
-Данные пользователя:
-""" + user_context  # Включаем ВСЕ данные пользователя без ограничений (инвентаризация, сотрудники, история)
+        system_message = prompts.build_system_message(
+            user_context, now, cache_control=getattr(settings, 'CHAT_PROMPT_CACHE_CONTROL', True)
+        )
         
-        messages.append({
-            "role": "system",
-            "content": system_prompt
-        })
+        messages.append(system_message)
         
         # Обрабатываем файлы, если они есть
         image_files = []  # Список изображений для отправки в vision модель
         file_contents = []  # Список текстового содержимого файлов
         
         if files:
+            # Извлекаем текст из всех файлов параллельно в пуле процессов (порядок сохраняется)
+            extractor = extraction_pool.get_extractor()
+
+            def extract_file(file):
+                # Файлы из хранилища читаются с диска, старые записи - из base64
+                file_path = blob_store.resolve_file_path(file)
+                file_data = None if file_path else blob_store.resolve_file_data(file)
+                if not file_path and not file_data:
+                    return None
+                return extraction_cache.cached_process_file(
+                    file.get('name', ''), file.get('type', 'неизвестный тип'), file_data,
+                    file_path=file_path,
+                    content_sha256=file.get('blob') if file_path else None,
+                    extractor=extractor,
+                    max_chars=FILE_TEXT_PREVIEW_CHARS
+                )
+
+            extraction_results = extraction_pool.process_files_parallel(
+                extract_file, [file if isinstance(file, dict) else {} for file in files]
+            )
+
             for i, file in enumerate(files):
                 try:
                     file_name = file.get('name', f'Файл {i+1}')
                     file_type = file.get('type', 'неизвестный тип')
-                    file_data = file.get('data', '')
+                    extraction_result = extraction_results[i]
                     
-                    if not file_data:
+                    if extraction_result is None:
                         file_contents.append(f"Файл {i+1} ({file_name}): [Файл пуст или данные не получены]")
                         continue
                     
-                    # Обрабатываем файл с помощью модуля file_processor
-                    try:
-                        extracted_text, image_base64 = process_file(file_name, file_type, file_data)
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке файла '{file_name}': {str(e)}", exc_info=True)
+                    if isinstance(extraction_result, Exception):
+                        e = extraction_result
+                        logger.error(f"Ошибка при обработке файла '{file_name}': {str(e)}", exc_info=e)
                         error_msg = f"[Ошибка при обработке файла '{file_name}': {str(e)}]"
                         file_contents.append(f"Файл {i+1} ({file_name}): {error_msg}")
                         continue
                     
+                    extracted_text, image_base64 = extraction_result
+                    
                     if image_base64:
                         # Это изображение - добавляем в список для отправки в vision модель
                         try:
@@ -1455,9 +836,9 @@ def process_chat_request_async(request_id):
                     else:
                         # Это текстовый файл или документ
                         if extracted_text and not extracted_text.startswith('[') and not extracted_text.startswith('Изображение'):
-                            text_preview = extracted_text[:1500]  # Ограничиваем до 1500 символов
-                            if len(extracted_text) > 1500:
-                                text_preview += "\n... [текст обрезан, показаны первые 1500 символов]"
+                            text_preview = extracted_text[:FILE_TEXT_PREVIEW_CHARS]
+                            if len(extracted_text) > FILE_TEXT_PREVIEW_CHARS:
+                                text_preview += f"\n... [текст обрезан, показаны первые {FILE_TEXT_PREVIEW_CHARS} символов]"
                             file_contents.append(f"Файл {i+1} ({file_name}):\n{text_preview}")
                         else:
                             file_contents.append(f"Файл {i+1} ({file_name}): {extracted_text}")
@@ -1528,10 +909,7 @@ def process_chat_request_async(request_id):
             if system_msg:
                 messages = [system_msg] + other_messages
             else:
-                messages.insert(0, {
-                    "role": "system",
-                    "content": system_prompt
-                })
+                messages.insert(0, system_message)
         
         # Подготавливаем payload для запроса
         payload = {
@@ -1541,7 +919,12 @@ def process_chat_request_async(request_id):
             "max_tokens": 1200,
             "top_p": 0.9,
             "frequency_penalty": 0.1,
-            "stream": False
+            # Потоковый режим: фрагменты ответа сразу уходят клиенту через /api/chat-stream/
+            "stream": True,
+            # Блок usage в ответе (включая cached_tokens) для метрик
+            "usage": {"include": True},
+            # Действия AI - вызовами инструментов (tools), текстовые команды остаются запасным вариантом
+            **ai_tools.request_options(OPENROUTER_MODEL)
         }
         
         # Заголовки для OpenRouter
@@ -1560,23 +943,69 @@ def process_chat_request_async(request_id):
         # Отслеживание времени начала LLM обработки
         llm_start_time = timezone.now()
         
-        # Отправляем запрос в OpenRouter
-        try:
-            logger.info(f"⏳ Отправка POST запроса в {OPENROUTER_URL}...")
-            response = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=90)
-            logger.info(f"📥 Получен ответ от OpenRouter: status_code={response.status_code}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Ошибка при отправке запроса в OpenRouter: {str(e)}", exc_info=True)
-            close_old_connections()
-            chat_request.status = ChatRequest.STATUS_FAILED
-            chat_request.error = f'Ошибка подключения к OpenRouter: {str(e)}'
-            chat_request.save()
-            return
+        # Одинаковый запрос (те же сообщения, данные пользователя и модель) может быть уже в кэше ответов,
+        # перефразированный вопрос при том же контексте - в семантическом кэше.
+        # Быстрый ответ по шаблону обрабатывается дальше так же, как ответ из кэша
+        cache_status = None  # Для метрик: exact / semantic / miss (None - кэши выключены)
+        semantic_context = None
+        if fast_result is not None:
+            response_cache_key, cached_result = None, fast_result
+        else:
+            response_cache_key, cached_result = response_cache.lookup(payload)
+            if cached_result is not None:
+                cache_status = 'exact'
+            elif semantic_cache.is_enabled() and not files:
+                semantic_context = semantic_cache.context_fingerprint(payload['model'], user_data, chat_history[-5:])
+                cached_result = semantic_cache.lookup(message, semantic_context)
+                cache_status = 'semantic' if cached_result is not None else 'miss'
+            elif response_cache_key is not None:
+                cache_status = 'miss'
         
-        if response.status_code == 200:
-            logger.info(f"✅ Успешный ответ от OpenRouter (200)")
-            result = response.json()
-            ai_response = result.get('choices', [{}])[0].get('message', {}).get('content', 'Извините, не удалось получить ответ.')
+        # Отправляем запрос в OpenRouter
+        if fast_result is not None:
+            logger.info(f"⚡ Ответ для запроса {request_id} собран по данным пользователя, запрос в OpenRouter не отправляется")
+            response = None
+        elif cached_result is not None:
+            logger.info(f"⚡ Ответ для запроса {request_id} взят из кэша ответов, запрос в OpenRouter не отправляется")
+            response = None
+        else:
+            try:
+                logger.info(f"⏳ Отправка POST запроса в {OPENROUTER_URL}...")
+                response = http_client.post('openrouter', OPENROUTER_URL, headers=headers, json=payload, stream=True)
+                logger.info(f"📥 Получен ответ от OpenRouter: status_code={response.status_code}")
+                # Модель без поддержки инструментов: повторяем запрос без tools
+                if 'tools' in payload and ai_tools.is_unsupported_error(response):
+                    response.close()
+                    ai_tools.mark_unsupported(OPENROUTER_MODEL)
+                    payload = {key: value for key, value in payload.items() if key not in ai_tools.REQUEST_FIELDS}
+                    response = http_client.post('openrouter', OPENROUTER_URL, headers=headers, json=payload, stream=True)
+                    logger.info(f"📥 Получен ответ от OpenRouter без tools: status_code={response.status_code}")
+            except requests.exceptions.RequestException as e:
+                logger.error(f"❌ Ошибка при отправке запроса в OpenRouter: {str(e)}", exc_info=True)
+                close_old_connections()
+                chat_request.status = ChatRequest.STATUS_FAILED
+                chat_request.error = f'Ошибка подключения к OpenRouter: {str(e)}'
+                chat_request.save()
+                return
+        
+        if cached_result is not None or response.status_code == 200:
+            if cached_result is not None:
+                result = cached_result
+                chat_stream.broker.publish(
+                    request_id, result.get('choices', [{}])[0].get('message', {}).get('content')
+                )
+            else:
+                logger.info(f"✅ Успешный ответ от OpenRouter (200)")
+                try:
+                    result = chat_stream.read_completion(response, request_id)
+                finally:
+                    # Возвращаем соединение в пул
+                    response.close()
+            ai_response = result.get('choices', [{}])[0].get('message', {}).get('content')
+            # Действия из вызовов инструментов; ответ только с вызовом инструмента получает текст-подтверждение
+            tool_commands = ai_tools.to_commands(result)
+            if not ai_response:
+                ai_response = ai_tools.describe(tool_commands) if tool_commands else 'Извините, не удалось получить ответ.'
             logger.info(f"📝 Получен ответ AI (длина: {len(ai_response)} символов): {ai_response[:100]}...")
             
             # Модерация ответа AI
@@ -1589,190 +1018,183 @@ def process_chat_request_async(request_id):
                 ai_response = moderation_result['filtered_response']
             
             # Обрабатываем действия (CREATE_EVENT, UPDATE_EVENT, DELETE_EVENT, DELETE_DOCUMENT, RENAME_DOCUMENT, SEND_SUPPORT_MESSAGE)
+            # Все команды ответа (текстовые, JSON, графики) находятся за один проход,
+            # дальше обработчики берут команды по имени в порядке приоритета
+            parsed_response = action_parser.parse(ai_response, tool_commands)
+            if parsed_response.commands:
+                logger.info(f"🔎 Команды в ответе AI: {[command.name for command in parsed_response.commands]}")
             action_result = None
             
             # СНАЧАЛА обрабатываем простые текстовые команды (они имеют приоритет)
-            if 'DELETE_EVENT:' in ai_response:
-                parts = ai_response.split('DELETE_EVENT:')
-                if len(parts) > 1:
-                    event_identifier = parts[1].strip().strip('"').strip("'").strip()
-                    # Убираем возможные переносы строк и лишние символы
-                    event_identifier = event_identifier.split('\n')[0].split('|')[0].strip()
-                    calendar_events = user_data.get('calendarEvents', [])
-                    
-                    logger.info(f"Поиск события для удаления: '{event_identifier}'")
-                    logger.info(f"Всего событий в календаре: {len(calendar_events)}")
-                    
-                    # Используем умный поиск событий
-                    event_id = find_event_smart(calendar_events, event_identifier)
-                    
-                    if event_id:
-                        action_result = {
-                            'action': 'delete_event',
-                            'id': event_id
-                        }
-                        logger.info(f"Команда удаления события создана: {action_result}")
-                        ai_response = parts[0].strip()
-                    else:
-                        logger.warning(f"Событие не найдено для удаления: '{event_identifier}'")
-                        logger.warning(f"Доступные события: {[{'id': e.get('id'), 'title': e.get('title')} for e in calendar_events]}")
+            command = parsed_response.text_command('DELETE_EVENT')
+            if command:
+                event_identifier = command.argument.strip().strip('"').strip("'").strip()
+                # Убираем возможные переносы строк и лишние символы
+                event_identifier = event_identifier.split('\n')[0].split('|')[0].strip()
+                calendar_events = user_data.get('calendarEvents', [])
+                
+                logger.info(f"Поиск события для удаления: '{event_identifier}'")
+                logger.info(f"Всего событий в календаре: {len(calendar_events)}")
+                
+                # Используем умный поиск событий
+                event_id = find_event_smart(calendar_events, event_identifier)
+                
+                if event_id:
+                    action_result = {
+                        'action': 'delete_event',
+                        'id': event_id
+                    }
+                    logger.info(f"Команда удаления события создана: {action_result}")
+                    ai_response = command.prefix
+                else:
+                    logger.warning(f"Событие не найдено для удаления: '{event_identifier}'")
+                    logger.warning(f"Доступные события: {[{'id': e.get('id'), 'title': e.get('title')} for e in calendar_events]}")
             
-            if not action_result and 'DELETE_DOCUMENT:' in ai_response:
-                parts = ai_response.split('DELETE_DOCUMENT:')
-                if len(parts) > 1:
-                    doc_identifier = parts[1].strip().strip('"').strip("'").strip()
-                    documents = user_data.get('documents', [])
-                    doc_id = None
-                    
-                    # Ищем по ID
+            command = parsed_response.text_command('DELETE_DOCUMENT')
+            if not action_result and command:
+                doc_identifier = command.argument.strip().strip('"').strip("'").strip()
+                documents = user_data.get('documents', [])
+                doc_id = None
+                
+                # Ищем по ID
+                for doc in documents:
+                    if str(doc.get('id', '')) == doc_identifier:
+                        doc_id = str(doc.get('id', ''))
+                        break
+                
+                # Ищем по названию
+                if not doc_id:
+                    doc_identifier_lower = doc_identifier.lower().strip()
                     for doc in documents:
-                        if str(doc.get('id', '')) == doc_identifier:
+                        doc_name = doc.get('name', '').lower().strip()
+                        if doc_name == doc_identifier_lower or doc_identifier_lower in doc_name:
                             doc_id = str(doc.get('id', ''))
                             break
-                    
-                    # Ищем по названию
-                    if not doc_id:
-                        doc_identifier_lower = doc_identifier.lower().strip()
+                
+                if doc_id:
+                    action_result = {
+                        'action': 'delete_document',
+                        'id': doc_id
+                    }
+                    ai_response = command.prefix
+            
+            command = parsed_response.text_command('RENAME_DOCUMENT')
+            if not action_result and command:
+                rename_data = command.argument.strip()
+                # Формат: старое_название|новое_название
+                if '|' in rename_data:
+                    rename_parts = rename_data.split('|')
+                    if len(rename_parts) >= 2:
+                        doc_identifier = rename_parts[0].strip().strip('"').strip("'").strip()
+                        new_name = rename_parts[1].strip().strip('"').strip("'").strip()
+                        documents = user_data.get('documents', [])
+                        doc_id = None
+                        
+                        # Ищем по ID или названию
                         for doc in documents:
-                            doc_name = doc.get('name', '').lower().strip()
-                            if doc_name == doc_identifier_lower or doc_identifier_lower in doc_name:
+                            if str(doc.get('id', '')) == doc_identifier:
                                 doc_id = str(doc.get('id', ''))
                                 break
-                    
-                    if doc_id:
-                        action_result = {
-                            'action': 'delete_document',
-                            'id': doc_id
-                        }
-                        ai_response = parts[0].strip()
-            
-            if not action_result and 'RENAME_DOCUMENT:' in ai_response:
-                parts = ai_response.split('RENAME_DOCUMENT:')
-                if len(parts) > 1:
-                    rename_data = parts[1].strip()
-                    # Формат: старое_название|новое_название
-                    if '|' in rename_data:
-                        rename_parts = rename_data.split('|')
-                        if len(rename_parts) >= 2:
-                            doc_identifier = rename_parts[0].strip().strip('"').strip("'").strip()
-                            new_name = rename_parts[1].strip().strip('"').strip("'").strip()
-                            documents = user_data.get('documents', [])
-                            doc_id = None
-                            
-                            # Ищем по ID или названию
+                        
+                        if not doc_id:
+                            doc_identifier_lower = doc_identifier.lower().strip()
                             for doc in documents:
-                                if str(doc.get('id', '')) == doc_identifier:
+                                doc_name = doc.get('name', '').lower().strip()
+                                if doc_name == doc_identifier_lower or doc_identifier_lower in doc_name:
                                     doc_id = str(doc.get('id', ''))
                                     break
-                            
-                            if not doc_id:
-                                doc_identifier_lower = doc_identifier.lower().strip()
-                                for doc in documents:
-                                    doc_name = doc.get('name', '').lower().strip()
-                                    if doc_name == doc_identifier_lower or doc_identifier_lower in doc_name:
-                                        doc_id = str(doc.get('id', ''))
-                                        break
-                            
-                            if doc_id and new_name:
-                                action_result = {
-                                    'action': 'rename_document',
-                                    'id': doc_id,
-                                    'name': new_name
-                                }
-                                ai_response = parts[0].strip()
+                        
+                        if doc_id and new_name:
+                            action_result = {
+                                'action': 'rename_document',
+                                'id': doc_id,
+                                'name': new_name
+                            }
+                            ai_response = command.prefix
             
-            if not action_result and 'SEND_SUPPORT_MESSAGE:' in ai_response:
-                parts = ai_response.split('SEND_SUPPORT_MESSAGE:')
-                if len(parts) > 1:
-                    message_data = parts[1].strip()
-                    # Формат: тема|сообщение
-                    if '|' in message_data:
-                        message_parts = message_data.split('|')
-                        if len(message_parts) >= 2:
-                            subject = message_parts[0].strip().strip('"').strip("'").strip()
-                            message = message_parts[1].strip().strip('"').strip("'").strip()
-                            if subject and message:
-                                action_result = {
-                                    'action': 'send_support_message',
-                                    'subject': subject,
-                                    'message': message
-                                }
-                                ai_response = parts[0].strip()
+            command = parsed_response.text_command('SEND_SUPPORT_MESSAGE')
+            if not action_result and command:
+                message_data = command.argument.strip()
+                # Формат: тема|сообщение
+                if '|' in message_data:
+                    message_parts = message_data.split('|')
+                    if len(message_parts) >= 2:
+                        subject = message_parts[0].strip().strip('"').strip("'").strip()
+                        message = message_parts[1].strip().strip('"').strip("'").strip()
+                        if subject and message:
+                            action_result = {
+                                'action': 'send_support_message',
+                                'subject': subject,
+                                'message': message
+                            }
+                            ai_response = command.prefix
             
-            if not action_result and 'CREATE_EVENT:' in ai_response:
-                parts = ai_response.split('CREATE_EVENT:')
-                if len(parts) > 1:
-                    event_data_raw = parts[1].strip()
-                    # Убираем возможные переносы строк и лишние символы
-                    event_data_raw = event_data_raw.split('\n')[0].strip()
-                    # Разделяем по |
-                    event_data = []
-                    current_part = ''
-                    for char in event_data_raw:
-                        if char == '|':
-                            event_data.append(current_part.strip())
-                            current_part = ''
-                        else:
-                            current_part += char
-                    if current_part:
+            command = parsed_response.text_command('CREATE_EVENT')
+            if not action_result and command:
+                event_data_raw = command.argument.strip()
+                # Убираем возможные переносы строк и лишние символы
+                event_data_raw = event_data_raw.split('\n')[0].strip()
+                # Разделяем по |
+                event_data = []
+                current_part = ''
+                for char in event_data_raw:
+                    if char == '|':
                         event_data.append(current_part.strip())
+                        current_part = ''
+                    else:
+                        current_part += char
+                if current_part:
+                    event_data.append(current_part.strip())
+                
+                logger.info(f"Обработка CREATE_EVENT: найдено {len(event_data)} частей")
+                logger.info(f"Данные события: {event_data}")
+                
+                if len(event_data) >= 2:
+                    title = event_data[0].strip().strip('"').strip("'").strip()
+                    date_str = event_data[1].strip().strip('"').strip("'").strip()
+                    description = event_data[2].strip().strip('"').strip("'").strip() if len(event_data) > 2 else ''
                     
-                    logger.info(f"Обработка CREATE_EVENT: найдено {len(event_data)} частей")
-                    logger.info(f"Данные события: {event_data}")
+                    # Нормализуем дату
+                    # Если дата в формате YYYY-MM-DDTHH:mm, оставляем как есть
+                    # Если только дата, добавляем время
+                    if date_str and 'T' not in date_str:
+                        if ' ' in date_str:
+                            date_str = date_str.replace(' ', 'T')
+                        else:
+                            date_str = date_str + 'T12:00'
                     
-                    if len(event_data) >= 2:
-                        title = event_data[0].strip().strip('"').strip("'").strip()
-                        date_str = event_data[1].strip().strip('"').strip("'").strip()
-                        description = event_data[2].strip().strip('"').strip("'").strip() if len(event_data) > 2 else ''
-                        
-                        # Нормализуем дату
-                        # Если дата в формате YYYY-MM-DDTHH:mm, оставляем как есть
-                        # Если только дата, добавляем время
-                        if date_str and 'T' not in date_str:
-                            if ' ' in date_str:
-                                date_str = date_str.replace(' ', 'T')
-                            else:
-                                date_str = date_str + 'T12:00'
-                        
-                        action_result = {
-                            'action': 'create_event',
-                            'title': title,
-                            'date': date_str,
-                            'description': description
-                        }
-                        logger.info(f"Создано действие create_event: {action_result}")
-                        ai_response = parts[0].strip()
-                    else:
-                        logger.warning(f"CREATE_EVENT: недостаточно данных. Найдено частей: {len(event_data)}")
+                    action_result = {
+                        'action': 'create_event',
+                        'title': title,
+                        'date': date_str,
+                        'description': description
+                    }
+                    logger.info(f"Создано действие create_event: {action_result}")
+                    ai_response = command.prefix
+                else:
+                    logger.warning(f"CREATE_EVENT: недостаточно данных. Найдено частей: {len(event_data)}")
             
             # ПОТОМ обрабатываем JSON команды (если простые команды не сработали)
             if not action_result:
-                # Ищем все JSON команды в ответе
-                json_commands = []
-                json_patterns = [
-                    r'\{\s*"action"\s*:\s*"[^"]+"[^}]*\}',
-                    r'\{[^{}]*"action"\s*:\s*"[^"]+"[^{}]*\}',
-                ]
-                
-                for pattern in json_patterns:
-                    matches = re.finditer(pattern, ai_response, re.DOTALL | re.IGNORECASE)
-                    for match in matches:
-                        try:
-                            cmd = json.loads(match.group(0))
-                            if cmd.get('action') in ['UPDATE_EVENT', 'DELETE_EVENT', 'DELETE_DOCUMENT', 'RENAME_DOCUMENT', 'SEND_SUPPORT_MESSAGE', 
-                                                     'CREATE_FOLDER', 'DELETE_FOLDER', 'UPDATE_FOLDER', 
-                                                     'CREATE_INVENTORY_ITEM', 'DELETE_INVENTORY_ITEM', 'UPDATE_INVENTORY_ITEM',
-                                                     'CREATE_EMPLOYEE_FOLDER', 'DELETE_EMPLOYEE_FOLDER', 'UPDATE_EMPLOYEE_FOLDER',
-                                                     'CREATE_EMPLOYEE', 'DELETE_EMPLOYEE', 'UPDATE_EMPLOYEE']:
-                                json_commands.append((match.group(0), cmd))
-                        except:
-                            continue
-                
-                # Обрабатываем команды по порядку
-                for json_str, cmd_data in json_commands:
-                    action_type = cmd_data.get('action')
+                # Обрабатываем JSON команды по порядку появления в ответе
+                for json_command in parsed_response.json_commands():
+                    json_str, cmd_data, action_type = json_command.raw, json_command.data, json_command.name
+                    
+                    if action_type == 'CREATE_EVENT':
+                        title = cmd_data.get('title', '').strip()
+                        date_str = cmd_data.get('date', '').strip()
+                        if date_str and 'T' not in date_str:
+                            date_str = date_str.replace(' ', 'T') if ' ' in date_str else date_str + 'T12:00'
+                        if title and date_str:
+                            action_result = {
+                                'action': 'create_event',
+                                'title': title,
+                                'date': date_str,
+                                'description': cmd_data.get('description', '').strip()
+                            }
+                            ai_response = ai_response.replace(json_str, '').strip()
                     
-                    if action_type == 'DELETE_EVENT':
+                    elif action_type == 'DELETE_EVENT':
                         event_identifier = cmd_data.get('event', '').strip()
                         calendar_events = user_data.get('calendarEvents', [])
                         
@@ -1974,195 +1396,175 @@ def process_chat_request_async(request_id):
                             ai_response = ai_response.replace(json_str, '').strip()
             
             # Обработка текстовых команд для инвентаризации
-            if not action_result and 'CREATE_FOLDER:' in ai_response:
-                parts = ai_response.split('CREATE_FOLDER:')
-                if len(parts) > 1:
-                    folder_name = parts[1].strip().split('\n')[0].strip().strip('"').strip("'")
-                    if folder_name:
-                        action_result = {
-                            'action': 'create_folder',
-                            'name': folder_name
-                        }
-                        ai_response = parts[0].strip()
+            command = parsed_response.text_command('CREATE_FOLDER')
+            if not action_result and command:
+                folder_name = command.line.strip('"').strip("'")
+                if folder_name:
+                    action_result = {
+                        'action': 'create_folder',
+                        'name': folder_name
+                    }
+                    ai_response = command.prefix
             
-            if not action_result and 'DELETE_FOLDER:' in ai_response:
-                parts = ai_response.split('DELETE_FOLDER:')
-                if len(parts) > 1:
-                    folder_identifier = parts[1].strip().split('\n')[0].strip().strip('"').strip("'")
-                    folders = user_data.get('inventoryFolders', [])
-                    folder_id = find_folder_smart(folders, folder_identifier)
-                    if folder_id:
-                        action_result = {
-                            'action': 'delete_folder',
-                            'id': folder_id
-                        }
-                        ai_response = parts[0].strip()
+            command = parsed_response.text_command('DELETE_FOLDER')
+            if not action_result and command:
+                folder_identifier = command.line.strip('"').strip("'")
+                folders = user_data.get('inventoryFolders', [])
+                folder_id = find_folder_smart(folders, folder_identifier)
+                if folder_id:
+                    action_result = {
+                        'action': 'delete_folder',
+                        'id': folder_id
+                    }
+                    ai_response = command.prefix
             
-            if not action_result and 'UPDATE_FOLDER:' in ai_response:
-                parts = ai_response.split('UPDATE_FOLDER:')
-                if len(parts) > 1:
-                    folder_data_raw = parts[1].strip().split('\n')[0].strip()
-                    if '|' in folder_data_raw:
-                        folder_parts = folder_data_raw.split('|')
-                        if len(folder_parts) >= 2:
-                            folder_identifier = folder_parts[0].strip().strip('"').strip("'")
-                            new_name = folder_parts[1].strip().strip('"').strip("'")
-                            folders = user_data.get('inventoryFolders', [])
-                            folder_id = find_folder_smart(folders, folder_identifier)
-                            if folder_id and new_name:
+            command = parsed_response.text_command('UPDATE_FOLDER')
+            if not action_result and command:
+                folder_data_raw = command.line
+                if '|' in folder_data_raw:
+                    folder_parts = folder_data_raw.split('|')
+                    if len(folder_parts) >= 2:
+                        folder_identifier = folder_parts[0].strip().strip('"').strip("'")
+                        new_name = folder_parts[1].strip().strip('"').strip("'")
+                        folders = user_data.get('inventoryFolders', [])
+                        folder_id = find_folder_smart(folders, folder_identifier)
+                        if folder_id and new_name:
+                            action_result = {
+                                'action': 'update_folder',
+                                'id': folder_id,
+                                'name': new_name
+                            }
+                            ai_response = command.prefix
+            
+            command = parsed_response.text_command('CREATE_INVENTORY_ITEM')
+            if not action_result and command:
+                item_data_raw = command.line
+                if '|' in item_data_raw:
+                    item_parts = item_data_raw.split('|')
+                    if len(item_parts) >= 3:
+                        item_name = item_parts[0].strip().strip('"').strip("'")
+                        quantity_str = item_parts[1].strip().strip('"').strip("'")
+                        price_str = item_parts[2].strip().strip('"').strip("'")
+                        folder_name = item_parts[3].strip().strip('"').strip("'") if len(item_parts) > 3 else None
+                        
+                        try:
+                            quantity = float(quantity_str) if quantity_str else 0
+                            price = float(price_str) if price_str else 0
+                            
+                            folder_id = None
+                            if folder_name:
+                                folders = user_data.get('inventoryFolders', [])
+                                folder_id = find_folder_smart(folders, folder_name)
+                            
+                            if item_name:
                                 action_result = {
-                                    'action': 'update_folder',
-                                    'id': folder_id,
-                                    'name': new_name
+                                    'action': 'create_inventory_item',
+                                    'name': item_name,
+                                    'quantity': quantity,
+                                    'price': price,
+                                    'folderId': folder_id
                                 }
-                                ai_response = parts[0].strip()
+                                ai_response = command.prefix
+                        except (ValueError, TypeError):
+                            logger.warning(f"Ошибка парсинга данных товара: {item_data_raw}")
             
-            if not action_result and 'CREATE_INVENTORY_ITEM:' in ai_response:
-                parts = ai_response.split('CREATE_INVENTORY_ITEM:')
-                if len(parts) > 1:
-                    item_data_raw = parts[1].strip().split('\n')[0].strip()
-                    if '|' in item_data_raw:
-                        item_parts = item_data_raw.split('|')
-                        if len(item_parts) >= 3:
-                            item_name = item_parts[0].strip().strip('"').strip("'")
-                            quantity_str = item_parts[1].strip().strip('"').strip("'")
-                            price_str = item_parts[2].strip().strip('"').strip("'")
-                            folder_name = item_parts[3].strip().strip('"').strip("'") if len(item_parts) > 3 else None
-                            
-                            try:
-                                quantity = float(quantity_str) if quantity_str else 0
-                                price = float(price_str) if price_str else 0
-                                
-                                folder_id = None
-                                if folder_name:
-                                    folders = user_data.get('inventoryFolders', [])
-                                    folder_id = find_folder_smart(folders, folder_name)
-                                
-                                if item_name:
-                                    action_result = {
-                                        'action': 'create_inventory_item',
-                                        'name': item_name,
-                                        'quantity': quantity,
-                                        'price': price,
-                                        'folderId': folder_id
-                                    }
-                                    ai_response = parts[0].strip()
-                            except (ValueError, TypeError):
-                                logger.warning(f"Ошибка парсинга данных товара: {item_data_raw}")
+            command = parsed_response.text_command('DELETE_INVENTORY_ITEM')
+            if not action_result and command:
+                item_identifier = command.line.strip('"').strip("'")
+                inventory_items = user_data.get('inventory', [])
+                item_id = find_inventory_item_smart(inventory_items, item_identifier)
+                if item_id:
+                    action_result = {
+                        'action': 'delete_inventory_item',
+                        'id': item_id
+                    }
+                    ai_response = command.prefix
             
-            if not action_result and 'DELETE_INVENTORY_ITEM:' in ai_response:
-                parts = ai_response.split('DELETE_INVENTORY_ITEM:')
-                if len(parts) > 1:
-                    item_identifier = parts[1].strip().split('\n')[0].strip().strip('"').strip("'")
+            command = parsed_response.text_command('UPDATE_INVENTORY_ITEM')
+            if not action_result and command:
+                # Формат JSON в тексте
+                item_data_raw = command.line
+                try:
+                    item_data = json.loads(item_data_raw)
+                    item_identifier = item_data.get('item', '').strip()
                     inventory_items = user_data.get('inventory', [])
                     item_id = find_inventory_item_smart(inventory_items, item_identifier)
+                    
                     if item_id:
+                        new_name = item_data.get('name', '').strip() if 'name' in item_data else None
+                        new_quantity = item_data.get('quantity') if 'quantity' in item_data else None
+                        new_price = item_data.get('price') if 'price' in item_data else None
+                        new_folder = item_data.get('folder', '').strip() if 'folder' in item_data else None
+                        
+                        folder_id = None
+                        if new_folder is not None:
+                            if new_folder:
+                                folders = user_data.get('inventoryFolders', [])
+                                folder_id = find_folder_smart(folders, new_folder)
+                            else:
+                                folder_id = None
+                        
+                        try:
+                            if new_quantity is not None:
+                                new_quantity = float(new_quantity)
+                            if new_price is not None:
+                                new_price = float(new_price)
+                        except (ValueError, TypeError):
+                            pass
+                        
                         action_result = {
-                            'action': 'delete_inventory_item',
-                            'id': item_id
+                            'action': 'update_inventory_item',
+                            'id': item_id,
+                            'name': new_name,
+                            'quantity': new_quantity,
+                            'price': new_price,
+                            'folderId': folder_id
                         }
-                        ai_response = parts[0].strip()
-            
-            if not action_result and 'UPDATE_INVENTORY_ITEM:' in ai_response:
-                parts = ai_response.split('UPDATE_INVENTORY_ITEM:')
-                if len(parts) > 1:
-                    # Формат JSON в тексте
-                    item_data_raw = parts[1].strip().split('\n')[0].strip()
-                    try:
-                        item_data = json.loads(item_data_raw)
-                        item_identifier = item_data.get('item', '').strip()
-                        inventory_items = user_data.get('inventory', [])
-                        item_id = find_inventory_item_smart(inventory_items, item_identifier)
-                        
-                        if item_id:
-                            new_name = item_data.get('name', '').strip() if 'name' in item_data else None
-                            new_quantity = item_data.get('quantity') if 'quantity' in item_data else None
-                            new_price = item_data.get('price') if 'price' in item_data else None
-                            new_folder = item_data.get('folder', '').strip() if 'folder' in item_data else None
+                        ai_response = command.prefix
+                except json.JSONDecodeError:
+                    # Если не JSON, пробуем формат с разделителями |
+                    if '|' in item_data_raw:
+                        item_parts = item_data_raw.split('|')
+                        if len(item_parts) >= 2:
+                            item_identifier = item_parts[0].strip().strip('"').strip("'")
+                            inventory_items = user_data.get('inventory', [])
+                            item_id = find_inventory_item_smart(inventory_items, item_identifier)
                             
-                            folder_id = None
-                            if new_folder is not None:
-                                if new_folder:
+                            if item_id:
+                                updates = {}
+                                if len(item_parts) > 1 and item_parts[1].strip():
+                                    updates['name'] = item_parts[1].strip().strip('"').strip("'")
+                                if len(item_parts) > 2 and item_parts[2].strip():
+                                    try:
+                                        updates['quantity'] = float(item_parts[2].strip())
+                                    except:
+                                        pass
+                                if len(item_parts) > 3 and item_parts[3].strip():
+                                    try:
+                                        updates['price'] = float(item_parts[3].strip())
+                                    except:
+                                        pass
+                                if len(item_parts) > 4 and item_parts[4].strip():
+                                    folder_name = item_parts[4].strip().strip('"').strip("'")
                                     folders = user_data.get('inventoryFolders', [])
-                                    folder_id = find_folder_smart(folders, new_folder)
-                                else:
-                                    folder_id = None
-                            
-                            try:
-                                if new_quantity is not None:
-                                    new_quantity = float(new_quantity)
-                                if new_price is not None:
-                                    new_price = float(new_price)
-                            except (ValueError, TypeError):
-                                pass
-                            
-                            action_result = {
-                                'action': 'update_inventory_item',
-                                'id': item_id,
-                                'name': new_name,
-                                'quantity': new_quantity,
-                                'price': new_price,
-                                'folderId': folder_id
-                            }
-                            ai_response = parts[0].strip()
-                    except json.JSONDecodeError:
-                        # Если не JSON, пробуем формат с разделителями |
-                        if '|' in item_data_raw:
-                            item_parts = item_data_raw.split('|')
-                            if len(item_parts) >= 2:
-                                item_identifier = item_parts[0].strip().strip('"').strip("'")
-                                inventory_items = user_data.get('inventory', [])
-                                item_id = find_inventory_item_smart(inventory_items, item_identifier)
+                                    folder_id = find_folder_smart(folders, folder_name)
+                                    if folder_id:
+                                        updates['folderId'] = folder_id
                                 
-                                if item_id:
-                                    updates = {}
-                                    if len(item_parts) > 1 and item_parts[1].strip():
-                                        updates['name'] = item_parts[1].strip().strip('"').strip("'")
-                                    if len(item_parts) > 2 and item_parts[2].strip():
-                                        try:
-                                            updates['quantity'] = float(item_parts[2].strip())
-                                        except:
-                                            pass
-                                    if len(item_parts) > 3 and item_parts[3].strip():
-                                        try:
-                                            updates['price'] = float(item_parts[3].strip())
-                                        except:
-                                            pass
-                                    if len(item_parts) > 4 and item_parts[4].strip():
-                                        folder_name = item_parts[4].strip().strip('"').strip("'")
-                                        folders = user_data.get('inventoryFolders', [])
-                                        folder_id = find_folder_smart(folders, folder_name)
-                                        if folder_id:
-                                            updates['folderId'] = folder_id
-                                    
-                                    action_result = {
-                                        'action': 'update_inventory_item',
-                                        'id': item_id,
-                                        **updates
-                                    }
-                                    ai_response = parts[0].strip()
+                                action_result = {
+                                    'action': 'update_inventory_item',
+                                    'id': item_id,
+                                    **updates
+                                }
+                                ai_response = command.prefix
             
             # Обработка JSON команд для сотрудников
             if not action_result:
-                json_commands_employees = []
-                json_patterns_employees = [
-                    r'\{\s*"action"\s*:\s*"[^"]+"[^}]*\}',
-                    r'\{[^{}]*"action"\s*:\s*"[^"]+"[^{}]*\}',
-                ]
-                
-                for pattern in json_patterns_employees:
-                    matches = re.finditer(pattern, ai_response, re.DOTALL | re.IGNORECASE)
-                    for match in matches:
-                        try:
-                            cmd = json.loads(match.group(0))
-                            if cmd.get('action') in ['CREATE_EMPLOYEE_FOLDER', 'DELETE_EMPLOYEE_FOLDER', 'UPDATE_EMPLOYEE_FOLDER',
-                                                     'CREATE_EMPLOYEE', 'DELETE_EMPLOYEE', 'UPDATE_EMPLOYEE']:
-                                json_commands_employees.append((match.group(0), cmd))
-                        except:
-                            continue
-                
-                for json_str, cmd_data in json_commands_employees:
-                    action_type = cmd_data.get('action')
+                for json_command in parsed_response.json_commands((
+                    'CREATE_EMPLOYEE_FOLDER', 'DELETE_EMPLOYEE_FOLDER', 'UPDATE_EMPLOYEE_FOLDER',
+                    'CREATE_EMPLOYEE', 'DELETE_EMPLOYEE', 'UPDATE_EMPLOYEE'
+                )):
+                    json_str, cmd_data, action_type = json_command.raw, json_command.data, json_command.name
                     
                     if action_type == 'CREATE_EMPLOYEE_FOLDER':
                         folder_name = cmd_data.get('name', '').strip()
@@ -2277,261 +1679,174 @@ def process_chat_request_async(request_id):
                             ai_response = ai_response.replace(json_str, '').strip()
             
             # Обработка текстовых команд для сотрудников
-            if not action_result and 'CREATE_EMPLOYEE_FOLDER:' in ai_response:
-                parts = ai_response.split('CREATE_EMPLOYEE_FOLDER:')
-                if len(parts) > 1:
-                    folder_name = parts[1].strip().split('\n')[0].strip().strip('"').strip("'")
-                    if folder_name:
-                        action_result = {
-                            'action': 'create_employee_folder',
-                            'name': folder_name
-                        }
-                        ai_response = parts[0].strip()
-            
-            if not action_result and 'DELETE_EMPLOYEE_FOLDER:' in ai_response:
-                parts = ai_response.split('DELETE_EMPLOYEE_FOLDER:')
-                if len(parts) > 1:
-                    folder_identifier = parts[1].strip().split('\n')[0].strip().strip('"').strip("'")
-                    folders = user_data.get('employeeFolders', [])
-                    folder_id = find_employee_folder_smart(folders, folder_identifier)
-                    if folder_id:
-                        action_result = {
-                            'action': 'delete_employee_folder',
-                            'id': folder_id
-                        }
-                        ai_response = parts[0].strip()
-            
-            if not action_result and 'UPDATE_EMPLOYEE_FOLDER:' in ai_response:
-                parts = ai_response.split('UPDATE_EMPLOYEE_FOLDER:')
-                if len(parts) > 1:
-                    folder_data_raw = parts[1].strip().split('\n')[0].strip()
-                    if '|' in folder_data_raw:
-                        folder_parts = folder_data_raw.split('|')
-                        if len(folder_parts) >= 2:
-                            folder_identifier = folder_parts[0].strip().strip('"').strip("'")
-                            new_name = folder_parts[1].strip().strip('"').strip("'")
-                            folders = user_data.get('employeeFolders', [])
-                            folder_id = find_employee_folder_smart(folders, folder_identifier)
-                            if folder_id and new_name:
-                                action_result = {
-                                    'action': 'update_employee_folder',
-                                    'id': folder_id,
-                                    'name': new_name
-                                }
-                                ai_response = parts[0].strip()
-            
-            if not action_result and 'CREATE_EMPLOYEE:' in ai_response:
-                parts = ai_response.split('CREATE_EMPLOYEE:')
-                if len(parts) > 1:
-                    employee_data_raw = parts[1].strip().split('\n')[0].strip()
-                    if '|' in employee_data_raw:
-                        employee_parts = employee_data_raw.split('|')
-                        if len(employee_parts) >= 4:
-                            fio = employee_parts[0].strip().strip('"').strip("'")
-                            phone = employee_parts[1].strip().strip('"').strip("'")
-                            email = employee_parts[2].strip().strip('"').strip("'")
-                            salary_str = employee_parts[3].strip().strip('"').strip("'")
-                            folder_name = employee_parts[4].strip().strip('"').strip("'") if len(employee_parts) > 4 else None
-                            
-                            try:
-                                salary = float(salary_str) if salary_str else 0
-                                
-                                folder_id = None
-                                if folder_name:
-                                    folders = user_data.get('employeeFolders', [])
-                                    folder_id = find_employee_folder_smart(folders, folder_name)
-                                
-                                if fio and phone and email:
-                                    action_result = {
-                                        'action': 'create_employee',
-                                        'fio': fio,
-                                        'phone': phone,
-                                        'email': email,
-                                        'salary': salary,
-                                        'folderId': folder_id
-                                    }
-                                    ai_response = parts[0].strip()
-                            except (ValueError, TypeError):
-                                logger.warning(f"Ошибка парсинга данных сотрудника: {employee_data_raw}")
+            command = parsed_response.text_command('CREATE_EMPLOYEE_FOLDER')
+            if not action_result and command:
+                folder_name = command.line.strip('"').strip("'")
+                if folder_name:
+                    action_result = {
+                        'action': 'create_employee_folder',
+                        'name': folder_name
+                    }
+                    ai_response = command.prefix
             
-            if not action_result and 'DELETE_EMPLOYEE:' in ai_response:
-                parts = ai_response.split('DELETE_EMPLOYEE:')
-                if len(parts) > 1:
-                    employee_identifier = parts[1].strip().split('\n')[0].strip().strip('"').strip("'")
-                    employees = user_data.get('employees', [])
-                    employee_id = find_employee_smart(employees, employee_identifier)
-                    if employee_id:
-                        action_result = {
-                            'action': 'delete_employee',
-                            'id': employee_id
-                        }
-                        ai_response = parts[0].strip()
+            command = parsed_response.text_command('DELETE_EMPLOYEE_FOLDER')
+            if not action_result and command:
+                folder_identifier = command.line.strip('"').strip("'")
+                folders = user_data.get('employeeFolders', [])
+                folder_id = find_employee_folder_smart(folders, folder_identifier)
+                if folder_id:
+                    action_result = {
+                        'action': 'delete_employee_folder',
+                        'id': folder_id
+                    }
+                    ai_response = command.prefix
             
-            if not action_result and 'UPDATE_EMPLOYEE:' in ai_response:
-                parts = ai_response.split('UPDATE_EMPLOYEE:')
-                if len(parts) > 1:
-                    # Пробуем JSON формат
-                    employee_data_raw = parts[1].strip().split('\n')[0].strip()
-                    try:
-                        employee_data = json.loads(employee_data_raw)
-                        employee_identifier = employee_data.get('employee', '').strip()
-                        employees = user_data.get('employees', [])
-                        employee_id = find_employee_smart(employees, employee_identifier)
-                        
-                        if employee_id:
-                            updates = {}
-                            if 'fio' in employee_data:
-                                updates['fio'] = employee_data.get('fio', '').strip()
-                            if 'phone' in employee_data:
-                                updates['phone'] = employee_data.get('phone', '').strip()
-                            if 'email' in employee_data:
-                                updates['email'] = employee_data.get('email', '').strip()
-                            if 'salary' in employee_data:
-                                try:
-                                    updates['salary'] = float(employee_data.get('salary', 0))
-                                except:
-                                    pass
-                            if 'folder' in employee_data:
-                                folder_name = employee_data.get('folder', '').strip()
-                                if folder_name:
-                                    folders = user_data.get('employeeFolders', [])
-                                    folder_id = find_employee_folder_smart(folders, folder_name)
-                                    if folder_id:
-                                        updates['folderId'] = folder_id
-                                else:
-                                    updates['folderId'] = None
-                            
+            command = parsed_response.text_command('UPDATE_EMPLOYEE_FOLDER')
+            if not action_result and command:
+                folder_data_raw = command.line
+                if '|' in folder_data_raw:
+                    folder_parts = folder_data_raw.split('|')
+                    if len(folder_parts) >= 2:
+                        folder_identifier = folder_parts[0].strip().strip('"').strip("'")
+                        new_name = folder_parts[1].strip().strip('"').strip("'")
+                        folders = user_data.get('employeeFolders', [])
+                        folder_id = find_employee_folder_smart(folders, folder_identifier)
+                        if folder_id and new_name:
                             action_result = {
-                                'action': 'update_employee',
-                                'id': employee_id,
-                                **updates
+                                'action': 'update_employee_folder',
+                                'id': folder_id,
+                                'name': new_name
                             }
-                            ai_response = parts[0].strip()
-                    except json.JSONDecodeError:
-                        # Если не JSON, пробуем текстовый формат с разделителями
-                        pass
+                            ai_response = command.prefix
             
-            # СНАЧАЛА обрабатываем простой текстовый формат UPDATE_EVENT (более надежный)
-            if not action_result and 'UPDATE_EVENT:' in ai_response:
-                parts = ai_response.split('UPDATE_EVENT:')
-                if len(parts) > 1:
-                    event_data_raw = parts[1].strip()
-                    # Убираем возможные переносы строк и лишние символы
-                    event_data_raw = event_data_raw.split('\n')[0].strip()
-                    # Разделяем по |
-                    event_data = []
-                    current_part = ''
-                    for char in event_data_raw:
-                        if char == '|':
-                            event_data.append(current_part.strip())
-                            current_part = ''
-                        else:
-                            current_part += char
-                    if current_part:
-                        event_data.append(current_part.strip())
-                    
-                    logger.info(f"Обработка UPDATE_EVENT (текстовый формат): найдено {len(event_data)} частей")
-                    logger.info(f"Данные события: {event_data}")
-                    
-                    if len(event_data) >= 1:
-                        event_identifier = event_data[0].strip().strip('"').strip("'").strip()
-                        calendar_events = user_data.get('calendarEvents', [])
+            command = parsed_response.text_command('CREATE_EMPLOYEE')
+            if not action_result and command:
+                employee_data_raw = command.line
+                if '|' in employee_data_raw:
+                    employee_parts = employee_data_raw.split('|')
+                    if len(employee_parts) >= 4:
+                        fio = employee_parts[0].strip().strip('"').strip("'")
+                        phone = employee_parts[1].strip().strip('"').strip("'")
+                        email = employee_parts[2].strip().strip('"').strip("'")
+                        salary_str = employee_parts[3].strip().strip('"').strip("'")
+                        folder_name = employee_parts[4].strip().strip('"').strip("'") if len(employee_parts) > 4 else None
                         
-                        # Используем умный поиск событий
-                        event_id = find_event_smart(calendar_events, event_identifier)
-                        
-                        if event_id:
-                            # Формат: UPDATE_EVENT: старое_название|новое_название|новая_дата|новое_описание
-                            new_title = event_data[1].strip().strip('"').strip("'").strip() if len(event_data) > 1 and event_data[1].strip() else None
-                            new_date = event_data[2].strip().strip('"').strip("'").strip() if len(event_data) > 2 and event_data[2].strip() else None
-                            new_description = event_data[3].strip().strip('"').strip("'").strip() if len(event_data) > 3 and event_data[3].strip() else None
+                        try:
+                            salary = float(salary_str) if salary_str else 0
                             
-                            # Нормализуем дату, если указана
-                            if new_date and 'T' not in new_date:
-                                if ' ' in new_date:
-                                    new_date = new_date.replace(' ', 'T')
-                                else:
-                                    new_date = new_date + 'T12:00'
+                            folder_id = None
+                            if folder_name:
+                                folders = user_data.get('employeeFolders', [])
+                                folder_id = find_employee_folder_smart(folders, folder_name)
                             
-                            action_result = {
-                                'action': 'update_event',
-                                'id': event_id,
-                                'title': new_title,
-                                'date': new_date,
-                                'description': new_description
-                            }
-                            logger.info(f"Создано действие update_event (текстовый формат): {action_result}")
-                            ai_response = parts[0].strip()
+                            if fio and phone and email:
+                                action_result = {
+                                    'action': 'create_employee',
+                                    'fio': fio,
+                                    'phone': phone,
+                                    'email': email,
+                                    'salary': salary,
+                                    'folderId': folder_id
+                                }
+                                ai_response = command.prefix
+                        except (ValueError, TypeError):
+                            logger.warning(f"Ошибка парсинга данных сотрудника: {employee_data_raw}")
             
-            # Затем обрабатываем JSON формат UPDATE_EVENT (для обратной совместимости)
-            json_found = False
-            json_str = None
-            update_data = None
+            command = parsed_response.text_command('DELETE_EMPLOYEE')
+            if not action_result and command:
+                employee_identifier = command.line.strip('"').strip("'")
+                employees = user_data.get('employees', [])
+                employee_id = find_employee_smart(employees, employee_identifier)
+                if employee_id:
+                    action_result = {
+                        'action': 'delete_employee',
+                        'id': employee_id
+                    }
+                    ai_response = command.prefix
             
-            if not action_result:
-                json_patterns = [
-                    r'\{\s*"action"\s*:\s*"UPDATE_EVENT"[^}]*\}',
-                    r'\{[^{}]*"action"\s*:\s*"UPDATE_EVENT"[^{}]*\}',
-                ]
-                
-                for pattern in json_patterns:
-                    json_match = re.search(pattern, ai_response, re.DOTALL | re.IGNORECASE)
-                    if json_match:
-                        json_str = json_match.group(0)
-                        try:
-                            update_data = json.loads(json_str)
-                            if update_data.get('action') == 'UPDATE_EVENT':
-                                json_found = True
-                                break
-                        except:
-                            continue
-                
-                if not json_found:
-                    lines = ai_response.split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if 'UPDATE_EVENT' in line and '{' in line and '}' in line:
+            command = parsed_response.text_command('UPDATE_EMPLOYEE')
+            if not action_result and command:
+                # Пробуем JSON формат
+                employee_data_raw = command.line
+                try:
+                    employee_data = json.loads(employee_data_raw)
+                    employee_identifier = employee_data.get('employee', '').strip()
+                    employees = user_data.get('employees', [])
+                    employee_id = find_employee_smart(employees, employee_identifier)
+                    
+                    if employee_id:
+                        updates = {}
+                        if 'fio' in employee_data:
+                            updates['fio'] = employee_data.get('fio', '').strip()
+                        if 'phone' in employee_data:
+                            updates['phone'] = employee_data.get('phone', '').strip()
+                        if 'email' in employee_data:
+                            updates['email'] = employee_data.get('email', '').strip()
+                        if 'salary' in employee_data:
                             try:
-                                update_data = json.loads(line)
-                                if update_data.get('action') == 'UPDATE_EVENT':
-                                    json_str = line
-                                    json_found = True
-                                    break
+                                updates['salary'] = float(employee_data.get('salary', 0))
                             except:
-                                continue
+                                pass
+                        if 'folder' in employee_data:
+                            folder_name = employee_data.get('folder', '').strip()
+                            if folder_name:
+                                folders = user_data.get('employeeFolders', [])
+                                folder_id = find_employee_folder_smart(folders, folder_name)
+                                if folder_id:
+                                    updates['folderId'] = folder_id
+                            else:
+                                updates['folderId'] = None
+                        
+                        action_result = {
+                            'action': 'update_employee',
+                            'id': employee_id,
+                            **updates
+                        }
+                        ai_response = command.prefix
+                except json.JSONDecodeError:
+                    # Если не JSON, пробуем текстовый формат с разделителями
+                    pass
             
-            if json_found and update_data and not action_result:
-                if update_data.get('action') == 'UPDATE_EVENT':
-                    event_identifier = update_data.get('event', '').strip()
+            # СНАЧАЛА обрабатываем простой текстовый формат UPDATE_EVENT (более надежный)
+            command = parsed_response.text_command('UPDATE_EVENT')
+            if not action_result and command:
+                event_data_raw = command.argument.strip()
+                # Убираем возможные переносы строк и лишние символы
+                event_data_raw = event_data_raw.split('\n')[0].strip()
+                # Разделяем по |
+                event_data = []
+                current_part = ''
+                for char in event_data_raw:
+                    if char == '|':
+                        event_data.append(current_part.strip())
+                        current_part = ''
+                    else:
+                        current_part += char
+                if current_part:
+                    event_data.append(current_part.strip())
+                
+                logger.info(f"Обработка UPDATE_EVENT (текстовый формат): найдено {len(event_data)} частей")
+                logger.info(f"Данные события: {event_data}")
+                
+                if len(event_data) >= 1:
+                    event_identifier = event_data[0].strip().strip('"').strip("'").strip()
                     calendar_events = user_data.get('calendarEvents', [])
                     
-                    logger.info(f"Поиск события для обновления: '{event_identifier}'")
-                    logger.info(f"Всего событий в календаре: {len(calendar_events)}")
-                    
                     # Используем умный поиск событий
                     event_id = find_event_smart(calendar_events, event_identifier)
                     
-                    if not event_id and calendar_events:
-                        event_id = str(calendar_events[-1].get('id', ''))
-                        logger.warning(f"Событие не найдено, используем последнее: {event_id}")
-                    
                     if event_id:
-                        new_title = None
-                        if 'title' in update_data:
-                            title_value = update_data.get('title')
-                            new_title = title_value.strip() if title_value else ''
-                        
-                        new_date = None
-                        if 'date' in update_data:
-                            new_date = update_data.get('date', '').strip() if update_data.get('date') else ''
+                        # Формат: UPDATE_EVENT: старое_название|новое_название|новая_дата|новое_описание
+                        new_title = event_data[1].strip().strip('"').strip("'").strip() if len(event_data) > 1 and event_data[1].strip() else None
+                        new_date = event_data[2].strip().strip('"').strip("'").strip() if len(event_data) > 2 and event_data[2].strip() else None
+                        new_description = event_data[3].strip().strip('"').strip("'").strip() if len(event_data) > 3 and event_data[3].strip() else None
                         
-                        new_description = None
-                        if 'description' in update_data:
-                            desc_value = update_data.get('description', '')
-                            if desc_value is not None:
-                                new_description = desc_value.strip() if desc_value else ''
+                        # Нормализуем дату, если указана
+                        if new_date and 'T' not in new_date:
+                            if ' ' in new_date:
+                                new_date = new_date.replace(' ', 'T')
                             else:
-                                new_description = ''
+                                new_date = new_date + 'T12:00'
                         
                         action_result = {
                             'action': 'update_event',
@@ -2540,127 +1855,93 @@ def process_chat_request_async(request_id):
                             'date': new_date,
                             'description': new_description
                         }
-                        if json_str:
-                            ai_response = ai_response.replace(json_str, '').strip()
+                        logger.info(f"Создано действие update_event (текстовый формат): {action_result}")
+                        ai_response = command.prefix
             
-            # Если не нашли JSON, пробуем старый формат UPDATE_EVENT:
-            if not json_found and not action_result and 'UPDATE_EVENT:' in ai_response:
-                parts = ai_response.split('UPDATE_EVENT:')
-                if len(parts) > 1:
-                    event_data_raw = parts[1].strip()
-                    event_data = []
-                    current_part = ''
-                    for char in event_data_raw:
-                        if char == '|':
-                            event_data.append(current_part.strip())
-                            current_part = ''
+            # Затем обрабатываем JSON формат UPDATE_EVENT (для обратной совместимости)
+            update_command = None if action_result else parsed_response.json_command('UPDATE_EVENT')
+            json_found = update_command is not None
+            
+            if json_found:
+                update_data, json_str = update_command.data, update_command.raw
+                event_identifier = update_data.get('event', '').strip()
+                calendar_events = user_data.get('calendarEvents', [])
+                
+                logger.info(f"Поиск события для обновления: '{event_identifier}'")
+                logger.info(f"Всего событий в календаре: {len(calendar_events)}")
+                
+                # Используем умный поиск событий
+                event_id = find_event_smart(calendar_events, event_identifier)
+                
+                # Неоднозначное или ненайденное событие не подменяется другим: действие не выполняется
+                if not event_id:
+                    logger.warning(f"Событие для обновления не определено однозначно: '{event_identifier}'")
+                
+                if event_id:
+                    new_title = None
+                    if 'title' in update_data:
+                        title_value = update_data.get('title')
+                        new_title = title_value.strip() if title_value else ''
+                    
+                    new_date = None
+                    if 'date' in update_data:
+                        new_date = update_data.get('date', '').strip() if update_data.get('date') else ''
+                    
+                    new_description = None
+                    if 'description' in update_data:
+                        desc_value = update_data.get('description', '')
+                        if desc_value is not None:
+                            new_description = desc_value.strip() if desc_value else ''
                         else:
-                            current_part += char
-                    if current_part:
-                        event_data.append(current_part.strip())
+                            new_description = ''
                     
-                    if len(event_data) >= 1:
-                        event_identifier = event_data[0].strip()
-                        calendar_events = user_data.get('calendarEvents', [])
-                        
-                        # Используем умный поиск событий
-                        event_id = find_event_smart(calendar_events, event_identifier)
-                        
-                        if not event_id and calendar_events:
-                            event_id = str(calendar_events[-1].get('id', ''))
-                            logger.warning(f"Событие не найдено, используем последнее: {event_id}")
-                        
-                        if event_id:
-                            new_title = event_data[1].strip() if len(event_data) > 1 and event_data[1].strip() else None
-                            new_date = event_data[2].strip() if len(event_data) > 2 and event_data[2].strip() else None
-                            new_description = event_data[3].strip() if len(event_data) > 3 and event_data[3].strip() else None
-                            
-                            action_result = {
-                                'action': 'update_event',
-                                'id': event_id,
-                                'title': new_title,
-                                'date': new_date,
-                                'description': new_description
-                            }
-                        ai_response = parts[0].strip()
+                    action_result = {
+                        'action': 'update_event',
+                        'id': event_id,
+                        'title': new_title,
+                        'date': new_date,
+                        'description': new_description
+                    }
+                    ai_response = ai_response.replace(json_str, '').strip()
             
-            # Дополнительная проверка: ищем команды в любом месте ответа (более гибкий поиск)
-            if not action_result:
-                # Ищем CREATE_EVENT в любом регистре и в любом месте
-                create_patterns = [
-                    r'CREATE_EVENT\s*:\s*([^\n]+)',
-                    r'create_event\s*:\s*([^\n]+)',
-                    r'Create_Event\s*:\s*([^\n]+)',
-                ]
-                for pattern in create_patterns:
-                    match = re.search(pattern, ai_response, re.IGNORECASE)
-                    if match:
-                        event_data_raw = match.group(1).strip()
-                        event_data = []
+            # Если не нашли JSON, пробуем старый формат UPDATE_EVENT:
+            command = parsed_response.text_command('UPDATE_EVENT')
+            if not json_found and not action_result and command:
+                event_data_raw = command.argument.strip()
+                event_data = []
+                current_part = ''
+                for char in event_data_raw:
+                    if char == '|':
+                        event_data.append(current_part.strip())
                         current_part = ''
-                        for char in event_data_raw:
-                            if char == '|':
-                                event_data.append(current_part.strip())
-                                current_part = ''
-                            else:
-                                current_part += char
-                        if current_part:
-                            event_data.append(current_part.strip())
-                        
-                        if len(event_data) >= 2:
-                            title = event_data[0].strip().strip('"').strip("'").strip()
-                            date_str = event_data[1].strip().strip('"').strip("'").strip()
-                            description = event_data[2].strip().strip('"').strip("'").strip() if len(event_data) > 2 else ''
-                            
-                            if date_str and 'T' not in date_str:
-                                if ' ' in date_str:
-                                    date_str = date_str.replace(' ', 'T')
-                                else:
-                                    date_str = date_str + 'T12:00'
-                            
-                            action_result = {
-                                'action': 'create_event',
-                                'title': title,
-                                'date': date_str,
-                                'description': description
-                            }
-                            logger.info(f"Найдена команда CREATE_EVENT (гибкий поиск): {action_result}")
-                            ai_response = ai_response.replace(match.group(0), '').strip()
-                            break
+                    else:
+                        current_part += char
+                if current_part:
+                    event_data.append(current_part.strip())
                 
-                # Ищем DELETE_EVENT в любом месте
-                delete_patterns = [
-                    r'DELETE_EVENT\s*:\s*["\']?([^"\'\n]+)["\']?',
-                    r'delete_event\s*:\s*["\']?([^"\'\n]+)["\']?',
-                ]
-                for pattern in delete_patterns:
-                    match = re.search(pattern, ai_response, re.IGNORECASE)
-                    if match:
-                        event_identifier = match.group(1).strip().strip('"').strip("'").strip()
-                        calendar_events = user_data.get('calendarEvents', [])
-                        event_id = None
-                        
-                        for event in calendar_events:
-                            if str(event.get('id', '')) == event_identifier:
-                                event_id = str(event.get('id', ''))
-                                break
-                        
-                        if not event_id:
-                            event_identifier_lower = event_identifier.lower().strip()
-                            for event in calendar_events:
-                                event_title = event.get('title', '').lower().strip()
-                                if event_title == event_identifier_lower or event_identifier_lower in event_title:
-                                    event_id = str(event.get('id', ''))
-                                    break
+                if len(event_data) >= 1:
+                    event_identifier = event_data[0].strip()
+                    calendar_events = user_data.get('calendarEvents', [])
+                    
+                    # Используем умный поиск событий
+                    event_id = find_event_smart(calendar_events, event_identifier)
+                    
+                    if not event_id:
+                        logger.warning(f"Событие для обновления не определено однозначно: '{event_identifier}'")
+                    
+                    if event_id:
+                        new_title = event_data[1].strip() if len(event_data) > 1 and event_data[1].strip() else None
+                        new_date = event_data[2].strip() if len(event_data) > 2 and event_data[2].strip() else None
+                        new_description = event_data[3].strip() if len(event_data) > 3 and event_data[3].strip() else None
                         
-                        if event_id:
-                            action_result = {
-                                'action': 'delete_event',
-                                'id': event_id
-                            }
-                            logger.info(f"Найдена команда DELETE_EVENT (гибкий поиск): {action_result}")
-                            ai_response = ai_response.replace(match.group(0), '').strip()
-                            break
+                        action_result = {
+                            'action': 'update_event',
+                            'id': event_id,
+                            'title': new_title,
+                            'date': new_date,
+                            'description': new_description
+                        }
+                    ai_response = command.prefix
             
             # Сохраняем результат
             logger.info(f"💾 Сохранение результата: status=COMPLETED, response_length={len(ai_response)}, action={bool(action_result)}")
@@ -2672,6 +1953,12 @@ def process_chat_request_async(request_id):
             chat_request.save()
             logger.info(f"✅ Результат сохранен успешно для запроса {request_id}")
             
+            # Кэшируем только ответы без действий: действие не должно повторяться без вызова модели
+            if cached_result is None and not action_result and not response_blocked:
+                response_cache.store(response_cache_key, result)
+                if semantic_context is not None:
+                    semantic_cache.store(message, semantic_context, result)
+            
             # Расчет метрик
             processing_end_time = timezone.now()
             processing_time = (processing_end_time - processing_start_time).total_seconds()
@@ -2700,7 +1987,11 @@ def process_chat_request_async(request_id):
                     message_blocked=message_blocked,
                     response_blocked=response_blocked,
                     context_used=context_used,
-                    response_text=ai_response
+                    response_text=ai_response,
+                    cache_status=cache_status,
+                    # Ответ из кэша ответов не расходовал токены
+                    usage=result.get('usage') if cached_result is None else None,
+                    fast_path=(fast_result is not None) if fast_answers.is_enabled() else None
                 )
             except Exception as e:
                 logger.error(f"Ошибка при создании метрик для запроса {request_id}: {str(e)}", exc_info=True)
@@ -2754,9 +2045,9 @@ def process_chat_request_async(request_id):
             if action_result:
                 logger.info(f"✅ Действие сохранено в запрос: {action_result}")
             else:
-                # Проверяем, содержит ли ответ команду CREATE_EVENT, которую не удалось распарсить
-                if 'CREATE_EVENT' in ai_response:
-                    logger.warning(f"⚠️ CREATE_EVENT найден в ответе, но не распознан. Ответ: {ai_response[:500]}")
+                # Проверяем, содержит ли ответ команды, которые не удалось распарсить
+                if parsed_response.actions:
+                    logger.warning(f"⚠️ Команды {[command.name for command in parsed_response.actions]} найдены в ответе, но не распознаны. Ответ: {ai_response[:500]}")
                 else:
                     logger.warning(f"⚠️ Действие не найдено в ответе AI. Ответ: {ai_response[:200]}")
             
@@ -2879,7 +2170,7 @@ def process_chat_request_async(request_id):
                 try:
                     text_only_messages = []
                     for msg in messages:
-                        if isinstance(msg.get('content'), list):
+                        if isinstance(msg.get('content'), list) and msg.get('role') != 'system':
                             text_parts = [item for item in msg['content'] if item.get('type') == 'text']
                             if text_parts:
                                 text_content = '\n'.join([item.get('text', '') for item in text_parts])
@@ -2892,17 +2183,24 @@ def process_chat_request_async(request_id):
                             text_only_messages.append(msg)
                     
                     if not text_only_messages or text_only_messages[0].get("role") != "system":
-                        text_only_messages.insert(0, {
-                            "role": "system",
-                            "content": system_prompt
-                        })
+                        text_only_messages.insert(0, system_message)
                     
-                    text_payload = {**payload, "messages": text_only_messages}
+                    # Ответ без изображений только текстовый (действия не выполняются), поэтому без tools;
+                    # поток читается так же, как в основном запросе
+                    text_payload = {
+                        key: value for key, value in payload.items() if key not in ai_tools.REQUEST_FIELDS
+                    }
+                    text_payload["messages"] = text_only_messages
                     try:
-                        text_response = requests.post(OPENROUTER_URL, headers=headers, json=text_payload, timeout=90)
+                        text_response = http_client.post(
+                            'openrouter', OPENROUTER_URL, headers=headers, json=text_payload, stream=True
+                        )
                         if text_response.status_code == 200:
-                            result = text_response.json()
-                            ai_response = result.get('choices', [{}])[0].get('message', {}).get('content', '')
+                            try:
+                                result = chat_stream.read_completion(text_response, request_id)
+                            finally:
+                                text_response.close()
+                            ai_response = result.get('choices', [{}])[0].get('message', {}).get('content') or ''
                             
                             # Модерация ответа AI
                             moderation_result = ContentModerator.check_ai_response(ai_response)
@@ -2936,12 +2234,15 @@ def process_chat_request_async(request_id):
                                     message_blocked=message_blocked,
                                     response_blocked=response_blocked,
                                     context_used=bool(user_data and len(user_data) > 0),
-                                    response_text=ai_response
+                                    response_text=ai_response,
+                                    usage=result.get('usage')
                                 )
                             except Exception as e:
                                 logger.error(f"Ошибка при создании метрик: {str(e)}")
                             
                             return
+                        logger.error(f"Ошибка от OpenRouter без изображений: status_code={text_response.status_code}")
+                        text_response.close()
                     except Exception as e:
                         logger.error(f"Ошибка при обработке текстового запроса: {str(e)}")
                         pass
@@ -2993,12 +2294,51 @@ def process_chat_request_async(request_id):
             logger.info(f"✅ Статус запроса {request_id} обновлен на FAILED")
         except Exception as save_error:
             logger.error(f"❌ Не удалось сохранить ошибку для запроса {request_id}: {str(save_error)}", exc_info=True)
+    finally:
+        # Будим подписчиков /api/chat-stream/: итоговый ответ уже сохранен в БД
+        chat_stream.broker.finish(request_id)
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def chat_api(request):
-    """API endpoint для обработки сообщений чата через OpenRouter (асинхронно)"""
+def _read_chat_api_request(request):
+    """
+    Разбирает тело запроса к chat_api
+
+    Returns:
+        tuple: (message, chat_history, user_data, user_data_hashes, files)
+
+    Raises:
+        MissingSectionsError: клиент сослался на разделы userData, которых нет в хранилище
+    """
+    if request.content_type == 'multipart/form-data':
+        # Файлы приходят как части multipart и сохраняются в хранилище потоково,
+        # без base64 и без загрузки тела запроса в память целиком
+        message = request.POST.get('message', '')
+        chat_history = json.loads(request.POST.get('history') or '[]')
+        user_data = json.loads(request.POST.get('userData') or '{}')  # Данные пользователя из localStorage
+        section_hashes = json.loads(request.POST.get('userDataHashes') or '{}')
+        files = [blob_store.store_upload(uploaded) for uploaded in request.FILES.getlist('files')]
+    else:
+        data = json.loads(request.body)
+        message = data.get('message', '')
+        chat_history = data.get('history', [])
+        user_data = data.get('userData', {})  # Данные пользователя из localStorage
+        section_hashes = data.get('userDataHashes', {})
+        files = data.get('files', [])  # Прикрепленные файлы в base64
+    if not isinstance(user_data, dict) or not isinstance(section_hashes, dict):
+        raise ValueError('userData и userDataHashes должны быть объектами')
+    # Неизменившиеся разделы userData клиент передает хэшами из ответа на предыдущий запрос
+    user_data, user_data_hashes = user_data_store.resolve(user_data, section_hashes)
+    return message, chat_history, user_data, user_data_hashes, files
+
+
+@async_api_view(["POST"])
+async def chat_api(request):
+    """
+    API endpoint для обработки сообщений чата через OpenRouter (асинхронно)
+
+    Async-представление: разбор файлов и запись в БД выполняются без блокировки цикла событий,
+    обработка запроса ставится в пул воркеров
+    """
     try:
         # Проверяем размер запроса
         content_length = request.META.get('CONTENT_LENGTH', 0)
@@ -3011,11 +2351,18 @@ def chat_api(request):
                     'error': f'Размер данных ({content_length / 1024 / 1024:.2f} MB) превышает максимально допустимый ({max_size / 1024 / 1024:.2f} MB). Пожалуйста, уменьшите размер файлов.'
                 }, status=413)
         
-        data = json.loads(request.body)
-        message = data.get('message', '')
-        chat_history = data.get('history', [])
-        user_data = data.get('userData', {})  # Данные пользователя из localStorage
-        files = data.get('files', [])  # Прикрепленные файлы
+        try:
+            message, chat_history, user_data, user_data_hashes, files = await sync_to_async(
+                _read_chat_api_request
+            )(request)
+        except MissingSectionsError as e:
+            logger.info(f"🔄 {str(e)}: клиент должен повторить запрос с полными данными")
+            return JsonResponse({
+                'success': False,
+                'error': 'Данные пользователя устарели на сервере. Повторите запрос с полными данными.',
+                'error_code': 'USER_DATA_RESYNC',
+                'missing_sections': e.sections
+            }, status=409)
         
         # Модерация входящего сообщения
         message = ContentModerator.sanitize_message(message)
@@ -3033,11 +2380,13 @@ def chat_api(request):
         message = moderation_result['filtered_message']
         
         # Создаем запрос в базе данных
-        chat_request = ChatRequest.objects.create(
+        chat_request = await ChatRequest.objects.acreate(
             message=message,
             chat_history=chat_history,
             user_data=user_data,
-            files_data=files,
+            user_data_hashes=user_data_hashes,
+            # Содержимое файлов сохраняется в хранилище, в запросе остаются только ссылки
+            files_data=await sync_to_async(blob_store.externalize_files)(files),
             status=ChatRequest.STATUS_PENDING
         )
         
@@ -3047,14 +2396,14 @@ def chat_api(request):
             user = None
             if user_email:
                 try:
-                    user = User.objects.get(email=user_email)
+                    user = await User.objects.aget(email=user_email)
                 except User.DoesNotExist:
                     pass
             
             ip_address = request.META.get('REMOTE_ADDR', '')
             user_agent = request.META.get('HTTP_USER_AGENT', '')
             
-            UserActivity.objects.create(
+            await UserActivity.objects.acreate(
                 user=user,
                 user_email=user_email if user_email else None,
                 activity_type='chat_request',
@@ -3072,40 +2421,36 @@ def chat_api(request):
             logger.error(f"Ошибка при создании UserActivity для запроса: {str(e)}", exc_info=True)
             # Не прерываем обработку запроса из-за ошибки метрик
         
-        # Запускаем обработку в фоновом потоке
-        logger.info(f"🧵 Запуск фонового потока для обработки запроса {chat_request.id}")
-        
-        # Проверяем, что поток действительно запустится
+        # Ставим обработку в очередь пула фоновых воркеров
+        # В режиме 'worker' запрос остается в статусе PENDING и его забирает manage.py run_chat_workers
+        dispatcher = get_dispatcher()
         try:
-            thread = threading.Thread(target=process_chat_request_async, args=(chat_request.id,), name=f"ChatRequest-{chat_request.id}")
-            thread.daemon = True
-            thread.start()
-            
-            # Проверяем, что поток запустился
-            if thread.is_alive():
-                logger.info(f"✅ Фоновый поток запущен для запроса {chat_request.id}, поток активен: {thread.is_alive()}")
-            else:
-                logger.warning(f"⚠️ Поток для запроса {chat_request.id} не запустился, попытка повторного запуска...")
-                # Пробуем еще раз
-                thread = threading.Thread(target=process_chat_request_async, args=(chat_request.id,), name=f"ChatRequest-{chat_request.id}-retry")
-                thread.daemon = True
-                thread.start()
-                logger.info(f"✅ Повторный запуск потока для запроса {chat_request.id}")
-        except Exception as thread_error:
-            logger.error(f"❌ Ошибка при запуске потока: {str(thread_error)}", exc_info=True)
-            # Если поток не запустился, обрабатываем синхронно (но это может быть медленно)
-            logger.warning(f"⚠️ Попытка синхронной обработки запроса {chat_request.id}")
-            try:
-                process_chat_request_async(chat_request.id)
-            except Exception as sync_error:
-                logger.error(f"❌ Ошибка при синхронной обработке: {str(sync_error)}", exc_info=True)
+            if chat_queue.get_processing_mode() != 'worker':
+                logger.info(f"🧵 Постановка запроса {chat_request.id} в очередь обработки")
+                dispatcher.submit(process_chat_request_async, chat_request.id)
+        except QueueFullError as queue_error:
+            logger.warning(f"⚠️ Запрос {chat_request.id} отклонен: {str(queue_error)}")
+            chat_request.status = ChatRequest.STATUS_FAILED
+            chat_request.error = 'Сервер перегружен: очередь обработки запросов заполнена'
+            await chat_request.asave()
+            response = JsonResponse({
+                'success': False,
+                'error': 'Сервер перегружен. Пожалуйста, повторите запрос через несколько секунд.',
+                'error_code': 'QUEUE_FULL',
+                'queue': dispatcher.stats()
+            }, status=503)
+            response['Retry-After'] = '5'
+            return response
         
-        # Сразу возвращаем ID запроса
+        # Сразу возвращаем ID запроса и адрес потока с фрагментами ответа
         return JsonResponse({
             'success': True,
             'request_id': str(chat_request.id),
             'status': 'processing',
-            'message': 'Запрос принят в обработку'
+            'message': 'Запрос принят в обработку',
+            'stream_url': f'/api/chat-stream/{chat_request.id}/',
+            # Хэши разделов userData: в следующем запросе неизменившиеся разделы можно заменить ими
+            'user_data_hashes': user_data_hashes
         })
         
     except json.JSONDecodeError as e:
@@ -3803,59 +3148,103 @@ def edit_chat_message(request, chat_id):
         }, status=500)
 
 
-@csrf_exempt
-@require_http_methods(["GET"])
-def chat_status(request, request_id):
-    """API endpoint для проверки статуса запроса к AI"""
+# Поля, нужные для ответа о статусе запроса. Тяжелые JSON (files_data с файлами в base64,
+# user_data, chat_history) при проверке статуса не загружаются
+CHAT_STATUS_FIELDS = ('status', 'response', 'action', 'error', 'created_at', 'updated_at', 'completed_at')
+
+
+def build_chat_status_payload(chat_request):
+    """Формирует ответ о статусе запроса (общий для /api/chat-status/ и /api/chat-stream/)"""
+    response_data = {
+        'success': True,
+        'request_id': str(chat_request.id),
+        'status': chat_request.status,
+        'created_at': chat_request.created_at.isoformat(),
+        'updated_at': chat_request.updated_at.isoformat(),
+    }
+    
+    if chat_request.status == ChatRequest.STATUS_COMPLETED:
+        response_data['response'] = chat_request.response
+        response_data['action'] = chat_request.action
+        logger.info(f"✅ Отправка ответа клиенту: action={chat_request.action}")
+        if chat_request.completed_at:
+            response_data['completed_at'] = chat_request.completed_at.isoformat()
+    elif chat_request.status == ChatRequest.STATUS_FAILED:
+        response_data['error'] = chat_request.error
+    
+    return response_data
+
+
+def _restart_stuck_request(chat_request):
+    """
+    Перезапускает обработку запроса, который обрабатывается более 5 минут
+    В режиме 'worker' зависшие запросы возвращают в очередь сами воркеры по истечении аренды
+    """
+    from datetime import timedelta
+    
+    if (chat_queue.get_processing_mode() == 'worker'
+            or chat_request.status not in [ChatRequest.STATUS_PROCESSING, ChatRequest.STATUS_PENDING]):
+        return
+    request_id = chat_request.id
+    time_elapsed = timezone.now() - chat_request.created_at
+    # Запрос, который еще ждет в очереди пула или обрабатывается, не перезапускаем
+    if time_elapsed > timedelta(minutes=5) and not get_dispatcher().is_in_flight(chat_request.id):
+        logger.warning(f"⚠️ Запрос {request_id} завис (прошло {time_elapsed.total_seconds()} секунд), попытка перезапуска обработки")
+        # Пытаемся перезапустить обработку
+        try:
+            from django.db import close_old_connections
+            close_old_connections()
+            # Обновляем статус и пробуем обработать снова
+            chat_request.status = ChatRequest.STATUS_PROCESSING
+            chat_request.save()
+            
+            # Ставим обработку заново в очередь пула (повторно не ставится, если запрос еще в работе)
+            get_dispatcher().submit(process_chat_request_async, chat_request.id)
+            logger.info(f"🔄 Перезапуск обработки зависшего запроса {request_id}")
+        except Exception as retry_error:
+            logger.error(f"❌ Ошибка при перезапуске обработки: {str(retry_error)}", exc_info=True)
+            # Если не удалось перезапустить, помечаем как failed
+            chat_request.status = ChatRequest.STATUS_FAILED
+            chat_request.error = f'Запрос завис и не удалось перезапустить обработку: {str(retry_error)}'
+            chat_request.save()
+
+
+@async_api_view(["GET"])
+async def chat_status(request, request_id):
+    """
+    API endpoint для проверки статуса запроса к AI
+
+    Long-poll: с параметром ?wait=<сек> ответ задерживается, пока статус запроса
+    не изменится (или не истечет время ожидания). Параметр status - статус,
+    уже известный клиенту (по умолчанию processing).
+    Async-представление: под ASGI ожидание не занимает поток
+    """
     try:
-        from django.utils import timezone
-        from datetime import timedelta
-        
-        chat_request = ChatRequest.objects.get(id=request_id)
-        
-        # Проверяем, не завис ли запрос (обрабатывается более 5 минут)
-        if chat_request.status in [ChatRequest.STATUS_PROCESSING, ChatRequest.STATUS_PENDING]:
-            time_elapsed = timezone.now() - chat_request.created_at
-            if time_elapsed > timedelta(minutes=5):
-                logger.warning(f"⚠️ Запрос {request_id} завис (прошло {time_elapsed.total_seconds()} секунд), попытка перезапуска обработки")
-                # Пытаемся перезапустить обработку
-                try:
-                    from django.db import close_old_connections
-                    close_old_connections()
-                    # Обновляем статус и пробуем обработать снова
-                    chat_request.status = ChatRequest.STATUS_PROCESSING
-                    chat_request.save()
-                    
-                    # Запускаем обработку заново в новом потоке
-                    thread = threading.Thread(target=process_chat_request_async, args=(chat_request.id,), name=f"ChatRequest-{chat_request.id}-retry")
-                    thread.daemon = True
-                    thread.start()
-                    logger.info(f"🔄 Перезапуск обработки зависшего запроса {request_id}")
-                except Exception as retry_error:
-                    logger.error(f"❌ Ошибка при перезапуске обработки: {str(retry_error)}", exc_info=True)
-                    # Если не удалось перезапустить, помечаем как failed
-                    chat_request.status = ChatRequest.STATUS_FAILED
-                    chat_request.error = f'Запрос завис и не удалось перезапустить обработку: {str(retry_error)}'
-                    chat_request.save()
-        
-        response_data = {
-            'success': True,
-            'request_id': str(chat_request.id),
-            'status': chat_request.status,
-            'created_at': chat_request.created_at.isoformat(),
-            'updated_at': chat_request.updated_at.isoformat(),
-        }
+        try:
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            wait = 0
+        wait = min(max(wait, 0), getattr(settings, 'CHAT_LONG_POLL_MAX_WAIT', 25))
+        
+        if wait > 0:
+            known_status = request.GET.get('status', ChatRequest.STATUS_PROCESSING)
+            since_version = await sync_to_async(chat_events.current_version)(request_id)
+            status_query = ChatRequest.objects.filter(id=request_id).values_list('status', flat=True)
+            current_status = await status_query.afirst()
+            if current_status is None:
+                raise ChatRequest.DoesNotExist
+            if current_status == known_status:
+                async def status_changed():
+                    return await status_query.afirst() != known_status
+                
+                await chat_events.async_wait_for_change(
+                    request_id, since_version, wait, status_changed=status_changed
+                )
         
-        if chat_request.status == ChatRequest.STATUS_COMPLETED:
-            response_data['response'] = chat_request.response
-            response_data['action'] = chat_request.action
-            logger.info(f"✅ Отправка ответа клиенту: action={chat_request.action}")
-            if chat_request.completed_at:
-                response_data['completed_at'] = chat_request.completed_at.isoformat()
-        elif chat_request.status == ChatRequest.STATUS_FAILED:
-            response_data['error'] = chat_request.error
+        chat_request = await ChatRequest.objects.only(*CHAT_STATUS_FIELDS).aget(id=request_id)
+        await sync_to_async(_restart_stuck_request)(chat_request)
         
-        return JsonResponse(response_data)
+        return JsonResponse(build_chat_status_payload(chat_request))
     except ChatRequest.DoesNotExist:
         return JsonResponse({
             'success': False,
@@ -4751,6 +4140,78 @@ def chat_status(request, request_id):
         }, status=500)
 
 
+@async_api_view(["GET"])
+async def chat_stream_view(request, request_id):
+    """
+    API endpoint потоковой выдачи ответа AI (Server-Sent Events)
+
+    События:
+        delta - очередной фрагмент текста ответа по мере генерации моделью
+        done - итоговый ответ после обработки действий и модерации (как в /api/chat-status/)
+        timeout - ответ не получен за CHAT_STREAM_TIMEOUT секунд, клиенту следует перейти на опрос статуса
+    Async-представление с асинхронным генератором: под ASGI фрагменты уходят клиенту сразу,
+    а открытый поток не занимает поток сервера
+    """
+    if not await ChatRequest.objects.filter(id=request_id).aexists():
+        return JsonResponse({
+            'success': False,
+            'error': 'Запрос не найден'
+        }, status=404)
+    
+    stream_timeout = getattr(settings, 'CHAT_STREAM_TIMEOUT', 120)
+    terminal_statuses = (ChatRequest.STATUS_COMPLETED, ChatRequest.STATUS_FAILED)
+    
+    async def event_stream():
+        deadline = time.monotonic() + stream_timeout
+        offset = 0
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            chunks, finished = await chat_stream.broker.async_wait(request_id, offset, timeout=1.0)
+            if chunks:
+                offset += len(chunks)
+                yield chat_stream.format_sse('delta', {'text': ''.join(chunks)})
+                if not finished:
+                    continue
+            
+            # Генерация завершена либо фрагментов нет (обработка в другом процессе) - проверяем БД
+            chat_request = await ChatRequest.objects.only(*CHAT_STATUS_FIELDS).aget(id=request_id)
+            if chat_request.status in terminal_statuses:
+                yield chat_stream.format_sse('done', build_chat_status_payload(chat_request))
+                return
+            if finished:
+                await asyncio.sleep(0.5)  # Генерация завершена, а статус еще не сохранен - не нагружаем БД
+            elif not chunks:
+                yield ': keep-alive\n\n'
+        yield chat_stream.format_sse('timeout', {'request_id': str(request_id)})
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Отключаем буферизацию в nginx
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def chat_queue_status(request):
+    """API endpoint для мониторинга пула обработки запросов (глубина очереди, загрузка воркеров)"""
+    try:
+        if chat_queue.get_processing_mode() == 'worker':
+            queue = chat_queue.queue_stats()
+        else:
+            queue = get_dispatcher().stats()
+        return JsonResponse({
+            'success': True,
+            'mode': chat_queue.get_processing_mode(),
+            'queue': queue
+        })
+    except Exception as e:
+        logger.error(f"Ошибка при получении состояния очереди: {str(e)}", exc_info=True)
+        return JsonResponse({
+            'success': False,
+            'error': f'Ошибка: {str(e)}'
+        }, status=500)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def error_log(request):